@@ -0,0 +1,207 @@
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import ffmpeg
+
+from .metrics import metrics
+from .utils import filename, probe_media, write_srt
+
+FORCE_STYLE = "OutlineColour=&H40000000,BorderStyle=3"
+
+# chunks start this much before their keyframe so that float rounding of the
+# seek position never drops the keyframe itself (well below a frame duration)
+SEEK_EPSILON = 0.001
+
+_SRT_TIME = re.compile(r"(\d+):(\d{2}):(\d{2})[,.](\d{3})")
+
+
+def _parse_time(value: str) -> float:
+    h, m, s, ms = _SRT_TIME.match(value.strip()).groups()
+    return int(h) * 3600 + int(m) * 60 + int(s) + int(ms) / 1000.0
+
+
+def parse_srt(text: str) -> List[dict]:
+    """
+    Cues of an .srt file as ``{"start", "end", "text"}`` dicts (times in seconds).
+    """
+    cues = []
+    for block in re.split(r"\n\s*\n", text.replace("\r\n", "\n").strip()):
+        lines = block.split("\n")
+        for i, line in enumerate(lines):
+            if "-->" in line:
+                start, end = line.split("-->")
+                cues.append({"start": _parse_time(start), "end": _parse_time(end),
+                             "text": "\n".join(lines[i + 1:])})
+                break
+    return cues
+
+
+def shift_cues(cues: List[dict], start: float, end: Optional[float]) -> List[dict]:
+    """
+    Cues visible in the window ``[start, end)`` of the video, clipped to it and shifted
+    so that the window starts at 0 (``end=None``: until the end of the video).
+    """
+    shifted = []
+    for cue in cues:
+        if cue["end"] <= start or (end is not None and cue["start"] >= end):
+            continue
+        cue_end = cue["end"] if end is None else min(cue["end"], end)
+        shifted.append({"start": max(cue["start"], start) - start, "end": cue_end - start, "text": cue["text"]})
+    return shifted
+
+
+def probe_keyframes(path: str) -> Tuple[List[float], float, bool]:
+    """
+    Keyframe times of the first video stream (from the packet flags, nothing is decoded).
+
+    Returns:
+        ``(keyframes, duration, has_audio)``, times relative to the start of the file.
+    """
+    info = probe_media(path, show_entries="packet=pts_time,flags")
+    fmt = info.get("format", {})
+    offset = float(fmt.get("start_time", 0) or 0)
+    duration = float(fmt.get("duration", 0) or 0)
+    video_index = next(s["index"] for s in info["streams"] if s.get("codec_type") == "video")
+    has_audio = any(s.get("codec_type") == "audio" for s in info["streams"])
+    keyframes = sorted(
+        float(p["pts_time"]) - offset for p in info.get("packets", [])
+        if p.get("stream_index") == video_index and "K" in p.get("flags", "") and p.get("pts_time") not in (None, "N/A")
+    )
+    return keyframes, duration, has_audio
+
+
+def plan_chunks(keyframes: List[float], duration: float, chunk_seconds: float) -> List[Tuple[float, Optional[float]]]:
+    """
+    Split the video at keyframes into chunks of at least ``chunk_seconds``
+    (the last one is at least half of it). Every chunk starts on a keyframe, so it can be
+    encoded on its own and the encoded chunks can be concatenated without re-encoding.
+
+    Returns:
+        ``[(start, end), ...]``, the ``end`` of the last chunk is None (end of the video).
+    """
+    cuts = [0.0]
+    for t in keyframes:
+        if t >= cuts[-1] + chunk_seconds and t <= duration - chunk_seconds / 2:
+            cuts.append(t)
+    return [(start, end) for start, end in zip(cuts, cuts[1:] + [None])]
+
+
+def default_workers() -> int:
+    # x264 already uses several threads per encode, a few chunks at a time keep all cores busy
+    return max(1, (os.cpu_count() or 1) // 4)
+
+
+def _filter_path(path: str) -> str:
+    # relative if possible (no drive letter for the subtitles filter to trip over), else forward slashes
+    try:
+        path = os.path.relpath(path)
+    except ValueError:
+        path = os.path.abspath(path)
+    return path.replace('\\', '/')
+
+
+def _ffmpeg_error(e: Exception) -> str:
+    stderr = getattr(e, "stderr", None)
+    if not stderr:
+        return str(e)
+    # the end of the log holds the actual error
+    return "\n".join(stderr.decode("utf-8", errors="ignore").strip().splitlines()[-20:])
+
+
+def _burn_chunk(path: str, srt_path: str, out_path: str, start: float, end: Optional[float], threads: int):
+    input_args = {}
+    if start > 0:
+        input_args["ss"] = start
+    if end is not None:
+        input_args["t"] = end - start
+    video = ffmpeg.input(path, **input_args).video
+    (
+        video.filter('subtitles', _filter_path(srt_path), force_style=FORCE_STYLE)
+        .output(out_path, vcodec="libx264", threads=threads)
+        .run(quiet=True, overwrite_output=True)
+    )
+
+
+def burn_single_pass(path: str, srt_path: str, out_path: str):
+    video = ffmpeg.input(path)
+    ffmpeg.concat(
+        video.filter('subtitles', _filter_path(srt_path), force_style=FORCE_STYLE), video.audio, v=1, a=1
+    ).output(out_path).run(quiet=True, overwrite_output=True)
+
+
+def burn_chunked(path: str, cues: List[dict], chunks: List[Tuple[float, Optional[float]]], out_path: str,
+                 work_dir: str, workers: int, has_audio: bool = True):
+    """
+    Burn the subtitles of each chunk in parallel (one FFmpeg process per chunk), then
+    concatenate the chunks with the concat demuxer (no re-encode) and add the original audio.
+    """
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    jobs = []
+    for i, (start, end) in enumerate(chunks):
+        seek = max(0.0, start - SEEK_EPSILON)
+        chunk_srt = os.path.join(work_dir, f"chunk_{i:04d}.srt")
+        with open(chunk_srt, "w", encoding="utf-8") as f:
+            write_srt(shift_cues(cues, seek, end), file=f)
+        jobs.append((path, chunk_srt, os.path.join(work_dir, f"chunk_{i:04d}.mp4"), seek, end, threads))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # list() re-raises the first failed chunk
+        list(pool.map(lambda job: _burn_chunk(*job), jobs))
+
+    list_path = os.path.join(work_dir, "chunks.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        for job in jobs:
+            f.write(f"file '{os.path.abspath(job[2])}'\n")
+    video = ffmpeg.input(list_path, f="concat", safe=0).video
+    if has_audio:
+        output = ffmpeg.output(video, ffmpeg.input(path).audio, out_path, vcodec="copy", acodec="aac")
+    else:
+        output = ffmpeg.output(video, out_path, vcodec="copy")
+    output.run(quiet=True, overwrite_output=True)
+
+
+def burn_subtitles(path: str, srt_path: str, out_path: str, output_dir: str,
+                   workers: int = 0, chunk_seconds: float = 60.0) -> bool:
+    """
+    Burn the subtitles of ``srt_path`` into the video ``path``, returns False if FFmpeg failed.
+
+    Videos long enough for at least two keyframe-aligned chunks of ``chunk_seconds`` are
+    encoded in ``workers`` parallel chunks (0: based on the CPU count), shorter ones in a single pass.
+    """
+    print(f"Adding subtitles to {filename(path)}...")
+    workers = workers or default_workers()
+
+    # the work dir is inside output_dir, so the subtitles filter gets a relative path
+    # (a temp directory with a Windows drive letter breaks the filter path parsing)
+    work_dir = tempfile.mkdtemp(prefix=f".burn_{filename(path)}_", dir=output_dir)
+    try:
+        with open(srt_path, "r", encoding="utf-8") as f:
+            cues = parse_srt(f.read())
+
+        chunks = []
+        has_audio = True
+        if workers > 1:
+            try:
+                keyframes, duration, has_audio = probe_keyframes(path)
+                chunks = plan_chunks(keyframes, duration, chunk_seconds)
+            except (ffmpeg.Error, StopIteration, KeyError, ValueError) as e:
+                print(f"Warning: keyframe probe failed ({_ffmpeg_error(e)}), burning in a single pass.")
+
+        with metrics.span("ffmpeg_burn", video=filename(path)) as span:
+            span["chunks"] = max(1, len(chunks))
+            if len(chunks) > 1:
+                burn_chunked(path, cues, chunks, out_path, work_dir, min(workers, len(chunks)), has_audio)
+            else:
+                local_srt = os.path.join(work_dir, os.path.basename(srt_path))
+                shutil.copyfile(srt_path, local_srt)
+                burn_single_pass(path, local_srt, out_path)
+    except ffmpeg.Error as e:
+        print("FFmpeg error while adding subtitles:\n" + _ffmpeg_error(e))
+        return False
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return True
@@ -1,11 +1,14 @@
 import os
-import shutil
+import atexit
 import ffmpeg
 import whisper
 import argparse
 import warnings
 import tempfile
-from .utils import filename, str2bool, write_srt, translate_segments, generate_tts_audio, merge_tts_with_video
+from .utils import filename, str2bool, write_srt, translate_segments, generate_tts_audio
+from .burn import burn_subtitles
+from .render import DUBBED_VARIANTS, VARIANTS, parse_variants, variant_paths, render_outputs
+from .metrics import metrics
 
 # Set FFmpeg path for Windows
 if os.name == 'nt':
@@ -45,6 +48,30 @@ def main():
                         help="Replace original audio with TTS (True) or overlay TTS on original (False)")
     parser.add_argument("--generate_tts", type=str2bool, default=False,
                         help="Generate TTS audio for translated subtitles")
+    parser.add_argument("--tts_cache_dir", type=str, default=None,
+                        help="cache of synthesized segments, reused when re-dubbing (default: <output_dir>/tts_cache)")
+    parser.add_argument("--tts_cache", type=str2bool, default=True,
+                        help="reuse previously synthesized segments with the same text, voice and settings")
+    parser.add_argument("--tts_seed", type=int, default=0,
+                        help="base random seed of the TTS, each segment is seeded from it and its text")
+    parser.add_argument("--tts_fit_duration", type=str2bool, default=True,
+                        help="synthesize every dubbed line to the length of its subtitle")
+    parser.add_argument("--voice_library", type=str, default=None,
+                        help="IndexTTS2 voice library index (indextts-voices build); --voice may be one of its voice ids, "
+                             "the default voice is the library voice of the target language")
+    parser.add_argument("--outputs", type=str, default="subtitled,dubbed",
+                        help=f"comma separated videos to create from one decode of the source, some of {list(VARIANTS)}; "
+                             "the dubbed ones need --generate_tts")
+    parser.add_argument("--burn_workers", type=int, default=0,
+                        help="parallel FFmpeg encodes of the subtitle burn-in (0: based on the CPU count, 1: single pass)")
+    parser.add_argument("--burn_chunk_seconds", type=float, default=60.0,
+                        help="length of the keyframe-aligned chunks burned in parallel, shorter videos are burned in a single pass")
+    parser.add_argument("--metrics_jsonl", type=str, default=None,
+                        help="append per-stage timings as JSON lines to this file")
+    parser.add_argument("--metrics_prom", type=str, default=None,
+                        help="write Prometheus text metrics to this file when done (node_exporter textfile collector)")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="write a Chrome trace (chrome://tracing, Perfetto) of all stages to this file")
 
     parser.add_argument("--task", type=str, default="transcribe", choices=[
                         "transcribe", "translate"], help="whether to perform X->X speech recognition ('transcribe') or X->English translation ('translate')")
@@ -63,8 +90,27 @@ def main():
     voice: str = args.pop("voice")
     replace_audio: bool = args.pop("replace_audio")
     generate_tts: bool = args.pop("generate_tts")
-    
+    tts_cache_dir: str | None = args.pop("tts_cache_dir")
+    tts_cache: bool = args.pop("tts_cache")
+    tts_seed: int = args.pop("tts_seed")
+    tts_fit_duration: bool = args.pop("tts_fit_duration")
+    voice_library: str | None = args.pop("voice_library")
+    variants: list = parse_variants(args.pop("outputs"))
+    burn_workers: int = args.pop("burn_workers")
+    burn_chunk_seconds: float = args.pop("burn_chunk_seconds")
+    metrics_jsonl: str | None = args.pop("metrics_jsonl")
+    metrics_prom: str | None = args.pop("metrics_prom")
+    trace_path: str | None = args.pop("trace")
+
     os.makedirs(output_dir, exist_ok=True)
+    if tts_cache:
+        tts_cache_dir = tts_cache_dir or os.path.join(output_dir, "tts_cache")
+    else:
+        tts_cache_dir = None
+    # the trace and Prometheus files are written at exit, also when a video fails
+    metrics.configure(jsonl_path=metrics_jsonl, trace_path=trace_path)
+    if metrics_prom:
+        atexit.register(metrics.write_prometheus, metrics_prom)
 
     if model_name.endswith(".en"):
         warnings.warn(
@@ -74,7 +120,8 @@ def main():
     elif language != "auto":
         args["language"] = language
         
-    model = whisper.load_model(model_name)
+    with metrics.span("whisper_load", model=model_name):
+        model = whisper.load_model(model_name)
     audios = get_audio(args.pop("video"))
     subtitles = get_subtitles(
         audios,
@@ -86,6 +133,10 @@ def main():
         generate_tts=generate_tts,
         tts_engine=tts_engine,
         voice=voice,
+        tts_cache_dir=tts_cache_dir,
+        tts_seed=tts_seed,
+        tts_fit_duration=tts_fit_duration,
+        voice_library=voice_library,
     )
 
     if srt_only:
@@ -101,55 +152,24 @@ def main():
             srt_path = subtitle_data
             tts_files = []
             segments = []
-        out_path = os.path.join(output_dir, f"{filename(path)}.mp4")
-
-        print(f"Adding subtitles to {filename(path)}...")
-
-        video = ffmpeg.input(path)
-        audio = video.audio
-
-        # If SRT is in a temp directory with Windows drive letter, copy to output_dir to avoid filter path parsing issues
-        if (os.name == 'nt') and (':' in srt_path):
-            safe_local_srt = os.path.join(output_dir, os.path.basename(srt_path))
-            try:
-                if os.path.abspath(srt_path) != os.path.abspath(safe_local_srt):
-                    shutil.copyfile(srt_path, safe_local_srt)
-                    srt_path = safe_local_srt
-            except Exception as copy_err:
-                print(f"Warning: failed to copy SRT locally ({copy_err}); attempting with original path.")
-
-        # Prepare path for subtitles filter: use relative if possible, else forward slashes
-        srt_for_filter = (srt_path if os.path.exists(srt_path) else os.path.abspath(srt_path)).replace('\\', '/')
-        try:
-            ffmpeg.concat(
-                video.filter('subtitles', srt_for_filter, force_style="OutlineColour=&H40000000,BorderStyle=3"), audio, v=1, a=1
-            ).output(out_path).run(quiet=True, overwrite_output=True)
-        except ffmpeg.Error as e:
-            print("Subtitle burn-in failed, retrying with verbose output...")
-            try:
-                ffmpeg.concat(
-                    video.filter('subtitles', srt_for_filter, force_style="OutlineColour=&H40000000,BorderStyle=3"), audio, v=1, a=1
-                ).output(out_path).run(quiet=False, overwrite_output=True)
-            except ffmpeg.Error as e2:
-                # Show stderr to help user debug and then continue to next file
-                try:
-                    err_text = e2.stderr.decode('utf-8', errors='ignore') if hasattr(e2, 'stderr') else str(e2)
-                except Exception:
-                    err_text = str(e2)
-                print("FFmpeg error while adding subtitles:\n" + err_text)
+        wanted = list(variants)
+        if not (generate_tts and tts_files and target_language):
+            wanted = [v for v in wanted if v not in DUBBED_VARIANTS]
+        if not wanted:
+            continue
+        outputs = variant_paths(path, output_dir, wanted)
+
+        if wanted == ["subtitled"]:
+            # a single output: the burn-in can run in parallel chunks
+            if not burn_subtitles(path, srt_path, outputs["subtitled"], output_dir, burn_workers, burn_chunk_seconds):
                 continue
+        # several outputs are rendered from one decode of the source
+        elif not render_outputs(path, srt_path, outputs, output_dir, tts_files, segments, replace_audio):
+            print(f"Failed to create the videos for {filename(path)}")
+            continue
 
-        # Generate TTS-dubbed version if TTS was generated
-        if generate_tts and tts_files and target_language:
-            tts_out_path = os.path.join(output_dir, f"{filename(path)}_dubbed.mp4")
-            print(f"Creating TTS-dubbed video for {filename(path)}...")
-            
-            if merge_tts_with_video(path, tts_files, segments, tts_out_path, replace_audio):
-                print(f"Saved TTS-dubbed video to {os.path.abspath(tts_out_path)}.")
-            else:
-                print(f"Failed to create TTS-dubbed video for {filename(path)}")
-
-        print(f"Saved subtitled video to {os.path.abspath(out_path)}.")
+        for variant, out_path in outputs.items():
+            print(f"Saved {variant.replace('_', '+')} video to {os.path.abspath(out_path)}.")
 
 
 def get_audio(paths):
@@ -161,68 +181,87 @@ def get_audio(paths):
         print(f"Extracting audio from {filename(path)}...")
         output_path = os.path.join(temp_dir, f"{filename(path)}.wav")
 
-        ffmpeg.input(path).output(
-            output_path,
-            acodec="pcm_s16le", ac=1, ar="16k"
-        ).run(quiet=True, overwrite_output=True)
+        with metrics.span("ffmpeg_extract", video=filename(path)):
+            ffmpeg.input(path).output(
+                output_path,
+                acodec="pcm_s16le", ac=1, ar="16k"
+            ).run(quiet=True, overwrite_output=True)
 
         audio_paths[path] = output_path
 
     return audio_paths
 
 
-def get_subtitles(audio_paths: list, output_srt: bool, output_dir: str, transcribe: callable,
-                  target_language: str | None, keep_original: bool, generate_tts: bool = False,
-                  tts_engine: str = "gtts", voice: str = "default"):
-    subtitles_path = {}
+def transcribe_video(path: str, audio_path: str, output_srt: bool, output_dir: str, transcribe: callable,
+                     target_language: str | None, keep_original: bool):
+    """
+    Transcribe (and translate) one video and write its .srt file.
 
-    for path, audio_path in audio_paths.items():
-        base_out_dir = output_dir if output_srt else tempfile.gettempdir()
-        base_srt_path = os.path.join(base_out_dir, f"{filename(path)}.srt")
+    Returns:
+        ``(srt_path, segments, translated)``, ``translated`` is True if the segments were
+        translated to ``target_language``.
+    """
+    base_out_dir = output_dir if output_srt else tempfile.gettempdir()
+    base_srt_path = os.path.join(base_out_dir, f"{filename(path)}.srt")
 
-        print(
-            f"Generating subtitles for {filename(path)}... This might take a while."
-        )
+    print(
+        f"Generating subtitles for {filename(path)}... This might take a while."
+    )
 
-        warnings.filterwarnings("ignore")
+    warnings.filterwarnings("ignore")
+    with metrics.span("whisper", video=filename(path)) as span:
         result = transcribe(audio_path)
-        warnings.filterwarnings("default")
+        span["segments"] = len(result["segments"])
+    warnings.filterwarnings("default")
+
+    segments = result["segments"]
+    detected_lang = result.get("language")
 
-        segments = result["segments"]
-        detected_lang = result.get("language")
+    final_srt_path = base_srt_path
+    final_segments = segments
 
-        final_srt_path = base_srt_path
+    # Perform translation if requested and language differs
+    if target_language and detected_lang and target_language.lower() != detected_lang.lower():
+        try:
+            translated_segments = translate_segments(segments, detected_lang, target_language)
+
+            if keep_original:
+                orig_path = base_srt_path.replace('.srt', f'.{detected_lang}.srt')
+                with open(orig_path, 'w', encoding='utf-8') as orig_f:
+                    write_srt(segments, file=orig_f)
+
+            final_srt_path = base_srt_path.replace('.srt', f'.{target_language}.srt')
+            with open(final_srt_path, 'w', encoding='utf-8') as translated_f:
+                write_srt(translated_segments, file=translated_f)
+            return final_srt_path, translated_segments, True
+
+        except Exception as e:
+            print(f"Translation failed ({e}); falling back to original language subtitles.")
+            final_srt_path = base_srt_path
+
+    with open(final_srt_path, 'w', encoding='utf-8') as srt:
+        write_srt(segments, file=srt)
+    return final_srt_path, final_segments, False
+
+
+def get_subtitles(audio_paths: list, output_srt: bool, output_dir: str, transcribe: callable,
+                  target_language: str | None, keep_original: bool, generate_tts: bool = False,
+                  tts_engine: str = "gtts", voice: str = "default", tts_cache_dir: str | None = None,
+                  tts_seed: int = 0, tts_fit_duration: bool = True, voice_library: str | None = None):
+    subtitles_path = {}
+
+    for path, audio_path in audio_paths.items():
+        final_srt_path, final_segments, translated = transcribe_video(
+            path, audio_path, output_srt, output_dir, transcribe, target_language, keep_original)
 
         tts_files = []
-        final_segments = segments
-
-        # Perform translation if requested and language differs
-        if target_language and detected_lang and target_language.lower() != detected_lang.lower():
-            try:
-                translated_segments = translate_segments(segments, detected_lang, target_language)
-                final_segments = translated_segments
-                
-                if keep_original:
-                    orig_path = base_srt_path.replace('.srt', f'.{detected_lang}.srt')
-                    with open(orig_path, 'w', encoding='utf-8') as orig_f:
-                        write_srt(segments, file=orig_f)
-                        
-                final_srt_path = base_srt_path.replace('.srt', f'.{target_language}.srt')
-                with open(final_srt_path, 'w', encoding='utf-8') as translated_f:
-                    write_srt(translated_segments, file=translated_f)
-                    
-                # Generate TTS if requested
-                if generate_tts:
-                    print(f"Generating TTS audio for {filename(path)}...")
-                    tts_files = generate_tts_audio(translated_segments, target_language, voice, output_dir)
-                    
-            except Exception as e:
-                print(f"Translation failed ({e}); falling back to original language subtitles.")
-                with open(final_srt_path, 'w', encoding='utf-8') as srt:
-                    write_srt(segments, file=srt)
-        else:
-            with open(final_srt_path, 'w', encoding='utf-8') as srt:
-                write_srt(segments, file=srt)
+        # Generate TTS if requested
+        if translated and generate_tts:
+            print(f"Generating TTS audio for {filename(path)}...")
+            with metrics.span("tts", video=filename(path), segments=len(final_segments)):
+                tts_files = generate_tts_audio(final_segments, target_language, voice, output_dir,
+                                               cache_dir=tts_cache_dir, seed=tts_seed,
+                                               fit_duration=tts_fit_duration, voice_library=voice_library)
 
         # Return enhanced data structure for TTS support
         if generate_tts and target_language:
@@ -234,6 +273,7 @@ def get_subtitles(audio_paths: list, output_srt: bool, output_dir: str, transcri
         else:
             subtitles_path[path] = final_srt_path
 
+    metrics.update_peak_memory()
     return subtitles_path
 
 
@@ -0,0 +1,172 @@
+import json
+import os
+import queue
+import subprocess
+import threading
+from typing import Optional
+
+# index-tts checkout next to auto-subtitle-main
+INDEX_TTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "index-tts")
+
+# Runs in the uv environment of index-tts: loads IndexTTS2 once, then synthesizes one JSON
+# request per stdin line and answers with one JSON line on stdout.
+SERVER_SCRIPT = r"""
+import json
+import os
+import random
+import sys
+import traceback
+
+# the responses go to the real stdout, every log line of IndexTTS2 to stderr
+responses = os.fdopen(os.dup(1), "w", buffering=1, encoding="utf-8")
+os.dup2(2, 1)
+sys.stdout = sys.stderr
+sys.path.insert(0, ".")
+
+import numpy as np
+import torch
+from indextts.infer_v2 import IndexTTS2
+
+options = json.loads(sys.argv[1])
+model = IndexTTS2(
+    cfg_path="checkpoints/config.yaml",
+    model_dir="checkpoints",
+    use_fp16=False,
+    device=options["device"],
+    voice_library=options["voice_library"],
+)
+responses.write(json.dumps({"ready": True}) + "\n")
+
+for line in sys.stdin:
+    request = json.loads(line)
+    try:
+        if request["seed"] is not None:
+            random.seed(request["seed"])
+            np.random.seed(request["seed"])
+            torch.manual_seed(request["seed"])
+        model.infer(
+            spk_audio_prompt=request["voice_path"],
+            text=request["text"],
+            output_path=request["output_path"],
+            verbose=False,
+            target_duration=request["target_duration"],
+        )
+        if os.path.exists(request["output_path"]):
+            response = {"ok": True}
+        else:
+            response = {"ok": False, "error": "Output file not created"}
+    except Exception as e:
+        traceback.print_exc()
+        response = {"ok": False, "error": repr(e)}
+    responses.write(json.dumps(response) + "\n")
+"""
+
+
+class IndexTTS2Process:
+    """
+    IndexTTS2 kept warm in a long-lived ``uv run`` process of the index-tts environment: the model
+    is loaded at the first ``generate`` and reused by the following ones (restarted if the process
+    dies). The auto-subtitle environment doesn't need the IndexTTS2 dependencies.
+
+    One request at a time; the requests of several threads are serialized.
+    """
+    # interpreter of the index-tts environment, SERVER_SCRIPT is run with it in ``index_tts_dir``
+    command = ["uv", "run", "python"]
+
+    def __init__(self, voice_library: Optional[str] = None, device: str = "cpu",
+                 index_tts_dir: str = INDEX_TTS_DIR, timeout: Optional[float] = None):
+        """
+        Args:
+            voice_library: IndexTTS2 voice library index, its voice ids can be used as ``voice_path``
+            timeout: seconds to wait for one segment (None: no limit), the process is killed after it
+        """
+        self.voice_library = os.path.abspath(voice_library) if voice_library else None
+        self.device = device
+        self.index_tts_dir = index_tts_dir
+        self.timeout = timeout
+        self._process = None
+        self._responses = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        self._process = subprocess.Popen(
+            self.command + ["-c", SERVER_SCRIPT, json.dumps({"device": self.device, "voice_library": self.voice_library})],
+            cwd=self.index_tts_dir,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+        )
+        self._responses = queue.Queue()
+        threading.Thread(target=self._read_responses, args=(self._process, self._responses), daemon=True).start()
+
+    @staticmethod
+    def _read_responses(process, responses):
+        for line in process.stdout:
+            responses.put(json.loads(line))
+        # the process exited
+        responses.put(None)
+
+    def _response(self, timeout: Optional[float]) -> Optional[dict]:
+        try:
+            response = self._responses.get(timeout=timeout)
+        except queue.Empty:
+            print(f"IndexTTS2 gave no answer in {timeout} seconds, restarting it")
+            self.close()
+            return None
+        if response is None:
+            print(f"IndexTTS2 process exited with code {self._process.wait()}")
+            self.close()
+        return response
+
+    def generate(self, text: str, output_path: str, voice_path: Optional[str] = None, seed: Optional[int] = None,
+                 target_duration: Optional[float] = None) -> bool:
+        """
+        Synthesize ``text`` to ``output_path``, returns False on failure.
+        """
+        if not os.path.exists(self.index_tts_dir):
+            print(f"Error: index-tts directory not found at {self.index_tts_dir}")
+            return False
+        request = {"text": text, "output_path": os.path.abspath(output_path), "voice_path": voice_path or None,
+                   "seed": seed, "target_duration": target_duration}
+        with self._lock:
+            try:
+                if self._process is None:
+                    self._start()
+                    # model loading, not limited by the timeout of a segment
+                    if self._response(None) is None:
+                        return False
+                self._process.stdin.write(json.dumps(request) + "\n")
+                self._process.stdin.flush()
+            except OSError as e:
+                print(f"Error running IndexTTS2: {e}")
+                self.close()
+                return False
+            response = self._response(self.timeout)
+        if response is None:
+            return False
+        if not response["ok"]:
+            print(f"TTS generation failed: {response['error']}")
+            return False
+        return os.path.exists(output_path)
+
+    def close(self):
+        process, self._process = self._process, None
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,4 @@
+from .stage_metrics import Metrics, peak_rss_bytes
+
+# process-wide instance
+metrics = Metrics.from_env("auto_subtitle")
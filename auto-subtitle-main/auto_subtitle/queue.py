@@ -0,0 +1,477 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import traceback
+from typing import List, Optional
+
+from .metrics import metrics
+from .utils import filename, str2bool
+
+# Stages of a video, each one is a separate job so that workers can specialize:
+#   subtitles: audio extraction, Whisper, translation, .srt  (Whisper model)
+#   tts:       IndexTTS2 synthesis of the translated segments  (TTS)
+#   burn:      subtitle burn-in                                (FFmpeg)
+#   merge:     dubbed video from the TTS segments              (FFmpeg)
+STAGES = ("subtitles", "tts", "burn", "merge")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    parent_id INTEGER,
+    stage TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    priority INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (state, stage, priority, available_at);
+"""
+
+
+class Job:
+    def __init__(self, row):
+        self.id = row["id"]
+        self.parent_id = row["parent_id"]
+        self.stage = row["stage"]
+        self.payload = json.loads(row["payload"])
+        self.attempts = row["attempts"]
+        self.max_attempts = row["max_attempts"]
+        self.lease_owner = row["lease_owner"]
+
+    def __repr__(self):
+        return f"Job({self.id}, {self.stage}, attempt {self.attempts}/{self.max_attempts})"
+
+
+class JobQueue:
+    """
+    Durable job queue in a local SQLite database (WAL mode), shared by any number of
+    worker processes on the same machine.
+
+    Job states: ``queued`` -> ``leased`` -> ``done``, or back to ``queued`` after a failure
+    (exponential backoff) until ``max_attempts``, then ``dead`` (dead letter).
+    A lease expires unless renewed by ``heartbeat``; expired jobs are leased again, so the
+    jobs of a killed worker are picked up by the others.
+    """
+
+    def __init__(self, path: str, backoff_seconds: float = 30.0, max_backoff_seconds: float = 3600.0):
+        self.path = path
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # one connection per thread (the heartbeat runs in its own thread)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def enqueue(self, stage: str, payload: dict, priority: int = 0, max_attempts: int = 3,
+                parent_id: Optional[int] = None, delay: float = 0.0, conn=None) -> int:
+        if stage not in STAGES:
+            raise ValueError(f"unknown stage {stage!r}, expected one of {STAGES}")
+        now = time.time()
+        cur = (conn or self._conn()).execute(
+            "INSERT INTO jobs (parent_id, stage, payload, priority, max_attempts, available_at, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (parent_id, stage, json.dumps(payload), priority, max_attempts, now + delay, now, now))
+        return cur.lastrowid
+
+    def lease(self, owner: str, stages=STAGES, lease_seconds: float = 300.0) -> Optional[Job]:
+        """
+        Take the next available job of one of ``stages`` (highest priority first, then oldest).
+        """
+        placeholders = ",".join("?" * len(stages))
+        conn = self._transaction()
+        try:
+            while True:
+                now = time.time()
+                row = conn.execute(
+                    f"SELECT * FROM jobs WHERE stage IN ({placeholders}) AND ("
+                    f" (state = 'queued' AND available_at <= ?) OR (state = 'leased' AND lease_expires < ?))"
+                    f" ORDER BY priority DESC, id LIMIT 1", (*stages, now, now)).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                if row["state"] == "leased" and row["attempts"] >= row["max_attempts"]:
+                    # the worker died during the last attempt
+                    conn.execute("UPDATE jobs SET state = 'dead', lease_owner = NULL, updated_at = ?,"
+                                 " last_error = COALESCE(last_error, '') || ? WHERE id = ?",
+                                 (now, f"lease of {row['lease_owner']} expired\n", row["id"]))
+                    continue
+                conn.execute("UPDATE jobs SET state = 'leased', lease_owner = ?, lease_expires = ?,"
+                             " attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                             (owner, now + lease_seconds, now, row["id"]))
+                conn.execute("COMMIT")
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+                return Job(row)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def heartbeat(self, job: Job, owner: str, lease_seconds: float = 300.0) -> bool:
+        """
+        Extend the lease of ``job``, returns False if the lease was lost (expired and taken over).
+        """
+        cur = self._conn().execute(
+            "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+            (time.time() + lease_seconds, time.time(), job.id, owner))
+        return cur.rowcount == 1
+
+    def complete(self, job: Job, owner: str, result: Optional[dict] = None, next_jobs: List[tuple] = ()) -> bool:
+        """
+        Mark ``job`` done and enqueue its follow-up ``(stage, payload)`` jobs in the same transaction.
+        """
+        conn = self._transaction()
+        try:
+            cur = conn.execute(
+                "UPDATE jobs SET state = 'done', result = ?, lease_owner = NULL, updated_at = ?"
+                " WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+                (json.dumps(result) if result is not None else None, time.time(), job.id, owner))
+            if cur.rowcount != 1:
+                conn.execute("ROLLBACK")
+                return False
+            priority = conn.execute("SELECT priority FROM jobs WHERE id = ?", (job.id,)).fetchone()[0]
+            for stage, payload in next_jobs:
+                self.enqueue(stage, payload, priority=priority, max_attempts=job.max_attempts,
+                             parent_id=job.id, conn=conn)
+            conn.execute("COMMIT")
+            return True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def fail(self, job: Job, owner: str, error: str) -> str:
+        """
+        Record a failed attempt: retry after a backoff, or move the job to the dead letter state.
+        Returns the new state.
+        """
+        now = time.time()
+        if job.attempts >= job.max_attempts:
+            state, available_at = "dead", now
+        else:
+            state = "queued"
+            available_at = now + min(self.backoff_seconds * 2 ** (job.attempts - 1), self.max_backoff_seconds)
+        self._conn().execute(
+            "UPDATE jobs SET state = ?, available_at = ?, lease_owner = NULL, last_error = ?, updated_at = ?"
+            " WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+            (state, available_at, error, now, job.id, owner))
+        return state
+
+    def retry_dead(self, job_ids: Optional[List[int]] = None) -> int:
+        """
+        Move dead jobs (all, or ``job_ids``) back to the queue with a fresh attempt count.
+        """
+        query = "UPDATE jobs SET state = 'queued', attempts = 0, available_at = ?, updated_at = ? WHERE state = 'dead'"
+        args = [time.time(), time.time()]
+        if job_ids:
+            query += f" AND id IN ({','.join('?' * len(job_ids))})"
+            args += list(job_ids)
+        return self._conn().execute(query, args).rowcount
+
+    def counts(self):
+        """
+        ``{stage: {state: count}}``
+        """
+        counts = {}
+        for row in self._conn().execute("SELECT stage, state, COUNT(*) FROM jobs GROUP BY stage, state"):
+            counts.setdefault(row[0], {})[row[1]] = row[2]
+        return counts
+
+    def pending(self, stages=STAGES) -> int:
+        placeholders = ",".join("?" * len(stages))
+        return self._conn().execute(
+            f"SELECT COUNT(*) FROM jobs WHERE stage IN ({placeholders}) AND state IN ('queued', 'leased')",
+            tuple(stages)).fetchone()[0]
+
+    def jobs(self, state: Optional[str] = None, limit: int = 50):
+        query, args = "SELECT * FROM jobs", []
+        if state:
+            query, args = query + " WHERE state = ?", [state]
+        return self._conn().execute(query + " ORDER BY id DESC LIMIT ?", (*args, limit)).fetchall()
+
+
+class Worker:
+    """
+    Pulls jobs of ``stages`` from a :class:`JobQueue` and runs them. Models are loaded once
+    per worker and reused for all its jobs: Whisper in the worker, IndexTTS2 in a long-lived
+    process of the index-tts environment (one per voice library), stopped when ``run`` returns.
+    """
+
+    def __init__(self, queue: JobQueue, stages=STAGES, worker_id: Optional[str] = None,
+                 lease_seconds: float = 300.0, heartbeat_seconds: float = 60.0, poll_seconds: float = 2.0):
+        self.queue = queue
+        self.stages = tuple(stages)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.poll_seconds = poll_seconds
+        self._whisper_models = {}
+        self._tts_processes = {}
+
+    def run(self, drain: bool = False, max_jobs: Optional[int] = None):
+        """
+        Process jobs until interrupted, or with ``drain`` until no job of the worker's stages is pending.
+        """
+        print(f"Worker {self.worker_id} started for stages: {', '.join(self.stages)}")
+        done = 0
+        try:
+            while max_jobs is None or done < max_jobs:
+                job = self.queue.lease(self.worker_id, self.stages, self.lease_seconds)
+                if job is None:
+                    if drain and self.queue.pending(self.stages) == 0:
+                        break
+                    time.sleep(self.poll_seconds)
+                    continue
+                self.process(job)
+                done += 1
+        finally:
+            for tts in self._tts_processes.values():
+                tts.close()
+            self._tts_processes.clear()
+        return done
+
+    def process(self, job: Job):
+        print(f"[{self.worker_id}] {job.stage} {filename(job.payload['video'])} ({job})")
+        stop = threading.Event()
+        lost = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.heartbeat_seconds):
+                if not self.queue.heartbeat(job, self.worker_id, self.lease_seconds):
+                    lost.set()
+                    return
+
+        beat = threading.Thread(target=heartbeat, daemon=True)
+        beat.start()
+        try:
+            with metrics.span(f"job_{job.stage}", job=job.id, attempt=job.attempts):
+                result, next_jobs = getattr(self, f"run_{job.stage}")(job.payload)
+        except Exception as e:
+            stop.set()
+            state = self.queue.fail(job, self.worker_id, f"{e!r}\n{traceback.format_exc()}")
+            metrics.inc("jobs", stage=job.stage, status="failed")
+            print(f"[{self.worker_id}] {job.stage} job {job.id} failed ({e!r}), {state}")
+            return
+        finally:
+            stop.set()
+            beat.join()
+        if lost.is_set() or not self.queue.complete(job, self.worker_id, result, next_jobs):
+            print(f"[{self.worker_id}] lost the lease of job {job.id}, result discarded")
+            return
+        metrics.inc("jobs", stage=job.stage, status="done")
+
+    # ------------------------------------------------------------------ stages
+
+    def _whisper(self, model_name: str):
+        if model_name not in self._whisper_models:
+            import whisper
+            metrics.inc("cache_misses", cache="whisper_model")
+            with metrics.span("whisper_load", model=model_name):
+                self._whisper_models[model_name] = whisper.load_model(model_name)
+        else:
+            metrics.inc("cache_hits", cache="whisper_model")
+        return self._whisper_models[model_name]
+
+    def _indextts2(self, voice_library: Optional[str]):
+        if voice_library not in self._tts_processes:
+            from .indextts_process import IndexTTS2Process
+
+            metrics.inc("cache_misses", cache="tts_model")
+            # started lazily, the model is loaded at the first segment
+            self._tts_processes[voice_library] = IndexTTS2Process(voice_library=voice_library)
+        else:
+            metrics.inc("cache_hits", cache="tts_model")
+        return self._tts_processes[voice_library]
+
+    def run_subtitles(self, p: dict):
+        from .cli import get_audio, transcribe_video
+
+        model = self._whisper(p["model"])
+        options = {"task": p["task"]}
+        if p["model"].endswith(".en"):
+            options["language"] = "en"
+        elif p["language"] != "auto":
+            options["language"] = p["language"]
+        audio_path = get_audio([p["video"]])[p["video"]]
+        try:
+            srt_path, segments, translated = transcribe_video(
+                p["video"], audio_path, p["output_srt"] or p["srt_only"], p["output_dir"],
+                lambda path: model.transcribe(path, **options), p["target_language"], p["keep_original"])
+        finally:
+            os.remove(audio_path)
+
+        next_jobs = []
+        if not p["srt_only"]:
+            next_jobs.append(("burn", {**p, "srt_path": srt_path}))
+        if p["generate_tts"] and translated:
+            next_jobs.append(("tts", {**p, "segments": [{k: s[k] for k in ("start", "end", "text")} for s in segments]}))
+        return {"srt_path": srt_path, "segments": len(segments)}, next_jobs
+
+    def run_tts(self, p: dict):
+        from .utils import generate_tts_audio
+
+        # per video directory, segment files of different videos must not collide
+        tts_dir = os.path.join(p["output_dir"], f"{filename(p['video'])}_tts")
+        with metrics.span("tts", video=filename(p["video"]), segments=len(p["segments"])):
+            tts_files = generate_tts_audio(p["segments"], p["target_language"], p["voice"], tts_dir,
+                                           cache_dir=p["tts_cache_dir"], seed=p["tts_seed"],
+                                           fit_duration=p.get("tts_fit_duration", True),
+                                           voice_library=p.get("voice_library"),
+                                           tts=self._indextts2(p.get("voice_library")))
+        if not tts_files:
+            raise RuntimeError("no TTS segment was generated")
+        return {"tts_files": len(tts_files)}, [("merge", {**p, "tts_files": tts_files})]
+
+    def run_burn(self, p: dict):
+        from .burn import burn_subtitles
+
+        out_path = os.path.join(p["output_dir"], f"{filename(p['video'])}.mp4")
+        if not burn_subtitles(p["video"], p["srt_path"], out_path, p["output_dir"]):
+            raise RuntimeError("subtitle burn-in failed")
+        return {"output": out_path}, []
+
+    def run_merge(self, p: dict):
+        from .utils import merge_tts_with_video
+
+        out_path = os.path.join(p["output_dir"], f"{filename(p['video'])}_dubbed.mp4")
+        with metrics.span("ffmpeg_merge", video=filename(p["video"])):
+            merged = merge_tts_with_video(p["video"], p["tts_files"], p["segments"], out_path, p["replace_audio"])
+        if not merged:
+            raise RuntimeError("merging the TTS audio failed")
+        return {"output": out_path}, []
+
+
+def _run_worker(db, stages, lease_seconds, heartbeat_seconds, drain, metrics_jsonl=None):
+    metrics.configure(jsonl_path=metrics_jsonl)
+    worker = Worker(JobQueue(db), stages, lease_seconds=lease_seconds, heartbeat_seconds=heartbeat_seconds)
+    worker.run(drain=drain)
+
+
+def print_status(queue: JobQueue, show_dead: bool = True):
+    counts = queue.counts()
+    states = ("queued", "leased", "done", "dead")
+    print(f"{'stage':<10}" + "".join(f"{s:>9}" for s in states))
+    for stage in STAGES:
+        row = counts.get(stage, {})
+        print(f"{stage:<10}" + "".join(f"{row.get(s, 0):>9}" for s in states))
+    if show_dead:
+        for row in queue.jobs("dead"):
+            error = (row["last_error"] or "").strip().splitlines()
+            print(f"dead job {row['id']} ({row['stage']}, {row['attempts']} attempts): "
+                  f"{json.loads(row['payload'])['video']}: {error[0] if error else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Durable batch queue for auto_subtitle: enqueue videos, run workers, check progress.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--db", type=str, default="auto_subtitle_queue.db", help="SQLite queue database")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = commands.add_parser("enqueue", help="add videos to the queue",
+                                  formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    enqueue.add_argument("video", nargs="+", type=str, help="paths to video files")
+    enqueue.add_argument("--model", default="small", help="name of the Whisper model to use")
+    enqueue.add_argument("--output_dir", "-o", type=str, default=".", help="directory to save the outputs")
+    enqueue.add_argument("--output_srt", type=str2bool, default=False)
+    enqueue.add_argument("--srt_only", type=str2bool, default=False)
+    enqueue.add_argument("--task", type=str, default="transcribe", choices=["transcribe", "translate"])
+    enqueue.add_argument("--language", type=str, default="auto")
+    enqueue.add_argument("--target_language", type=str, default=None)
+    enqueue.add_argument("--keep_original", type=str2bool, default=False)
+    enqueue.add_argument("--generate_tts", type=str2bool, default=False)
+    enqueue.add_argument("--voice", type=str, default="default")
+    enqueue.add_argument("--replace_audio", type=str2bool, default=True)
+    enqueue.add_argument("--tts_cache_dir", type=str, default=None, help="default: <output_dir>/tts_cache")
+    enqueue.add_argument("--tts_cache", type=str2bool, default=True)
+    enqueue.add_argument("--tts_seed", type=int, default=0)
+    enqueue.add_argument("--tts_fit_duration", type=str2bool, default=True)
+    enqueue.add_argument("--voice_library", type=str, default=None, help="IndexTTS2 voice library index")
+    enqueue.add_argument("--priority", type=int, default=0, help="higher runs first")
+    enqueue.add_argument("--max_attempts", type=int, default=3, help="attempts per stage before dead-lettering")
+
+    worker = commands.add_parser("worker", help="process jobs",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    worker.add_argument("--stages", type=str, default=",".join(STAGES),
+                        help="comma separated stages this worker runs, e.g. 'burn,merge' for an FFmpeg-only worker")
+    worker.add_argument("--processes", type=int, default=1, help="worker processes, each with its own models")
+    worker.add_argument("--lease_seconds", type=float, default=300.0)
+    worker.add_argument("--heartbeat_seconds", type=float, default=60.0)
+    worker.add_argument("--drain", action="store_true", help="exit when no job of these stages is pending")
+    worker.add_argument("--metrics_jsonl", type=str, default=None,
+                        help="append per-stage timings as JSON lines to this file")
+
+    commands.add_parser("status", help="job counts per stage and state, dead jobs")
+
+    retry = commands.add_parser("retry", help="re-queue dead jobs")
+    retry.add_argument("job_ids", nargs="*", type=int, help="job ids (default: all dead jobs)")
+
+    args = parser.parse_args()
+    queue = JobQueue(args.db)
+
+    if args.command == "enqueue":
+        options = vars(args).copy()
+        for key in ("db", "command", "video", "priority", "max_attempts", "tts_cache"):
+            options.pop(key)
+        # workers may run from another directory
+        options["output_dir"] = os.path.abspath(args.output_dir)
+        os.makedirs(options["output_dir"], exist_ok=True)
+        if args.tts_cache:
+            options["tts_cache_dir"] = os.path.abspath(args.tts_cache_dir or os.path.join(args.output_dir, "tts_cache"))
+        else:
+            options["tts_cache_dir"] = None
+        if args.voice_library:
+            options["voice_library"] = os.path.abspath(args.voice_library)
+        for video in args.video:
+            job_id = queue.enqueue("subtitles", {**options, "video": os.path.abspath(video)},
+                                   priority=args.priority, max_attempts=args.max_attempts)
+            print(f"Queued {video} as job {job_id}")
+    elif args.command == "worker":
+        stages = tuple(s.strip() for s in args.stages.split(",") if s.strip())
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+        worker_args = (args.db, stages, args.lease_seconds, args.heartbeat_seconds, args.drain, args.metrics_jsonl)
+        if args.processes > 1:
+            import multiprocessing
+
+            processes = [multiprocessing.Process(target=_run_worker, args=worker_args) for _ in range(args.processes)]
+            for p in processes:
+                p.start()
+            for p in processes:
+                p.join()
+        else:
+            _run_worker(*worker_args)
+    elif args.command == "status":
+        print_status(queue)
+    elif args.command == "retry":
+        print(f"Re-queued {queue.retry_dead(args.job_ids)} dead jobs")
+
+
+if __name__ == "__main__":
+    main()
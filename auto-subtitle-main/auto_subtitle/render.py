@@ -0,0 +1,137 @@
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import ffmpeg
+
+from .burn import FORCE_STYLE, _ffmpeg_error, _filter_path
+from .metrics import metrics
+from .utils import filename, media_duration, probe_media
+
+# output variant -> file name suffix
+VARIANTS = {
+    "subtitled": "",                          # burned subtitles, original audio
+    "dubbed": "_dubbed",                      # original video (copied), dubbed audio
+    "subtitled_dubbed": "_subtitled_dubbed",  # burned subtitles, dubbed audio
+    "softsub": "_softsub",                    # original video (copied), original audio, mov_text subtitles
+    "softsub_dubbed": "_softsub_dubbed",      # original video (copied), dubbed audio, mov_text subtitles
+}
+DUBBED_VARIANTS = ("dubbed", "subtitled_dubbed", "softsub_dubbed")
+BURNED_VARIANTS = ("subtitled", "subtitled_dubbed")
+
+
+def parse_variants(value: str) -> List[str]:
+    variants = [v.strip() for v in value.split(",") if v.strip()]
+    unknown = [v for v in variants if v not in VARIANTS]
+    if unknown:
+        raise ValueError(f"Unknown output variants {unknown}, expected some of {list(VARIANTS)}")
+    return variants
+
+
+def variant_paths(path: str, output_dir: str, variants: List[str]) -> Dict[str, str]:
+    return {v: os.path.join(output_dir, f"{filename(path)}{VARIANTS[v]}.mp4") for v in variants}
+
+
+def _dubbed_audio(video, tts_files: List[Tuple[int, str]], segments: List[dict],
+                  duration: float, replace_audio: bool, has_audio: bool):
+    """
+    Dubbed audio track: every TTS segment delayed to its subtitle start and mixed in one ``amix``,
+    over silence (``replace_audio``) or over the original audio.
+
+    ``tts_files`` are (segment index, audio file) pairs, skipped lines have no file.
+    """
+    if replace_audio or not has_audio:
+        base = ffmpeg.input('anullsrc=channel_layout=mono:sample_rate=16000', f='lavfi', t=duration)
+    else:
+        base = video.audio
+    delayed = [
+        ffmpeg.input(tts_file).filter('adelay', delays=f"{int(segments[index]['start'] * 1000)}", all=1)
+        for index, tts_file in tts_files if os.path.exists(tts_file)
+    ]
+    if not delayed:
+        return None
+    return ffmpeg.filter([base] + delayed, 'amix', inputs=len(delayed) + 1, duration='first',
+                         dropout_transition=0, normalize=0)
+
+
+def build_render(path: str, srt_path: Optional[str], outputs: Dict[str, str], has_audio: bool, duration: float,
+                 tts_files: Optional[List[Tuple[int, str]]] = None, segments: Optional[List[dict]] = None,
+                 replace_audio: bool = True):
+    """
+    FFmpeg graph of all output variants of a video: the source is decoded once, the burned video
+    is ``split`` between the burned variants and the dubbed audio is ``asplit`` between the dubbed
+    ones, the other variants copy the original video stream. ``srt_path`` is only read by the
+    burned and soft-sub variants.
+
+    Returns:
+        the merged output node, or None if a dubbed variant is requested without TTS audio.
+    """
+    video = ffmpeg.input(path)
+    burned = [v for v in outputs if v in BURNED_VARIANTS]
+    dubbed = [v for v in outputs if v in DUBBED_VARIANTS]
+    video_streams, dub_streams = {}, {}
+    if burned:
+        burned_video = video.video.filter('subtitles', _filter_path(srt_path), force_style=FORCE_STYLE)
+        parts = burned_video.split() if len(burned) > 1 else [burned_video]
+        video_streams = {v: parts[i] for i, v in enumerate(burned)}
+    if dubbed:
+        dub_audio = _dubbed_audio(video, tts_files or [], segments or [], duration, replace_audio, has_audio)
+        if dub_audio is None:
+            return None
+        parts = dub_audio.asplit() if len(dubbed) > 1 else [dub_audio]
+        dub_streams = {v: parts[i] for i, v in enumerate(dubbed)}
+    if any(v.startswith("softsub") for v in outputs):
+        soft_subs = ffmpeg.input(srt_path)["s"]
+
+    output_nodes = []
+    for variant, out_path in outputs.items():
+        streams = [video_streams.get(variant, video.video)]
+        kwargs = {"vcodec": "libx264" if variant in BURNED_VARIANTS else "copy"}
+        if variant in DUBBED_VARIANTS:
+            streams.append(dub_streams[variant])
+        elif has_audio:
+            streams.append(video.audio)
+        if len(streams) > 1:
+            kwargs["acodec"] = "aac"
+        if variant.startswith("softsub"):
+            streams.append(soft_subs)
+            kwargs["scodec"] = "mov_text"
+        output_nodes.append(ffmpeg.output(*streams, out_path, **kwargs))
+    return ffmpeg.merge_outputs(*output_nodes)
+
+
+def render_outputs(path: str, srt_path: str, outputs: Dict[str, str], output_dir: str,
+                   tts_files: Optional[List[Tuple[int, str]]] = None, segments: Optional[List[dict]] = None,
+                   replace_audio: bool = True) -> bool:
+    """
+    Render the output variants of a video (see ``VARIANTS``) with a single FFmpeg run.
+
+    Args:
+        outputs: variant -> output path.
+        tts_files, segments: (segment index, TTS audio) pairs of ``generate_tts_audio`` and the
+            subtitle segments, needed for the dubbed variants.
+    Returns:
+        False if FFmpeg failed.
+    """
+    print(f"Rendering {', '.join(outputs)} for {filename(path)}...")
+    # the work dir is inside output_dir, so the subtitles filter gets a relative path
+    work_dir = tempfile.mkdtemp(prefix=f".render_{filename(path)}_", dir=output_dir)
+    try:
+        local_srt = os.path.join(work_dir, os.path.basename(srt_path))
+        shutil.copyfile(srt_path, local_srt)
+        has_audio = any(s.get("codec_type") == "audio" for s in probe_media(path)["streams"])
+        graph = build_render(path, local_srt, outputs, has_audio, media_duration(path),
+                             tts_files, segments, replace_audio)
+        if graph is None:
+            print("No TTS files to merge")
+            return False
+        with metrics.span("ffmpeg_render", video=filename(path)) as span:
+            span["variants"] = len(outputs)
+            graph.run(quiet=True, overwrite_output=True)
+    except ffmpeg.Error as e:
+        print("FFmpeg error while rendering:\n" + _ffmpeg_error(e))
+        return False
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return True
@@ -0,0 +1,181 @@
+import os
+import json
+import hashlib
+import unicodedata
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no lock, one writer per cache directory
+    fcntl = None
+
+# bump to invalidate all cached segments (e.g. after a TTS model update)
+CACHE_VERSION = 1
+
+_file_digests = {}
+
+
+def normalize_text(text: str) -> str:
+    """
+    Text as it is used for the cache key: NFKC, collapsed whitespace.
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def file_digest(path: str) -> str:
+    """
+    SHA-256 of a file's content, memoized by (path, size, mtime).
+    """
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo_key not in _file_digests:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        _file_digests[memo_key] = h.hexdigest()
+    return _file_digests[memo_key]
+
+
+def segment_seed(text: str, base_seed: int = 0) -> int:
+    """
+    Deterministic seed of a segment, derived from its normalized text and ``base_seed``
+    (not from its position, so an edit elsewhere in the SRT doesn't change it).
+    """
+    digest = hashlib.sha256(f"{base_seed}:{normalize_text(text)}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "little") & 0x7FFFFFFF
+
+
+def segment_key(text: str, voice_path: Optional[str], emotion: Optional[str], params: dict, seed: int) -> str:
+    """
+    Cache key of a synthesized segment: normalized text, voice audio content, emotion settings,
+    generation parameters and seed.
+    """
+    voice = file_digest(voice_path) if voice_path and os.path.isfile(voice_path) else voice_path
+    material = json.dumps({
+        "version": CACHE_VERSION,
+        "text": normalize_text(text),
+        "voice": voice,
+        "emotion": emotion,
+        "params": params,
+        "seed": seed,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class SegmentCache:
+    """
+    Synthesized segment audio stored in a few large append-only chunk files
+    (``chunk_00000.bin``, ...) with a JSON lines index (``index.jsonl``) of
+    ``key -> (chunk, offset, length)``.
+
+    Audio is written to the chunk before its index line, so an interrupted run leaves
+    at most unreferenced bytes. Several processes can share a cache directory: ``put`` holds
+    an exclusive ``flock`` of the index while it appends, and picks up the entries of the
+    other writers first; a miss re-reads the index lines added since the last read.
+    """
+
+    def __init__(self, cache_dir: str, max_chunk_bytes: int = 256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_chunk_bytes = max_chunk_bytes
+        self.index_path = os.path.join(cache_dir, "index.jsonl")
+        self._index = {}
+        self._index_newline = False
+        # bytes of the index already read
+        self._index_pos = 0
+        self._chunk_sizes = {}
+        self._chunk = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index(locked=False)
+
+    def _chunk_path(self, chunk: int) -> str:
+        return os.path.join(self.cache_dir, f"chunk_{chunk:05d}.bin")
+
+    def _load_index(self, locked: bool):
+        """
+        Read the index lines added since the last read. With ``locked`` (no writer is appending),
+        a partial last line is the remnant of an interrupted write; otherwise it may still be
+        being written and is read next time.
+        """
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_pos)
+            for raw in f:
+                if not raw.endswith(b"\n") and not locked:
+                    break
+                self._index_pos += len(raw)
+                # the next entry must not be appended to a partially written line
+                self._index_newline = not raw.endswith(b"\n")
+                try:
+                    entry = json.loads(raw.decode("utf-8"))
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    # partially written line
+                    continue
+                chunk = entry["chunk"]
+                self._chunk = max(self._chunk, chunk)
+                if entry["offset"] + entry["length"] > self._chunk_sizes.get(chunk, 0):
+                    path = self._chunk_path(chunk)
+                    self._chunk_sizes[chunk] = os.path.getsize(path) if os.path.exists(path) else 0
+                if entry["offset"] + entry["length"] <= self._chunk_sizes[chunk]:
+                    self._index[entry["key"]] = entry
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        entry = self._index.get(key)
+        if entry is None:
+            # added by another process since the last read
+            self._load_index(locked=False)
+            entry = self._index.get(key)
+        if entry is None:
+            return None
+        with open(self._chunk_path(entry["chunk"]), "rb") as f:
+            f.seek(entry["offset"])
+            data = f.read(entry["length"])
+        return data if len(data) == entry["length"] else None
+
+    def get(self, key: str, output_file: str) -> bool:
+        """
+        Write the cached audio of ``key`` to ``output_file``, returns False on a miss.
+        """
+        data = self.get_bytes(key)
+        if data is None:
+            return False
+        with open(output_file, "wb") as f:
+            f.write(data)
+        return True
+
+    def put(self, key: str, audio_file: str):
+        """
+        Add the audio file of ``key`` to the cache.
+        """
+        with open(audio_file, "rb") as f:
+            data = f.read()
+        with open(self.index_path, "ab") as index:
+            if fcntl is not None:
+                # released when the index is closed
+                fcntl.flock(index.fileno(), fcntl.LOCK_EX)
+            self._load_index(locked=True)
+            path = self._chunk_path(self._chunk)
+            if os.path.exists(path) and os.path.getsize(path) + len(data) > self.max_chunk_bytes:
+                self._chunk += 1
+                path = self._chunk_path(self._chunk)
+            with open(path, "ab") as f:
+                # under the lock, the end of the chunk is where this write lands
+                offset = os.fstat(f.fileno()).st_size
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            entry = {"key": key, "chunk": self._chunk, "offset": offset, "length": len(data)}
+            line = (("\n" if self._index_newline else "") + json.dumps(entry) + "\n").encode("utf-8")
+            index.write(line)
+            index.flush()
+            self._index_pos += len(line)
+        self._index_newline = False
+        self._chunk_sizes[self._chunk] = offset + len(data)
+        self._index[key] = entry
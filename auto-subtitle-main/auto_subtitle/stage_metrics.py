@@ -0,0 +1,273 @@
+# Stage timings, counters and tracing, shared by IndexTTS and auto_subtitle.
+# The source is index-tts/indextts/utils/stage_metrics.py. auto-subtitle-main/auto_subtitle/stage_metrics.py
+# is an identical copy, because auto_subtitle runs IndexTTS in its own environment and cannot import it;
+# edit the source and copy it over (auto-subtitle-main/test_metrics.py checks that they match).
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+
+def _label_key(labels: Dict) -> Tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: Tuple) -> str:
+    if not key:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in key)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(key, escaped)) + "}"
+
+
+def peak_rss_bytes() -> int:
+    """
+    Peak resident set size of the process (0 where ``resource`` is unavailable, e.g. Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Metrics:
+    """
+    Process-wide registry of stage timings, counters and gauges.
+
+    - ``span(stage)`` times a block; durations are aggregated per stage (count/sum/max) and, when
+      enabled, written as JSON lines (``jsonl_path``) and Chrome trace events (``trace_path``,
+      open it in ``chrome://tracing`` or https://ui.perfetto.dev).
+    - ``inc(name)`` / ``observe(name, value)`` / ``set_gauge(name, value)`` record counters,
+      value summaries (e.g. tokens per second) and gauges.
+    - ``prometheus_text()`` renders everything in the Prometheus text exposition format.
+
+    Thread-safe; spans may be nested and opened from several threads.
+    """
+
+    def __init__(self, namespace: str = "indextts", jsonl_path: Optional[str] = None,
+                 trace_path: Optional[str] = None, max_trace_events: int = 1_000_000):
+        self.namespace = namespace
+        self.max_trace_events = max_trace_events
+        self._lock = threading.Lock()
+        self._jsonl = None
+        self.jsonl_path = None
+        self.trace_path = None
+        self._atexit_registered = False
+        self.reset()
+        self.configure(jsonl_path=jsonl_path, trace_path=trace_path)
+
+    @classmethod
+    def from_env(cls, namespace: str = "indextts"):
+        """
+        ``<NAMESPACE>_METRICS_JSONL`` and ``<NAMESPACE>_TRACE`` enable the JSON lines and Chrome trace outputs.
+        """
+        prefix = namespace.upper()
+        return cls(namespace, jsonl_path=os.environ.get(f"{prefix}_METRICS_JSONL"),
+                   trace_path=os.environ.get(f"{prefix}_TRACE"))
+
+    def configure(self, jsonl_path: Optional[str] = None, trace_path: Optional[str] = None):
+        """
+        Enable the JSON lines output and/or the Chrome trace file (written at exit or by ``write_trace``).
+        """
+        with self._lock:
+            if jsonl_path and jsonl_path != self.jsonl_path:
+                if self._jsonl is not None:
+                    self._jsonl.close()
+                if os.path.dirname(jsonl_path):
+                    os.makedirs(os.path.dirname(jsonl_path), exist_ok=True)
+                self._jsonl = open(jsonl_path, "a", encoding="utf-8", buffering=1)
+                self.jsonl_path = jsonl_path
+            if trace_path:
+                self.trace_path = trace_path
+                if not self._atexit_registered:
+                    atexit.register(self.write_trace)
+                    self._atexit_registered = True
+
+    def reset(self):
+        with self._lock:
+            self._spans: Dict[Tuple, list] = {}
+            self._counters: Dict[Tuple, float] = {}
+            self._summaries: Dict[Tuple, list] = {}
+            self._gauges: Dict[Tuple, float] = {}
+            self._trace_events = []
+            self._origin = time.perf_counter()
+
+    def emit(self, record: Dict):
+        """
+        Write one JSON line (no-op unless ``jsonl_path`` is configured).
+        """
+        if self._jsonl is None:
+            return
+        line = json.dumps({"ts": time.time(), **record}, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._jsonl is not None:
+                self._jsonl.write(line + "\n")
+
+    @contextmanager
+    def span(self, stage: str, **attrs):
+        """
+        Time the enclosed block as ``stage``. The yielded dict can be filled with extra attributes
+        (e.g. token counts), they are attached to the JSON line and the trace event.
+
+        Example:
+            >>> with metrics.span("gpt_decode", segment=3) as span:
+            ...     codes = generate()
+            ...     span["tokens"] = codes.numel()
+        """
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            end = time.perf_counter()
+            self.record_span(stage, start, end, **attrs)
+
+    def record_span(self, stage: str, start: float, end: float, **attrs):
+        """
+        Record a span measured by the caller with ``time.perf_counter()``.
+        """
+        duration = end - start
+        with self._lock:
+            agg = self._spans.setdefault(_label_key({"stage": stage}), [0, 0.0, 0.0])
+            agg[0] += 1
+            agg[1] += duration
+            agg[2] = max(agg[2], duration)
+            if self.trace_path and len(self._trace_events) < self.max_trace_events:
+                self._trace_events.append({
+                    "name": stage, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                    "ts": (start - self._origin) * 1e6, "dur": duration * 1e6, "args": attrs,
+                })
+        self.emit({"type": "span", "stage": stage, "duration": duration, **attrs})
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            key = (name, _label_key(labels))
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        with self._lock:
+            agg = self._summaries.setdefault((name, _label_key(labels)), [0, 0.0, float("-inf")])
+            agg[0] += 1
+            agg[1] += value
+            agg[2] = max(agg[2], value)
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def update_peak_memory(self) -> Dict[str, int]:
+        """
+        Refresh the peak memory gauges: process RSS and, if torch is loaded with CUDA, allocated device memory.
+        """
+        peaks = {"peak_rss_bytes": peak_rss_bytes()}
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized():
+            peaks["cuda_peak_allocated_bytes"] = torch.cuda.max_memory_allocated()
+        for name, value in peaks.items():
+            self.set_gauge(name, value)
+        return peaks
+
+    def snapshot(self) -> Dict:
+        """
+        Aggregated values as a JSON-serializable dict.
+        """
+        with self._lock:
+            return {
+                "spans": {dict(k)["stage"]: {"count": c, "sum": s, "max": m} for k, (c, s, m) in self._spans.items()},
+                "counters": {name + _format_labels(k): v for (name, k), v in self._counters.items()},
+                "summaries": {name + _format_labels(k): {"count": c, "sum": s, "max": m}
+                              for (name, k), (c, s, m) in self._summaries.items()},
+                "gauges": {name + _format_labels(k): v for (name, k), v in self._gauges.items()},
+            }
+
+    def prometheus_text(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        self.update_peak_memory()
+        ns = self.namespace
+        lines = []
+        with self._lock:
+            lines.append(f"# HELP {ns}_stage_seconds Wall time spent per pipeline stage.")
+            lines.append(f"# TYPE {ns}_stage_seconds summary")
+            for key, (count, total, _) in sorted(self._spans.items()):
+                lines.append(f"{ns}_stage_seconds_sum{_format_labels(key)} {total:.6f}")
+                lines.append(f"{ns}_stage_seconds_count{_format_labels(key)} {count}")
+            lines.append(f"# TYPE {ns}_stage_seconds_max gauge")
+            for key, (_, _, peak) in sorted(self._spans.items()):
+                lines.append(f"{ns}_stage_seconds_max{_format_labels(key)} {peak:.6f}")
+
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {ns}_{name}_total counter")
+                for (n, key), value in sorted(self._counters.items()):
+                    if n == name:
+                        lines.append(f"{ns}_{name}_total{_format_labels(key)} {value:g}")
+            for name in sorted({name for name, _ in self._summaries}):
+                lines.append(f"# TYPE {ns}_{name} summary")
+                for (n, key), (count, total, _) in sorted(self._summaries.items()):
+                    if n == name:
+                        lines.append(f"{ns}_{name}_sum{_format_labels(key)} {total:.6f}")
+                        lines.append(f"{ns}_{name}_count{_format_labels(key)} {count}")
+            for name in sorted({name for name, _ in self._gauges}):
+                lines.append(f"# TYPE {ns}_{name} gauge")
+                for (n, key), value in sorted(self._gauges.items()):
+                    if n == name:
+                        lines.append(f"{ns}_{name}{_format_labels(key)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """
+        Write ``prometheus_text()`` atomically, e.g. for the node_exporter textfile collector.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def write_trace(self, path: Optional[str] = None):
+        """
+        Write the recorded spans as a Chrome trace (JSON array format).
+        """
+        path = path or self.trace_path
+        if not path:
+            return
+        with self._lock:
+            events = list(self._trace_events)
+        events.append({"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": self.namespace}})
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+    def serve_prometheus(self, port: int, host: str = "0.0.0.0"):
+        """
+        Serve ``GET /metrics`` from a daemon thread. Returns the HTTP server.
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name=f"{self.namespace}-metrics", daemon=True).start()
+        return server
+
@@ -1,11 +1,22 @@
+import json
 import os
-from typing import Iterator, TextIO, List
-import tempfile
+from typing import Iterator, TextIO, List, Tuple
+import shutil
 import subprocess
 
+from .indextts_process import IndexTTS2Process
+from .metrics import metrics
+from .segment_cache import SegmentCache, segment_key, segment_seed
+
+# Emotion passed to IndexTTS2 for every segment
+TTS_EMOTION = "happy"
+
 # Global cache for translation models
 _mt_cache = {}
 
+# ffprobe results, see probe_media
+_probe_cache = {}
+
 def str2bool(string):
     string = string.lower()
     str2val = {"true": True, "false": False}
@@ -50,6 +61,31 @@ def filename(path):
     return os.path.splitext(os.path.basename(path))[0]
 
 
+def probe_media(path: str, **kwargs) -> dict:
+    """
+    ``ffmpeg.probe`` of a file, memoized by (path, size, mtime, probe arguments) so the
+    stages of a video share one ffprobe run.
+    """
+    import ffmpeg
+
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns, tuple(sorted(kwargs.items())))
+    if memo_key not in _probe_cache:
+        _probe_cache[memo_key] = ffmpeg.probe(path, **kwargs)
+    return _probe_cache[memo_key]
+
+
+def media_duration(path: str) -> float:
+    """
+    Duration of a media file in seconds (container duration, else the longest stream).
+    """
+    info = probe_media(path)
+    duration = info.get("format", {}).get("duration")
+    if duration is None:
+        duration = max(float(s["duration"]) for s in info["streams"] if "duration" in s)
+    return float(duration)
+
+
 def translate_segments(segments: List[dict], src: str, tgt: str) -> List[dict]:
     """
     Translate subtitle segments using HuggingFace M2M100 model.
@@ -65,9 +101,13 @@ def translate_segments(segments: List[dict], src: str, tgt: str) -> List[dict]:
         cache_key = "m2m100"
         if cache_key not in _mt_cache:
             print("Loading M2M100 translation model (this may take a moment)...")
-            tokenizer = M2M100Tokenizer.from_pretrained("facebook/m2m100_418M")
-            model = M2M100ForConditionalGeneration.from_pretrained("facebook/m2m100_418M")
+            metrics.inc("cache_misses", cache="m2m100_model")
+            with metrics.span("m2m100_load"):
+                tokenizer = M2M100Tokenizer.from_pretrained("facebook/m2m100_418M")
+                model = M2M100ForConditionalGeneration.from_pretrained("facebook/m2m100_418M")
             _mt_cache[cache_key] = (tokenizer, model)
+        else:
+            metrics.inc("cache_hits", cache="m2m100_model")
         
         tokenizer, model = _mt_cache[cache_key]
         
@@ -103,14 +143,16 @@ def translate_segments(segments: List[dict], src: str, tgt: str) -> List[dict]:
             tokenizer.src_lang = src_lang
             
             # Encode and translate
-            encoded = tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=512)
-            generated_tokens = model.generate(
-                **encoded, 
-                forced_bos_token_id=tokenizer.get_lang_id(tgt_lang),
-                max_length=512,
-                num_beams=5,
-                do_sample=False
-            )
+            with metrics.span("m2m100", batch=len(texts)) as span:
+                encoded = tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=512)
+                generated_tokens = model.generate(
+                    **encoded,
+                    forced_bos_token_id=tokenizer.get_lang_id(tgt_lang),
+                    max_length=512,
+                    num_beams=5,
+                    do_sample=False
+                )
+                span["tokens"] = generated_tokens.numel()
             
             # Decode translations
             translations = tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
@@ -128,17 +170,47 @@ def translate_segments(segments: List[dict], src: str, tgt: str) -> List[dict]:
         return segments
 
 
-def generate_tts_audio(segments: List[dict], target_language: str, voice: str, output_dir: str) -> List[str]:
+def generate_tts_audio(segments: List[dict], target_language: str, voice: str, output_dir: str,
+                       cache_dir: str = None, seed: int = 0, fit_duration: bool = True,
+                       voice_library: str = None, tts: IndexTTS2Process = None) -> List[Tuple[int, str]]:
     """
     Generate TTS audio for translated segments using indexTTS2.
-    Returns list of generated audio file paths.
+    Returns (segment index, audio file path) of every generated segment: empty and failed
+    lines have no audio, so the files don't line up with ``segments``.
+
+    Every segment is synthesized with a seed derived from its text and ``seed``. With
+    ``cache_dir``, synthesized segments are cached by (text, voice audio, emotion, parameters,
+    seed): re-dubbing after editing a few lines only synthesizes the changed lines, and
+    repeated lines of a video are synthesized once.
+
+    With ``fit_duration``, every segment is synthesized to the length of its subtitle
+    (``end - start``) by IndexTTS2 duration control, so dubbed lines don't overlap.
+
+    With ``voice_library`` (index of an IndexTTS2 voice library), ``voice`` can be one of its
+    voice ids, and the default voice is the library voice of ``target_language``: its prompt
+    conditioning is precomputed, no reference audio is encoded.
+
+    IndexTTS2 is loaded once for all the segments, in ``tts`` (a warm process, e.g. of a queue
+    worker) or in a process started for this call.
     """
+    own_tts = tts is None
+    if own_tts:
+        tts = IndexTTS2Process(voice_library=voice_library)
     try:
         # Create TTS segments directory
         tts_dir = os.path.join(output_dir, "tts_segments")
         os.makedirs(tts_dir, exist_ok=True)
         
         audio_files = []
+        cache = SegmentCache(cache_dir) if cache_dir else None
+        voice_path = _get_voice_reference(voice, target_language, voice_library)
+        voice_key = voice_path
+        if voice_library and not os.path.isfile(voice_path):
+            # library voices are keyed by their source audio, a rebuilt voice is synthesized again
+            voice_key = f"voice_library:{voice_path}:{_load_voice_library(voice_library)['voices'][voice_path]['digest']}"
+        params = {"engine": "indextts2", "language": target_language}
+        # lines already synthesized in this run: key -> audio file
+        generated = {}
         
         print(f"Generating TTS audio in {target_language} with voice: {voice}")
         
@@ -149,12 +221,33 @@ def generate_tts_audio(segments: List[dict], target_language: str, voice: str, o
             
             # Generate unique filename for this segment
             audio_file = os.path.join(tts_dir, f"segment_{i:04d}.wav")
+            tts_seed = segment_seed(text, seed)
+            target_duration = None
+            if fit_duration and segment.get('end', 0) > segment.get('start', 0):
+                target_duration = round(segment['end'] - segment['start'], 3)
+            key = segment_key(text, voice_key, TTS_EMOTION, {**params, "target_duration": target_duration}, tts_seed)
             
-            # Use indexTTS2
-            success = _generate_with_indextts2(text, target_language, voice, audio_file)
+            if key in generated:
+                shutil.copyfile(generated[key], audio_file)
+                success = True
+                metrics.inc("cache_hits", cache="tts_segment")
+            elif cache is not None and cache.get(key, audio_file):
+                success = True
+                metrics.inc("cache_hits", cache="tts_segment")
+            else:
+                metrics.inc("cache_misses", cache="tts_segment")
+                # Use indexTTS2
+                with metrics.span("tts_segment", segment=i, chars=len(text)):
+                    success = _generate_with_indextts2(text, target_language, voice_path, audio_file,
+                                                       seed=tts_seed, target_duration=target_duration,
+                                                       voice_library=voice_library, tts=tts)
+                metrics.inc("tts_segments", status="ok" if success else "failed")
+                if success and cache is not None:
+                    cache.put(key, audio_file)
             
             if success:
-                audio_files.append(audio_file)
+                generated[key] = audio_file
+                audio_files.append((i, audio_file))
             else:
                 print(f"Failed to generate TTS for segment {i}: {text[:50]}...")
         
@@ -163,11 +256,16 @@ def generate_tts_audio(segments: List[dict], target_language: str, voice: str, o
     except Exception as e:
         print(f"TTS generation failed: {e}")
         return []
+    finally:
+        if own_tts:
+            tts.close()
 
 
-def _generate_with_indextts2(text: str, language: str, voice: str, output_file: str) -> bool:
+def _generate_with_indextts2(text: str, language: str, voice: str, output_file: str, seed: int = None,
+                             target_duration: float = None, voice_library: str = None,
+                             tts: IndexTTS2Process = None) -> bool:
     """
-    Generate TTS using IndexTTS2 via wrapper
+    Generate TTS using IndexTTS2, run in the uv environment of index-tts
     
     Integrates with the index-tts library for high-quality voice cloning and
     emotionally expressive speech synthesis.
@@ -175,49 +273,24 @@ def _generate_with_indextts2(text: str, language: str, voice: str, output_file:
     Args:
         text: Text to synthesize
         language: Target language code (e.g., 'en', 'es', 'zh')
-        voice: Path to voice reference audio file, or emotion keyword
+        voice: Path to voice reference audio file, voice id of ``voice_library``, or emotion keyword
         output_file: Path where output WAV should be saved
+        seed: Random seed of the synthesis, for reproducible output
+        target_duration: Length of the output in seconds (the subtitle time slot), None for natural speed
+        voice_library: Path to an IndexTTS2 voice library index (indextts-voices build)
+        tts: IndexTTS2 process with the model loaded, None to load it for this segment only
     
     Returns:
         True on success, False on failure
     """
     try:
-        # Use the wrapper to call IndexTTS2 from uv environment
-        import sys
-        wrapper_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "indextts_wrapper.py")
-        
-        if not os.path.exists(wrapper_path):
-            print(f"IndexTTS2 wrapper not found at {wrapper_path}")
-            return False
-        
         # Get voice reference audio
-        voice_path = _get_voice_reference(voice, language)
-        
-        # Call wrapper
-        import subprocess
-        result = subprocess.run(
-            [sys.executable, wrapper_path, 
-             "--text", text,
-             "--output", output_file,
-             "--language", language,
-             "--voice", voice_path if voice_path else "",
-             "--emotion", "happy"],
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
-        
-        # Check if successful
-        if result.returncode == 0 and os.path.exists(output_file):
-            return True
-        else:
-            print(f"IndexTTS2 generation failed: {result.stderr}")
-            return False
+        voice_path = _get_voice_reference(voice, language, voice_library)
+        if tts is not None:
+            return tts.generate(text, output_file, voice_path=voice_path, seed=seed, target_duration=target_duration)
+        with IndexTTS2Process(voice_library=voice_library) as tts:
+            return tts.generate(text, output_file, voice_path=voice_path, seed=seed, target_duration=target_duration)
         
-    except ImportError as e:
-        print(f"IndexTTS2 not installed. Please install from: https://github.com/index-tts/index-tts")
-        print(f"Error: {e}")
-        return False
     except Exception as e:
         print(f"IndexTTS2 generation failed: {e}")
         import traceback
@@ -225,20 +298,44 @@ def _generate_with_indextts2(text: str, language: str, voice: str, output_file:
         return False
 
 
-def _get_voice_reference(voice: str, language: str) -> str:
+def _load_voice_library(path: str) -> dict:
+    """
+    Index of an IndexTTS2 voice library (voice id -> language, source audio digest, ...).
+    """
+    mtime = os.path.getmtime(path)
+    cached = _voice_library_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "r", encoding="utf-8") as f:
+            cached = (mtime, json.load(f))
+        _voice_library_cache[path] = cached
+    return cached[1]
+
+
+def _get_voice_reference(voice: str, language: str, voice_library: str = None) -> str:
     """
     Get or generate voice reference audio for IndexTTS2
     
     Args:
-        voice: Voice identifier (can be path to audio file or keyword)
+        voice: Voice identifier (can be path to audio file, voice id of ``voice_library`` or keyword)
         language: Target language for fallback voice selection
+        voice_library: Optional path to an IndexTTS2 voice library index
     
     Returns:
-        Path to voice reference audio file
+        Path to voice reference audio file, or a voice id of ``voice_library``
     """
     # If voice is a file path, use it directly
     if os.path.exists(voice):
         return voice
+
+    # Precomputed voices: the requested id, else the first voice of the language, else a default one
+    if voice_library:
+        voices = _load_voice_library(voice_library)["voices"]
+        if voice in voices:
+            return voice
+        for lang in (language.lower()[:2], "default"):
+            matches = sorted(voice_id for voice_id, entry in voices.items() if entry["language"] == lang)
+            if matches:
+                return matches[0]
     
     # Check for default voice samples in examples directory
     default_voices = {
@@ -297,78 +394,30 @@ def _create_silent_wav(output_file: str, duration: float = 1.0) -> bool:
         return False
 
 
-def merge_tts_with_video(video_path: str, tts_files: List[str], segments: List[dict], 
+def merge_tts_with_video(video_path: str, tts_files: List[Tuple[int, str]], segments: List[dict],
                         output_path: str, replace_audio: bool = True) -> bool:
     """
-    Merge generated TTS audio with original video using FFmpeg
+    Merge generated TTS audio with original video using FFmpeg: the dubbed audio track of
+    ``render`` (every segment delayed to its subtitle start, mixed in one ``amix``).
+
+    ``tts_files`` are the (segment index, audio file) pairs of ``generate_tts_audio``.
     """
     try:
-        import ffmpeg
-        
+        from .render import build_render
+
         if not tts_files or not segments:
             print("No TTS files to merge")
             return False
-        
-        # Create a temporary file for the merged audio
-        temp_audio = os.path.join(tempfile.gettempdir(), "merged_tts.wav")
-        
-        # Create silence audio with video duration
-        video_info = ffmpeg.probe(video_path)
-        duration = float(video_info['streams'][0]['duration'])
-        
-        # Generate silence as base
-        silence = ffmpeg.input('anullsrc=channel_layout=mono:sample_rate=16000', f='lavfi', t=duration)
-        
-        # Create filter chain to overlay TTS segments
-        audio_inputs = [silence]
-        filter_chain = []
-        
-        for i, (tts_file, segment) in enumerate(zip(tts_files, segments)):
-            if os.path.exists(tts_file):
-                # Load TTS segment
-                tts_input = ffmpeg.input(tts_file)
-                audio_inputs.append(tts_input)
-                
-                # Add delay filter for timing
-                start_time = segment['start']
-                if i == 0:
-                    mixed = ffmpeg.filter([audio_inputs[0], tts_input], 'amix', 
-                                        inputs=2, duration='longest', dropout_transition=0)
-                else:
-                    # Apply delay and mix
-                    delayed = ffmpeg.filter(tts_input, 'adelay', delays=f'{start_time*1000}')
-                    mixed = ffmpeg.filter([mixed, delayed], 'amix', 
-                                        inputs=2, duration='longest', dropout_transition=0)
-        
-        # Export merged audio
-        if 'mixed' in locals():
-            mixed.output(temp_audio, acodec='pcm_s16le', ac=1, ar=16000).run(overwrite_output=True, quiet=True)
-        else:
+
+        has_audio = any(s.get("codec_type") == "audio" for s in probe_media(video_path)["streams"])
+        graph = build_render(video_path, None, {"dubbed": output_path}, has_audio, media_duration(video_path),
+                             tts_files, segments, replace_audio)
+        if graph is None:
+            print("No TTS files to merge")
             return False
-        
-        # Combine with video
-        video = ffmpeg.input(video_path)
-        audio = ffmpeg.input(temp_audio)
-        
-        if replace_audio:
-            # Replace original audio
-            output = ffmpeg.output(video['v'], audio['a'], output_path, vcodec='copy', acodec='aac')
-        else:
-            # Mix with original audio (overlay)
-            original_audio = video['a']
-            mixed_audio = ffmpeg.filter([original_audio, audio['a']], 'amix', inputs=2, duration='longest')
-            output = ffmpeg.output(video['v'], mixed_audio, output_path, vcodec='copy', acodec='aac')
-        
-        output.run(overwrite_output=True, quiet=True)
-        
-        # Cleanup
-        try:
-            os.remove(temp_audio)
-        except:
-            pass
-        
+        graph.run(overwrite_output=True, quiet=True)
         return True
-        
+
     except Exception as e:
         print(f"Audio merging failed: {e}")
         return False
@@ -3,12 +3,12 @@ Wrapper to call IndexTTS2 from uv environment.
 This allows the auto-subtitle project to use IndexTTS2 without requiring all dependencies.
 """
 
-import subprocess
 import sys
-import os
-import json
 
-def generate_tts(text: str, output_path: str, language: str = "en", voice_path: str = None, emotion: str = "happy") -> bool:
+from auto_subtitle.indextts_process import IndexTTS2Process
+
+def generate_tts(text: str, output_path: str, language: str = "en", voice_path: str = None, emotion: str = "happy",
+                 seed: int = None, target_duration: float = None, voice_library: str = None) -> bool:
     """
     Generate TTS audio using IndexTTS2 via uv environment.
     
@@ -16,90 +16,18 @@ def generate_tts(text: str, output_path: str, language: str = "en", voice_path:
         text: Text to synthesize
         output_path: Path to save the audio file
         language: Language code (e.g., 'en', 'es', 'zh')
-        voice_path: Optional path to reference voice audio
+        voice_path: Optional path to reference voice audio, or a voice id of ``voice_library``
         emotion: Emotion for synthesis (happy, sad, angry, surprise)
+        seed: Optional random seed, the same seed and inputs give the same audio
+        target_duration: Optional length of the audio in seconds, the speech is fitted to it in one pass
+        voice_library: Optional path to a voice library index with precomputed voice prompts
     
     Returns:
         True if successful, False otherwise
     """
-    # Path to index-tts directory
-    index_tts_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "index-tts")
-    
-    if not os.path.exists(index_tts_dir):
-        print(f"Error: index-tts directory not found at {index_tts_dir}")
-        return False
-    
-    # Create a Python script to run via uv
-    script_content = f"""
-import sys
-sys.path.insert(0, '.')
-from indextts.infer_v2 import IndexTTS2
-import torch
-
-# Initialize model
-model = IndexTTS2(
-    cfg_path="checkpoints/config.yaml",
-    model_dir="checkpoints",
-    use_fp16=False,  # Set to True if using GPU
-    device="cpu"  # or "cuda:0" if GPU available
-)
-
-# Generate audio
-ref_audio = {repr(voice_path)} if {repr(voice_path)} else None
-
-try:
-    # Run TTS inference (correct API: infer, not infer_batch)
-    model.infer(
-        spk_audio_prompt=ref_audio,
-        text={repr(text)},
-        output_path={repr(output_path)},
-        verbose=False
-    )
-    
-    # Check if file was created
-    import os
-    if os.path.exists({repr(output_path)}):
-        print("SUCCESS")
-    else:
-        print("ERROR: Output file not created")
-        sys.exit(1)
-except Exception as e:
-    import traceback
-    print(f"ERROR: {{e}}")
-    traceback.print_exc()
-    sys.exit(1)
-"""
-    
-    # Write temporary script
-    temp_script = os.path.join(index_tts_dir, "temp_tts_gen.py")
-    with open(temp_script, "w", encoding="utf-8") as f:
-        f.write(script_content)
-    
-    try:
-        # Run via uv
-        result = subprocess.run(
-            ["uv", "run", "python", "temp_tts_gen.py"],
-            cwd=index_tts_dir,
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
-        
-        # Clean up
-        if os.path.exists(temp_script):
-            os.remove(temp_script)
-        
-        if "SUCCESS" in result.stdout:
-            return True
-        else:
-            print(f"TTS generation failed: {result.stderr}")
-            return False
-            
-    except Exception as e:
-        print(f"Error running IndexTTS2: {e}")
-        if os.path.exists(temp_script):
-            os.remove(temp_script)
-        return False
+    # the model is loaded for this call only, see IndexTTS2Process to keep it loaded
+    with IndexTTS2Process(voice_library=voice_library, timeout=60) as tts:
+        return tts.generate(text, output_path, voice_path=voice_path, seed=seed, target_duration=target_duration)
 
 
 if __name__ == "__main__":
@@ -112,6 +40,9 @@ if __name__ == "__main__":
     parser.add_argument("--language", default="en", help="Language code")
     parser.add_argument("--voice", default=None, help="Reference voice audio path")
     parser.add_argument("--emotion", default="happy", help="Emotion")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed")
+    parser.add_argument("--target_duration", type=float, default=None, help="Length of the audio in seconds")
+    parser.add_argument("--voice_library", default=None, help="Voice library index, --voice may be one of its voice ids")
     
     args = parser.parse_args()
     
@@ -120,7 +51,10 @@ if __name__ == "__main__":
         output_path=args.output,
         language=args.language,
         voice_path=args.voice,
-        emotion=args.emotion
+        emotion=args.emotion,
+        seed=args.seed,
+        target_duration=args.target_duration,
+        voice_library=args.voice_library
     )
     
     sys.exit(0 if success else 1)
@@ -11,7 +11,8 @@ setup(
     ],
     description="Automatically generate and embed subtitles into your videos",
     entry_points={
-        'console_scripts': ['auto_subtitle=auto_subtitle.cli:main'],
+        'console_scripts': ['auto_subtitle=auto_subtitle.cli:main',
+                            'auto_subtitle_queue=auto_subtitle.queue:main'],
     },
     include_package_data=True,
 )
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Test script for the chunked subtitle burn-in (chunk planning and SRT shifting, no FFmpeg needed)
+"""
+
+import os
+import sys
+import io
+
+# Add the auto_subtitle module to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from auto_subtitle.burn import parse_srt, plan_chunks, shift_cues
+from auto_subtitle.utils import write_srt
+
+
+def test_plan_chunks():
+    """Chunks start on keyframes and the last one is not tiny"""
+    print("Testing chunk planning...")
+    keyframes = [i * 2.0 for i in range(100)]  # 2 s GOP, 199.5 s video
+    chunks = plan_chunks(keyframes, 199.5, 60)
+    assert chunks == [(0.0, 60.0), (60.0, 120.0), (120.0, None)], chunks
+
+    # the last chunk would be shorter than half a chunk: merged into the previous one
+    assert plan_chunks(keyframes, 125.0, 60) == [(0.0, 60.0), (60.0, None)]
+    # short clip: one chunk, burned in a single pass
+    assert plan_chunks(keyframes[:30], 59.0, 60) == [(0.0, None)]
+    # sparse keyframes: cut at the first keyframe past the chunk length
+    assert plan_chunks([0.0, 50.0, 75.0, 150.0], 240.0, 60) == [(0.0, 75.0), (75.0, 150.0), (150.0, None)]
+    print("✅ Chunk planning test passed")
+
+
+def test_shift_srt():
+    """Cues are clipped to the chunk and shifted to its start, and survive an SRT round trip"""
+    print("Testing SRT shifting...")
+    cues = [
+        {"start": 1.0, "end": 3.0, "text": "first"},
+        {"start": 58.5, "end": 61.25, "text": "across the cut"},
+        {"start": 3700.0, "end": 3702.5, "text": "after an hour"},
+    ]
+    buffer = io.StringIO()
+    write_srt(cues, file=buffer)
+    parsed = parse_srt(buffer.getvalue())
+    assert parsed == cues, parsed
+
+    assert shift_cues(parsed, 0.0, 60.0) == [
+        {"start": 1.0, "end": 3.0, "text": "first"},
+        {"start": 58.5, "end": 60.0, "text": "across the cut"},
+    ]
+    second = shift_cues(parsed, 60.0, None)
+    assert second[0] == {"start": 0.0, "end": 1.25, "text": "across the cut"}, second
+    assert second[1]["start"] == 3640.0
+    assert shift_cues(parsed, 10.0, 50.0) == []
+    print("✅ SRT shifting test passed")
+
+
+if __name__ == "__main__":
+    test_plan_chunks()
+    test_shift_srt()
+    print("\n✅ All burn-in tests passed!")
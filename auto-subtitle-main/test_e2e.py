@@ -57,7 +57,7 @@ try:
     if tts_files and len(tts_files) > 0:
         print(f"✅ TTS generation successful!")
         print(f"Generated {len(tts_files)} audio file(s):")
-        for f in tts_files:
+        for _, f in tts_files:
             if os.path.exists(f):
                 size = os.path.getsize(f) / 1024  # KB
                 print(f"  - {os.path.basename(f)} ({size:.1f} KB)")
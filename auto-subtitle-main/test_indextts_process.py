@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Test script for the warm IndexTTS2 process (with a fake IndexTTS2, no model is loaded)
+"""
+
+import os
+import sys
+import tempfile
+import threading
+
+# Add the auto_subtitle module to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from auto_subtitle import utils
+from auto_subtitle.indextts_process import IndexTTS2Process
+
+FAKE_INFER_V2 = '''
+import os
+import sys
+
+
+class IndexTTS2:
+    def __init__(self, voice_library=None, **kwargs):
+        print(">> loading the fake model")
+        with open("loads.txt", "a") as f:
+            f.write(f"{os.getpid()}\\n")
+
+    def infer(self, spk_audio_prompt, text, output_path, target_duration=None, **kwargs):
+        # log lines must not break the answers on stdout
+        print(f">> synthesizing {text}")
+        if text == "crash":
+            sys.exit(3)
+        if text == "fail":
+            raise RuntimeError("out of memory")
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(f"{text}|{spk_audio_prompt}|{target_duration}|{os.getpid()}")
+'''
+
+
+class LocalIndexTTS2Process(IndexTTS2Process):
+    # the fake index-tts runs with this interpreter, not in a uv environment
+    command = [sys.executable]
+
+
+def make_index_tts(temp_dir):
+    index_tts_dir = os.path.join(temp_dir, "index-tts")
+    os.makedirs(os.path.join(index_tts_dir, "indextts"))
+    open(os.path.join(index_tts_dir, "indextts", "__init__.py"), "w").close()
+    with open(os.path.join(index_tts_dir, "indextts", "infer_v2.py"), "w") as f:
+        f.write(FAKE_INFER_V2)
+    return index_tts_dir
+
+
+def read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_warm_process():
+    """The model is loaded once for all segments, and reloaded after the process died"""
+    print("Testing warm IndexTTS2 process...")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index_tts_dir = make_index_tts(temp_dir)
+        loads = os.path.join(index_tts_dir, "loads.txt")
+        with LocalIndexTTS2Process(index_tts_dir=index_tts_dir, timeout=30) as tts:
+            outputs = [os.path.join(temp_dir, f"{i}.wav") for i in range(3)]
+            for i, out in enumerate(outputs):
+                assert tts.generate(f"line {i}", out, voice_path="voice.wav", target_duration=1.5)
+            texts = [read(out).split("|") for out in outputs]
+            assert [t[:3] for t in texts] == [[f"line {i}", "voice.wav", "1.5"] for i in range(3)]
+            assert len(read(loads).split()) == 1 and len({t[3] for t in texts}) == 1
+
+            # a failed segment keeps the process, a dead process is restarted at the next segment
+            assert not tts.generate("fail", os.path.join(temp_dir, "fail.wav"))
+            assert not tts.generate("crash", os.path.join(temp_dir, "crash.wav"))
+            assert len(read(loads).split()) == 1
+            assert tts.generate("again", os.path.join(temp_dir, "again.wav"))
+            assert len(read(loads).split()) == 2
+    print("✅ Warm IndexTTS2 process test passed")
+
+
+def test_concurrent_runs():
+    """Several runs in the same index-tts directory keep their own texts and outputs"""
+    print("Testing concurrent TTS runs...")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index_tts_dir = make_index_tts(temp_dir)
+        voice = os.path.join(temp_dir, "voice.wav")
+        open(voice, "wb").close()
+        results = {}
+
+        def dub(worker):
+            segments = [{"text": f"w{worker} line {i}", "start": float(i), "end": i + 1.0} for i in range(3)]
+            with LocalIndexTTS2Process(index_tts_dir=index_tts_dir, timeout=30) as tts:
+                results[worker] = utils.generate_tts_audio(segments, "es", voice, os.path.join(temp_dir, f"w{worker}"),
+                                                           fit_duration=False, tts=tts)
+
+        threads = [threading.Thread(target=dub, args=(w,)) for w in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for worker, files in results.items():
+            assert [read(path).split("|")[0] for _, path in files] == [f"w{worker} line {i}" for i in range(3)]
+        # one model load per run, no script left in index-tts
+        assert len(read(os.path.join(index_tts_dir, "loads.txt")).split()) == 3
+        assert sorted(os.listdir(index_tts_dir)) == ["indextts", "loads.txt"]
+    print("✅ Concurrent TTS runs test passed")
+
+
+if __name__ == "__main__":
+    test_warm_process()
+    test_concurrent_runs()
+    print("\n✅ All IndexTTS2 process tests passed")
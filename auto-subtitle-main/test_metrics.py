@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Test script for the per-stage metrics of the subtitle pipeline
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+# Add the auto_subtitle module to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from auto_subtitle import utils
+from auto_subtitle.metrics import metrics
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SHARED_SOURCE = os.path.join(ROOT, "..", "index-tts", "indextts", "utils", "stage_metrics.py")
+
+
+def test_shared_module():
+    """The metrics module is an identical copy of the IndexTTS one"""
+    print("Testing shared metrics module...")
+    if not os.path.isfile(SHARED_SOURCE):
+        print("⚠️ index-tts is not next to auto-subtitle-main, skipped")
+        return
+    with open(SHARED_SOURCE, "rb") as f:
+        source = f.read()
+    with open(os.path.join(ROOT, "auto_subtitle", "stage_metrics.py"), "rb") as f:
+        copy = f.read()
+    assert copy == source, "auto_subtitle/stage_metrics.py differs from index-tts, copy it over again"
+    assert metrics.namespace == "auto_subtitle"
+    print("✅ Shared metrics module test passed")
+
+
+def test_tts_instrumentation():
+    """Dubbing records one span per synthesized line and the segment cache hits/misses"""
+    print("Testing TTS instrumentation...")
+    calls = []
+
+    def fake_generate(text, language, voice, output_file, **kwargs):
+        calls.append(text)
+        with open(output_file, "wb") as f:
+            f.write(text.encode("utf-8"))
+        return text != "falla"
+
+    original = utils._generate_with_indextts2
+    utils._generate_with_indextts2 = fake_generate
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            voice = os.path.join(temp_dir, "voice.wav")
+            open(voice, "wb").close()
+            jsonl_path = os.path.join(temp_dir, "metrics.jsonl")
+            metrics.reset()
+            metrics.configure(jsonl_path=jsonl_path)
+            segments = [{"text": t, "start": float(i), "end": i + 1.0}
+                        for i, t in enumerate(["hola", "", "adiós", "falla", "hola"])]
+            cache_dir = os.path.join(temp_dir, "cache")
+            files = utils.generate_tts_audio(segments, "es", voice, temp_dir, cache_dir=cache_dir, fit_duration=False)
+            assert len(files) == 3 and calls == ["hola", "adiós", "falla"], (files, calls)
+
+            snapshot = metrics.snapshot()
+            assert snapshot["spans"]["tts_segment"]["count"] == 3, snapshot
+            counters = snapshot["counters"]
+            assert counters['cache_misses{cache="tts_segment"}'] == 3, counters
+            assert counters['cache_hits{cache="tts_segment"}'] == 1, counters
+            assert counters['tts_segments{status="ok"}'] == 2, counters
+            assert counters['tts_segments{status="failed"}'] == 1, counters
+
+            # a second run only synthesizes the line that failed
+            utils.generate_tts_audio(segments, "es", voice, temp_dir, cache_dir=cache_dir, fit_duration=False)
+            assert calls[3:] == ["falla"], calls
+            assert metrics.snapshot()["counters"]['cache_hits{cache="tts_segment"}'] == 4
+
+            text = metrics.prometheus_text()
+            assert 'auto_subtitle_stage_seconds_count{stage="tts_segment"} 4' in text, text
+            with open(jsonl_path, encoding="utf-8") as f:
+                records = [json.loads(line) for line in f]
+            assert [r["segment"] for r in records if r.get("stage") == "tts_segment"] == [0, 2, 3, 3]
+    finally:
+        utils._generate_with_indextts2 = original
+        metrics.reset()
+    print("✅ TTS instrumentation test passed")
+
+
+if __name__ == "__main__":
+    test_shared_module()
+    test_tts_instrumentation()
+    print("\n✅ All metrics tests passed")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test script for the durable batch queue
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+# Add the auto_subtitle module to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from auto_subtitle.queue import JobQueue, Worker
+
+
+def test_retry_and_dead_letter():
+    """Failed jobs are retried after a backoff, then dead-lettered"""
+    print("Testing retry and dead letter...")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        queue = JobQueue(os.path.join(temp_dir, "queue.db"), backoff_seconds=0.2)
+        job_id = queue.enqueue("burn", {"video": "a.mp4"}, max_attempts=2)
+
+        job = queue.lease("w1")
+        assert job.id == job_id and job.attempts == 1
+        assert queue.lease("w2") is None
+        assert queue.fail(job, "w1", "boom") == "queued"
+        # backoff
+        assert queue.lease("w1") is None
+        time.sleep(0.3)
+        job = queue.lease("w1")
+        assert job.attempts == 2
+        assert queue.fail(job, "w1", "boom") == "dead"
+        assert queue.counts() == {"burn": {"dead": 1}}
+
+        assert queue.retry_dead() == 1
+        assert queue.lease("w1").attempts == 1
+    print("✅ Retry and dead letter test passed")
+
+
+def test_expired_lease():
+    """A job whose worker stopped heart-beating is taken over by another worker"""
+    print("Testing lease expiry...")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        queue = JobQueue(os.path.join(temp_dir, "queue.db"))
+        queue.enqueue("subtitles", {"video": "a.mp4"})
+        job = queue.lease("w1", lease_seconds=0.2)
+        assert queue.heartbeat(job, "w1", lease_seconds=0.2)
+        time.sleep(0.3)
+        taken = queue.lease("w2")
+        assert taken.id == job.id and taken.attempts == 2
+        # the first worker lost its lease
+        assert not queue.heartbeat(job, "w1")
+        assert not queue.complete(job, "w1", {})
+        assert queue.complete(taken, "w2", {}, [("burn", {"video": "a.mp4"}), ("tts", {"video": "a.mp4"})])
+        assert queue.counts() == {"subtitles": {"done": 1}, "burn": {"queued": 1}, "tts": {"queued": 1}}
+    print("✅ Lease expiry test passed")
+
+
+class FakeWorker(Worker):
+    def run_subtitles(self, payload):
+        return {}, [("burn", payload)]
+
+    def run_burn(self, payload):
+        if payload["video"] == "bad.mp4":
+            raise RuntimeError("ffmpeg failed")
+        return {"output": payload["video"]}, []
+
+
+def test_worker():
+    """Workers run the stages they own and follow-up jobs"""
+    print("Testing worker...")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        queue = JobQueue(os.path.join(temp_dir, "queue.db"), backoff_seconds=0)
+        queue.enqueue("subtitles", {"video": "a.mp4"}, max_attempts=2)
+        queue.enqueue("subtitles", {"video": "bad.mp4"}, max_attempts=2)
+        # an FFmpeg-only worker has nothing to do yet
+        assert FakeWorker(queue, stages=["burn"], poll_seconds=0).run(drain=True) == 0
+        FakeWorker(queue, stages=["subtitles"], poll_seconds=0).run(drain=True)
+        FakeWorker(queue, stages=["burn"], poll_seconds=0).run(drain=True)
+        assert queue.counts() == {"subtitles": {"done": 2}, "burn": {"done": 1, "dead": 1}}, queue.counts()
+    print("✅ Worker test passed")
+
+
+if __name__ == "__main__":
+    test_retry_and_dead_letter()
+    test_expired_lease()
+    test_worker()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Test script for the single-decode multi-output render (FFmpeg graph only, nothing is run)
+"""
+
+import os
+import sys
+import tempfile
+
+# Add the auto_subtitle module to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from auto_subtitle.render import build_render, parse_variants, variant_paths
+
+
+def test_variants():
+    """Variant names are validated and mapped to output files"""
+    print("Testing output variants...")
+    variants = parse_variants("subtitled, dubbed,softsub")
+    assert variants == ["subtitled", "dubbed", "softsub"]
+    paths = variant_paths("videos/talk.mp4", "out", variants)
+    assert paths["subtitled"] == os.path.join("out", "talk.mp4")
+    assert paths["dubbed"] == os.path.join("out", "talk_dubbed.mp4")
+    try:
+        parse_variants("subtitled,karaoke")
+        assert False, "unknown variant accepted"
+    except ValueError:
+        pass
+    print("✅ Output variants test passed")
+
+
+def test_single_decode_graph():
+    """All variants come from one input of the source, the burned video and the dub are split"""
+    print("Testing render graph...")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tts_files = []
+        for i in range(3):
+            tts_files.append((i, os.path.join(temp_dir, f"tts_{i}.wav")))
+            open(tts_files[-1][1], "wb").close()
+        segments = [{"start": 0.0}, {"start": 2.5}, {"start": 7.0}]
+        outputs = variant_paths("talk.mp4", "out", ["subtitled", "dubbed", "subtitled_dubbed", "softsub"])
+
+        args = build_render("talk.mp4", "talk.srt", outputs, True, 10.0, tts_files, segments).compile()
+        assert args.count("talk.mp4") == 1, args
+        graph = args[args.index("-filter_complex") + 1]
+        assert graph.count("subtitles=") == 1 and "split=2" in graph and "asplit=2" in graph, graph
+        assert "amix=" in graph and "inputs=4" in graph and "delays=2500" in graph, graph
+        assert "mov_text" in args
+        # dubbed and soft-sub variants copy the original video
+        assert args.count("copy") == 2 and args.count("libx264") == 2, args
+
+        # without TTS audio there is nothing to dub
+        assert build_render("talk.mp4", "talk.srt", outputs, True, 10.0, [], []) is None
+    print("✅ Render graph test passed")
+
+
+def test_dub_timing():
+    """TTS files are placed at the start of their own segment, skipped lines don't shift them"""
+    print("Testing dub timing...")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        segments = [{"start": 1.0}, {"start": 2.5}, {"start": 4.0}, {"start": 7.25}]
+        # segment 1 was empty and segment 2 failed, they have no audio
+        tts_files = []
+        for i in (0, 3):
+            tts_files.append((i, os.path.join(temp_dir, f"segment_{i:04d}.wav")))
+            open(tts_files[-1][1], "wb").close()
+
+        # the merge stage of the queue renders the dubbed variant alone, without subtitles
+        args = build_render("talk.mp4", None, {"dubbed": "talk_dubbed.mp4"}, True, 10.0, tts_files, segments).compile()
+        graph = args[args.index("-filter_complex") + 1]
+        # one amix of all segments, the first one is delayed too
+        assert graph.count("amix=") == 1 and "inputs=3" in graph and "normalize=0" in graph, graph
+        assert "delays=1000" in graph and "delays=7250" in graph, graph
+        assert "delays=2500" not in graph and "delays=4000" not in graph, graph
+        assert "subtitles=" not in graph and "talk.srt" not in args, args
+    print("✅ Dub timing test passed")
+
+
+if __name__ == "__main__":
+    test_variants()
+    test_single_decode_graph()
+    test_dub_timing()
+    print("\n✅ All render tests passed!")
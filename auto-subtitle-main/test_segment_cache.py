@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Test script for the synthesized segment cache
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+
+# Add the auto_subtitle module to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from auto_subtitle.segment_cache import SegmentCache, segment_key, segment_seed
+
+
+def test_keys():
+    """Keys and seeds depend on the normalized text and settings only"""
+    print("Testing segment keys...")
+    params = {"engine": "indextts2", "language": "es"}
+    assert segment_seed("Hola  mundo ") == segment_seed("Hola mundo")
+    assert segment_seed("Hola mundo") != segment_seed("Hola mundo", 1)
+    key = segment_key("Hola mundo", None, "happy", params, 1)
+    assert key == segment_key(" Hola   mundo", None, "happy", params, 1)
+    assert key != segment_key("Hola mundo", None, "sad", params, 1)
+    assert key != segment_key("Hola mundo", None, "happy", params, 2)
+    assert key != segment_key("Hola mundo", None, "happy", {**params, "language": "fr"}, 1)
+    print("✅ Segment key test passed")
+
+
+def test_cache_roundtrip():
+    """Entries survive reopening and roll over to new chunks"""
+    print("Testing segment cache...")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache_dir = os.path.join(temp_dir, "cache")
+        cache = SegmentCache(cache_dir, max_chunk_bytes=1000)
+        for i in range(5):
+            audio = os.path.join(temp_dir, f"in_{i}.wav")
+            with open(audio, "wb") as f:
+                f.write(bytes([i]) * 600)
+            cache.put(f"key{i}", audio)
+
+        # interrupted write of an index line
+        with open(os.path.join(cache_dir, "index.jsonl"), "a") as f:
+            f.write('{"key": "broken", "chu')
+
+        cache = SegmentCache(cache_dir, max_chunk_bytes=1000)
+        assert len(cache) == 5 and "broken" not in cache
+        assert len([n for n in os.listdir(cache_dir) if n.startswith("chunk_")]) == 5
+        cache.put("key5", audio)
+        assert "key5" in SegmentCache(cache_dir)
+        out = os.path.join(temp_dir, "out.wav")
+        assert cache.get("key3", out)
+        with open(out, "rb") as f:
+            assert f.read() == bytes([3]) * 600
+        assert not cache.get("missing", out)
+    print("✅ Segment cache test passed")
+
+
+def _put_segments(cache_dir, temp_dir, writer, count):
+    cache = SegmentCache(cache_dir, max_chunk_bytes=4000)
+    for i in range(count):
+        audio = os.path.join(temp_dir, f"w{writer}_{i}.wav")
+        with open(audio, "wb") as f:
+            f.write(bytes([writer * 64 + i]) * (300 + i))
+        cache.put(f"w{writer}_{i}", audio)
+
+
+def test_two_writers():
+    """Two processes appending to one cache never share an offset"""
+    print("Testing concurrent cache writers...")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache_dir = os.path.join(temp_dir, "cache")
+        reader = SegmentCache(cache_dir)
+        count = 60
+        writers = [multiprocessing.Process(target=_put_segments, args=(cache_dir, temp_dir, w, count))
+                   for w in (1, 2)]
+        for p in writers:
+            p.start()
+        for p in writers:
+            p.join()
+            assert p.exitcode == 0
+
+        cache = SegmentCache(cache_dir)
+        assert len(cache) == 2 * count
+        spans = {}
+        for key, entry in cache._index.items():
+            spans.setdefault(entry["chunk"], []).append((entry["offset"], entry["length"]))
+        for chunk, chunk_spans in spans.items():
+            chunk_spans.sort()
+            # back to back, no two entries overlap
+            assert all(a + n == b for (a, n), (b, _) in zip(chunk_spans, chunk_spans[1:])), chunk
+            assert sum(n for _, n in chunk_spans) == os.path.getsize(cache._chunk_path(chunk))
+            assert sum(n for _, n in chunk_spans) <= 4000
+        # a cache opened before the writers sees their entries, every key holds its own audio
+        for w in (1, 2):
+            for i in range(count):
+                assert reader.get_bytes(f"w{w}_{i}") == bytes([w * 64 + i]) * (300 + i), (w, i)
+    print("✅ Concurrent cache writers test passed")
+
+
+if __name__ == "__main__":
+    test_keys()
+    test_cache_roundtrip()
+    test_two_writers()
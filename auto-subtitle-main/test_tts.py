@@ -52,7 +52,7 @@ def test_tts(segments):
             if audio_files:
                 print("✅ indexTTS2 test passed")
                 print(f"Generated {len(audio_files)} audio files")
-                for i, file in enumerate(audio_files):
+                for i, file in audio_files:
                     if os.path.exists(file):
                         size = os.path.getsize(file)
                         print(f"  - {os.path.basename(file)}: {size} bytes")
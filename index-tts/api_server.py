@@ -0,0 +1,137 @@
+import io
+import json
+import os
+import sys
+import wave
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+warnings.filterwarnings("ignore", category=FutureWarning)
+warnings.filterwarnings("ignore", category=UserWarning)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+from indextts.utils.metrics import metrics
+
+import argparse
+parser = argparse.ArgumentParser(
+    description="IndexTTS HTTP API",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument("--port", type=int, default=7861, help="Port to run the API server on")
+parser.add_argument("--host", type=str, default="0.0.0.0", help="Host to run the API server on")
+parser.add_argument("--model_dir", type=str, default="./checkpoints", help="Model checkpoints directory")
+parser.add_argument("--fp16", action="store_true", default=False, help="Use FP16 for inference if available")
+parser.add_argument("--cuda_kernel", action="store_true", default=False, help="Use CUDA kernel for inference if available")
+parser.add_argument("--no_cpu_kernel", action="store_true", default=False, help="Don't build the fused C++ kernel of BigVGAN on CPU")
+parser.add_argument("--cond_cache_dir", type=str, default=None, help="Directory to persist computed voice prompt conditionings")
+parser.add_argument("--max_batch_size", type=int, default=8, help="Max segments decoded together")
+parser.add_argument("--kv_cache_tokens", type=int, default=32768, help="Paged KV cache capacity in tokens")
+parser.add_argument("--metrics_jsonl", type=str, default=None, help="Append per-stage timings as JSON lines to this file")
+parser.add_argument("--trace", type=str, default=None, help="Write a Chrome trace of all stages to this file at exit")
+parser.add_argument("--voice_library", type=str, default=None, help="Voice library index (indextts-voices build), its voice ids are accepted as spk_audio_prompt")
+parser.add_argument("--warmup", type=str, default="default", choices=["none", "minimal", "default", "full"], help="Warm up all stages with this profile before accepting requests")
+
+# request fields forwarded to `IndexTTS2.infer`
+INFER_FIELDS = {
+    "spk_audio_prompt", "text", "emo_audio_prompt", "emo_alpha", "emo_vector", "use_emo_text", "emo_text",
+    "use_random", "interval_silence", "max_text_tokens_per_segment",
+    "do_sample", "top_p", "top_k", "temperature", "repetition_penalty", "max_mel_tokens",
+}
+
+
+def wav_bytes(sampling_rate, wav_data):
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as f:
+        f.setnchannels(wav_data.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(sampling_rate)
+        f.writeframes(wav_data.tobytes())
+    return buf.getvalue()
+
+
+class TTSRequestHandler(BaseHTTPRequestHandler):
+    scheduler = None
+
+    def _send(self, code, body, content_type="application/json"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, {"status": "ok", "stats": self.scheduler.stats})
+        elif self.path == "/metrics":
+            self._send(200, metrics.prometheus_text().encode("utf-8"), content_type="text/plain; version=0.0.4")
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        """
+        POST /tts with a JSON body: {"text": "...", "spk_audio_prompt": "<path on the server or voice id>", ...}
+        Returns the generated audio as audio/wav.
+        """
+        if self.path != "/tts":
+            self._send(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            kwargs = {k: v for k, v in payload.items() if k in INFER_FIELDS}
+            if not kwargs.get("text") or not kwargs.get("spk_audio_prompt"):
+                self._send(400, {"error": "`text` and `spk_audio_prompt` are required"})
+                return
+            library = self.scheduler.tts.voice_library
+            if not os.path.isfile(kwargs["spk_audio_prompt"]) and not (library and kwargs["spk_audio_prompt"] in library):
+                self._send(400, {"error": f"spk_audio_prompt not found: {kwargs['spk_audio_prompt']}"})
+                return
+        except (ValueError, TypeError) as e:
+            self._send(400, {"error": f"invalid request: {e}"})
+            return
+        try:
+            result = self.scheduler.infer(output_path=None, **kwargs)
+        except Exception as e:
+            self._send(500, {"error": repr(e)})
+            return
+        if result is None:
+            self._send(400, {"error": "nothing to synthesize"})
+            return
+        self._send(200, wav_bytes(*result), content_type="audio/wav")
+
+
+if __name__ == "__main__":
+    cmd_args = parser.parse_args()
+    if not os.path.exists(cmd_args.model_dir):
+        print(f"Model directory {cmd_args.model_dir} does not exist. Please download the model first.")
+        sys.exit(1)
+
+    from indextts.infer_v2 import IndexTTS2
+    from indextts.scheduler import ContinuousBatchingScheduler
+    metrics.configure(jsonl_path=cmd_args.metrics_jsonl, trace_path=cmd_args.trace)
+
+    tts = IndexTTS2(model_dir=cmd_args.model_dir,
+                    cfg_path=os.path.join(cmd_args.model_dir, "config.yaml"),
+                    use_fp16=cmd_args.fp16,
+                    use_cuda_kernel=cmd_args.cuda_kernel,
+                    use_cpu_kernel=not cmd_args.no_cpu_kernel,
+                    cond_cache_dir=cmd_args.cond_cache_dir,
+                    voice_library=cmd_args.voice_library,
+                    )
+    if cmd_args.warmup != "none":
+        tts.warmup(cmd_args.warmup)
+    TTSRequestHandler.scheduler = ContinuousBatchingScheduler(tts, max_batch_size=cmd_args.max_batch_size,
+                                                              kv_cache_tokens=cmd_args.kv_cache_tokens)
+    server = ThreadingHTTPServer((cmd_args.host, cmd_args.port), TTSRequestHandler)
+    print(f">> IndexTTS API listening on http://{cmd_args.host}:{cmd_args.port} (POST /tts, GET /health, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        TTSRequestHandler.scheduler.close()
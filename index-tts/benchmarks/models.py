@@ -0,0 +1,48 @@
+import os
+
+import torch
+from omegaconf import OmegaConf
+
+from indextts.gpt.model_v2 import UnifiedVoice
+from indextts.s2mel.modules.bigvgan import bigvgan
+from indextts.s2mel.modules.bigvgan.env import AttrDict
+from indextts.s2mel.modules.commons import MyModel
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs")
+
+
+def load_config(name_or_path="tiny"):
+    """
+    Load a benchmark config by name (``benchmarks/configs/<name>.yaml``) or path.
+    """
+    path = name_or_path if os.path.isfile(name_or_path) else os.path.join(CONFIG_DIR, f"{name_or_path}.yaml")
+    return OmegaConf.load(path)
+
+
+def build_gpt(cfg, device="cpu"):
+    torch.manual_seed(cfg.seed)
+    gpt = UnifiedVoice(**cfg.gpt).to(device)
+    gpt.eval()
+    gpt.post_init_gpt2_config(kv_cache=True)
+    return gpt
+
+
+def build_s2mel(cfg, device="cpu"):
+    """
+    Length regulator + CFM (DiT estimator) of s2mel, without the GPT latent projection
+    (its 1280-dim input is fixed by the released GPT).
+    """
+    torch.manual_seed(cfg.seed + 1)
+    s2mel = MyModel(cfg.s2mel, use_gpt_latent=False).to(device)
+    s2mel.models["cfm"].estimator.setup_caches(max_batch_size=1, max_seq_length=8192)
+    s2mel.eval()
+    return s2mel
+
+
+def build_vocoder(cfg, device="cpu"):
+    torch.manual_seed(cfg.seed + 2)
+    h = AttrDict(OmegaConf.to_container(cfg.vocoder, resolve=True))
+    vocoder = bigvgan.BigVGAN(h, use_cuda_kernel=False).to(device)
+    vocoder.remove_weight_norm()
+    vocoder.eval()
+    return vocoder
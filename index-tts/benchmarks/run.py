@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import torch
+
+from benchmarks.models import build_gpt, build_s2mel, build_vocoder, load_config
+from indextts.utils.metrics import peak_rss_bytes
+
+# metrics where lower is better, all others are throughputs
+LOWER_IS_BETTER = ("e2e_seconds", "rtf", "peak_rss")
+
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def timeit(fn, repeat, warmup=1):
+    """
+    Median wall time of ``fn()`` over ``repeat`` runs, after ``warmup`` untimed runs.
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+class Inputs:
+    """
+    Seeded random inputs of the fixed benchmark sizes.
+    """
+
+    def __init__(self, cfg, batch_size):
+        g = torch.Generator().manual_seed(cfg.seed)
+        i = cfg.inputs
+        self.batch_size = batch_size
+        # w2v-bert features of the voice prompt, same layout as `IndexTTS2` passes them to the GPT
+        self.spk_cond = torch.randn(batch_size, i.prompt_frames, 1024, generator=g)
+        self.text_tokens = torch.randint(2, cfg.gpt.number_text_tokens, (batch_size, i.text_tokens),
+                                         generator=g, dtype=torch.int32)
+        # content features of the prompt + generated codes, as produced by the semantic codec + GPT latent
+        self.prompt_content = torch.randn(batch_size, i.prompt_frames, cfg.s2mel.length_regulator.in_channels, generator=g)
+        self.content = torch.randn(batch_size, i.gen_tokens, cfg.s2mel.length_regulator.in_channels, generator=g)
+        self.ref_mel = torch.randn(batch_size, 80, i.prompt_frames, generator=g)
+        self.style = torch.randn(batch_size, cfg.s2mel.style_encoder.dim, generator=g)
+        self.target_frames = int(i.gen_tokens * 1.72)
+
+
+def run_gpt(gpt, cfg, inputs):
+    lengths = torch.full((inputs.batch_size,), cfg.inputs.prompt_frames)
+    emo_vec = gpt.merge_emovec(inputs.spk_cond, inputs.spk_cond, lengths, lengths)
+    # exactly `gen_tokens` tokens per row: the stop token is suppressed until then
+    codes, _ = gpt.inference_speech(inputs.spk_cond, inputs.text_tokens, cond_lengths=lengths, emo_cond_lengths=lengths,
+                                    emo_vec=emo_vec, do_sample=True, top_p=0.8, top_k=30, temperature=0.8,
+                                    num_beams=1, repetition_penalty=10.0, max_generate_length=cfg.inputs.gen_tokens,
+                                    min_new_tokens=cfg.inputs.gen_tokens)
+    return codes
+
+
+def run_s2mel(s2mel, cfg, inputs):
+    lr = s2mel.models["length_regulator"]
+    batch_size = inputs.batch_size
+    prompt_lens = torch.full((batch_size,), cfg.inputs.prompt_frames)
+    target_lens = torch.full((batch_size,), inputs.target_frames)
+    prompt_cond = lr(inputs.prompt_content, ylens=prompt_lens, n_quantizers=3, f0=None)[0]
+    cond = lr(inputs.content, ylens=target_lens, n_quantizers=3, f0=None)[0]
+    cat_condition = torch.cat([prompt_cond, cond], dim=1)
+    x_lens = torch.full((batch_size,), cat_condition.size(1))
+    return s2mel.models["cfm"].inference(cat_condition, x_lens, inputs.ref_mel, inputs.style, None,
+                                         cfg.inputs.diffusion_steps, inference_cfg_rate=cfg.inputs.inference_cfg_rate)
+
+
+def run_vocoder(vocoder, inputs, mel):
+    return vocoder(mel[:, :, -inputs.target_frames:])
+
+
+def bench(cfg, repeat=3):
+    results = {}
+    gpt, s2mel, vocoder = build_gpt(cfg), build_s2mel(cfg), build_vocoder(cfg)
+    hop_length = cfg.s2mel.preprocess_params.spect_params.hop_length
+    sampling_rate = cfg.vocoder.sampling_rate
+    with torch.inference_mode():
+        for batch_size in cfg.inputs.batch_sizes:
+            torch.manual_seed(cfg.seed)
+            inputs = Inputs(cfg, batch_size)
+            tag = f"b{batch_size}"
+
+            gpt_s = timeit(lambda: run_gpt(gpt, cfg, inputs), repeat)
+            results[f"gpt_decode_tokens_per_s.{tag}"] = batch_size * cfg.inputs.gen_tokens / gpt_s
+
+            cfm_s = timeit(lambda: run_s2mel(s2mel, cfg, inputs), repeat)
+            results[f"cfm_steps_per_s.{tag}"] = cfg.inputs.diffusion_steps / cfm_s
+
+            mel = run_s2mel(s2mel, cfg, inputs)
+            vocoder_s = timeit(lambda: run_vocoder(vocoder, inputs, mel), repeat)
+            samples = batch_size * inputs.target_frames * hop_length
+            results[f"vocoder_samples_per_s.{tag}"] = samples / vocoder_s
+
+            # end to end: decode -> s2mel -> vocoder for one batch of segments
+            audio_seconds = samples / sampling_rate
+            total_s = gpt_s + cfm_s + vocoder_s
+            results[f"e2e_seconds.{tag}"] = total_s
+            results[f"rtf.{tag}"] = total_s / audio_seconds
+            print(f">> batch {batch_size}: gpt {gpt_s:.3f}s, cfm {cfm_s:.3f}s, vocoder {vocoder_s:.3f}s, "
+                  f"RTF {total_s / audio_seconds:.4f}")
+    results["peak_rss_mb"] = peak_rss_bytes() / 2 ** 20
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the relative change of every metric against ``baseline``, returns the names of the
+    metrics which regressed by more than ``tolerance``.
+    """
+    regressions = []
+    for name, value in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        lower_is_better = name.startswith(LOWER_IS_BETTER)
+        change = (value - old) / old
+        regressed = change > tolerance if lower_is_better else change < -tolerance
+        print(f"   {name:36s} {old:12.3f} -> {value:12.3f} ({100 * change:+.1f}%){'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline CPU benchmark of the IndexTTS2 inference stages "
+                                                 "with small random-weight models.")
+    parser.add_argument("--config", type=str, default="tiny", help="config name in benchmarks/configs or path")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement (median is reported)")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads (default: torch default)")
+    parser.add_argument("--output", "-o", type=str, default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", type=str, default=None, help="baseline JSON file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change reported as a regression")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    cfg = load_config(args.config)
+    report = {
+        "config": args.config,
+        "git_revision": git_revision(),
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "threads": torch.get_num_threads(),
+        "repeat": args.repeat,
+        "results": bench(cfg, repeat=args.repeat),
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(">> results saved to:", args.output)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f">> compared to {args.compare} ({baseline.get('git_revision')}):")
+        regressions = compare(report["results"], baseline["results"], args.tolerance)
+        if regressions:
+            print(f">> {len(regressions)} regression(s) above {100 * args.tolerance:.0f}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+import time
+
+from indextts.utils.front import TextNormalizer, TextTokenizer
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "text_corpus.txt")
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+def lines_per_second(fn, lines):
+    start = time.perf_counter()
+    fn(lines)
+    return len(lines) / (time.perf_counter() - start)
+
+
+def bench(corpus, bpe_path=None, repeat=10):
+    """
+    Throughput of the text front-end in lines per second.
+
+    ``cold``: every line is new (memo disabled), ``warm``: the lines were seen before (e.g. a
+    re-dubbed video or the web UI re-tokenizing the same text), ``batch``: ``batch_*`` over the
+    corpus repeated ``repeat`` times, as for the subtitle lines of a video.
+    """
+    results = {}
+    repeated = corpus * repeat
+
+    cold = TextNormalizer(memo_size=0)
+    cold.load()
+    results["normalize_cold_lines_per_s"] = lines_per_second(lambda ls: [cold.normalize(t) for t in ls], corpus)
+
+    normalizer = TextNormalizer()
+    normalizer.load()
+    normalizer.batch_normalize(corpus)
+    results["normalize_warm_lines_per_s"] = lines_per_second(lambda ls: [normalizer.normalize(t) for t in ls], repeated)
+    normalizer = TextNormalizer()
+    normalizer.load()
+    results["batch_normalize_lines_per_s"] = lines_per_second(normalizer.batch_normalize, repeated)
+
+    if bpe_path and os.path.isfile(bpe_path):
+        tokenizer = TextTokenizer(bpe_path, cold, memo_size=0)
+        results["tokenize_cold_lines_per_s"] = lines_per_second(lambda ls: [tokenizer.tokenize(t) for t in ls], corpus)
+
+        tokenizer = TextTokenizer(bpe_path, TextNormalizer())
+        tokenizer.batch_encode(corpus, out_type=str)
+        results["tokenize_warm_lines_per_s"] = lines_per_second(lambda ls: [tokenizer.tokenize(t) for t in ls], repeated)
+        tokenizer = TextTokenizer(bpe_path, TextNormalizer())
+        results["batch_encode_lines_per_s"] = lines_per_second(lambda ls: tokenizer.batch_encode(ls, out_type=str), repeated)
+    else:
+        print(f">> {bpe_path} not found, tokenizer benchmarks skipped")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Text front-end (normalize + tokenize) throughput")
+    parser.add_argument("--corpus", type=str, default=DEFAULT_CORPUS, help="text file, one line per utterance")
+    parser.add_argument("--bpe", type=str, default="checkpoints/bpe.model", help="sentencepiece model")
+    parser.add_argument("--repeat", type=int, default=10, help="corpus repetitions for the warm/batch runs")
+    parser.add_argument("--output", "-o", type=str, default=None, help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    print(f">> {len(corpus)} lines from {args.corpus}")
+    results = bench(corpus, args.bpe, args.repeat)
+    for name, value in results.items():
+        print(f"   {name:32s} {value:12.1f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"corpus": args.corpus, "lines": len(corpus), "repeat": args.repeat, "results": results}, f, indent=2)
+        print(">> results saved to:", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import math
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+def polyphase_upsample_weights(filter: torch.Tensor, ratio: int):
+    """
+    Polyphase form of ``UpSample1d``: the zero-stuffed transposed convolution becomes one
+    ordinary convolution per output phase, so the multiplications by the stuffed zeros are skipped.
+
+    ``UpSample1d`` computes ``y[n] = ratio * sum_k xp[k] * f[n + pad_left - ratio * k]`` over the
+    input ``xp`` replicate-padded by ``pad``; output ``n = ratio * j + p`` only sees the taps
+    ``f[p + pad_left - ratio * q]`` at ``xp[j + q]``.
+
+    Args:
+        filter: [1, 1, K] lowpass filter of ``UpSample1d``
+    Returns:
+        ``(weight, pad_left, pad_right)``, weight [ratio, L] (phase, tap) to correlate with the
+        input replicate-padded by ``(pad_left, pad_right)``.
+    """
+    f = filter.reshape(-1)
+    K = f.numel()
+    pad = K // ratio - 1
+    up_pad_left = pad * ratio + (K - ratio) // 2
+    qs = {}
+    for p in range(ratio):
+        q_lo = math.ceil((p + up_pad_left - K + 1) / ratio)
+        q_hi = (p + up_pad_left) // ratio
+        qs[p] = range(q_lo, q_hi + 1)
+    q_min = min(r.start for r in qs.values())
+    q_max = max(r.stop - 1 for r in qs.values())
+    assert q_min <= pad <= q_max, "unsupported UpSample1d configuration"
+    weight = torch.zeros(ratio, q_max - q_min + 1, dtype=f.dtype)
+    for p, q_range in qs.items():
+        for q in q_range:
+            weight[p, q - q_min] = ratio * f[p + up_pad_left - ratio * q]
+    return weight, pad - q_min, q_max - pad
+
+
+class PolyphaseActivation1d(nn.Module):
+    """
+    Inference-only ``Activation1d`` (upsample -> Snake/SnakeBeta -> downsample), numerically
+    equivalent to the torch implementation but faster on CPU:
+
+    - polyphase upsampling: only the nonzero products of the zero-stuffed ``conv_transpose1d``
+      are computed, with the ``ratio`` gain folded in the taps
+    - ``exp(alpha)``, ``exp(beta)`` and ``1 / beta`` are computed once, not at every forward
+    - the activation runs in place on the phase outputs, which are interleaved straight into the
+      padded input of the downsampling conv
+
+    Built by ``from_activation`` from a trained ``Activation1d`` (e.g. at ``remove_weight_norm`` time);
+    later changes of its parameters are not seen.
+    """
+
+    def __init__(self, up_weight, up_pad, alpha, inv_beta, down_filter, down_pad, down_stride):
+        super().__init__()
+        C = alpha.numel()
+        self.ratio = up_weight.shape[0]
+        # the upsampling filter is the same for every channel: a few scaled shifted adds per phase
+        # are much faster on CPU than a grouped conv with ``ratio`` outputs per group
+        self.up_taps = [[(k, float(w)) for k, w in enumerate(phase.tolist()) if w != 0] for phase in up_weight]
+        self.up_pad = up_pad
+        self.down_pad = down_pad
+        self.down_stride = down_stride
+        self.register_buffer("up_weight", up_weight.contiguous(), persistent=False)
+        self.register_buffer("alpha", alpha.reshape(1, C, 1, 1), persistent=False)
+        self.register_buffer("inv_beta", inv_beta.reshape(1, C, 1, 1), persistent=False)
+        self.register_buffer("down_filter", down_filter.expand(C, -1, -1).contiguous(), persistent=False)
+        # fused C++ kernel (see load.py), set by prepare_activations
+        self.kernel = None
+
+    @classmethod
+    def from_activation(cls, activation1d):
+        act = activation1d.act
+        lowpass = activation1d.downsample.lowpass
+        if not (lowpass.padding and lowpass.padding_mode == "replicate"):
+            raise ValueError("PolyphaseActivation1d needs replicate padding in the downsampling filter")
+        with torch.no_grad():
+            alpha = act.alpha.detach().float()
+            # Snake: 1 / alpha, SnakeBeta: 1 / beta
+            beta = act.beta.detach().float() if hasattr(act, "beta") else alpha
+            if act.alpha_logscale:
+                alpha = torch.exp(alpha)
+                beta = torch.exp(beta)
+            inv_beta = 1.0 / (beta + act.no_div_by_zero)
+            up_weight, pad_left, pad_right = polyphase_upsample_weights(activation1d.upsample.filter.float(),
+                                                                        activation1d.up_ratio)
+        module = cls(up_weight, (pad_left, pad_right), alpha, inv_beta, lowpass.filter.float(),
+                     (lowpass.pad_left, lowpass.pad_right), lowpass.stride)
+        return module.to(act.alpha.device)
+
+    # x: [B, C, T]
+    def forward(self, x):
+        if self.kernel is not None and self.ratio == self.down_stride:
+            return self.kernel.forward(x, self.up_weight, self.up_pad[0], self.down_filter[0, 0],
+                                       self.down_pad[0], self.down_pad[1], self.alpha.view(-1), self.inv_beta.view(-1))
+        B, C, T = x.shape
+        r = self.ratio
+        # upsample into the phases [B, C, r, T]
+        xp = F.pad(x, self.up_pad, mode="replicate")
+        y = x.new_empty(B, C, r, T)
+        for p, taps in enumerate(self.up_taps):
+            (k0, w0), *rest = taps
+            torch.mul(xp[..., k0:k0 + T], w0, out=y[:, :, p])
+            for k, w in rest:
+                y[:, :, p].add_(xp[..., k:k + T], alpha=w)
+        # snake: y + 1/b * sin^2(a * y)
+        z = torch.mul(y, self.alpha).sin_().square_().mul_(self.inv_beta).add_(y)
+        # interleave the phases into the replicate-padded input of the downsampling conv
+        left, right = self.down_pad
+        zp = z.new_empty(B, C, left + T * r + right)
+        zp[..., left:left + T * r].view(B, C, T, r).copy_(z.transpose(2, 3))
+        zp[..., :left] = zp[..., left:left + 1]
+        zp[..., left + T * r:] = zp[..., left + T * r - 1:left + T * r]
+        return F.conv1d(zp, self.down_filter, stride=self.down_stride, groups=C)
+
+
+def prepare_activations(model: nn.Module, use_cpu_kernel: bool = True):
+    """
+    Build the CPU fast path of every torch ``Activation1d`` of ``model`` (see ``prepare_inference``).
+
+    Args:
+        use_cpu_kernel: also build the fused C++ kernel (needs a C++ compiler and ninja, falls back
+            to the torch polyphase path), only for a model on CPU.
+    """
+    fast_paths = []
+    for module in list(model.modules()):
+        if hasattr(module, "prepare_inference"):
+            module.prepare_inference()
+            fast_paths.append(module.fast)
+    if not fast_paths or not use_cpu_kernel or fast_paths[0].alpha.device.type != "cpu":
+        return
+    try:
+        from indextts.BigVGAN.alias_free_activation.cpu import load
+
+        kernel = load.load()
+        print(">> Preload custom CPU kernel for BigVGAN", kernel)
+    except Exception as e:
+        print(f">> Failed to load custom CPU kernel for BigVGAN ({e.__class__.__name__}). Falling back to torch.")
+        return
+    for fast in fast_paths:
+        fast.kernel = kernel
@@ -0,0 +1,102 @@
+/*
+ * Fused anti-aliased Snake/SnakeBeta activation for CPU inference:
+ * polyphase upsample -> snake -> lowpass downsample, one pass per (batch, channel) row.
+ *
+ * The upsampled signal is never stored interleaved: each upsampling phase is written straight
+ * into the phase buffer of the strided downsampling filter (q[d][m] = z_pad[stride * m + d]),
+ * so every inner loop runs over contiguous memory and can be vectorized.
+ */
+#include <torch/extension.h>
+#include <ATen/Parallel.h>
+
+#include <cmath>
+#include <vector>
+
+// x: [B, C, T] float32
+// up_weight: [R, L] polyphase upsampling taps (ratio gain folded in), for x replicate-padded by
+//            (up_pad_left, L - 1 - up_pad_left)
+// down_filter: [K] lowpass filter, applied with stride R to the activated signal replicate-padded
+//              by (down_pad_left, down_pad_right)
+// alpha, inv_beta: [C] snake parameters (exp already applied): y + inv_beta * sin^2(alpha * y)
+torch::Tensor fwd(torch::Tensor x, torch::Tensor up_weight, int64_t up_pad_left, torch::Tensor down_filter,
+                  int64_t down_pad_left, int64_t down_pad_right, torch::Tensor alpha, torch::Tensor inv_beta) {
+    TORCH_CHECK(x.dim() == 3 && x.scalar_type() == torch::kFloat && x.device().is_cpu(),
+                "expected a float32 CPU tensor [B, C, T]");
+    x = x.contiguous();
+    up_weight = up_weight.contiguous();
+    down_filter = down_filter.contiguous();
+    alpha = alpha.contiguous();
+    inv_beta = inv_beta.contiguous();
+
+    const int64_t B = x.size(0), C = x.size(1), T = x.size(2);
+    const int64_t R = up_weight.size(0), L = up_weight.size(1), K = down_filter.size(0);
+    const int64_t Lp = down_pad_left + R * T + down_pad_right;  // padded upsampled length
+    TORCH_CHECK(Lp >= K, "input too short");
+    const int64_t To = (Lp - K) / R + 1;
+    const int64_t M = (Lp + R - 1) / R;  // length of each phase buffer
+
+    auto out = torch::empty({B, C, To}, x.options());
+    const float* xs = x.data_ptr<float>();
+    const float* W = up_weight.data_ptr<float>();
+    const float* G = down_filter.data_ptr<float>();
+    const float* A = alpha.data_ptr<float>();
+    const float* IB = inv_beta.data_ptr<float>();
+    float* os = out.data_ptr<float>();
+
+    at::parallel_for(0, B * C, 1, [&](int64_t begin, int64_t end) {
+        std::vector<float> xp(T + L - 1);
+        std::vector<float> acc(T);
+        std::vector<float> q(R * M);
+        for (int64_t row = begin; row < end; ++row) {
+            const float* src = xs + row * T;
+            const float a = A[row % C];
+            const float ib = IB[row % C];
+
+            // replicate padding of the input
+            for (int64_t i = 0; i < up_pad_left; ++i) xp[i] = src[0];
+            for (int64_t n = 0; n < T; ++n) xp[up_pad_left + n] = src[n];
+            for (int64_t i = up_pad_left + T; i < T + L - 1; ++i) xp[i] = src[T - 1];
+
+            for (int64_t p = 0; p < R; ++p) {
+                // upsampling phase p: acc[n] = sum_t w[p, t] * xp[n + t]
+                float* ac = acc.data();
+                for (int64_t n = 0; n < T; ++n) ac[n] = 0.f;
+                for (int64_t t = 0; t < L; ++t) {
+                    const float w = W[p * L + t];
+                    if (w == 0.f) continue;
+                    const float* xt = xp.data() + t;
+                    for (int64_t n = 0; n < T; ++n) ac[n] += w * xt[n];
+                }
+                // snake, written to the position (down_pad_left + R * n + p) of the padded signal
+                const int64_t pos = down_pad_left + p;
+                float* dst = q.data() + (pos % R) * M + pos / R;
+                for (int64_t n = 0; n < T; ++n) {
+                    const float v = ac[n];
+                    const float s = std::sin(a * v);
+                    dst[n] = v + ib * s * s;
+                }
+            }
+
+            // replicate padding of the activated signal
+            const float first = q[(down_pad_left % R) * M + down_pad_left / R];
+            for (int64_t pos = 0; pos < down_pad_left; ++pos) q[(pos % R) * M + pos / R] = first;
+            const int64_t last_pos = down_pad_left + R * T - 1;
+            const float last = q[(last_pos % R) * M + last_pos / R];
+            for (int64_t pos = last_pos + 1; pos < Lp; ++pos) q[(pos % R) * M + pos / R] = last;
+
+            // downsampling: out[j] = sum_i g[i] * z_pad[R * j + i]
+            float* o = os + row * To;
+            for (int64_t j = 0; j < To; ++j) o[j] = 0.f;
+            for (int64_t i = 0; i < K; ++i) {
+                const float g = G[i];
+                const float* s = q.data() + (i % R) * M + i / R;
+                for (int64_t j = 0; j < To; ++j) o[j] += g * s[j];
+            }
+        }
+    });
+    return out;
+}
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
+    m.def("forward", &fwd, "Anti-aliased activation forward (CPU)");
+}
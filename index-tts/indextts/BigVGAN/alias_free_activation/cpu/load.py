@@ -0,0 +1,67 @@
+import hashlib
+import os
+import pathlib
+import platform
+
+import torch
+from torch.utils import cpp_extension
+
+_module = None
+# error of a failed build, not retried in this process
+_error = None
+
+srcpath = pathlib.Path(__file__).parent.absolute()
+buildpath = srcpath / "build"
+# written when the build fails, later loads fail at once instead of compiling again
+failed_marker = buildpath / "FAILED"
+
+
+def build_key():
+    """
+    Identifies a build attempt: the kernel source, the PyTorch version and the platform.
+    """
+    digest = hashlib.sha1((srcpath / "anti_alias_activation_cpu.cpp").read_bytes()).hexdigest()[:16]
+    return f"{digest} torch={torch.__version__} {platform.system()}-{platform.machine()}"
+
+
+def load(verbose=False):
+    """
+    Build (once, cached in ``build/``) and load the fused CPU kernel.
+
+    A failed build (no C++ compiler or ninja, unsupported compiler, ...) is remembered, in this
+    process and in ``build/FAILED`` for the same ``build_key``: later loads raise at once instead
+    of compiling again. Delete that file to retry, e.g. after installing a compiler.
+    """
+    global _module, _error
+    if _module is not None:
+        return _module
+    if _error is not None:
+        raise _error
+    key = build_key()
+    if failed_marker.is_file() and failed_marker.read_text(encoding="utf-8").split("\n", 1)[0] == key:
+        _error = RuntimeError(f"the CPU kernel build failed before, delete {failed_marker} to retry")
+        raise _error
+    if os.name == "nt":
+        extra_cflags = ["/O2", "/fp:fast"]
+    else:
+        # -ffast-math lets gcc vectorize sin() with the glibc vector math library
+        extra_cflags = ["-O3", "-ffast-math"]
+    os.makedirs(buildpath, exist_ok=True)
+    try:
+        _module = cpp_extension.load(
+            name="anti_alias_activation_cpu",
+            sources=[srcpath / "anti_alias_activation_cpu.cpp"],
+            build_directory=buildpath,
+            extra_cflags=extra_cflags,
+            verbose=verbose,
+        )
+    except Exception as e:
+        _error = e
+        try:
+            failed_marker.write_text(f"{key}\n{e.__class__.__name__}: {e}\n", encoding="utf-8")
+        except OSError:
+            pass
+        raise
+    if failed_marker.is_file():
+        failed_marker.unlink()
+    return _module
@@ -11,6 +11,7 @@ from torch.nn.utils import remove_weight_norm, spectral_norm, weight_norm
 
 import indextts.BigVGAN.activations as activations
 
+from indextts.BigVGAN.alias_free_activation.cpu.activation1d import prepare_activations
 from indextts.BigVGAN.ECAPA_TDNN import ECAPA_TDNN
 from indextts.BigVGAN.utils import get_padding, init_weights
 
@@ -129,15 +130,18 @@ class AMPBlock2(torch.nn.Module):
 
 class BigVGAN(torch.nn.Module):
     # this is our main BigVGAN model. Applies anti-aliased periodic activation for resblocks.
-    def __init__(self, h, use_cuda_kernel=False):
+    def __init__(self, h, use_cuda_kernel=False, use_cpu_kernel=True):
         """
         Args:
             h (dict)
             use_cuda_kernel (bool): whether to use custom cuda kernel for anti-aliased activation
+            use_cpu_kernel (bool): whether to build the fused C++ kernel of the anti-aliased activation,
+                at ``remove_weight_norm`` of a model on CPU
         """
         super(BigVGAN, self).__init__()
         self.h = h
         self.h["use_cuda_kernel"] = use_cuda_kernel
+        self.h["use_cpu_kernel"] = use_cpu_kernel
 
         self.num_kernels = len(h.resblock_kernel_sizes)
         self.num_upsamples = len(h.upsample_rates)
@@ -199,7 +203,7 @@ class BigVGAN(torch.nn.Module):
         # self.logit_scale = nn.Parameter(torch.ones([]) * np.log(1 / 0.07))
 
     def forward(self, x, mel_ref, lens=None):
-        speaker_embedding = self.speaker_encoder(mel_ref, lens)
+        speaker_embedding = self.compute_speaker_embedding(mel_ref, lens)
         n_batch = x.size(0)
         contrastive_loss = None
         if n_batch * 2 == speaker_embedding.size(0):
@@ -207,6 +211,29 @@ class BigVGAN(torch.nn.Module):
             contrastive_loss = self.cal_clip_loss(spe_emb_chunk1.squeeze(1), spe_emb_chunk2.squeeze(1), self.logit_scale.exp())
 
             speaker_embedding = speaker_embedding[:n_batch, :, :]
+        return self.decode(x, speaker_embedding), contrastive_loss
+
+    def compute_speaker_embedding(self, mel_ref, lens=None):
+        """
+        ECAPA-TDNN speaker embedding of the reference mel, reusable by ``decode`` for every
+        latent of the same speaker.
+
+        Args:
+            mel_ref: [B, T, num_mels]
+        Returns:
+            [B, 1, speaker_embedding_dim]
+        """
+        return self.speaker_encoder(mel_ref, lens)
+
+    def decode(self, x, speaker_embedding):
+        """
+        Args:
+            x: [B, T, gpt_dim] GPT latent
+            speaker_embedding: [B, 1, speaker_embedding_dim] (or [1, 1, speaker_embedding_dim]),
+                from ``compute_speaker_embedding``
+        Returns:
+            [B, 1, T * hop_length] waveform
+        """
         speaker_embedding = speaker_embedding.transpose(1, 2)
 
         # upsample feat
@@ -247,7 +274,20 @@ class BigVGAN(torch.nn.Module):
         x = self.conv_post(x)
         x = torch.tanh(x)
 
-        return x, contrastive_loss
+        return x
+
+    def activation_bytes_per_frame(self, bytes_per_element=4):
+        """
+        Rough peak activation memory of ``decode`` per latent frame: the widest upsampling stage,
+        times the tensors alive in an AMP block (input, sum of the blocks, block temporaries and
+        the 2x upsampled anti-aliased activation).
+        """
+        frames = 4 if self.feat_upsample else 1
+        peak = 0
+        for i, u in enumerate(self.h.upsample_rates):
+            frames *= u
+            peak = max(peak, frames * (self.h.upsample_initial_channel // (2 ** (i + 1))))
+        return peak * 8 * bytes_per_element
 
     def remove_weight_norm(self):
         print('Removing weight norm...')
@@ -258,6 +298,8 @@ class BigVGAN(torch.nn.Module):
             l.remove_weight_norm()
         remove_weight_norm(self.conv_pre)
         remove_weight_norm(self.conv_post)
+        # inference from here on: precompute the CPU fast path of the anti-aliased activations
+        prepare_activations(self, use_cpu_kernel=self.h.get("use_cpu_kernel", True))
 
     def cal_clip_loss(self, image_features, text_features, logit_scale):
         device = image_features.device
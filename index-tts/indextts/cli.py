@@ -1,3 +1,4 @@
+import contextlib
 import os
 import sys
 import warnings
@@ -9,7 +10,7 @@ def main():
     parser = argparse.ArgumentParser(description="IndexTTS Command Line")
     parser.add_argument("text", type=str, help="Text to be synthesized")
     parser.add_argument("-v", "--voice", type=str, required=True, help="Path to the audio prompt file (wav format)")
-    parser.add_argument("-o", "--output_path", type=str, default="gen.wav", help="Path to the output wav file")
+    parser.add_argument("-o", "--output_path", type=str, default="gen.wav", help="Path to the output wav file, '-' for raw PCM on stdout")
     parser.add_argument("-c", "--config", type=str, default="checkpoints/config.yaml", help="Path to the config file. Default is 'checkpoints/config.yaml'")
     parser.add_argument("--model_dir", type=str, default="checkpoints", help="Path to the model directory. Default is 'checkpoints'")
     parser.add_argument("--fp16", action="store_true", default=False, help="Use FP16 for inference if available")
@@ -58,7 +59,10 @@ def main():
 
     # TODO: Add CLI support for IndexTTS2.
     from indextts.infer import IndexTTS
-    tts = IndexTTS(cfg_path=args.config, model_dir=args.model_dir, use_fp16=args.fp16, device=args.device)
+    from indextts.utils.audio_sink import targets_stdout
+    # with "-o -" the PCM goes to stdout, the model loading logs go to stderr
+    with contextlib.redirect_stdout(sys.stderr if targets_stdout(output_path) else sys.stdout):
+        tts = IndexTTS(cfg_path=args.config, model_dir=args.model_dir, use_fp16=args.fp16, device=args.device)
     tts.infer(audio_prompt=args.voice, text=args.text.strip(), output_path=output_path)
 
 if __name__ == "__main__":
@@ -85,6 +85,7 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
         self.lm_head = new_embeddings
 
     def store_mel_emb(self, mel_emb):
+        # 已弃用: 实例上的状态会被并发请求互相覆盖, 请通过 generate(..., cached_mel_emb=...) 传入
         self.cached_mel_emb = mel_emb
 
     def prepare_inputs_for_generation(self, input_ids, past_key_values=None, **kwargs):
@@ -115,6 +116,7 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
             "position_ids": position_ids,
             "attention_mask": attention_mask,
             "token_type_ids": token_type_ids,
+            "cached_mel_emb": kwargs.get("cached_mel_emb"),
         }
 
     def forward(
@@ -133,25 +135,32 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
             output_attentions=None,
             output_hidden_states=None,
             return_dict=None,
+            cached_mel_emb=None,
     ):
-        assert self.cached_mel_emb is not None
+        """
+        ``cached_mel_emb``: the conditioning + text prefix embeddings of the request, passed to
+        ``generate`` with the inputs so that concurrent requests don't share state.
+        """
+        if cached_mel_emb is None:
+            cached_mel_emb = self.cached_mel_emb
+        assert cached_mel_emb is not None
         assert inputs_embeds is None  # Not supported by this inference model.
         assert labels is None  # Training not supported by this inference model.
         return_dict = (
             return_dict if return_dict is not None else self.config.use_return_dict
         )
         # Create embedding
-        mel_len = self.cached_mel_emb.shape[1]
+        mel_len = cached_mel_emb.shape[1]
         if input_ids.shape[1] != 1:
             text_inputs = input_ids[:, mel_len:]
             text_emb = self.embeddings(text_inputs)
             text_emb = text_emb + self.text_pos_embedding(text_emb)
-            if self.cached_mel_emb.shape[0] != text_emb.shape[0]:
-                mel_emb = self.cached_mel_emb.repeat_interleave(
-                    text_emb.shape[0] // self.cached_mel_emb.shape[0], 0
+            if cached_mel_emb.shape[0] != text_emb.shape[0]:
+                mel_emb = cached_mel_emb.repeat_interleave(
+                    text_emb.shape[0] // cached_mel_emb.shape[0], 0
                 )
             else:  # this outcome only occurs once per loop in most cases
-                mel_emb = self.cached_mel_emb
+                mel_emb = cached_mel_emb
             emb = torch.cat([mel_emb, text_emb], dim=1)
         else:
             emb = self.embeddings(input_ids)
@@ -695,7 +704,6 @@ class UnifiedVoice(nn.Module):
         duration_emb_half = self.speed_emb(torch.ones_like(tmp).long())
         conds_latent = torch.cat((speech_conditioning_latent + emo_vec.unsqueeze(1), duration_emb_half.unsqueeze(1), duration_emb.unsqueeze(1)), 1)
         input_ids, inputs_embeds, attention_mask = self.prepare_gpt_inputs(conds_latent, text_inputs)
-        self.inference_model.store_mel_emb(inputs_embeds)
         if input_tokens is None:
             inputs = input_ids
         else:
@@ -726,6 +734,7 @@ class UnifiedVoice(nn.Module):
                                             eos_token_id=self.stop_mel_token, attention_mask=attention_mask,
                                             max_length=max_length, logits_processor=logits_processor,
                                             num_return_sequences=num_return_sequences,
+                                            cached_mel_emb=inputs_embeds,
                                             **hf_generate_kwargs)
         if isinstance(output, torch.Tensor):
             return output[:, trunc_index:], speech_conditioning_latent
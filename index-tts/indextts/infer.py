@@ -6,7 +6,6 @@ from subprocess import CalledProcessError
 from typing import Dict, List
 
 import torch
-import torchaudio
 from torch.nn.utils.rnn import pad_sequence
 from omegaconf import OmegaConf
 from tqdm import tqdm
@@ -18,16 +17,22 @@ warnings.filterwarnings("ignore", category=UserWarning)
 
 from indextts.BigVGAN.models import BigVGAN as Generator
 from indextts.gpt.model import UnifiedVoice
+from indextts.utils.audio_io import load_audio
+from indextts.utils.audio_sink import open_sink, stdout_audio
 from indextts.utils.checkpoint import load_checkpoint
+from indextts.utils.code_postprocess import postprocess_codes
 from indextts.utils.feature_extractors import MelSpectrogramFeatures
+from indextts.utils.metrics import metrics
 
 from indextts.utils.front import TextNormalizer, TextTokenizer
+from indextts.utils.token_budget import GenerationGuard, segment_text, segment_token_budget, trim_runaway_codes
+from transformers import StoppingCriteriaList
 
 
 class IndexTTS:
     def __init__(
             self, cfg_path="checkpoints/config.yaml", model_dir="checkpoints", use_fp16=True, device=None,
-            use_cuda_kernel=None,
+            use_cuda_kernel=None, use_cpu_kernel=True,
     ):
         """
         Args:
@@ -36,6 +41,8 @@ class IndexTTS:
             use_fp16 (bool): whether to use fp16.
             device (str): device to use (e.g., 'cuda:0', 'cpu'). If None, it will be set automatically based on the availability of CUDA or MPS.
             use_cuda_kernel (None | bool): whether to use BigVGan custom fused activation CUDA kernel, only for CUDA device.
+            use_cpu_kernel (bool): whether to build BigVGan custom fused activation C++ kernel, only for CPU device
+                (needs a C++ compiler and ninja, a failed build falls back to torch and is not retried).
         """
         if device is not None:
             self.device = device
@@ -109,7 +116,7 @@ class IndexTTS:
             except:
                 print(">> Failed to load custom CUDA kernel for BigVGAN. Falling back to torch.")
                 self.use_cuda_kernel = False
-        self.bigvgan = Generator(self.cfg.bigvgan, use_cuda_kernel=self.use_cuda_kernel)
+        self.bigvgan = Generator(self.cfg.bigvgan, use_cuda_kernel=self.use_cuda_kernel, use_cpu_kernel=use_cpu_kernel)
         self.bigvgan_path = os.path.join(self.model_dir, self.cfg.bigvgan_checkpoint)
         vocoder_dict = torch.load(self.bigvgan_path, map_location="cpu")
         self.bigvgan.load_state_dict(vocoder_dict["generator"])
@@ -127,75 +134,35 @@ class IndexTTS:
         # 缓存参考音频mel：
         self.cache_audio_prompt = None
         self.cache_cond_mel = None
+        # BigVGAN 的说话人 embedding, 随 cache_cond_mel 一起缓存
+        self.cache_spk_emb = None
+        self.cache_spk_emb_mel = None
         # 进度引用显示（可选）
         self.gr_progress = None
         self.model_version = self.cfg.version if hasattr(self.cfg, "version") else None
+        # GPT mel 码的帧率 (24kHz, 每个码对应 mel_length_compression 个采样点)
+        self.codes_per_second = 24000 / self.gpt.mel_length_compression
 
     def remove_long_silence(self, codes: torch.Tensor, silent_token=52, max_consecutive=30):
         """
         Shrink special tokens (silent_token and stop_mel_token) in codes
         codes: [B, T]
         """
-        code_lens = []
-        codes_list = []
-        device = codes.device
-        dtype = codes.dtype
-        isfix = False
-        for i in range(0, codes.shape[0]):
-            code = codes[i]
-            if not torch.any(code == self.stop_mel_token).item():
-                len_ = code.size(0)
-            else:
-                stop_mel_idx = (code == self.stop_mel_token).nonzero(as_tuple=False)
-                len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
-
-            count = torch.sum(code == silent_token).item()
-            if count > max_consecutive:
-                # code = code.cpu().tolist()
-                ncode_idx = []
-                n = 0
-                for k in range(len_):
-                    assert code[
-                               k] != self.stop_mel_token, f"stop_mel_token {self.stop_mel_token} should be shrinked here"
-                    if code[k] != silent_token:
-                        ncode_idx.append(k)
-                        n = 0
-                    elif code[k] == silent_token and n < 10:
-                        ncode_idx.append(k)
-                        n += 1
-                    # if (k == 0 and code[k] == 52) or (code[k] == 52 and code[k-1] == 52):
-                    #    n += 1
-                # new code
-                len_ = len(ncode_idx)
-                codes_list.append(code[ncode_idx])
-                isfix = True
-            else:
-                # shrink to len_
-                codes_list.append(code[:len_])
-            code_lens.append(len_)
-        if isfix:
-            if len(codes_list) > 1:
-                codes = pad_sequence(codes_list, batch_first=True, padding_value=self.stop_mel_token)
-            else:
-                codes = codes_list[0].unsqueeze(0)
-        else:
-            # unchanged
-            pass
-        # clip codes to max length
-        max_len = max(code_lens)
-        if max_len < codes.shape[1]:
-            codes = codes[:, :max_len]
-        code_lens = torch.tensor(code_lens, dtype=torch.long, device=device)
-        return codes, code_lens
-
-    def bucket_segments(self, segments, bucket_max_size=4) -> List[List[Dict]]:
+        return postprocess_codes(codes, self.stop_mel_token, silent_token=silent_token,
+                                 max_consecutive=max_consecutive)
+
+    def bucket_segments(self, segments, bucket_max_size=4, budgets=None) -> List[List[Dict]]:
         """
         Segment data bucketing.
         if ``bucket_max_size=1``, return all segments in one bucket.
+        if ``budgets`` (mel token budget per segment) is given, segments with similar budgets are
+        bucketed together instead of similar text lengths, so a batch decodes to similar lengths.
         """
         outputs: List[Dict] = []
         for idx, sent in enumerate(segments):
-            outputs.append({"idx": idx, "sent": sent, "len": len(sent)})
+            outputs.append({"idx": idx, "sent": sent, "len": len(sent),
+                            "budget": budgets[idx] if budgets is not None else None})
+        key = "budget" if budgets is not None else "len"
 
         if len(outputs) > bucket_max_size:
             # split segments into buckets by segment length
@@ -204,9 +171,9 @@ class IndexTTS:
             last_bucket = None
             last_bucket_sent_len_median = 0
 
-            for sent in sorted(outputs, key=lambda x: x["len"]):
-                current_sent_len = sent["len"]
-                if current_sent_len == 0:
+            for sent in sorted(outputs, key=lambda x: x[key]):
+                current_sent_len = sent[key]
+                if sent["len"] == 0:
                     print(">> skip empty segment")
                     continue
                 if last_bucket is None \
@@ -220,7 +187,7 @@ class IndexTTS:
                     # current bucket can hold more segments
                     last_bucket.append(sent)  # sorted
                     mid = len(last_bucket) // 2
-                    last_bucket_sent_len_median = last_bucket[mid]["len"]
+                    last_bucket_sent_len_median = last_bucket[mid][key]
             last_bucket = None
             # merge all buckets with size 1
             out_buckets: List[List[Dict]] = []
@@ -275,13 +242,59 @@ class IndexTTS:
         except Exception as e:
             pass
 
+    def get_speaker_embedding(self, cond_mel: torch.Tensor) -> torch.Tensor:
+        """
+        BigVGAN speaker embedding of the reference mel, computed once per ``cache_cond_mel``
+        instead of once per vocoder call.
+        """
+        if self.cache_spk_emb is None or self.cache_spk_emb_mel is not cond_mel:
+            self.cache_spk_emb = self.bigvgan.compute_speaker_embedding(cond_mel.transpose(1, 2))
+            self.cache_spk_emb_mel = cond_mel
+            metrics.inc("cache_misses", cache="spk_emb")
+        else:
+            metrics.inc("cache_hits", cache="spk_emb")
+        return self.cache_spk_emb
+
+    def vocoder_chunk_frames(self, memory_mb=None) -> int:
+        """
+        Max latent frames per BigVGAN call within an activation memory budget.
+
+        Args:
+            memory_mb: 显存/内存预算 (MB), 默认: CUDA 空闲显存的一半, 其他设备 2048
+        """
+        if memory_mb is None:
+            memory_mb = 2048
+            if "cuda" in str(self.device):
+                free, _ = torch.cuda.mem_get_info(self.device)
+                memory_mb = free / 2 / 1024 ** 2
+        bytes_per_element = 2 if self.dtype is not None else 4
+        return max(1, int(memory_mb * 1024 ** 2 // self.bigvgan.activation_bytes_per_frame(bytes_per_element)))
+
+    @staticmethod
+    def chunk_latents(latents: List[torch.Tensor], max_frames: int) -> List[List[torch.Tensor]]:
+        """
+        Group consecutive latents ([1, T, D]) into vocoder chunks of at most ``max_frames`` frames
+        (a longer latent gets a chunk of its own).
+        """
+        chunks = []
+        frames = 0
+        for latent in latents:
+            if chunks and frames + latent.shape[1] <= max_frames:
+                chunks[-1].append(latent)
+                frames += latent.shape[1]
+            else:
+                chunks.append([latent])
+                frames = latent.shape[1]
+        return chunks
+
     def _set_gr_progress(self, value, desc):
         if self.gr_progress is not None:
             self.gr_progress(value, desc=desc)
 
     # 快速推理：对于“多句长文本”，可实现至少 2~10 倍以上的速度提升~ （First modified by sunnyboxs 2025-04-16）
+    @stdout_audio
     def infer_fast(self, audio_prompt, text, output_path, verbose=False, max_text_tokens_per_segment=100,
-                   segments_bucket_max_size=4, **generation_kwargs):
+                   segments_bucket_max_size=4, vocoder_memory_mb=None, **generation_kwargs):
         """
         Args:
             ``max_text_tokens_per_segment``: 分句的最大token数，默认``100``，可以根据GPU硬件情况调整
@@ -290,6 +303,7 @@ class IndexTTS:
             ``segments_bucket_max_size``: 分句分桶的最大容量，默认``4``，可以根据GPU内存调整
                 - 越大，bucket数量越少，batch越多，推理速度越*快*，占用内存更多，可能影响质量
                 - 越小，bucket数量越多，batch越少，推理速度越*慢*，占用内存和质量更接近于非快速推理
+            ``vocoder_memory_mb``: BigVGAN 每次解码的显存预算 (MB)，决定每次解码的 latent 长度，默认为空闲显存的一半
         """
         print(">> starting fast inference...")
 
@@ -300,19 +314,8 @@ class IndexTTS:
 
         # 如果参考音频改变了，才需要重新生成 cond_mel, 提升速度
         if self.cache_cond_mel is None or self.cache_audio_prompt != audio_prompt:
-            audio, sr = torchaudio.load(audio_prompt)
-            audio = torch.mean(audio, dim=0, keepdim=True)
-            if audio.shape[0] > 1:
-                audio = audio[0].unsqueeze(0)
-            audio = torchaudio.transforms.Resample(sr, 24000)(audio)
-
-            max_audio_length_seconds = 50  
-            max_audio_samples = int(max_audio_length_seconds * 24000)
-            
-            if audio.shape[1] > max_audio_samples:
-                if verbose:
-                    print(f"Audio too long ({audio.shape[1]} samples), truncating to {max_audio_samples} samples")
-                audio = audio[:, :max_audio_samples]
+            # truncated to 50 seconds before resampling
+            audio = load_audio(audio_prompt, 24000, max_audio_length_seconds=50, verbose=verbose)
 
             cond_mel = MelSpectrogramFeatures()(audio).to(self.device)
             cond_mel_frame = cond_mel.shape[-1]
@@ -321,7 +324,9 @@ class IndexTTS:
 
             self.cache_audio_prompt = audio_prompt
             self.cache_cond_mel = cond_mel
+            metrics.inc("cache_misses", cache="cond_mel")
         else:
+            metrics.inc("cache_hits", cache="cond_mel")
             cond_mel = self.cache_cond_mel
             cond_mel_frame = cond_mel.shape[-1]
             pass
@@ -348,10 +353,13 @@ class IndexTTS:
         num_beams = generation_kwargs.pop("num_beams", 3)
         repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
         max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 600)
+        # 每段的 token 预算 (按文本时长估计), 以及重复循环检测, 设为 0/None 关闭
+        token_budget_margin = generation_kwargs.pop("token_budget_margin", 1.5)
+        loop_detection_seconds = generation_kwargs.pop("loop_detection_seconds", 3.0)
+        loop_min_span = int(loop_detection_seconds * self.codes_per_second) if loop_detection_seconds else 0
         sampling_rate = 24000
         # lang = "EN"
         # lang = "ZH"
-        wavs = []
         gpt_gen_time = 0
         gpt_forward_time = 0
         bigvgan_time = 0
@@ -360,7 +368,11 @@ class IndexTTS:
         all_text_tokens: List[List[torch.Tensor]] = []
         self._set_gr_progress(0.1, "text processing...")
         bucket_max_size = segments_bucket_max_size if self.device != "cpu" else 1
-        all_segments = self.bucket_segments(segments, bucket_max_size=bucket_max_size)
+        budgets = None
+        if token_budget_margin:
+            budgets = [segment_token_budget(segment_text(sent), self.codes_per_second, margin=token_budget_margin,
+                                            max_tokens=max_mel_tokens) for sent in segments]
+        all_segments = self.bucket_segments(segments, bucket_max_size=bucket_max_size, budgets=budgets)
         bucket_count = len(all_segments)
         if verbose:
             print(">> segments bucket_count:", bucket_count,
@@ -385,8 +397,9 @@ class IndexTTS:
         all_batch_num = sum(len(s) for s in all_segments)
         all_batch_codes = []
         processed_num = 0
-        for item_tokens in all_text_tokens:
+        for item_tokens, batch_segments in zip(all_text_tokens, all_segments):
             batch_num = len(item_tokens)
+            batch_budgets = [item["budget"] or max_mel_tokens for item in batch_segments]
             if batch_num > 1:
                 batch_text_tokens = self.pad_tokens_cat(item_tokens)
             else:
@@ -410,10 +423,22 @@ class IndexTTS:
                                                            length_penalty=length_penalty,
                                                            num_beams=num_beams,
                                                            repetition_penalty=repetition_penalty,
-                                                           max_generate_length=max_mel_tokens,
+                                                           max_generate_length=max(batch_budgets),
+                                                           stopping_criteria=StoppingCriteriaList([
+                                                               GenerationGuard(batch_budgets, min_span=loop_min_span)]),
                                                            **generation_kwargs)
-                    all_batch_codes.append(temp_codes)
-            gpt_gen_time += time.perf_counter() - m_start_time
+            m_end_time = time.perf_counter()
+            temp_codes, reasons = trim_runaway_codes(temp_codes, self.stop_mel_token, batch_budgets,
+                                                     min_span=loop_min_span)
+            for item, budget, reason in zip(batch_segments, batch_budgets, reasons):
+                if reason == "loop" or (reason == "budget" and budget < max_mel_tokens):
+                    print(f">> segment {item['idx']}: generation stopped by the {reason} guard (budget: {budget})")
+                    metrics.inc("gpt_guard_stops", reason=reason)
+            all_batch_codes.append(temp_codes)
+            gpt_gen_time += m_end_time - m_start_time
+            metrics.record_span("gpt_decode", m_start_time, m_end_time, batch=batch_num, tokens=temp_codes.numel())
+            metrics.observe("gpt_decode_tokens_per_second", temp_codes.numel() / max(m_end_time - m_start_time, 1e-9))
+            metrics.inc("gpt_tokens", temp_codes.numel())
 
         # gpt latent
         self._set_gr_progress(0.5, "gpt latents inference...")
@@ -452,20 +477,24 @@ class IndexTTS:
                                                                    device=text_tokens.device),
                                      return_latent=True, clip_inputs=False)
                         gpt_forward_time += time.perf_counter() - m_start_time
+                        metrics.record_span("gpt_forward", m_start_time, time.perf_counter())
                         all_latents.append(latent)
         del all_batch_codes, all_text_tokens, all_segments
         # bigvgan chunk
-        chunk_size = 2
+        max_chunk_frames = self.vocoder_chunk_frames(vocoder_memory_mb)
         all_latents = [all_latents[all_idxs.index(i)] for i in range(len(all_latents))]
         if verbose:
             print(">> all_latents:", len(all_latents))
             print("  latents length:", [l.shape[1] for l in all_latents])
-        chunk_latents = [all_latents[i: i + chunk_size] for i in range(0, len(all_latents), chunk_size)]
+            print(">> bigvgan max chunk frames:", max_chunk_frames)
+        chunk_latents = self.chunk_latents(all_latents, max_chunk_frames)
         chunk_length = len(chunk_latents)
         latent_length = len(all_latents)
 
         # bigvgan chunk decode
         self._set_gr_progress(0.7, "bigvgan decoding...")
+        # 每个 chunk 解码后直接写入输出, 内存占用不随文本长度增长
+        sink = open_sink(output_path or None, sampling_rate)
         tqdm_progress = tqdm(total=latent_length, desc="bigvgan")
         for items in chunk_latents:
             tqdm_progress.update(len(items))
@@ -473,12 +502,13 @@ class IndexTTS:
             with torch.no_grad():
                 with torch.amp.autocast(latent.device.type, enabled=self.dtype is not None, dtype=self.dtype):
                     m_start_time = time.perf_counter()
-                    wav, _ = self.bigvgan(latent, auto_conditioning.transpose(1, 2))
+                    wav = self.bigvgan.decode(latent, self.get_speaker_embedding(auto_conditioning))
                     bigvgan_time += time.perf_counter() - m_start_time
+                    metrics.record_span("vocoder", m_start_time, time.perf_counter(), samples=wav.shape[-1])
                     wav = wav.squeeze(1)
                     pass
             wav = torch.clamp(32767 * wav, -32767.0, 32767.0)
-            wavs.append(wav.cpu())  # to cpu before saving
+            sink.write(wav)
 
         # clear cache
         tqdm_progress.close()  # 确保进度条被关闭
@@ -488,8 +518,8 @@ class IndexTTS:
 
         # wav audio output
         self._set_gr_progress(0.9, "saving audio...")
-        wav = torch.cat(wavs, dim=1)
-        wav_length = wav.shape[-1] / sampling_rate
+        sink.close()
+        wav_length = sink.duration
         print(f">> Reference audio length: {cond_mel_frame * 256 / sampling_rate:.2f} seconds")
         print(f">> gpt_gen_time: {gpt_gen_time:.2f} seconds")
         print(f">> gpt_forward_time: {gpt_forward_time:.2f} seconds")
@@ -500,22 +530,23 @@ class IndexTTS:
         print(f">> [fast] batch_num: {all_batch_num} bucket_max_size: {bucket_max_size}",
               f"bucket_count: {bucket_count}" if bucket_max_size > 1 else "")
         print(f">> [fast] RTF: {(end_time - start_time) / wav_length:.4f}")
+        metrics.record_span("request", start_time, end_time, mode="fast", segments=all_batch_num,
+                            audio_seconds=wav_length, rtf=(end_time - start_time) / wav_length,
+                            **metrics.update_peak_memory())
+        metrics.observe("rtf", (end_time - start_time) / wav_length)
 
-        # save audio
-        wav = wav.cpu()  # to cpu
         if output_path:
-            # 直接保存音频到指定路径中
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            torchaudio.save(output_path, wav.type(torch.int16), sampling_rate)
-            print(">> wav file saved to:", output_path)
-            return output_path
+            if sink.path:
+                print(">> wav file saved to:", sink.path)
+            # a binary stream has no path to return
+            return sink.path
         else:
             # 返回以符合Gradio的格式要求
-            wav_data = wav.type(torch.int16)
-            wav_data = wav_data.numpy().T
+            wav_data = sink.tensor().numpy().T
             return (sampling_rate, wav_data)
 
     # 原始推理模式
+    @stdout_audio
     def infer(self, audio_prompt, text, output_path, verbose=False, max_text_tokens_per_segment=120,
               **generation_kwargs):
         print(">> starting inference...")
@@ -526,11 +557,7 @@ class IndexTTS:
 
         # 如果参考音频改变了，才需要重新生成 cond_mel, 提升速度
         if self.cache_cond_mel is None or self.cache_audio_prompt != audio_prompt:
-            audio, sr = torchaudio.load(audio_prompt)
-            audio = torch.mean(audio, dim=0, keepdim=True)
-            if audio.shape[0] > 1:
-                audio = audio[0].unsqueeze(0)
-            audio = torchaudio.transforms.Resample(sr, 24000)(audio)
+            audio = load_audio(audio_prompt, 24000)
             cond_mel = MelSpectrogramFeatures()(audio).to(self.device)
             cond_mel_frame = cond_mel.shape[-1]
             if verbose:
@@ -538,7 +565,9 @@ class IndexTTS:
 
             self.cache_audio_prompt = audio_prompt
             self.cache_cond_mel = cond_mel
+            metrics.inc("cache_misses", cache="cond_mel")
         else:
+            metrics.inc("cache_hits", cache="cond_mel")
             cond_mel = self.cache_cond_mel
             cond_mel_frame = cond_mel.shape[-1]
             pass
@@ -561,15 +590,23 @@ class IndexTTS:
         num_beams = generation_kwargs.pop("num_beams", 3)
         repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
         max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 600)
+        # 每段的 token 预算 (按文本时长估计), 以及重复循环检测, 设为 0/None 关闭
+        token_budget_margin = generation_kwargs.pop("token_budget_margin", 1.5)
+        loop_detection_seconds = generation_kwargs.pop("loop_detection_seconds", 3.0)
+        loop_min_span = int(loop_detection_seconds * self.codes_per_second) if loop_detection_seconds else 0
         sampling_rate = 24000
         # lang = "EN"
         # lang = "ZH"
-        wavs = []
         gpt_gen_time = 0
         gpt_forward_time = 0
         bigvgan_time = 0
         progress = 0
         has_warned = False
+        if output_path and isinstance(output_path, str) and os.path.isfile(output_path):
+            os.remove(output_path)
+            print(">> remove old wav file:", output_path)
+        # 每段音频生成后直接写入输出 (wav/flac 文件, PCM 管道, 或 Gradio 所需的内存), 内存占用不随文本长度增长
+        sink = open_sink(output_path or None, sampling_rate)
         for sent in segments:
             text_tokens = self.tokenizer.convert_tokens_to_ids(sent)
             text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=self.device).unsqueeze(0)
@@ -585,6 +622,10 @@ class IndexTTS:
 
             # text_len = torch.IntTensor([text_tokens.size(1)], device=text_tokens.device)
             # print(text_len)
+            budget = max_mel_tokens
+            if token_budget_margin:
+                budget = segment_token_budget(segment_text(sent), self.codes_per_second, margin=token_budget_margin,
+                                              max_tokens=max_mel_tokens)
             progress += 1
             self._set_gr_progress(0.2 + 0.4 * (progress - 1) / len(segments),
                                   f"gpt latents inference {progress}/{len(segments)}...")
@@ -603,10 +644,21 @@ class IndexTTS:
                                                       length_penalty=length_penalty,
                                                       num_beams=num_beams,
                                                       repetition_penalty=repetition_penalty,
-                                                      max_generate_length=max_mel_tokens,
+                                                      max_generate_length=budget,
+                                                      stopping_criteria=StoppingCriteriaList([
+                                                          GenerationGuard([budget], min_span=loop_min_span)]),
                                                       **generation_kwargs)
-                gpt_gen_time += time.perf_counter() - m_start_time
-                if not has_warned and (codes[:, -1] != self.stop_mel_token).any():
+                m_end_time = time.perf_counter()
+                gpt_gen_time += m_end_time - m_start_time
+                metrics.record_span("gpt_decode", m_start_time, m_end_time, segment=progress - 1, tokens=codes.shape[-1])
+                metrics.observe("gpt_decode_tokens_per_second", codes.shape[-1] / max(m_end_time - m_start_time, 1e-9))
+                metrics.inc("gpt_tokens", codes.shape[-1])
+                codes, reasons = trim_runaway_codes(codes, self.stop_mel_token, [budget], min_span=loop_min_span)
+                if reasons[0] == "loop" or (reasons[0] == "budget" and budget < max_mel_tokens):
+                    print(f">> segment {progress - 1}: generation stopped by the {reasons[0]} guard after "
+                          f"{codes.shape[-1]} codes (budget: {budget})")
+                    metrics.inc("gpt_guard_stops", reason=reasons[0])
+                elif not has_warned and (codes[:, -1] != self.stop_mel_token).any():
                     warnings.warn(
                         f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
                         f"Input text tokens: {text_tokens.shape[1]}. "
@@ -641,21 +693,23 @@ class IndexTTS:
                                                                device=text_tokens.device),
                                  return_latent=True, clip_inputs=False)
                     gpt_forward_time += time.perf_counter() - m_start_time
+                    metrics.record_span("gpt_forward", m_start_time, time.perf_counter(), segment=progress - 1)
 
                     m_start_time = time.perf_counter()
-                    wav, _ = self.bigvgan(latent, auto_conditioning.transpose(1, 2))
+                    wav = self.bigvgan.decode(latent, self.get_speaker_embedding(auto_conditioning))
                     bigvgan_time += time.perf_counter() - m_start_time
+                    metrics.record_span("vocoder", m_start_time, time.perf_counter(), samples=wav.shape[-1])
                     wav = wav.squeeze(1)
 
                 wav = torch.clamp(32767 * wav, -32767.0, 32767.0)
                 if verbose:
                     print(f"wav shape: {wav.shape}", "min:", wav.min(), "max:", wav.max())
                 # wavs.append(wav[:, :-512])
-                wavs.append(wav.cpu())  # to cpu before saving
+                sink.write(wav)
         end_time = time.perf_counter()
         self._set_gr_progress(0.9, "saving audio...")
-        wav = torch.cat(wavs, dim=1)
-        wav_length = wav.shape[-1] / sampling_rate
+        sink.close()
+        wav_length = sink.duration
         print(f">> Reference audio length: {cond_mel_frame * 256 / sampling_rate:.2f} seconds")
         print(f">> gpt_gen_time: {gpt_gen_time:.2f} seconds")
         print(f">> gpt_forward_time: {gpt_forward_time:.2f} seconds")
@@ -663,23 +717,18 @@ class IndexTTS:
         print(f">> Total inference time: {end_time - start_time:.2f} seconds")
         print(f">> Generated audio length: {wav_length:.2f} seconds")
         print(f">> RTF: {(end_time - start_time) / wav_length:.4f}")
+        metrics.record_span("request", start_time, end_time, segments=len(segments), audio_seconds=wav_length,
+                            rtf=(end_time - start_time) / wav_length, **metrics.update_peak_memory())
+        metrics.observe("rtf", (end_time - start_time) / wav_length)
 
-        # save audio
-        wav = wav.cpu()  # to cpu
         if output_path:
-            # 直接保存音频到指定路径中
-            if os.path.isfile(output_path):
-                os.remove(output_path)
-                print(">> remove old wav file:", output_path)
-            if os.path.dirname(output_path) != "":
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            torchaudio.save(output_path, wav.type(torch.int16), sampling_rate)
-            print(">> wav file saved to:", output_path)
-            return output_path
+            if sink.path:
+                print(">> wav file saved to:", sink.path)
+            # a binary stream has no path to return
+            return sink.path
         else:
             # 返回以符合Gradio的格式要求
-            wav_data = wav.type(torch.int16)
-            wav_data = wav_data.numpy().T
+            wav_data = sink.tensor().numpy().T
             return (sampling_rate, wav_data)
 
 if __name__ == "__main__":
@@ -2,10 +2,9 @@ import os
 from subprocess import CalledProcessError
 
 os.environ['HF_HUB_CACHE'] = './checkpoints/hf_cache'
-import json
-import re
+import math
 import time
-import librosa
+from collections import OrderedDict
 import torch
 import torchaudio
 from torch.nn.utils.rnn import pad_sequence
@@ -18,27 +17,67 @@ warnings.filterwarnings("ignore", category=UserWarning)
 from omegaconf import OmegaConf
 
 from indextts.gpt.model_v2 import UnifiedVoice
+from indextts.pipeline import PipelineStage, StagePipeline
 from indextts.utils.maskgct_utils import build_semantic_model, build_semantic_codec
+from indextts.utils.audio_io import load_audio, load_audio_multi_rate
 from indextts.utils.checkpoint import load_checkpoint
+from indextts.utils.code_postprocess import postprocess_codes
+from indextts.utils.metrics import metrics
+from indextts.utils.qwen_emotion import QwenEmotion
+from indextts.utils.cond_cache import ConditioningCache, model_fingerprint
+from indextts.utils.audio_sink import AudioSink, WavSink, open_sink, stdout_audio
+from indextts.utils.duration_control import DurationPlanner, pad_to_duration
+from indextts.utils.feature_extractors import SeamlessM4TFeatures
 from indextts.utils.front import TextNormalizer, TextTokenizer
+from indextts.utils.token_budget import GenerationGuard, segment_text, segment_token_budget, trim_runaway_codes
+from indextts.voice_library import VoiceLibrary
 
 from indextts.s2mel.modules.commons import load_checkpoint2, MyModel
 from indextts.s2mel.modules.bigvgan import bigvgan
 from indextts.s2mel.modules.campplus.DTDNN import CAMPPlus
 from indextts.s2mel.modules.audio import mel_spectrogram
 
-from transformers import AutoTokenizer
-from modelscope import AutoModelForCausalLM
-from huggingface_hub import hf_hub_download
+from transformers import StoppingCriteriaList
+from huggingface_hub import hf_hub_download, try_to_load_from_cache
 import safetensors
-from transformers import SeamlessM4TFeatureExtractor
 import random
+import shutil
+import tempfile
 import torch.nn.functional as F
 
+# warmup(profile): GPT 解码长度 (codes) 以及 s2mel/BigVGAN 的 mel 帧数
+WARMUP_PROFILES = {
+    "minimal": {"gpt_lengths": [50], "mel_frames": [256]},
+    "default": {"gpt_lengths": [50, 200], "mel_frames": [256, 1024]},
+    "full": {"gpt_lengths": [50, 200, 600], "mel_frames": [256, 1024, 2048]},
+}
+WARMUP_TEXT = "大家好，今天是2025年10月1日。Hello, this is IndexTTS warming up at 3:30 PM."
+
+class RequestContext:
+    """
+    Per-request state of `IndexTTS2.infer`: the progress callback.
+
+    The model modules hold no per-request state (the GPT prefix embeddings are passed to
+    ``generate`` as ``cached_mel_emb``), so several threads can run `infer` on one instance,
+    sharing a single copy of the weights.
+
+    Args:
+        progress: optional ``callable(value, desc=...)``, e.g. a ``gr.Progress``.
+    """
+
+    def __init__(self, progress=None):
+        self.progress = progress
+
+    def set_progress(self, value, desc):
+        if self.progress is not None:
+            self.progress(value, desc=desc)
+
+
 class IndexTTS2:
     def __init__(
             self, cfg_path="checkpoints/config.yaml", model_dir="checkpoints", use_fp16=False, device=None,
-            use_cuda_kernel=None,use_deepspeed=False
+            use_cuda_kernel=None, use_cpu_kernel=True, use_deepspeed=False, cond_cache_size=8, cond_cache_dir=None,
+            pipeline_threads=None, voice_library=None
     ):
         """
         Args:
@@ -47,7 +86,15 @@ class IndexTTS2:
             use_fp16 (bool): whether to use fp16.
             device (str): device to use (e.g., 'cuda:0', 'cpu'). If None, it will be set automatically based on the availability of CUDA or MPS.
             use_cuda_kernel (None | bool): whether to use BigVGan custom fused activation CUDA kernel, only for CUDA device.
+            use_cpu_kernel (bool): whether to build BigVGan custom fused activation C++ kernel, only for CPU device
+                (needs a C++ compiler and ninja, a failed build falls back to torch and is not retried).
             use_deepspeed (bool): whether to use DeepSpeed or not.
+            cond_cache_size (int): number of speaker/emotion prompt conditionings kept in memory.
+            cond_cache_dir (str): optional directory to persist computed prompt conditionings across restarts.
+            pipeline_threads (tuple[int, int, int]): CPU thread budgets of the GPT, s2mel and BigVGAN stages
+                for `infer(..., use_pipeline=True)`. Defaults to a 1:2:1 split of all cores.
+            voice_library (str): optional voice library index (see `indextts.voice_library`), its voice ids
+                can be used instead of the paths of `spk_audio_prompt` / `emo_audio_prompt`.
         """
         if device is not None:
             self.device = device
@@ -75,6 +122,7 @@ class IndexTTS2:
         self.model_dir = model_dir
         self.dtype = torch.float16 if self.use_fp16 else None
         self.stop_mel_token = self.cfg.gpt.stop_mel_token
+        self.model_version = self.cfg.version if hasattr(self.cfg, "version") else None
 
         self.qwen_emo = QwenEmotion(os.path.join(self.model_dir, self.cfg.qwen_emo_path))
 
@@ -108,7 +156,8 @@ class IndexTTS2:
                 print(f"{e!r}")
                 self.use_cuda_kernel = False
 
-        self.extract_features = SeamlessM4TFeatureExtractor.from_pretrained("facebook/w2v-bert-2.0")
+        # w2v-bert 输入特征: torch 实现, 在模型设备上批量计算
+        self.extract_features = SeamlessM4TFeatures.from_pretrained("facebook/w2v-bert-2.0").to(self.device)
         self.semantic_model, self.semantic_mean, self.semantic_std = build_semantic_model(
             os.path.join(self.model_dir, self.cfg.w2v_stat))
         self.semantic_model = self.semantic_model.to(self.device)
@@ -149,7 +198,8 @@ class IndexTTS2:
         print(">> campplus_model weights restored from:", campplus_ckpt_path)
 
         bigvgan_name = self.cfg.vocoder.name
-        self.bigvgan = bigvgan.BigVGAN.from_pretrained(bigvgan_name, use_cuda_kernel=self.use_cuda_kernel)
+        self.bigvgan = bigvgan.BigVGAN.from_pretrained(bigvgan_name, use_cuda_kernel=self.use_cuda_kernel,
+                                                       use_cpu_kernel=use_cpu_kernel)
         self.bigvgan = self.bigvgan.to(self.device)
         self.bigvgan.remove_weight_norm()
         self.bigvgan.eval()
@@ -183,19 +233,30 @@ class IndexTTS2:
             "center": False
         }
         self.mel_fn = lambda x: mel_spectrogram(x, **mel_fn_args)
-
-        # 缓存参考音频：
-        self.cache_spk_cond = None
-        self.cache_s2mel_style = None
-        self.cache_s2mel_prompt = None
-        self.cache_spk_audio_prompt = None
-        self.cache_emo_cond = None
-        self.cache_emo_audio_prompt = None
-        self.cache_mel = None
-
-        # 进度引用显示（可选）
-        self.gr_progress = None
-        self.model_version = self.cfg.version if hasattr(self.cfg, "version") else None
+        self.mel_hop_length = mel_fn_args["hop_size"]
+        # GPT 语义码的帧率: s2mel 把每个码扩展为 1.72 个 mel 帧
+        self.codes_per_second = mel_fn_args["sampling_rate"] / self.mel_hop_length / 1.72
+
+        # 缓存参考音频：按音频内容哈希缓存多个说话人/情感参考的条件特征
+        # 指纹覆盖所有参与计算条件特征的模型权重, 更换其中任何一个都会使缓存和音色库失效
+        fingerprint = model_fingerprint({
+            "gpt": self.gpt_path,
+            "s2mel": s2mel_path,
+            "w2v_bert": _hub_cached_file("facebook/w2v-bert-2.0", "model.safetensors"),
+            "w2v_stat": os.path.join(self.model_dir, self.cfg.w2v_stat),
+            "semantic_codec": semantic_code_ckpt,
+            "campplus": campplus_ckpt_path,
+            "bigvgan": _hub_cached_file(bigvgan_name, "bigvgan_generator.pt"),
+        })
+        self.cond_cache = ConditioningCache(max_entries=cond_cache_size, cache_dir=cond_cache_dir,
+                                            namespace=f"{self.model_version}|{fingerprint}")
+        # 预先计算好的参考音色库：按音色 ID 直接查表，无需编码参考音频
+        self.voice_library = None
+        if voice_library is not None:
+            self.voice_library = VoiceLibrary(voice_library, namespace=self.cond_cache.namespace)
+            print(f">> voice library loaded: {len(self.voice_library)} voices from {voice_library}")
+
+        self.pipeline_threads = pipeline_threads
 
     @torch.no_grad()
     def get_emb(self, input_features, attention_mask):
@@ -213,57 +274,8 @@ class IndexTTS2:
         Shrink special tokens (silent_token and stop_mel_token) in codes
         codes: [B, T]
         """
-        code_lens = []
-        codes_list = []
-        device = codes.device
-        dtype = codes.dtype
-        isfix = False
-        for i in range(0, codes.shape[0]):
-            code = codes[i]
-            if not torch.any(code == self.stop_mel_token).item():
-                len_ = code.size(0)
-            else:
-                stop_mel_idx = (code == self.stop_mel_token).nonzero(as_tuple=False)
-                len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
-
-            count = torch.sum(code == silent_token).item()
-            if count > max_consecutive:
-                # code = code.cpu().tolist()
-                ncode_idx = []
-                n = 0
-                for k in range(len_):
-                    assert code[
-                               k] != self.stop_mel_token, f"stop_mel_token {self.stop_mel_token} should be shrinked here"
-                    if code[k] != silent_token:
-                        ncode_idx.append(k)
-                        n = 0
-                    elif code[k] == silent_token and n < 10:
-                        ncode_idx.append(k)
-                        n += 1
-                    # if (k == 0 and code[k] == 52) or (code[k] == 52 and code[k-1] == 52):
-                    #    n += 1
-                # new code
-                len_ = len(ncode_idx)
-                codes_list.append(code[ncode_idx])
-                isfix = True
-            else:
-                # shrink to len_
-                codes_list.append(code[:len_])
-            code_lens.append(len_)
-        if isfix:
-            if len(codes_list) > 1:
-                codes = pad_sequence(codes_list, batch_first=True, padding_value=self.stop_mel_token)
-            else:
-                codes = codes_list[0].unsqueeze(0)
-        else:
-            # unchanged
-            pass
-        # clip codes to max length
-        max_len = max(code_lens)
-        if max_len < codes.shape[1]:
-            codes = codes[:, :max_len]
-        code_lens = torch.tensor(code_lens, dtype=torch.long, device=device)
-        return codes, code_lens
+        return postprocess_codes(codes, self.stop_mel_token, silent_token=silent_token,
+                                 max_consecutive=max_consecutive)
 
     def interval_silence(self, wavs, sampling_rate=22050, interval_silence=200):
         """
@@ -302,24 +314,334 @@ class IndexTTS2:
 
         return wavs_list
 
-    def _set_gr_progress(self, value, desc):
-        if self.gr_progress is not None:
-            self.gr_progress(value, desc=desc)
-
     def _load_and_cut_audio(self,audio_path,max_audio_length_seconds,verbose=False,sr=None):
-        if not sr:
-            audio, sr = librosa.load(audio_path)
-        else:
-            audio, _ = librosa.load(audio_path,sr=sr)
-        audio = torch.tensor(audio).unsqueeze(0)
-        max_audio_samples = int(max_audio_length_seconds * sr)
-
-        if audio.shape[1] > max_audio_samples:
-            if verbose:
-                print(f"Audio too long ({audio.shape[1]} samples), truncating to {max_audio_samples} samples")
-            audio = audio[:, :max_audio_samples]
+        sr = sr or 22050
+        audio = load_audio(audio_path, sr, max_audio_length_seconds, verbose)
         return audio, sr
     
+    @torch.no_grad()
+    def _get_spk_conditioning(self, spk_audio_prompt, verbose=False, cond_cache=None):
+        """
+        Speaker prompt conditioning: w2v-bert features, reference mel, CAMPPlus style and s2mel prompt condition.
+        """
+        if self.voice_library is not None and spk_audio_prompt in self.voice_library:
+            return self.voice_library.get(spk_audio_prompt, device=self.device)
+        if cond_cache is None:
+            cond_cache = self.cond_cache
+        key = cond_cache.make_key("spk", spk_audio_prompt)
+        bundle = cond_cache.get(key, device=self.device)
+        if bundle is not None:
+            return bundle
+
+        # decode once, truncate at the native rate, then resample to both model rates
+        audios = load_audio_multi_rate(spk_audio_prompt, (22050, 16000), 15, verbose)
+        bundle = self.compute_spk_conditioning(audios[22050], audios[16000])
+        cond_cache.put(key, bundle)
+        return bundle
+
+    @torch.no_grad()
+    def compute_spk_conditioning(self, audio_22k, audio_16k):
+        """
+        Speaker prompt conditioning of an already loaded reference audio.
+
+        Args:
+            audio_22k: [1, N] reference audio at 22050 Hz.
+            audio_16k: the same audio at 16000 Hz.
+        """
+        return self._encode_prompt_batch([(audio_22k, audio_16k)])[0]
+
+    @torch.no_grad()
+    def encode_prompts(self, audios, batch_size=8, verbose=False):
+        """
+        Speaker prompt conditionings of many reference clips at once, e.g. to onboard a set of voices
+        or the speakers of a diarized video.
+
+        Args:
+            audios (list): audio paths (or voice ids of the voice library), or ``(audio_22k, audio_16k)``
+                pairs of [1, N] tensors.
+            batch_size (int): clips encoded together.
+
+        Returns:
+            one bundle per clip, as `compute_spk_conditioning`. Bundles of paths are cached as
+            the ones of `infer`.
+        """
+        bundles = [None] * len(audios)
+        pending = []  # (index, cache key, audio_22k, audio_16k)
+        for i, audio in enumerate(audios):
+            if not isinstance(audio, str):
+                pending.append((i, None, audio[0], audio[1]))
+                continue
+            if self.voice_library is not None and audio in self.voice_library:
+                bundles[i] = self.voice_library.get(audio, device=self.device)
+                continue
+            key = self.cond_cache.make_key("spk", audio)
+            bundles[i] = self.cond_cache.get(key, device=self.device)
+            if bundles[i] is None:
+                audios_multi_rate = load_audio_multi_rate(audio, (22050, 16000), 15, verbose)
+                pending.append((i, key, audios_multi_rate[22050], audios_multi_rate[16000]))
+
+        # batches of similar lengths, little padding
+        pending.sort(key=lambda item: item[3].shape[-1])
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            with metrics.span("encode_prompts", clips=len(batch)):
+                batch_bundles = self._encode_prompt_batch([(audio_22k, audio_16k) for _, _, audio_22k, audio_16k in batch])
+            for (i, key, _, _), bundle in zip(batch, batch_bundles):
+                if key is not None:
+                    self.cond_cache.put(key, bundle)
+                bundles[i] = bundle
+        return bundles
+
+    def _encode_prompt_batch(self, clips):
+        """
+        Prompt conditionings of ``[(audio_22k, audio_16k), ...]``.
+
+        w2v-bert, the bulk of the cost, runs on the padded batch with its attention mask. The semantic
+        codec (convolutions), CAMPPlus (global pooling) and the length regulator (interpolation to the
+        longest length) have no padding mask, they run batched over clips of the same length only, so
+        every bundle is the one of the clip encoded alone.
+        """
+        inputs = self.extract_features([audio_16k[0] for _, audio_16k in clips], sampling_rate=16000)
+        # 单条编码时的特征帧数 (奇数帧时多一帧补齐)
+        feature_lengths = [self.extract_features.num_output_frames(audio_16k.shape[-1]) for _, audio_16k in clips]
+        spk_cond_embs = self.get_emb(inputs["input_features"], inputs["attention_mask"])
+
+        groups = OrderedDict()
+        for j, (audio_22k, audio_16k) in enumerate(clips):
+            groups.setdefault((audio_22k.shape[-1], audio_16k.shape[-1]), []).append(j)
+        bundles = [None] * len(clips)
+        for members in groups.values():
+            spk_cond_emb = spk_cond_embs[members, :feature_lengths[members[0]]]
+            semantic_codes, S_ref = self.semantic_codec.quantize(spk_cond_emb)
+            if semantic_codes.dim() == 3:  # [n_q, B, T]
+                semantic_codes = semantic_codes.transpose(0, 1)
+            audio_22k = torch.cat([clips[j][0] for j in members]).to(spk_cond_emb.device).float()
+            ref_mel = self.mel_fn(audio_22k)
+            ref_target_lengths = torch.LongTensor([ref_mel.size(2)] * len(members)).to(ref_mel.device)
+            feats = []
+            for j in members:
+                feat = torchaudio.compliance.kaldi.fbank(clips[j][1].to(ref_mel.device),
+                                                         num_mel_bins=80,
+                                                         dither=0,
+                                                         sample_frequency=16000)
+                feats.append(feat - feat.mean(dim=0, keepdim=True))  # feat2另外一个滤波器能量组特征[922, 80]
+            style = self.campplus_model(torch.stack(feats))  # 参考音频的全局style2[B,192]
+
+            prompt_condition = self.s2mel.models['length_regulator'](S_ref,
+                                                                     ylens=ref_target_lengths,
+                                                                     n_quantizers=3,
+                                                                     f0=None)[0]
+            for k, j in enumerate(members):
+                # clone: a view would keep (and persist, in the disk cache) the whole batch
+                bundles[j] = {
+                    "spk_cond_emb": spk_cond_emb[k:k + 1].clone(),
+                    "style": style[k:k + 1].clone(),
+                    "prompt_condition": prompt_condition[k:k + 1].clone(),
+                    "ref_mel": ref_mel[k:k + 1].clone(),
+                    "semantic_codes": semantic_codes[k:k + 1].clone(),
+                }
+        return bundles
+
+    @torch.no_grad()
+    def _get_emo_conditioning(self, emo_audio_prompt, verbose=False, cond_cache=None):
+        """
+        Emotion prompt conditioning: w2v-bert features of the emotion reference audio.
+        """
+        if self.voice_library is not None and emo_audio_prompt in self.voice_library:
+            # 情感参考与说话人参考使用同一个 w2v-bert 特征
+            return self.voice_library.get(emo_audio_prompt, device=self.device)["spk_cond_emb"]
+        if cond_cache is None:
+            cond_cache = self.cond_cache
+        key = cond_cache.make_key("emo", emo_audio_prompt)
+        bundle = cond_cache.get(key, device=self.device)
+        if bundle is not None:
+            return bundle["emo_cond_emb"]
+
+        emo_audio, _ = self._load_and_cut_audio(emo_audio_prompt,15,verbose,sr=16000)
+        emo_inputs = self.extract_features(emo_audio, sampling_rate=16000)
+        emo_cond_emb = self.get_emb(emo_inputs["input_features"], emo_inputs["attention_mask"])
+
+        cond_cache.put(key, {"emo_cond_emb": emo_cond_emb})
+        return emo_cond_emb
+
+    @torch.no_grad()
+    def prepare_conditioning(self, spk_audio_prompt, emo_audio_prompt=None, emo_alpha=1.0, emo_vector=None,
+                             use_emo_text=False, emo_text=None, use_random=False, verbose=False, cond_cache=None):
+        """
+        Speaker and emotion conditioning of one request, shared by all of its text segments.
+        The prompt encodings are looked up in (and added to) ``cond_cache``, ``self.cond_cache`` by default.
+
+        Returns:
+            dict with the speaker prompt bundle (``spk_cond_emb``, ``style``, ``prompt_condition``, ``ref_mel``),
+            ``emo_cond_emb``, the merged emotion vector ``emovec`` and the GPT conditioning latents
+            ``speech_conditioning_latent`` / ``conds_latent``.
+        """
+        if use_emo_text or emo_vector is not None:
+            # we're using a text or emotion vector guidance; so we must remove
+            # "emotion reference voice", to ensure we use correct emotion mixing!
+            emo_audio_prompt = None
+
+        if use_emo_text:
+            # automatically generate emotion vectors from text prompt
+            emo_dict = self.qwen_emo.inference(emo_text)
+            print(f"detected emotion vectors from text: {emo_dict}")
+            # convert ordered dict to list of vectors; the order is VERY important!
+            emo_vector = list(emo_dict.values())
+
+        if emo_vector is not None:
+            # we have emotion vectors; they can't be blended via alpha mixing
+            # in the main inference process later, so we must pre-calculate
+            # their new strengths here based on the alpha instead!
+            emo_vector_scale = max(0.0, min(1.0, emo_alpha))
+            if emo_vector_scale != 1.0:
+                # scale each vector and truncate to 4 decimals (for nicer printing)
+                emo_vector = [int(x * emo_vector_scale * 10000) / 10000 for x in emo_vector]
+                print(f"scaled emotion vectors to {emo_vector_scale}x: {emo_vector}")
+
+        if emo_audio_prompt is None:
+            # we are not using any external "emotion reference voice"; use
+            # speaker's voice as the main emotion reference audio.
+            emo_audio_prompt = spk_audio_prompt
+            # must always use alpha=1.0 when we don't have an external reference voice
+            emo_alpha = 1.0
+
+        # 如果参考音频改变了，才需要重新生成, 提升速度
+        spk_cond = self._get_spk_conditioning(spk_audio_prompt, verbose, cond_cache=cond_cache)
+        style = spk_cond["style"]
+        spk_cond_emb = spk_cond["spk_cond_emb"]
+
+        if emo_vector is not None:
+            weight_vector = torch.tensor(emo_vector).to(self.device)
+            if use_random:
+                random_index = [random.randint(0, x - 1) for x in self.emo_num]
+            else:
+                random_index = [find_most_similar_cosine(style, tmp) for tmp in self.spk_matrix]
+
+            emo_matrix = [tmp[index].unsqueeze(0) for index, tmp in zip(random_index, self.emo_matrix)]
+            emo_matrix = torch.cat(emo_matrix, 0)
+            emovec_mat = weight_vector.unsqueeze(1) * emo_matrix
+            emovec_mat = torch.sum(emovec_mat, 0)
+            emovec_mat = emovec_mat.unsqueeze(0)
+
+        emo_cond_emb = self._get_emo_conditioning(emo_audio_prompt, verbose, cond_cache=cond_cache)
+
+        device_type = torch.device(self.device).type
+        cond_lengths = torch.tensor([spk_cond_emb.shape[-1]], device=spk_cond_emb.device)
+        emo_cond_lengths = torch.tensor([emo_cond_emb.shape[-1]], device=spk_cond_emb.device)
+        with torch.amp.autocast(device_type, enabled=self.dtype is not None, dtype=self.dtype):
+            emovec = self.gpt.merge_emovec(
+                spk_cond_emb,
+                emo_cond_emb,
+                cond_lengths,
+                emo_cond_lengths,
+                alpha=emo_alpha
+            )
+
+            if emo_vector is not None:
+                emovec = emovec_mat + (1 - torch.sum(weight_vector)) * emovec
+                # emovec = emovec_mat
+
+            speech_conditioning_latent = self.gpt.get_conditioning(spk_cond_emb.transpose(1, 2), cond_lengths)
+            # same layout as `UnifiedVoice.inference_speech`: [spk latents + emovec][speed half][speed]
+            zero = torch.zeros(1, dtype=torch.long, device=spk_cond_emb.device)
+            conds_latent = torch.cat((speech_conditioning_latent + emovec.unsqueeze(1),
+                                      self.gpt.speed_emb(zero + 1).unsqueeze(1),
+                                      self.gpt.speed_emb(zero).unsqueeze(1)), 1)
+
+        cond = dict(spk_cond)
+        cond.update(
+            emo_cond_emb=emo_cond_emb,
+            emovec=emovec,
+            speech_conditioning_latent=speech_conditioning_latent,
+            conds_latent=conds_latent,
+        )
+        return cond
+
+    @torch.no_grad()
+    def _gpt_latent(self, cond, text_tokens, codes):
+        """
+        GPT forward pass over the generated codes, returns the latent used by s2mel.
+        """
+        spk_cond_emb = cond["spk_cond_emb"]
+        emo_cond_emb = cond["emo_cond_emb"]
+        use_speed = torch.zeros(spk_cond_emb.size(0)).to(spk_cond_emb.device).long()
+        with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+            return self.gpt(
+                cond["speech_conditioning_latent"],
+                text_tokens,
+                torch.tensor([text_tokens.shape[-1]], device=text_tokens.device),
+                codes,
+                torch.tensor([codes.shape[-1]], device=text_tokens.device),
+                emo_cond_emb,
+                cond_mel_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
+                emo_cond_mel_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
+                emo_vec=cond["emovec"],
+                use_speed=use_speed,
+            )
+
+    @torch.no_grad()
+    def _s2mel(self, cond, latents, codes_list, code_lens_list, diffusion_steps=25, inference_cfg_rate=0.7,
+               target_lengths_list=None):
+        """
+        Semantic-to-mel stage for a batch of segments sharing the same speaker prompt.
+        The flow matching runs once for the whole batch, rows are masked by their lengths.
+
+        Args:
+            target_lengths_list: mel frame count of each segment (duration control),
+                by default 1.72 frames per code.
+
+        Returns:
+            list of mel spectrograms [1, 80, T_i], without the prompt part.
+        """
+        prompt_condition = cond["prompt_condition"]
+        ref_mel = cond["ref_mel"]
+        style = cond["style"]
+        cat_conditions = []
+        for i, (latent, codes, code_lens) in enumerate(zip(latents, codes_list, code_lens_list)):
+            latent = self.s2mel.models['gpt_layer'](latent)
+            S_infer = self.semantic_codec.quantizer.vq2emb(codes.unsqueeze(1))
+            S_infer = S_infer.transpose(1, 2)
+            S_infer = S_infer + latent
+            if target_lengths_list is not None and target_lengths_list[i] is not None:
+                target_lengths = torch.as_tensor(target_lengths_list[i], device=code_lens.device).long().reshape(-1)
+            else:
+                target_lengths = (code_lens * 1.72).long()
+
+            seg_cond = self.s2mel.models['length_regulator'](S_infer,
+                                                             ylens=target_lengths,
+                                                             n_quantizers=3,
+                                                             f0=None)[0]
+            cat_conditions.append(torch.cat([prompt_condition, seg_cond], dim=1).squeeze(0))
+        batch_size = len(cat_conditions)
+        x_lens = torch.LongTensor([c.size(0) for c in cat_conditions]).to(prompt_condition.device)
+        cat_condition = pad_sequence(cat_conditions, batch_first=True)
+        vc_target = self.s2mel.models['cfm'].inference(cat_condition,
+                                                       x_lens,
+                                                       ref_mel.expand(batch_size, -1, -1),
+                                                       style.expand(batch_size, -1),
+                                                       None, diffusion_steps,
+                                                       inference_cfg_rate=inference_cfg_rate)
+        ref_len = ref_mel.size(-1)
+        return [vc_target[i:i + 1, :, ref_len:x_lens[i]] for i in range(batch_size)]
+
+    @torch.no_grad()
+    def _vocode(self, mels):
+        """
+        BigVGAN stage for a batch of mel spectrograms [1, 80, T_i].
+
+        Returns:
+            list of waveforms [1, T_i * hop_length], scaled to the int16 range.
+        """
+        if len(mels) == 1:
+            wavs = [self.bigvgan(mels[0].float()).squeeze().unsqueeze(0)]
+        else:
+            max_len = max(m.size(-1) for m in mels)
+            # pad with the log-mel floor (silence)
+            batch = torch.cat([F.pad(m.float(), (0, max_len - m.size(-1)), value=math.log(1e-5)) for m in mels])
+            out = self.bigvgan(batch)
+            wavs = [out[i, :, :m.size(-1) * self.mel_hop_length] for i, m in enumerate(mels)]
+        return [torch.clamp(32767 * wav, -32767.0, 32767.0) for wav in wavs]
+
     def normalize_emo_vec(self, emo_vector, apply_bias=True):
         # apply biased emotion factors for better user experience,
         # by de-emphasizing emotions that can cause strange results
@@ -336,6 +658,86 @@ class IndexTTS2:
 
         return emo_vector
 
+    @torch.no_grad()
+    def warmup(self, profile="default", spk_audio_prompt=None, num_beams=3, diffusion_steps=25):
+        """
+        Run representative shapes through every stage once (text normalizer, prompt encoders,
+        GPT decode, s2mel, BigVGAN), so that the first request doesn't pay for the lazy
+        initializations: kernel selection, normalizer caches and first allocations.
+        Call it before accepting requests (it doesn't change any state shared with them, but
+        requests served meanwhile would pay for the lazy initializations).
+
+        Args:
+            profile: a key of ``WARMUP_PROFILES``, or a dict with the GPT decode lengths
+                (``gpt_lengths``) and the mel frame counts of s2mel and BigVGAN (``mel_frames``).
+            spk_audio_prompt: voice to warm up with, its conditioning stays cached.
+                By default a synthetic voice, which is not cached.
+        Returns:
+            dict of warm-up seconds per stage.
+        """
+        if isinstance(profile, str):
+            if profile not in WARMUP_PROFILES:
+                raise ValueError(f"unknown warm-up profile {profile!r}, expected one of {list(WARMUP_PROFILES)}")
+            profile = WARMUP_PROFILES[profile]
+        timings = {}
+
+        def timed(stage, fn):
+            start = time.perf_counter()
+            with metrics.span("warmup", stage=stage):
+                result = fn()
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+            return result
+
+        start_time = time.perf_counter()
+        text_tokens_list = timed("text", lambda: self.tokenizer.tokenize(WARMUP_TEXT))
+        text_tokens = torch.tensor(self.tokenizer.convert_tokens_to_ids(text_tokens_list),
+                                   dtype=torch.int32, device=self.device).unsqueeze(0)
+
+        cond_cache = None
+        tmp_dir = None
+        if spk_audio_prompt is None:
+            # 合成的参考音频 (带颤音的谐波 + 噪声), 其条件特征不写入缓存
+            tmp_dir = tempfile.mkdtemp(prefix="indextts_warmup_")
+            spk_audio_prompt = os.path.join(tmp_dir, "voice.wav")
+            t = torch.arange(3 * 22050) / 22050
+            f0 = 140 * (1 + 0.05 * torch.sin(2 * math.pi * 5 * t))
+            phase = 2 * math.pi * torch.cumsum(f0, 0) / 22050
+            voice = sum(torch.sin(k * phase) / k for k in range(1, 6)) * (0.6 + 0.4 * torch.sin(2 * math.pi * 3 * t))
+            voice = voice + 0.01 * torch.randn(t.shape, generator=torch.Generator().manual_seed(0))
+            with WavSink(spk_audio_prompt, 22050) as sink:
+                sink.write(8000 * voice.unsqueeze(0))
+            # 合成音色只写入临时缓存, 不替换共享的 self.cond_cache
+            cond_cache = ConditioningCache(max_entries=2)
+        try:
+            cond = timed("conditioning", lambda: self.prepare_conditioning(spk_audio_prompt, cond_cache=cond_cache))
+            spk_cond_emb = cond["spk_cond_emb"]
+            emo_cond_emb = cond["emo_cond_emb"]
+
+            def gpt_decode(length):
+                with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    codes, _ = self.gpt.inference_speech(
+                        spk_cond_emb, text_tokens, emo_cond_emb,
+                        cond_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
+                        emo_cond_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
+                        emo_vec=cond["emovec"], do_sample=True, top_p=0.8, top_k=30, temperature=0.8,
+                        num_return_sequences=1, length_penalty=0.0, num_beams=num_beams, repetition_penalty=10.0,
+                        max_generate_length=length, min_new_tokens=length)
+                codes, code_lens = postprocess_codes(codes, self.stop_mel_token, max_consecutive=None)
+                return codes, code_lens, self._gpt_latent(cond, text_tokens, codes)
+
+            for length in profile["gpt_lengths"]:
+                codes, code_lens, latent = timed("gpt", lambda: gpt_decode(length))
+            for frames in profile["mel_frames"]:
+                mel = timed("s2mel", lambda: self._s2mel(cond, [latent], [codes], [code_lens], diffusion_steps,
+                                                         target_lengths_list=[frames])[0])
+                timed("vocoder", lambda: self._vocode([mel]))
+        finally:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        print(f">> warm-up done in {time.perf_counter() - start_time:.2f} seconds: "
+              + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()))
+        return timings
+
     # 原始推理模式
     def infer(self, spk_audio_prompt, text, output_path,
               emo_audio_prompt=None, emo_alpha=1.0,
@@ -362,13 +764,24 @@ class IndexTTS2:
             except IndexError:
                 return None
 
+    @stdout_audio
     def infer_generator(self, spk_audio_prompt, text, output_path,
               emo_audio_prompt=None, emo_alpha=1.0,
               emo_vector=None,
               use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
-              verbose=False, max_text_tokens_per_segment=120, stream_return=False, quick_streaming_tokens=0, **generation_kwargs):
+              verbose=False, max_text_tokens_per_segment=120, stream_return=False, quick_streaming_tokens=0,
+              use_pipeline=False, text_segments=None, progress=None, **generation_kwargs):
+        """
+        Args:
+            text_segments: already tokenized segments (lists of text tokens) to synthesize instead of
+                splitting ``text``, e.g. from the plan of a long-form job (see ``indextts.longform``).
+            progress: optional ``callable(value, desc=...)`` reporting the progress of this request
+                (e.g. ``gr.Progress``).
+        """
+        # 每个请求独立的上下文, 多线程并发调用 infer 时互不干扰
+        ctx = RequestContext(progress)
         print(">> starting inference...")
-        self._set_gr_progress(0, "starting inference...")
+        ctx.set_progress(0, "starting inference...")
         if verbose:
             print(f"origin text:{text}, spk_audio_prompt:{spk_audio_prompt}, "
                   f"emo_audio_prompt:{emo_audio_prompt}, emo_alpha:{emo_alpha}, "
@@ -376,115 +789,21 @@ class IndexTTS2:
                   f"emo_text:{emo_text}")
         start_time = time.perf_counter()
 
-        if use_emo_text or emo_vector is not None:
-            # we're using a text or emotion vector guidance; so we must remove
-            # "emotion reference voice", to ensure we use correct emotion mixing!
-            emo_audio_prompt = None
-
-        if use_emo_text:
-            # automatically generate emotion vectors from text prompt
-            if emo_text is None:
-                emo_text = text  # use main text prompt
-            emo_dict = self.qwen_emo.inference(emo_text)
-            print(f"detected emotion vectors from text: {emo_dict}")
-            # convert ordered dict to list of vectors; the order is VERY important!
-            emo_vector = list(emo_dict.values())
-
-        if emo_vector is not None:
-            # we have emotion vectors; they can't be blended via alpha mixing
-            # in the main inference process later, so we must pre-calculate
-            # their new strengths here based on the alpha instead!
-            emo_vector_scale = max(0.0, min(1.0, emo_alpha))
-            if emo_vector_scale != 1.0:
-                # scale each vector and truncate to 4 decimals (for nicer printing)
-                emo_vector = [int(x * emo_vector_scale * 10000) / 10000 for x in emo_vector]
-                print(f"scaled emotion vectors to {emo_vector_scale}x: {emo_vector}")
-
-        if emo_audio_prompt is None:
-            # we are not using any external "emotion reference voice"; use
-            # speaker's voice as the main emotion reference audio.
-            emo_audio_prompt = spk_audio_prompt
-            # must always use alpha=1.0 when we don't have an external reference voice
-            emo_alpha = 1.0
-
-        # 如果参考音频改变了，才需要重新生成, 提升速度
-        if self.cache_spk_cond is None or self.cache_spk_audio_prompt != spk_audio_prompt:
-            if self.cache_spk_cond is not None:
-                self.cache_spk_cond = None
-                self.cache_s2mel_style = None
-                self.cache_s2mel_prompt = None
-                self.cache_mel = None
-                torch.cuda.empty_cache()
-            audio,sr = self._load_and_cut_audio(spk_audio_prompt,15,verbose)
-            audio_22k = torchaudio.transforms.Resample(sr, 22050)(audio)
-            audio_16k = torchaudio.transforms.Resample(sr, 16000)(audio)
-
-            inputs = self.extract_features(audio_16k, sampling_rate=16000, return_tensors="pt")
-            input_features = inputs["input_features"]
-            attention_mask = inputs["attention_mask"]
-            input_features = input_features.to(self.device)
-            attention_mask = attention_mask.to(self.device)
-            spk_cond_emb = self.get_emb(input_features, attention_mask)
-
-            _, S_ref = self.semantic_codec.quantize(spk_cond_emb)
-            ref_mel = self.mel_fn(audio_22k.to(spk_cond_emb.device).float())
-            ref_target_lengths = torch.LongTensor([ref_mel.size(2)]).to(ref_mel.device)
-            feat = torchaudio.compliance.kaldi.fbank(audio_16k.to(ref_mel.device),
-                                                     num_mel_bins=80,
-                                                     dither=0,
-                                                     sample_frequency=16000)
-            feat = feat - feat.mean(dim=0, keepdim=True)  # feat2另外一个滤波器能量组特征[922, 80]
-            style = self.campplus_model(feat.unsqueeze(0))  # 参考音频的全局style2[1,192]
-
-            prompt_condition = self.s2mel.models['length_regulator'](S_ref,
-                                                                     ylens=ref_target_lengths,
-                                                                     n_quantizers=3,
-                                                                     f0=None)[0]
-
-            self.cache_spk_cond = spk_cond_emb
-            self.cache_s2mel_style = style
-            self.cache_s2mel_prompt = prompt_condition
-            self.cache_spk_audio_prompt = spk_audio_prompt
-            self.cache_mel = ref_mel
-        else:
-            style = self.cache_s2mel_style
-            prompt_condition = self.cache_s2mel_prompt
-            spk_cond_emb = self.cache_spk_cond
-            ref_mel = self.cache_mel
-
-        if emo_vector is not None:
-            weight_vector = torch.tensor(emo_vector).to(self.device)
-            if use_random:
-                random_index = [random.randint(0, x - 1) for x in self.emo_num]
-            else:
-                random_index = [find_most_similar_cosine(style, tmp) for tmp in self.spk_matrix]
-
-            emo_matrix = [tmp[index].unsqueeze(0) for index, tmp in zip(random_index, self.emo_matrix)]
-            emo_matrix = torch.cat(emo_matrix, 0)
-            emovec_mat = weight_vector.unsqueeze(1) * emo_matrix
-            emovec_mat = torch.sum(emovec_mat, 0)
-            emovec_mat = emovec_mat.unsqueeze(0)
-
-        if self.cache_emo_cond is None or self.cache_emo_audio_prompt != emo_audio_prompt:
-            if self.cache_emo_cond is not None:
-                self.cache_emo_cond = None
-                torch.cuda.empty_cache()
-            emo_audio, _ = self._load_and_cut_audio(emo_audio_prompt,15,verbose,sr=16000)
-            emo_inputs = self.extract_features(emo_audio, sampling_rate=16000, return_tensors="pt")
-            emo_input_features = emo_inputs["input_features"]
-            emo_attention_mask = emo_inputs["attention_mask"]
-            emo_input_features = emo_input_features.to(self.device)
-            emo_attention_mask = emo_attention_mask.to(self.device)
-            emo_cond_emb = self.get_emb(emo_input_features, emo_attention_mask)
-
-            self.cache_emo_cond = emo_cond_emb
-            self.cache_emo_audio_prompt = emo_audio_prompt
+        with metrics.span("conditioning"):
+            cond = self.prepare_conditioning(spk_audio_prompt, emo_audio_prompt, emo_alpha,
+                                             emo_vector, use_emo_text, emo_text or text,
+                                             use_random, verbose)
+        spk_cond_emb = cond["spk_cond_emb"]
+        emo_cond_emb = cond["emo_cond_emb"]
+        emovec = cond["emovec"]
+
+        ctx.set_progress(0.1, "text processing...")
+        if text_segments is None:
+            text_tokens_list = self.tokenizer.tokenize(text)
+            segments = self.tokenizer.split_segments(text_tokens_list, max_text_tokens_per_segment, quick_streaming_tokens = quick_streaming_tokens)
         else:
-            emo_cond_emb = self.cache_emo_cond
-
-        self._set_gr_progress(0.1, "text processing...")
-        text_tokens_list = self.tokenizer.tokenize(text)
-        segments = self.tokenizer.split_segments(text_tokens_list, max_text_tokens_per_segment, quick_streaming_tokens = quick_streaming_tokens)
+            segments = [list(sent) for sent in text_segments]
+            text_tokens_list = [token for sent in segments for token in sent]
         segments_count = len(segments)
 
         text_token_ids = self.tokenizer.convert_tokens_to_ids(text_tokens_list)
@@ -507,19 +826,34 @@ class IndexTTS2:
         num_beams = generation_kwargs.pop("num_beams", 3)
         repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
         max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 1500)
+        # 每段的 token 预算 (按文本时长估计), 以及重复循环检测, 设为 0/None 关闭
+        token_budget_margin = generation_kwargs.pop("token_budget_margin", 1.5)
+        loop_detection_seconds = generation_kwargs.pop("loop_detection_seconds", 3.0)
+        loop_min_span = int(loop_detection_seconds * self.codes_per_second) if loop_detection_seconds else 0
+        # 时长控制: 整个输出 (含段间静音) 的目标时长 (秒), 例如字幕的时间槽
+        target_duration = generation_kwargs.pop("target_duration", None)
+        duration_tolerance = generation_kwargs.pop("duration_tolerance", 0.1)
+        duration_speed_range = generation_kwargs.pop("duration_speed_range", (0.5, 2.0))
         sampling_rate = 22050
 
-        wavs = []
+        planner = None
+        if target_duration:
+            silences = segments_count if stream_return else max(segments_count - 1, 0)
+            silence_seconds = silences * int(sampling_rate * max(interval_silence, 0) / 1000.0) / sampling_rate
+            planner = DurationPlanner(target_duration, [len(sent) for sent in segments],
+                                      sampling_rate / self.mel_hop_length, fixed_seconds=silence_seconds,
+                                      speed_range=duration_speed_range)
+
         gpt_gen_time = 0
         gpt_forward_time = 0
         s2mel_time = 0
         bigvgan_time = 0
         has_warned = False
         silence = None # for stream_return
-        for seg_idx, sent in enumerate(segments):
-            self._set_gr_progress(0.2 + 0.7 * seg_idx / segments_count,
-                                  f"speech synthesis {seg_idx + 1}/{segments_count}...")
 
+        def gpt_stage(item):
+            nonlocal gpt_gen_time, gpt_forward_time, has_warned
+            seg_idx, sent = item
             text_tokens = self.tokenizer.convert_tokens_to_ids(sent)
             text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=self.device).unsqueeze(0)
             if verbose:
@@ -529,21 +863,15 @@ class IndexTTS2:
                 text_token_syms = self.tokenizer.convert_ids_to_tokens(text_tokens[0].tolist())
                 print("text_token_syms is same as segment tokens", text_token_syms == sent)
 
+            budget = max_mel_tokens
+            if token_budget_margin:
+                budget = segment_token_budget(segment_text(sent), self.codes_per_second, margin=token_budget_margin,
+                                              max_tokens=max_mel_tokens)
+            guard = GenerationGuard([budget], min_span=loop_min_span)
+
             m_start_time = time.perf_counter()
             with torch.no_grad():
                 with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                    emovec = self.gpt.merge_emovec(
-                        spk_cond_emb,
-                        emo_cond_emb,
-                        torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
-                        alpha=emo_alpha
-                    )
-
-                    if emo_vector is not None:
-                        emovec = emovec_mat + (1 - torch.sum(weight_vector)) * emovec
-                        # emovec = emovec_mat
-
                     codes, speech_conditioning_latent = self.gpt.inference_speech(
                         spk_cond_emb,
                         text_tokens,
@@ -559,12 +887,22 @@ class IndexTTS2:
                         length_penalty=length_penalty,
                         num_beams=num_beams,
                         repetition_penalty=repetition_penalty,
-                        max_generate_length=max_mel_tokens,
+                        max_generate_length=budget,
+                        stopping_criteria=StoppingCriteriaList([guard]),
                         **generation_kwargs
                     )
 
-                gpt_gen_time += time.perf_counter() - m_start_time
-                if not has_warned and (codes[:, -1] != self.stop_mel_token).any():
+                m_end_time = time.perf_counter()
+                gpt_gen_time += m_end_time - m_start_time
+                metrics.record_span("gpt_decode", m_start_time, m_end_time, segment=seg_idx, tokens=codes.shape[-1])
+                metrics.observe("gpt_decode_tokens_per_second", codes.shape[-1] / max(m_end_time - m_start_time, 1e-9))
+                metrics.inc("gpt_tokens", codes.shape[-1])
+                codes, reasons = trim_runaway_codes(codes, self.stop_mel_token, [budget], min_span=loop_min_span)
+                if reasons[0] == "loop" or (reasons[0] == "budget" and budget < max_mel_tokens):
+                    print(f">> segment {seg_idx}: generation stopped by the {reasons[0]} guard after "
+                          f"{codes.shape[-1]} codes (budget: {budget})")
+                    metrics.inc("gpt_guard_stops", reason=reasons[0])
+                elif not has_warned and (codes[:, -1] != self.stop_mel_token).any():
                     warnings.warn(
                         f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
                         f"Input text tokens: {text_tokens.shape[1]}. "
@@ -573,92 +911,110 @@ class IndexTTS2:
                     )
                     has_warned = True
 
-                code_lens = torch.tensor([codes.shape[-1]], device=codes.device, dtype=codes.dtype)
-                #                 if verbose:
-                #                     print(codes, type(codes))
-                #                     print(f"codes shape: {codes.shape}, codes type: {codes.dtype}")
-                #                     print(f"code len: {code_lens}")
-
-                code_lens = []
-                for code in codes:
-                    if self.stop_mel_token not in code:
-                        code_lens.append(len(code))
-                        code_len = len(code)
-                    else:
-                        len_ = (code == self.stop_mel_token).nonzero(as_tuple=False)[0] + 1
-                        code_len = len_ - 1
-                    code_lens.append(code_len)
-                codes = codes[:, :code_len]
-                code_lens = torch.LongTensor(code_lens)
-                code_lens = code_lens.to(self.device)
+                # trim each row at its first stop token
+                codes, code_lens = postprocess_codes(codes, self.stop_mel_token, max_consecutive=None)
                 if verbose:
                     print(codes, type(codes))
                     print(f"fix codes shape: {codes.shape}, codes type: {codes.dtype}")
                     print(f"code len: {code_lens}")
 
                 m_start_time = time.perf_counter()
-                use_speed = torch.zeros(spk_cond_emb.size(0)).to(spk_cond_emb.device).long()
-                with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                    latent = self.gpt(
-                        speech_conditioning_latent,
-                        text_tokens,
-                        torch.tensor([text_tokens.shape[-1]], device=text_tokens.device),
-                        codes,
-                        torch.tensor([codes.shape[-1]], device=text_tokens.device),
-                        emo_cond_emb,
-                        cond_mel_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_cond_mel_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_vec=emovec,
-                        use_speed=use_speed,
-                    )
-                    gpt_forward_time += time.perf_counter() - m_start_time
-
-                dtype = None
-                with torch.amp.autocast(text_tokens.device.type, enabled=dtype is not None, dtype=dtype):
-                    m_start_time = time.perf_counter()
-                    diffusion_steps = 25
-                    inference_cfg_rate = 0.7
-                    latent = self.s2mel.models['gpt_layer'](latent)
-                    S_infer = self.semantic_codec.quantizer.vq2emb(codes.unsqueeze(1))
-                    S_infer = S_infer.transpose(1, 2)
-                    S_infer = S_infer + latent
-                    target_lengths = (code_lens * 1.72).long()
-
-                    cond = self.s2mel.models['length_regulator'](S_infer,
-                                                                 ylens=target_lengths,
-                                                                 n_quantizers=3,
-                                                                 f0=None)[0]
-                    cat_condition = torch.cat([prompt_condition, cond], dim=1)
-                    vc_target = self.s2mel.models['cfm'].inference(cat_condition,
-                                                                   torch.LongTensor([cat_condition.size(1)]).to(
-                                                                       cond.device),
-                                                                   ref_mel, style, None, diffusion_steps,
-                                                                   inference_cfg_rate=inference_cfg_rate)
-                    vc_target = vc_target[:, :, ref_mel.size(-1):]
-                    s2mel_time += time.perf_counter() - m_start_time
-
-                    m_start_time = time.perf_counter()
-                    wav = self.bigvgan(vc_target.float()).squeeze().unsqueeze(0)
-                    print(wav.shape)
-                    bigvgan_time += time.perf_counter() - m_start_time
-                    wav = wav.squeeze(1)
-
-                wav = torch.clamp(32767 * wav, -32767.0, 32767.0)
-                if verbose:
-                    print(f"wav shape: {wav.shape}", "min:", wav.min(), "max:", wav.max())
-                # wavs.append(wav[:, :-512])
-                wavs.append(wav.cpu())  # to cpu before saving
+                latent = self._gpt_latent(cond, text_tokens, codes)
+                m_end_time = time.perf_counter()
+                gpt_forward_time += m_end_time - m_start_time
+                metrics.record_span("gpt_forward", m_start_time, m_end_time, segment=seg_idx)
+            return seg_idx, latent, codes, code_lens
+
+        def s2mel_stage(item):
+            nonlocal s2mel_time
+            seg_idx, latent, codes, code_lens = item
+            target_lengths = None
+            if planner is not None:
+                # segments reach this stage in order (also in the pipeline), see DurationPlanner
+                target_lengths = planner.segment_frames(seg_idx, int(code_lens[0]))
+            m_start_time = time.perf_counter()
+            vc_target = self._s2mel(cond, [latent], [codes], [code_lens], target_lengths_list=[target_lengths])[0]
+            m_end_time = time.perf_counter()
+            s2mel_time += m_end_time - m_start_time
+            metrics.record_span("cfm", m_start_time, m_end_time, frames=vc_target.shape[-1])
+            return vc_target
+
+        def vocoder_stage(vc_target):
+            nonlocal bigvgan_time
+            m_start_time = time.perf_counter()
+            wav = self._vocode([vc_target])[0]
+            m_end_time = time.perf_counter()
+            bigvgan_time += m_end_time - m_start_time
+            metrics.record_span("vocoder", m_start_time, m_end_time, samples=wav.shape[-1])
+            if verbose:
+                print(f"wav shape: {wav.shape}", "min:", wav.min(), "max:", wav.max())
+            return wav.cpu()  # to cpu before saving
+
+        pipeline = None
+        if use_pipeline and segments_count > 1:
+            # segment i+1 runs the GPT while segment i is in the CFM or the vocoder
+            threads = self.pipeline_threads or StagePipeline.split_threads((1, 2, 1))
+            pipeline = StagePipeline([
+                PipelineStage("gpt", gpt_stage, threads[0]),
+                PipelineStage("s2mel", s2mel_stage, threads[1]),
+                PipelineStage("bigvgan", vocoder_stage, threads[2]),
+            ])
+            results = pipeline.run(enumerate(segments))
+        else:
+            results = (vocoder_stage(s2mel_stage(gpt_stage(item))) for item in enumerate(segments))
+
+        if output_path and isinstance(output_path, str) and os.path.isfile(output_path):
+            os.remove(output_path)
+            print(">> remove old wav file:", output_path)
+        if output_path or not stream_return:
+            # 每段音频生成后直接写入输出 (wav/flac 文件, PCM 管道, 或 Gradio 所需的内存), 内存占用不随文本长度增长
+            sink = open_sink(output_path or None, sampling_rate)
+        else:
+            # stream_return: the caller gets the audio, only count it
+            sink = AudioSink(sampling_rate)
+        silence_samples = int(sampling_rate * interval_silence / 1000.0) if interval_silence > 0 else 0
+
+        try:
+            ctx.set_progress(0.2, f"speech synthesis 1/{segments_count}...")
+            for seg_idx, wav in enumerate(results):
+                ctx.set_progress(0.2 + 0.7 * (seg_idx + 1) / segments_count,
+                                 f"speech synthesis {min(seg_idx + 2, segments_count)}/{segments_count}...")
+                # silences are only inserted between segments
+                if seg_idx > 0:
+                    sink.write_silence(silence_samples)
+                sink.write(wav)
                 if stream_return:
-                    yield wav.cpu()
+                    yield wav
                     if silence == None:
-                        silence = self.interval_silence(wavs, sampling_rate=sampling_rate, interval_silence=interval_silence)
+                        silence = self.interval_silence([wav], sampling_rate=sampling_rate, interval_silence=interval_silence)
                     yield silence
+            if pipeline is not None:
+                pipeline.report()
+            if planner is not None:
+                # stream_return yields a silence after every segment
+                synthesized = sink.num_samples + (silence_samples if stream_return and sink.num_samples else 0)
+                overshoot = synthesized / sampling_rate - target_duration
+                print(f">> target duration: {target_duration:.2f} seconds, speaking rate per segment: "
+                      + ", ".join(f"{speed:.2f}x" for speed in planner.speeds))
+                if overshoot > duration_tolerance:
+                    print(f">> Warning: the speech is {overshoot:.2f} seconds longer than the target duration "
+                          f"at the fastest speaking rate ({duration_speed_range[1]}x)")
+                metrics.observe("duration_error_seconds", max(overshoot, 0.0))
+                pad = pad_to_duration(synthesized, target_duration, sampling_rate)
+                if pad > 0 and sink.num_samples:
+                    # rounding of the mel frames, or speech shorter than the target at the slowest rate
+                    sink.write_silence(pad)
+                    if stream_return:
+                        yield torch.zeros(sink.channels, pad)
+        except BaseException:
+            # the audio written so far stays a valid file
+            sink.close()
+            raise
         end_time = time.perf_counter()
 
-        self._set_gr_progress(0.9, "saving audio...")
-        wavs = self.insert_interval_silence(wavs, sampling_rate=sampling_rate, interval_silence=interval_silence)
-        wav = torch.cat(wavs, dim=1)
-        wav_length = wav.shape[-1] / sampling_rate
+        ctx.set_progress(0.9, "saving audio...")
+        sink.close()
+        wav_length = sink.duration
         print(f">> gpt_gen_time: {gpt_gen_time:.2f} seconds")
         print(f">> gpt_forward_time: {gpt_forward_time:.2f} seconds")
         print(f">> s2mel_time: {s2mel_time:.2f} seconds")
@@ -666,30 +1022,35 @@ class IndexTTS2:
         print(f">> Total inference time: {end_time - start_time:.2f} seconds")
         print(f">> Generated audio length: {wav_length:.2f} seconds")
         print(f">> RTF: {(end_time - start_time) / wav_length:.4f}")
+        metrics.record_span("request", start_time, end_time, segments=segments_count, audio_seconds=wav_length,
+                            rtf=(end_time - start_time) / wav_length, **metrics.update_peak_memory())
+        metrics.observe("rtf", (end_time - start_time) / wav_length)
 
-        # save audio
-        wav = wav.cpu()  # to cpu
         if output_path:
-            # 直接保存音频到指定路径中
-            if os.path.isfile(output_path):
-                os.remove(output_path)
-                print(">> remove old wav file:", output_path)
-            if os.path.dirname(output_path) != "":
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            torchaudio.save(output_path, wav.type(torch.int16), sampling_rate)
-            print(">> wav file saved to:", output_path)
+            if sink.path:
+                print(">> wav file saved to:", sink.path)
             if stream_return:
                 return None
-            yield output_path
+            # a binary stream has no path to return
+            yield sink.path
         else:
             if stream_return:
                 return None
             # 返回以符合Gradio的格式要求
-            wav_data = wav.type(torch.int16)
-            wav_data = wav_data.numpy().T
+            wav_data = sink.tensor().numpy().T
             yield (sampling_rate, wav_data)
 
 
+def _hub_cached_file(repo_id, filename):
+    """
+    Local path of a model file: ``repo_id`` is a local directory or a Hugging Face repo already downloaded to the cache.
+    """
+    if os.path.isdir(repo_id):
+        return os.path.join(repo_id, filename)
+    path = try_to_load_from_cache(repo_id, filename)
+    return path if isinstance(path, str) else None
+
+
 def find_most_similar_cosine(query_vector, matrix):
     query_vector = query_vector.float()
     matrix = matrix.float()
@@ -698,119 +1059,6 @@ def find_most_similar_cosine(query_vector, matrix):
     most_similar_index = torch.argmax(similarities)
     return most_similar_index
 
-class QwenEmotion:
-    def __init__(self, model_dir):
-        self.model_dir = model_dir
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_dir,
-            torch_dtype="float16",  # "auto"
-            device_map="auto"
-        )
-        self.prompt = "文本情感分类"
-        self.cn_key_to_en = {
-            "高兴": "happy",
-            "愤怒": "angry",
-            "悲伤": "sad",
-            "恐惧": "afraid",
-            "反感": "disgusted",
-            # TODO: the "低落" (melancholic) emotion will always be mapped to
-            # "悲伤" (sad) by QwenEmotion's text analysis. it doesn't know the
-            # difference between those emotions even if user writes exact words.
-            # SEE: `self.melancholic_words` for current workaround.
-            "低落": "melancholic",
-            "惊讶": "surprised",
-            "自然": "calm",
-        }
-        self.desired_vector_order = ["高兴", "愤怒", "悲伤", "恐惧", "反感", "低落", "惊讶", "自然"]
-        self.melancholic_words = {
-            # emotion text phrases that will force QwenEmotion's "悲伤" (sad) detection
-            # to become "低落" (melancholic) instead, to fix limitations mentioned above.
-            "低落",
-            "melancholy",
-            "melancholic",
-            "depression",
-            "depressed",
-            "gloomy",
-        }
-        self.max_score = 1.2
-        self.min_score = 0.0
-
-    def clamp_score(self, value):
-        return max(self.min_score, min(self.max_score, value))
-
-    def convert(self, content):
-        # generate emotion vector dictionary:
-        # - insert values in desired order (Python 3.7+ `dict` remembers insertion order)
-        # - convert Chinese keys to English
-        # - clamp all values to the allowed min/max range
-        # - use 0.0 for any values that were missing in `content`
-        emotion_dict = {
-            self.cn_key_to_en[cn_key]: self.clamp_score(content.get(cn_key, 0.0))
-            for cn_key in self.desired_vector_order
-        }
-
-        # default to a calm/neutral voice if all emotion vectors were empty
-        if all(val <= 0.0 for val in emotion_dict.values()):
-            print(">> no emotions detected; using default calm/neutral voice")
-            emotion_dict["calm"] = 1.0
-
-        return emotion_dict
-
-    def inference(self, text_input):
-        start = time.time()
-        messages = [
-            {"role": "system", "content": f"{self.prompt}"},
-            {"role": "user", "content": f"{text_input}"}
-        ]
-        text = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True,
-            enable_thinking=False,
-        )
-        model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
-
-        # conduct text completion
-        generated_ids = self.model.generate(
-            **model_inputs,
-            max_new_tokens=32768,
-            pad_token_id=self.tokenizer.eos_token_id
-        )
-        output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist()
-
-        # parsing thinking content
-        try:
-            # rindex finding 151668 (</think>)
-            index = len(output_ids) - output_ids[::-1].index(151668)
-        except ValueError:
-            index = 0
-
-        content = self.tokenizer.decode(output_ids[index:], skip_special_tokens=True)
-
-        # decode the JSON emotion detections as a dictionary
-        try:
-            content = json.loads(content)
-        except json.decoder.JSONDecodeError:
-            # invalid JSON; fallback to manual string parsing
-            # print(">> parsing QwenEmotion response", content)
-            content = {
-                m.group(1): float(m.group(2))
-                for m in re.finditer(r'([^\s":.,]+?)"?\s*:\s*([\d.]+)', content)
-            }
-            # print(">> dict result", content)
-
-        # workaround for QwenEmotion's inability to distinguish "悲伤" (sad) vs "低落" (melancholic).
-        # if we detect any of the IndexTTS "melancholic" words, we swap those vectors
-        # to encode the "sad" emotion as "melancholic" (instead of sadness).
-        text_input_lower = text_input.lower()
-        if any(word in text_input_lower for word in self.melancholic_words):
-            # print(">> before vec swap", content)
-            content["悲伤"], content["低落"] = content.get("低落", 0.0), content.get("悲伤", 0.0)
-            # print(">>  after vec swap", content)
-
-        return self.convert(content)
-
 
 if __name__ == "__main__":
     prompt_wav = "examples/voice_01.wav"
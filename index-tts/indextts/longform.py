@@ -0,0 +1,366 @@
+import contextlib
+import hashlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+import wave
+from typing import List, Optional
+
+import numpy as np
+import torch
+
+from indextts.utils.audio_sink import open_sink
+from indextts.utils.metrics import metrics
+from indextts.utils.token_budget import segment_text
+
+PLAN_VERSION = 1
+
+
+def _write_json_atomic(path: str, data: dict):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_text(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _read_wav_blocks(path: str, block_samples: int = 1 << 16):
+    """
+    Int16 [channels, N] blocks of a 16-bit PCM wav file.
+    """
+    with wave.open(path, "rb") as f:
+        channels = f.getnchannels()
+        while True:
+            data = f.readframes(block_samples)
+            if not data:
+                break
+            pcm = np.frombuffer(data, dtype="<i2").reshape(-1, channels).T.copy()
+            yield torch.from_numpy(pcm)
+
+
+class LongformJob:
+    """
+    Checkpointed synthesis of a long document with ``IndexTTS2``.
+
+    The job directory holds the segment plan (``plan.json``: the normalized and tokenized
+    segments and the inference settings, written once) and a chunk store (``segments/``) where
+    every segment is committed as its own wav file (written to a temporary name, then renamed)
+    as soon as it is synthesized. A restarted job skips the committed segments, and the final
+    output is stitched from the store.
+
+    Several workers (processes or machines sharing the directory) can run the same job: a segment
+    is claimed by creating ``segments/<idx>.claim`` with ``O_EXCL``, and kept fresh by a heartbeat
+    while it is synthesized; claims older than ``stale_seconds`` (crashed worker) are taken over.
+
+    Example:
+        >>> job = LongformJob.create("jobs/chapter1", tts, text, "examples/voice_01.wav")
+        >>> job.run(tts)
+        >>> job.stitch("chapter1.wav")
+    """
+
+    def __init__(self, job_dir: str):
+        self.job_dir = job_dir
+        self.segments_dir = os.path.join(job_dir, "segments")
+        with open(os.path.join(job_dir, "plan.json"), "r", encoding="utf-8") as f:
+            self.plan = json.load(f)
+        if self.plan.get("version") != PLAN_VERSION:
+            raise ValueError(f"unsupported long-form plan version {self.plan.get('version')} in {job_dir}")
+        os.makedirs(self.segments_dir, exist_ok=True)
+        # claim path -> content of the claims held by this worker
+        self._held = {}
+
+    @classmethod
+    def create(cls, job_dir: str, tts, text: str, spk_audio_prompt: str, max_text_tokens_per_segment: int = 120,
+               interval_silence: int = 200, **infer_kwargs) -> "LongformJob":
+        """
+        Plan a job (or open it, if ``job_dir`` already holds the plan of the same document and settings).
+
+        Args:
+            tts: the ``IndexTTS2`` instance, its tokenizer splits the document into segments.
+            infer_kwargs: other (JSON serializable) arguments of ``IndexTTS2.infer`` used for
+                every segment, e.g. ``emo_audio_prompt``, ``emo_vector``, ``top_p``.
+        """
+        # 音色库 ID 原样保留
+        if os.path.isfile(spk_audio_prompt):
+            spk_audio_prompt = os.path.abspath(spk_audio_prompt)
+        settings = dict(spk_audio_prompt=spk_audio_prompt,
+                        max_text_tokens_per_segment=max_text_tokens_per_segment,
+                        interval_silence=interval_silence, infer_kwargs=infer_kwargs)
+        text_sha1 = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        plan_path = os.path.join(job_dir, "plan.json")
+        if os.path.isfile(plan_path):
+            job = cls(job_dir)
+            if job.plan["text_sha1"] != text_sha1 or job.plan["settings"] != json.loads(json.dumps(settings)):
+                raise ValueError(f"{job_dir} holds a job of another document or other settings")
+            print(f">> resuming long-form job {job_dir}: {len(job.missing())}/{job.num_segments} segments left")
+            return job
+
+        os.makedirs(job_dir, exist_ok=True)
+        text_tokens_list = tts.tokenizer.tokenize(text)
+        segments = tts.tokenizer.split_segments(text_tokens_list, max_text_tokens_per_segment)
+        _write_json_atomic(plan_path, {
+            "version": PLAN_VERSION,
+            "text_sha1": text_sha1,
+            "settings": settings,
+            "sampling_rate": 22050,
+            "segments": segments,
+        })
+        print(f">> long-form job {job_dir}: {len(segments)} segments planned")
+        return cls(job_dir)
+
+    @property
+    def segments(self) -> List[List[str]]:
+        return self.plan["segments"]
+
+    @property
+    def num_segments(self) -> int:
+        return len(self.segments)
+
+    def segment_path(self, idx: int) -> str:
+        return os.path.join(self.segments_dir, f"{idx:06d}.wav")
+
+    def _claim_path(self, name) -> str:
+        return os.path.join(self.segments_dir, f"{name if isinstance(name, str) else f'{name:06d}'}.claim")
+
+    def missing(self) -> List[int]:
+        return [i for i in range(self.num_segments) if not os.path.isfile(self.segment_path(i))]
+
+    def claim(self, name, worker_id: str = "", stale_seconds: float = 600.0) -> bool:
+        """
+        Atomically claim a segment (or another unit of work such as ``"stitch"``) for this worker.
+
+        A claim not refreshed for ``stale_seconds`` is taken over: it is renamed away (only one
+        worker can) and only dropped if it is still the claim found stale, then recreated with
+        ``O_EXCL``, so two workers never both take over the same claim.
+        """
+        path = self._claim_path(name)
+        content = json.dumps({"worker": worker_id, "host": socket.gethostname(), "pid": os.getpid(),
+                              "time": time.time(), "token": uuid.uuid4().hex})
+        for _ in range(3):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._remove_stale_claim(path, stale_seconds):
+                    return False
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(content)
+            self._held[path] = content
+            return True
+        return False
+
+    def _remove_stale_claim(self, path: str, stale_seconds: float) -> bool:
+        """
+        Remove the claim at ``path`` if it is stale.
+
+        Returns:
+            False if the claim is held by a live worker.
+        """
+        # the content is read before the age: a claim recreated in between is seen as fresh
+        stale = _read_text(path)
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except FileNotFoundError:
+            return True  # released meanwhile
+        if stale is None:
+            return True
+        if age < stale_seconds:
+            return False
+        grave = f"{path}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(path, grave)
+        except FileNotFoundError:
+            return True  # taken over by another worker meanwhile, the retry sees its claim
+        moved = _read_text(grave)
+        os.remove(grave)
+        if moved != stale:
+            # another worker took the claim over between the read and the rename: give it back
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return False
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(moved)
+            return False
+        print(f">> taking over the stale claim {path} ({age:.0f} seconds old)")
+        return True
+
+    def holds(self, name) -> bool:
+        """
+        Whether this worker still holds its claim of ``name`` (it was not taken over).
+        """
+        path = self._claim_path(name)
+        return path in self._held and _read_text(path) == self._held[path]
+
+    @contextlib.contextmanager
+    def heartbeat(self, name, interval: float):
+        """
+        Touch the claim of ``name`` every ``interval`` seconds while the work runs, so a slow
+        segment is not taken over as stale. Stops if the claim was taken over anyway.
+        """
+        path = self._claim_path(name)
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval) and self.holds(name):
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    return
+
+        thread = threading.Thread(target=beat, name=f"claim-heartbeat-{os.path.basename(path)}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def release(self, name):
+        """
+        Remove the claim of ``name``, unless another worker took it over.
+        """
+        path = self._claim_path(name)
+        content = self._held.pop(path, None)
+        if content is not None and _read_text(path) == content:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def synthesize_segment(self, tts, idx: int):
+        """
+        Synthesize segment ``idx`` and commit it to the chunk store.
+        """
+        settings = self.plan["settings"]
+        tokens = self.segments[idx]
+        final_path = self.segment_path(idx)
+        tmp_path = os.path.join(self.segments_dir, f".{idx:06d}.{os.getpid()}.tmp.wav")
+        try:
+            with metrics.span("longform_segment", segment=idx):
+                tts.infer(settings["spk_audio_prompt"], segment_text(tokens), tmp_path,
+                          max_text_tokens_per_segment=settings["max_text_tokens_per_segment"],
+                          text_segments=[tokens], **settings["infer_kwargs"])
+            os.replace(tmp_path, final_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def run(self, tts, worker_id: Optional[str] = None, stale_seconds: float = 600.0,
+            max_segments: Optional[int] = None) -> int:
+        """
+        Synthesize the missing segments not claimed by other workers.
+
+        Returns:
+            the number of segments synthesized by this call.
+        """
+        worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        done = 0
+        for idx in self.missing():
+            if max_segments is not None and done >= max_segments:
+                break
+            if not self.claim(idx, worker_id, stale_seconds):
+                continue
+            try:
+                # committed by another worker between the listing and the claim
+                if not os.path.isfile(self.segment_path(idx)):
+                    with self.heartbeat(idx, stale_seconds / 4):
+                        self.synthesize_segment(tts, idx)
+                    done += 1
+                    metrics.inc("longform_segments")
+                    print(f">> long-form segment {idx + 1}/{self.num_segments} committed "
+                          f"({self.num_segments - len(self.missing())} done)")
+            finally:
+                self.release(idx)
+        return done
+
+    def stitch(self, output_path) -> str:
+        """
+        Write the final output from the chunk store, with the interval silences between segments.
+        """
+        missing = self.missing()
+        if missing:
+            raise RuntimeError(f"{len(missing)} segments of {self.job_dir} are not synthesized yet (first: {missing[0]})")
+        sampling_rate = self.plan["sampling_rate"]
+        interval_silence = self.plan["settings"]["interval_silence"]
+        silence_samples = int(sampling_rate * interval_silence / 1000.0) if interval_silence > 0 else 0
+        with open_sink(output_path, sampling_rate) as sink:
+            for idx in range(self.num_segments):
+                if idx > 0:
+                    sink.write_silence(silence_samples)
+                for block in _read_wav_blocks(self.segment_path(idx)):
+                    sink.write(block)
+        print(f">> long-form output: {sink.duration:.2f} seconds saved to {output_path}")
+        return output_path
+
+
+def run_longform(tts, job_dir: str, text: str, spk_audio_prompt: str, output_path: str,
+                 worker_id: Optional[str] = None, **kwargs) -> Optional[str]:
+    """
+    Plan (or resume) a long-form job, synthesize its missing segments and stitch the output.
+
+    Returns:
+        ``output_path``, or None if segments claimed by other workers are still missing
+        (the last worker to finish stitches).
+    """
+    job = LongformJob.create(job_dir, tts, text, spk_audio_prompt, **kwargs)
+    job.run(tts, worker_id=worker_id)
+    if job.missing() or not job.claim("stitch", worker_id or ""):
+        return None
+    try:
+        # a quarter of the default stale_seconds of the claim
+        with job.heartbeat("stitch", 150.0):
+            return job.stitch(output_path)
+    finally:
+        job.release("stitch")
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="IndexTTS2 checkpointed long-form synthesis")
+    parser.add_argument("job_dir", type=str, help="Job directory (segment plan and synthesized segments), reused to resume")
+    parser.add_argument("-t", "--text_file", type=str, required=True, help="Path to the UTF-8 text of the document")
+    parser.add_argument("-v", "--voice", type=str, required=True, help="Path to the speaker audio prompt, or a voice id of --voice_library")
+    parser.add_argument("--voice_library", type=str, default=None, help="Voice library index (indextts-voices build)")
+    parser.add_argument("-o", "--output_path", type=str, default="gen.wav", help="Path to the output audio file")
+    parser.add_argument("-c", "--config", type=str, default="checkpoints/config.yaml", help="Path to the config file")
+    parser.add_argument("--model_dir", type=str, default="checkpoints", help="Path to the model directory")
+    parser.add_argument("--fp16", action="store_true", default=False, help="Use FP16 for inference if available")
+    parser.add_argument("-d", "--device", type=str, default=None, help="Device to run the model on (cpu, cuda, mps, xpu)")
+    parser.add_argument("--max_text_tokens_per_segment", type=int, default=120, help="Max text tokens per segment")
+    parser.add_argument("--worker_id", type=str, default=None, help="Name of this worker in the segment claims")
+    parser.add_argument("--warmup", type=str, default="none", choices=["none", "minimal", "default", "full"],
+                        help="Warm up all stages with this profile before the first segment")
+    args = parser.parse_args()
+
+    with open(args.text_file, "r", encoding="utf-8") as f:
+        text = f.read()
+    if not text.strip():
+        print("ERROR: Text is empty.")
+        sys.exit(1)
+
+    from indextts.infer_v2 import IndexTTS2
+    tts = IndexTTS2(cfg_path=args.config, model_dir=args.model_dir, use_fp16=args.fp16, device=args.device,
+                    voice_library=args.voice_library)
+    if args.warmup != "none":
+        tts.warmup(args.warmup, spk_audio_prompt=args.voice)
+    if run_longform(tts, args.job_dir, text, args.voice, args.output_path, worker_id=args.worker_id,
+                    max_text_tokens_per_segment=args.max_text_tokens_per_segment) is None:
+        print(">> segments claimed by other workers are still running, the last worker writes the output")
+
+
+if __name__ == "__main__":
+    main()
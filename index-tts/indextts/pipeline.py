@@ -0,0 +1,155 @@
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional
+
+import torch
+
+_DONE = object()
+
+
+@dataclass
+class PipelineStage:
+    """
+    One stage of a :class:`StagePipeline`.
+
+    Args:
+        name: stage name used in the utilization report.
+        fn: ``fn(item) -> item`` applied to every item.
+        num_threads: intra-op thread budget of the stage thread (``torch.set_num_threads``), None keeps the default.
+    """
+    name: str
+    fn: Callable
+    num_threads: Optional[int] = None
+
+
+class _StageError:
+    def __init__(self, stage, error):
+        self.stage = stage
+        self.error = error
+
+
+class StagePipeline:
+    """
+    Run a sequence of stages over a stream of items, every stage in its own thread.
+
+    Stages are connected by bounded queues (``queue_size``), so a fast stage never runs more
+    than ``queue_size`` items ahead of the next one. Each item flows through the stages in order
+    and the results are yielded in input order. Busy time per stage is recorded in ``self.stats``.
+
+    With the OpenMP backend the intra-op thread count is per calling thread, so every stage thread
+    gets its own ``num_threads`` budget.
+
+    Example:
+        >>> pipeline = StagePipeline([PipelineStage("gpt", gpt_fn, 4), PipelineStage("cfm", cfm_fn, 8)])
+        >>> for result in pipeline.run(segments):
+        ...     ...
+    """
+
+    def __init__(self, stages: List[PipelineStage], queue_size: int = 2):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stats = {}
+
+    @staticmethod
+    def split_threads(weights, total=None):
+        """
+        Split ``total`` CPU threads (default: all cores) over the stages proportionally to ``weights``.
+        """
+        total = total or os.cpu_count() or 1
+        return [max(1, int(total * w / sum(weights))) for w in weights]
+
+    def _worker(self, stage, in_queue, out_queue, stop):
+        if stage.num_threads:
+            # ATen initializes the thread count of a new thread lazily at its first parallel op, with the
+            # last value set by any thread: force that initialization first, or it overrides the budget
+            torch.get_num_threads()
+            # the OpenMP thread count is per calling thread
+            torch.set_num_threads(stage.num_threads)
+        stats = self.stats[stage.name]
+        with torch.inference_mode():
+            while True:
+                item = in_queue.get()
+                if item is _DONE:
+                    out_queue.put(_DONE)
+                    break
+                seq, payload = item
+                if not isinstance(payload, _StageError) and not stop.is_set():
+                    start = time.perf_counter()
+                    try:
+                        payload = stage.fn(payload)
+                    except BaseException as e:
+                        payload = _StageError(stage.name, e)
+                        stop.set()
+                    stats["busy"] += time.perf_counter() - start
+                    stats["items"] += 1
+                out_queue.put((seq, payload))
+
+    def run(self, items: Iterable):
+        """
+        Generator of the results of all stages applied to ``items``, in input order.
+        An exception raised by a stage is re-raised here, and the remaining items are skipped.
+        """
+        self.stats = {stage.name: {"busy": 0.0, "items": 0} for stage in self.stages}
+        caller_threads = torch.get_num_threads()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=self._worker, args=(stage, queues[i], queues[i + 1], stop),
+                             name=f"indextts-stage-{stage.name}", daemon=True)
+            for i, stage in enumerate(self.stages)
+        ]
+        for t in threads:
+            t.start()
+
+        def feed():
+            for seq, item in enumerate(items):
+                if stop.is_set():
+                    break
+                queues[0].put((seq, item))
+            queues[0].put(_DONE)
+
+        feeder = threading.Thread(target=feed, name="indextts-stage-feed", daemon=True)
+        start = time.perf_counter()
+        feeder.start()
+
+        pending = {}
+        next_seq = 0
+        error = None
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _DONE:
+                    break
+                seq, payload = item
+                if isinstance(payload, _StageError):
+                    error = error or payload
+                    continue
+                pending[seq] = payload
+                # reassemble in input order
+                while next_seq in pending and error is None:
+                    yield pending.pop(next_seq)
+                    next_seq += 1
+        finally:
+            stop.set()
+            # drain, so that blocked workers can exit
+            while any(t.is_alive() for t in threads):
+                try:
+                    queues[-1].get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.stats["wall"] = time.perf_counter() - start
+            # new threads start from the last `set_num_threads` value, give back the caller's one
+            torch.set_num_threads(caller_threads)
+        if error is not None:
+            raise error.error
+
+    def report(self):
+        wall = self.stats.get("wall") or 1e-9
+        for stage in self.stages:
+            s = self.stats[stage.name]
+            print(f">> stage {stage.name}: {s['items']} items, busy {s['busy']:.2f}s, "
+                  f"utilization {100 * s['busy'] / wall:.1f}%"
+                  + (f", {stage.num_threads} threads" if stage.num_threads else ""))
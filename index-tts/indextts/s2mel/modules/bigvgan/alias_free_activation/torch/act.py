@@ -1,6 +1,7 @@
 # Adapted from https://github.com/junjun3518/alias-free-torch under the Apache License 2.0
 #   LICENSE is in incl_licenses directory.
 
+import torch
 import torch.nn as nn
 from .resample import UpSample1d, DownSample1d
 
@@ -20,9 +21,21 @@ class Activation1d(nn.Module):
         self.act = activation
         self.upsample = UpSample1d(up_ratio, up_kernel_size)
         self.downsample = DownSample1d(down_ratio, down_kernel_size)
+        # CPU fast path, built by prepare_inference
+        self.fast = None
+
+    def prepare_inference(self):
+        """
+        Precompute the polyphase CPU fast path (inference only: the parameters are frozen).
+        """
+        from indextts.BigVGAN.alias_free_activation.cpu.activation1d import PolyphaseActivation1d
+
+        self.fast = PolyphaseActivation1d.from_activation(self)
 
     # x: [B,C,T]
     def forward(self, x):
+        if self.fast is not None and not self.training and x.device.type == "cpu" and x.dtype == torch.float32:
+            return self.fast(x)
         x = self.upsample(x)
         x = self.act(x)
         x = self.downsample(x)
@@ -17,6 +17,7 @@ from torch.nn.utils import weight_norm, remove_weight_norm
 from . import activations
 from .utils import init_weights, get_padding
 from .alias_free_activation.torch.act import Activation1d as TorchActivation1d
+from indextts.BigVGAN.alias_free_activation.cpu.activation1d import prepare_activations
 from .env import AttrDict
 
 from huggingface_hub import PyTorchModelHubMixin, hf_hub_download
@@ -257,16 +258,18 @@ class BigVGAN(
     Args:
         h (AttrDict): Hyperparameters.
         use_cuda_kernel (bool): If set to True, loads optimized CUDA kernels for AMP. This should be used for inference only, as training is not supported with CUDA kernels.
+        use_cpu_kernel (bool): If set to True, builds the fused C++ kernel of the anti-aliased activation at `remove_weight_norm` of a model on CPU (needs a C++ compiler and ninja, falls back to torch).
 
     Note:
         - The `use_cuda_kernel` parameter should be used for inference only, as training with CUDA kernels is not supported.
         - Ensure that the activation function is correctly specified in the hyperparameters (h.activation).
     """
 
-    def __init__(self, h: AttrDict, use_cuda_kernel: bool = False):
+    def __init__(self, h: AttrDict, use_cuda_kernel: bool = False, use_cpu_kernel: bool = True):
         super().__init__()
         self.h = h
         self.h["use_cuda_kernel"] = use_cuda_kernel
+        self.h["use_cpu_kernel"] = use_cpu_kernel
 
         # Select which Activation1d, lazy-load cuda version to ensure backward compatibility
         if self.h.get("use_cuda_kernel", False):
@@ -398,6 +401,8 @@ class BigVGAN(
         except ValueError:
             print("[INFO] Model already removed weight norm. Skipping!")
             pass
+        # inference from here on: precompute the CPU fast path of the anti-aliased activations
+        prepare_activations(self, use_cpu_kernel=self.h.get("use_cpu_kernel", True))
 
     # Additional methods for huggingface_hub support
     def _save_pretrained(self, save_directory: Path) -> None:
@@ -425,6 +430,7 @@ class BigVGAN(
             map_location: str = "cpu",  # Additional argument
             strict: bool = False,  # Additional argument
             use_cuda_kernel: bool = False,
+            use_cpu_kernel: bool = True,
             **model_kwargs,
     ):
         """Load Pytorch pretrained weights and return the loaded model."""
@@ -458,7 +464,7 @@ class BigVGAN(
             print(
                 f"[WARNING] For detail, see the official GitHub repository: https://github.com/NVIDIA/BigVGAN?tab=readme-ov-file#using-custom-cuda-kernel-for-synthesis"
             )
-        model = cls(h, use_cuda_kernel=use_cuda_kernel)
+        model = cls(h, use_cuda_kernel=use_cuda_kernel, use_cpu_kernel=use_cpu_kernel)
 
         # Download and load pretrained generator weight
         if os.path.isdir(model_id):
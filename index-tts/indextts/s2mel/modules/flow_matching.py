@@ -90,11 +90,13 @@ class BASECFM(torch.nn.Module, ABC):
                 stacked_style = torch.cat([style, torch.zeros_like(style)], dim=0)
                 stacked_mu = torch.cat([mu, torch.zeros_like(mu)], dim=0)
                 stacked_x = torch.cat([x, x], dim=0)
-                stacked_t = torch.cat([t.unsqueeze(0), t.unsqueeze(0)], dim=0)
+                stacked_t = t.unsqueeze(0).expand(stacked_x.size(0))
+                # batched inference: every row has its own length
+                stacked_x_lens = torch.cat([x_lens, x_lens], dim=0)
 
                 # Perform a single forward pass for both original and CFG inputs
                 stacked_dphi_dt = self.estimator(
-                    stacked_x, stacked_prompt_x, x_lens, stacked_t, stacked_style, stacked_mu,
+                    stacked_x, stacked_prompt_x, stacked_x_lens, stacked_t, stacked_style, stacked_mu,
                 )
 
                 # Split the output back into the original and CFG components
@@ -103,7 +105,7 @@ class BASECFM(torch.nn.Module, ABC):
                 # Apply CFG formula
                 dphi_dt = (1.0 + inference_cfg_rate) * dphi_dt - inference_cfg_rate * cfg_dphi_dt
             else:
-                dphi_dt = self.estimator(x, prompt_x, x_lens, t.unsqueeze(0), style, mu)
+                dphi_dt = self.estimator(x, prompt_x, x_lens, t.unsqueeze(0).expand(x.size(0)), style, mu)
 
             x = x + dt * dphi_dt
             t = t + dt
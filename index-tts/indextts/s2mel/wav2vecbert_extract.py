@@ -1,4 +1,3 @@
-from transformers import SeamlessM4TFeatureExtractor
 from transformers import Wav2Vec2BertModel
 import torch
 import torch.nn as nn
@@ -13,6 +12,7 @@ import safetensors
 import json5
 # from codec.kmeans.repcodec_model import RepCodec
 from startts.examples.ftchar.models.codec.kmeans.repcodec_model import RepCodec
+from indextts.utils.feature_extractors import SeamlessM4TFeatures
 
 class JsonHParams:
     def __init__(self, **kwargs):
@@ -96,8 +96,7 @@ class Extract_wav2vectbert:
         self.semantic_std = torch.sqrt(self.stat_mean_var["var"])
         self.semantic_mean = self.semantic_mean.to(device)
         self.semantic_std = self.semantic_std.to(device)
-        self.processor = SeamlessM4TFeatureExtractor.from_pretrained(
-                "./MaskGCT_model/w2v_bert/")
+        self.processor = SeamlessM4TFeatures.from_pretrained("./MaskGCT_model/w2v_bert/").to(device)
         self.device = device
         
         cfg_maskgct = load_config('./MaskGCT_model/maskgct.json')
@@ -110,7 +109,7 @@ class Extract_wav2vectbert:
 
     @torch.no_grad()
     def extract_features(self, speech): # speech [b,T]
-        inputs = self.processor(speech, sampling_rate=16000, return_tensors="pt")
+        inputs = self.processor(speech, sampling_rate=16000)
         input_features = inputs["input_features"]
         attention_mask = inputs["attention_mask"]
         return input_features, attention_mask #[2, 620, 160] [2, 620]
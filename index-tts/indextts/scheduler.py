@@ -0,0 +1,651 @@
+import itertools
+import queue
+import threading
+import time
+import traceback
+import warnings
+from collections import deque
+from concurrent.futures import Future
+
+import torch
+from transformers import DynamicCache
+
+from indextts.utils.audio_sink import open_sink
+from indextts.utils.code_postprocess import postprocess_codes
+from indextts.utils.metrics import metrics
+from indextts.utils.token_budget import find_repetition, segment_text, segment_token_budget, trim_runaway_codes
+
+
+class PagedKVCache:
+    """
+    Block-paged key/value memory shared by all sequences of the GPT decode batch.
+
+    The memory is one preallocated pool of fixed size blocks (``block_size`` tokens for every layer).
+    Each sequence owns a block table, blocks are taken from the free list while it grows and
+    given back as soon as it finishes, so sequences can join and leave the batch at any step.
+    """
+
+    def __init__(self, num_layers, num_heads, head_dim, num_blocks, block_size=16, device="cpu", dtype=torch.float32):
+        self.block_size = block_size
+        self.num_blocks = num_blocks
+        shape = (num_layers, num_blocks, num_heads, block_size, head_dim)
+        self.key = torch.zeros(shape, device=device, dtype=dtype)
+        self.value = torch.zeros(shape, device=device, dtype=dtype)
+        # block 0 is never allocated, it pads the block tables of shorter sequences
+        self._free = deque(range(1, num_blocks))
+
+    @property
+    def num_free_blocks(self):
+        return len(self._free)
+
+    def blocks_for(self, num_tokens):
+        return -(-num_tokens // self.block_size)
+
+    def reserve(self, block_table, num_tokens) -> bool:
+        """
+        Grow ``block_table`` to hold ``num_tokens`` tokens. Returns False if the pool is exhausted.
+        """
+        needed = self.blocks_for(num_tokens) - len(block_table)
+        if needed > len(self._free):
+            return False
+        for _ in range(needed):
+            block_table.append(self._free.popleft())
+        return True
+
+    def release(self, block_table):
+        self._free.extend(block_table)
+        block_table.clear()
+
+    def write(self, block_table, keys, values, start=0):
+        """
+        Store the keys/values [layers, H, n, D] of tokens ``start .. start + n`` of a sequence.
+        """
+        n = keys.shape[2]
+        pos = 0
+        while pos < n:
+            block, offset = divmod(start + pos, self.block_size)
+            count = min(self.block_size - offset, n - pos)
+            self.key[:, block_table[block], :, offset:offset + count] = keys[:, :, pos:pos + count]
+            self.value[:, block_table[block], :, offset:offset + count] = values[:, :, pos:pos + count]
+            pos += count
+
+    def append(self, block_tables, positions, keys, values):
+        """
+        Store one new token per sequence, keys/values are [layers, B, H, D].
+        """
+        blocks = torch.tensor([table[p // self.block_size] for table, p in zip(block_tables, positions)],
+                              device=self.key.device)
+        offsets = torch.tensor([p % self.block_size for p in positions], device=self.key.device)
+        # advanced indices on dims 1 and 3 move the batch dim to the front: [B, layers, H, D]
+        self.key[:, blocks, :, offsets] = keys.transpose(0, 1).to(self.key.dtype)
+        self.value[:, blocks, :, offsets] = values.transpose(0, 1).to(self.value.dtype)
+
+    def block_index(self, block_tables, lengths):
+        """
+        Padded block tables and attention mask of a batch of sequences, for ``gather_layer``.
+
+        Returns:
+            table: [B, max_blocks] long, block 0 pads the shorter sequences.
+            mask: [B, max_blocks * block_size] bool, False for the unused tail of every sequence.
+        """
+        max_blocks = max(len(t) for t in block_tables)
+        table = torch.zeros((len(block_tables), max_blocks), dtype=torch.long)
+        for i, t in enumerate(block_tables):
+            table[i, :len(t)] = torch.tensor(t, dtype=torch.long)
+        table = table.to(self.key.device)
+        lengths = torch.tensor(lengths, device=self.key.device)
+        mask = torch.arange(max_blocks * self.block_size, device=self.key.device).unsqueeze(0) < lengths.unsqueeze(1)
+        return table, mask
+
+    def gather_layer(self, layer, table):
+        """
+        Dense past keys/values [B, H, max_blocks * block_size, D] of one layer for the block ``table``.
+        """
+        B, max_blocks = table.shape
+        _, _, H, bs, D = self.key.shape
+        keys = self.key[layer, table].transpose(1, 2).reshape(B, H, max_blocks * bs, D)
+        values = self.value[layer, table].transpose(1, 2).reshape(B, H, max_blocks * bs, D)
+        return keys, values
+
+
+class _PagedStepCache(DynamicCache):
+    """
+    ``past_key_values`` of one decode step: every attention layer gathers its own past from the
+    :class:`PagedKVCache` when it runs, so only one layer of dense keys/values exists at a time
+    instead of all of them. The keys/values of the new token are kept in ``new_keys`` / ``new_values``
+    for ``PagedKVCache.append``.
+
+    Each layer still copies the past keys/values of the whole batch at every step (the gather, then
+    the concatenation with the new token): O(B * H * T * D) per layer and step, with T the longest
+    sequence rounded up to a block. Avoiding that copy needs an attention kernel that reads the
+    block table directly (paged attention), which the HF GPT-2 attention does not support.
+    """
+
+    def __init__(self, kv_cache, table, past_length):
+        super().__init__()
+        self.kv_cache = kv_cache
+        self.table = table
+        self.past_length = past_length
+        self.new_keys = []
+        self.new_values = []
+
+    def get_seq_length(self, layer_idx=0):
+        return self.past_length
+
+    def update(self, key_states, value_states, layer_idx, cache_kwargs=None):
+        self.new_keys.append(key_states[:, :, -1])
+        self.new_values.append(value_states[:, :, -1])
+        keys, values = self.kv_cache.gather_layer(layer_idx, self.table)
+        return torch.cat([keys, key_states], dim=-2), torch.cat([values, value_states], dim=-2)
+
+class _Request:
+    def __init__(self, request_id, cond, segments, params, output_path, interval_silence, progress, future):
+        self.request_id = request_id
+        self.cond = cond
+        self.params = params
+        self.output_path = output_path
+        self.interval_silence = interval_silence
+        self.progress = progress
+        self.future = future
+        self.wavs = [None] * len(segments)
+        self.remaining = len(segments)
+        # finished segments are written to the sink in order, then dropped
+        self.sink = None
+        self.next_seg = 0
+        self.failed = False
+        self.start_time = time.perf_counter()
+
+
+class _Sequence:
+    def __init__(self, request, seg_idx, text_tokens, budget):
+        self.request = request
+        self.seg_idx = seg_idx
+        self.text_tokens = text_tokens
+        self.budget = budget
+        self.tokens = []
+        self.block_table = []
+        self.num_cached = 0
+        self.seen = None
+
+
+class ContinuousBatchingScheduler:
+    """
+    In-flight batching of concurrent ``IndexTTS2`` requests.
+
+    Text segments of all submitted requests share one GPT decode batch: new segments are admitted
+    (prefilled) between two decode steps, finished ones are retired immediately, and the KV cache
+    lives in a :class:`PagedKVCache` so the batch size can change at every step. Finished code
+    sequences are handed to a second thread running the GPT latent, s2mel and BigVGAN stages,
+    batched across segments that share the same speaker prompt.
+
+    Only sampling/greedy decoding is supported (no beam search), ``num_beams`` is ignored.
+
+    Example:
+        >>> scheduler = ContinuousBatchingScheduler(tts, max_batch_size=8)
+        >>> future = scheduler.submit(spk_audio_prompt="examples/voice_01.wav", text="Hello", output_path="gen.wav")
+        >>> future.result()
+    """
+
+    def __init__(self, tts, max_batch_size=8, kv_cache_tokens=32768, block_size=16, max_post_batch_size=4):
+        """
+        Args:
+            tts: a loaded ``IndexTTS2`` instance.
+            max_batch_size (int): maximum number of segments decoded together.
+            kv_cache_tokens (int): capacity of the paged KV cache, in tokens over all sequences.
+            block_size (int): tokens per KV cache block.
+            max_post_batch_size (int): maximum number of segments per s2mel/BigVGAN batch.
+        """
+        self.tts = tts
+        self.gpt = tts.gpt
+        self.device = torch.device(tts.device)
+        self.max_batch_size = max_batch_size
+        self.max_post_batch_size = max_post_batch_size
+
+        config = self.gpt.gpt.config
+        kv_dtype = torch.float16 if tts.use_fp16 else torch.float32
+        self.kv_cache = PagedKVCache(config.n_layer, config.n_head, config.n_embd // config.n_head,
+                                     num_blocks=-(-kv_cache_tokens // block_size) + 1, block_size=block_size,
+                                     device=self.device, dtype=kv_dtype)
+
+        self._cv = threading.Condition()
+        self._prepare_lock = threading.Lock()
+        self._waiting = deque()
+        self._running = []
+        # requests whose future is not resolved yet, failed by `close`
+        self._active = set()
+        self._post_queue = queue.Queue()
+        self._request_ids = itertools.count()
+        self._closed = False
+        self.stats = {"steps": 0, "tokens": 0, "prefills": 0, "preemptions": 0, "max_batch": 0}
+
+        self._decode_thread = threading.Thread(target=self._decode_loop, name="indextts-decode", daemon=True)
+        self._post_thread = threading.Thread(target=self._post_loop, name="indextts-s2mel", daemon=True)
+        self._decode_thread.start()
+        self._post_thread.start()
+        print(f">> ContinuousBatchingScheduler started: max_batch_size={max_batch_size}, "
+              f"kv_cache_tokens={kv_cache_tokens}, block_size={block_size}")
+
+    # ------------------------------------------------------------------ API
+
+    def submit(self, spk_audio_prompt, text, output_path=None,
+               emo_audio_prompt=None, emo_alpha=1.0, emo_vector=None,
+               use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
+               verbose=False, max_text_tokens_per_segment=120, progress=None, **generation_kwargs) -> Future:
+        """
+        Queue a request, arguments are the same as ``IndexTTS2.infer``.
+        ``progress`` is an optional ``callable(value, desc)``.
+
+        Returns:
+            ``concurrent.futures.Future`` of the output path, or of ``(sampling_rate, wav_data)`` if
+            ``output_path`` is None.
+        """
+        if self._closed:
+            raise RuntimeError("ContinuousBatchingScheduler is closed")
+        params = {
+            "do_sample": bool(generation_kwargs.pop("do_sample", True)),
+            "top_p": float(generation_kwargs.pop("top_p", 0.8)),
+            "top_k": int(generation_kwargs.pop("top_k", 30) or 0),
+            "temperature": float(generation_kwargs.pop("temperature", 0.8)),
+            "repetition_penalty": float(generation_kwargs.pop("repetition_penalty", 10.0)),
+            "max_mel_tokens": int(generation_kwargs.pop("max_mel_tokens", 1500)),
+        }
+        token_budget_margin = generation_kwargs.pop("token_budget_margin", 1.5)
+        loop_detection_seconds = generation_kwargs.pop("loop_detection_seconds", 3.0)
+        params["loop_min_span"] = int(loop_detection_seconds * self.tts.codes_per_second) if loop_detection_seconds else 0
+        # beam search is not batched across requests
+        generation_kwargs.pop("num_beams", None)
+        generation_kwargs.pop("length_penalty", None)
+        if generation_kwargs and verbose:
+            print(f">> ContinuousBatchingScheduler ignores generation kwargs: {list(generation_kwargs)}")
+
+        future = Future()
+        tts = self.tts
+        # conditioning runs in the caller thread, while the scheduler keeps decoding
+        with self._prepare_lock:
+            cond = tts.prepare_conditioning(spk_audio_prompt, emo_audio_prompt, emo_alpha, emo_vector,
+                                            use_emo_text, emo_text or text, use_random, verbose)
+            text_tokens_list = tts.tokenizer.tokenize(text)
+            segments = tts.tokenizer.split_segments(text_tokens_list, max_text_tokens_per_segment)
+        if not segments:
+            future.set_result(None)
+            return future
+        request = _Request(next(self._request_ids), cond, segments, params, output_path,
+                           interval_silence, progress, future)
+        sequences = []
+        for seg_idx, sent in enumerate(segments):
+            text_tokens = tts.tokenizer.convert_tokens_to_ids(sent)
+            text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=self.device).unsqueeze(0)
+            budget = params["max_mel_tokens"]
+            if token_budget_margin:
+                budget = segment_token_budget(segment_text(sent), tts.codes_per_second, margin=token_budget_margin,
+                                              max_tokens=budget)
+            sequences.append(_Sequence(request, seg_idx, text_tokens, budget))
+        with self._cv:
+            if self._closed:
+                future.set_exception(RuntimeError("ContinuousBatchingScheduler is closed"))
+                return future
+            self._active.add(request)
+            self._waiting.extend(sequences)
+            self._cv.notify_all()
+        return future
+
+    def infer(self, **kwargs):
+        """
+        Blocking equivalent of ``IndexTTS2.infer``.
+        """
+        return self.submit(**kwargs).result()
+
+    def close(self, timeout=None):
+        """
+        Stop the scheduler threads. Requests that are not finished by then fail with a ``RuntimeError``.
+        """
+        with self._cv:
+            self._closed = True
+            self._cv.notify_all()
+        self._decode_thread.join(timeout)
+        self._post_queue.put(None)
+        self._post_thread.join(timeout)
+        with self._cv:
+            unfinished = list(self._active)
+        for request in unfinished:
+            self._fail(request, RuntimeError("ContinuousBatchingScheduler was closed before the request finished"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # ------------------------------------------------------------- decoding
+
+    def _decode_loop(self):
+        while True:
+            with self._cv:
+                while not self._closed and not self._waiting and not self._running:
+                    self._cv.wait()
+                if self._closed:
+                    break
+                admitted = self._admit()
+            try:
+                with torch.inference_mode():
+                    if admitted:
+                        with metrics.span("gpt_prefill", sequences=len(admitted)):
+                            self._prefill(admitted)
+                    if self._running:
+                        with metrics.span("gpt_decode_step", batch=len(self._running)):
+                            self._decode_step()
+            except Exception as e:
+                failed = admitted + self._running
+                self._running = []
+                for seq in failed:
+                    self.kv_cache.release(seq.block_table)
+                    self._fail(seq.request, e)
+            self._retire()
+
+    def _admit(self):
+        """
+        Move waiting segments into the batch while there is room in the batch and the KV cache.
+        """
+        admitted = []
+        # keep one free block per running sequence, so that the next decode step does not preempt
+        reserve = len(self._running)
+        while self._waiting and len(self._running) + len(admitted) < self.max_batch_size:
+            seq = self._waiting[0]
+            if seq.request.failed:
+                self._waiting.popleft()
+                continue
+            prompt_len = self.gpt.cond_num + 2 + seq.text_tokens.shape[1] + 3
+            if self.kv_cache.blocks_for(prompt_len) > self.kv_cache.num_blocks - 1:
+                # would wait forever at the head of the queue
+                self._waiting.popleft()
+                self._fail(seq.request, self._too_large_error(seq, prompt_len))
+                continue
+            if self.kv_cache.blocks_for(prompt_len) + reserve > self.kv_cache.num_free_blocks:
+                break
+            self._waiting.popleft()
+            self.kv_cache.reserve(seq.block_table, prompt_len)
+            admitted.append(seq)
+        return admitted
+
+    def _prompt_embeds(self, seq):
+        gpt = self.gpt
+        cond = seq.request.cond
+        with torch.amp.autocast(self.device.type, enabled=self.tts.dtype is not None, dtype=self.tts.dtype):
+            # [cond latents][text] as in `UnifiedVoice.inference_speech`, followed by the start mel token
+            _, inputs_embeds, _ = gpt.prepare_gpt_inputs(cond["conds_latent"], seq.text_tokens)
+            start = torch.tensor([gpt.start_mel_token], device=self.device)
+            start_emb = gpt.mel_embedding(start) + gpt.mel_pos_embedding.emb(torch.zeros_like(start))
+        return torch.cat([inputs_embeds[0], start_emb.to(inputs_embeds.dtype)], dim=0)
+
+    def _logits(self, hidden_states):
+        return self.gpt.mel_head(self.gpt.final_norm(hidden_states)).float()
+
+    def _prefill(self, admitted):
+        prompts = [self._prompt_embeds(seq) for seq in admitted]
+        lengths = [p.shape[0] for p in prompts]
+        max_len = max(lengths)
+        dim = prompts[0].shape[-1]
+        inputs_embeds = prompts[0].new_zeros((len(prompts), max_len, dim))
+        attention_mask = torch.zeros((len(prompts), max_len), dtype=torch.long, device=self.device)
+        for i, p in enumerate(prompts):
+            # left padding, the last position of every row is the start mel token
+            inputs_embeds[i, max_len - lengths[i]:] = p
+            attention_mask[i, max_len - lengths[i]:] = 1
+        with torch.amp.autocast(self.device.type, enabled=self.tts.dtype is not None, dtype=self.tts.dtype):
+            out = self.gpt.gpt(inputs_embeds=inputs_embeds, attention_mask=attention_mask, use_cache=True,
+                               return_dict=True)
+            logits = self._logits(out.last_hidden_state[:, -1])
+        past = out.past_key_values
+        if not isinstance(past, tuple):
+            past = past.to_legacy_cache()
+        for i, seq in enumerate(admitted):
+            keys = torch.stack([layer[0][i, :, max_len - lengths[i]:] for layer in past])
+            values = torch.stack([layer[1][i, :, max_len - lengths[i]:] for layer in past])
+            self.kv_cache.write(seq.block_table, keys.to(self.kv_cache.key.dtype), values.to(self.kv_cache.value.dtype))
+            seq.num_cached = lengths[i]
+            seq.seen = torch.zeros(logits.shape[-1], dtype=torch.bool, device=self.device)
+            # `inference_speech` feeds dummy ids (1) for the prompt and the start mel token,
+            # HF's repetition penalty sees them as previous tokens
+            seq.seen[1] = True
+            seq.seen[self.gpt.start_mel_token] = True
+        self._accept(admitted, self._sample(logits, admitted))
+        self._running.extend(admitted)
+        self.stats["prefills"] += len(admitted)
+
+    def _ensure_capacity(self):
+        """
+        Reserve the KV block for the next token of every running sequence, preempting the most
+        recently admitted sequences (they will be recomputed) when the cache is full.
+        """
+        i = 0
+        while i < len(self._running):
+            seq = self._running[i]
+            if self.kv_cache.reserve(seq.block_table, seq.num_cached + 1):
+                i += 1
+                continue
+            if len(self._running) == 1:
+                # alone in the cache: it cannot grow even if everything else is preempted
+                self._running.pop()
+                self.kv_cache.release(seq.block_table)
+                self._fail(seq.request, self._too_large_error(seq, seq.num_cached + 1))
+                return
+            victim = self._running.pop()
+            self.kv_cache.release(victim.block_table)
+            victim.tokens = []
+            victim.num_cached = 0
+            victim.seen = None
+            self.stats["preemptions"] += 1
+            with self._cv:
+                self._waiting.appendleft(victim)
+
+    def _too_large_error(self, seq, num_tokens):
+        capacity = (self.kv_cache.num_blocks - 1) * self.kv_cache.block_size
+        return RuntimeError(f"segment {seq.seg_idx} of request {seq.request.request_id} needs {num_tokens} "
+                            f"tokens of KV cache, more than its capacity of {capacity} tokens: "
+                            f"increase kv_cache_tokens")
+
+    def _decode_step(self):
+        self._ensure_capacity()
+        running = self._running
+        if not running:
+            return
+        gpt = self.gpt
+        last_tokens = torch.tensor([seq.tokens[-1] for seq in running], device=self.device)
+        # mel position of the fed token, same offset as `GPT2InferenceModel.forward`
+        positions = torch.tensor([len(seq.tokens) + 1 for seq in running], device=self.device)
+        table, mask = self.kv_cache.block_index([seq.block_table for seq in running],
+                                                [seq.num_cached for seq in running])
+        attention_mask = torch.cat([mask, mask.new_ones((len(running), 1))], dim=1).long()
+        # the past is gathered layer by layer inside the forward, see `_PagedStepCache`
+        cache = _PagedStepCache(self.kv_cache, table, mask.shape[1])
+        with torch.amp.autocast(self.device.type, enabled=self.tts.dtype is not None, dtype=self.tts.dtype):
+            emb = gpt.mel_embedding(last_tokens) + gpt.mel_pos_embedding.emb(positions)
+            out = gpt.gpt(inputs_embeds=emb.unsqueeze(1), past_key_values=cache,
+                          attention_mask=attention_mask, use_cache=True, return_dict=True)
+            logits = self._logits(out.last_hidden_state[:, -1])
+        self.kv_cache.append([seq.block_table for seq in running], [seq.num_cached for seq in running],
+                             torch.stack(cache.new_keys), torch.stack(cache.new_values))
+        for seq in running:
+            seq.num_cached += 1
+        self._accept(running, self._sample(logits, running))
+        self.stats["steps"] += 1
+        self.stats["tokens"] += len(running)
+        metrics.inc("gpt_tokens", len(running))
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(running))
+
+    def _sample(self, logits, seqs):
+        """
+        Per-row repetition penalty, temperature, top-k and top-p (the order of HF `generate`),
+        then multinomial sampling or greedy selection.
+        """
+        V = logits.shape[-1]
+        params = [seq.request.params for seq in seqs]
+
+        def column(key, dtype=torch.float32):
+            return torch.tensor([p[key] for p in params], dtype=dtype, device=logits.device).unsqueeze(1)
+
+        seen = torch.stack([seq.seen for seq in seqs])
+        penalty = column("repetition_penalty")
+        logits = torch.where(seen, torch.where(logits < 0, logits * penalty, logits / penalty), logits)
+        logits = logits / column("temperature")
+
+        sorted_logits, sorted_idx = logits.sort(dim=-1, descending=True)
+        top_k = column("top_k", torch.long)
+        top_k = torch.where((top_k <= 0) | (top_k > V), torch.full_like(top_k, V), top_k)
+        remove = torch.arange(V, device=logits.device).unsqueeze(0) >= top_k
+        sorted_logits = sorted_logits.masked_fill(remove, float("-inf"))
+        probs = sorted_logits.softmax(dim=-1)
+        # keep the smallest prefix whose probability mass reaches top_p (the first token is always kept)
+        remove = remove | ((probs.cumsum(dim=-1) - probs) >= column("top_p"))
+        sorted_logits = sorted_logits.masked_fill(remove, float("-inf"))
+
+        choice = torch.multinomial(sorted_logits.softmax(dim=-1), 1)
+        do_sample = column("do_sample", torch.bool)
+        choice = torch.where(do_sample, choice, torch.zeros_like(choice))
+        return sorted_idx.gather(1, choice).squeeze(1).tolist()
+
+    def _accept(self, seqs, tokens):
+        for seq, token in zip(seqs, tokens):
+            seq.tokens.append(token)
+            seq.seen[token] = True
+
+    def _retire(self):
+        stop_token = self.gpt.stop_mel_token
+        still_running = []
+        for seq in self._running:
+            min_span = seq.request.params["loop_min_span"]
+            done = (seq.tokens[-1] == stop_token or len(seq.tokens) >= seq.budget
+                    or (min_span > 0 and find_repetition(seq.tokens, min_span=min_span) is not None))
+            if seq.request.failed:
+                self.kv_cache.release(seq.block_table)
+            elif done:
+                self.kv_cache.release(seq.block_table)
+                self._post_queue.put(seq)
+            else:
+                still_running.append(seq)
+        self._running = still_running
+
+    # ---------------------------------------------------- s2mel + vocoder
+
+    def _post_loop(self):
+        while True:
+            seq = self._post_queue.get()
+            if seq is None:
+                break
+            batch = [seq]
+            while True:
+                try:
+                    seq = self._post_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if seq is None:
+                    self._post_queue.put(None)
+                    break
+                batch.append(seq)
+            # batch the segments that share the same speaker prompt
+            groups = {}
+            for seq in batch:
+                if not seq.request.failed:
+                    groups.setdefault(id(seq.request.cond["prompt_condition"]), []).append(seq)
+            for group in groups.values():
+                for i in range(0, len(group), self.max_post_batch_size):
+                    self._synthesize(group[i:i + self.max_post_batch_size])
+
+    def _synthesize(self, seqs):
+        tts = self.tts
+        try:
+            with torch.inference_mode():
+                latents, codes_list, code_lens_list = [], [], []
+                for seq in seqs:
+                    codes = torch.tensor(seq.tokens, dtype=torch.long, device=self.device).unsqueeze(0)
+                    codes, reasons = trim_runaway_codes(codes, self.gpt.stop_mel_token, [seq.budget],
+                                                        min_span=seq.request.params["loop_min_span"])
+                    if reasons[0] == "budget" and seq.budget >= seq.request.params["max_mel_tokens"]:
+                        warnings.warn(
+                            f"WARN: generation stopped due to exceeding `max_mel_tokens` ({seq.request.params['max_mel_tokens']}).",
+                            category=RuntimeWarning
+                        )
+                    elif reasons[0] is not None:
+                        print(f">> request {seq.request.request_id} segment {seq.seg_idx}: generation stopped by the "
+                              f"{reasons[0]} guard after {len(seq.tokens)} codes (budget: {seq.budget})")
+                        metrics.inc("gpt_guard_stops", reason=reasons[0])
+                    codes, code_lens = postprocess_codes(codes, self.gpt.stop_mel_token, max_consecutive=None)
+                    with metrics.span("gpt_forward"):
+                        latents.append(tts._gpt_latent(seq.request.cond, seq.text_tokens, codes))
+                    codes_list.append(codes)
+                    code_lens_list.append(code_lens)
+                # all sequences of a group share the speaker prompt, the first cond is used for s2mel
+                with metrics.span("cfm", batch=len(seqs)):
+                    mels = tts._s2mel(seqs[0].request.cond, latents, codes_list, code_lens_list)
+                with metrics.span("vocoder", batch=len(seqs)):
+                    wavs = tts._vocode(mels)
+        except Exception as e:
+            for seq in seqs:
+                self._fail(seq.request, e)
+            return
+        for seq, wav in zip(seqs, wavs):
+            request = seq.request
+            if request.failed:
+                continue
+            request.wavs[seq.seg_idx] = wav.cpu()
+            request.remaining -= 1
+            try:
+                self._write_ready(request)
+            except Exception as e:
+                self._fail(request, e)
+                continue
+            if request.progress is not None:
+                done = len(request.wavs) - request.remaining
+                request.progress(0.1 + 0.8 * done / len(request.wavs), f"speech synthesis {done}/{len(request.wavs)}...")
+            if request.remaining == 0:
+                self._finish(request)
+
+    def _write_ready(self, request, sampling_rate=22050):
+        if request.sink is None:
+            request.sink = open_sink(request.output_path or None, sampling_rate)
+        silence_samples = int(sampling_rate * request.interval_silence / 1000.0) if request.interval_silence > 0 else 0
+        while request.next_seg < len(request.wavs) and request.wavs[request.next_seg] is not None:
+            if request.next_seg > 0:
+                request.sink.write_silence(silence_samples)
+            request.sink.write(request.wavs[request.next_seg])
+            request.wavs[request.next_seg] = None
+            request.next_seg += 1
+
+    def _finish(self, request):
+        sampling_rate = 22050
+        try:
+            request.sink.close()
+            wav_length = request.sink.duration
+            elapsed = time.perf_counter() - request.start_time
+            print(f">> request {request.request_id}: {wav_length:.2f} seconds of audio in {elapsed:.2f} seconds")
+            metrics.record_span("request", request.start_time, request.start_time + elapsed,
+                                segments=len(request.wavs), audio_seconds=wav_length, rtf=elapsed / wav_length,
+                                **metrics.update_peak_memory())
+            metrics.observe("rtf", elapsed / wav_length)
+            if request.output_path:
+                result = request.output_path
+            else:
+                result = (sampling_rate, request.sink.tensor().numpy().T)
+        except Exception as e:
+            self._fail(request, e)
+            return
+        request.cond = None
+        with self._cv:
+            self._active.discard(request)
+        request.future.set_result(result)
+
+    def _fail(self, request, error):
+        if request.failed:
+            return
+        request.failed = True
+        with self._cv:
+            self._active.discard(request)
+        if request.future.done():
+            return
+        print(f">> request {request.request_id} failed: {error!r}")
+        if request.sink is not None:
+            request.sink.close()
+        if error.__traceback__ is not None:
+            traceback.print_exc()
+        if not request.future.done():
+            request.future.set_exception(error)
@@ -0,0 +1,82 @@
+import functools
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import torch
+import torchaudio
+
+
+def decode_audio(audio_path: str, mono: str = "mean") -> Tuple[torch.Tensor, int]:
+    """
+    Decode an audio file into a mono float32 tensor at its native sample rate.
+
+    soundfile (libsndfile) handles wav/flac/ogg without any resampling; other containers
+    (mp3, m4a, ...) fall back to torchaudio's ffmpeg backend.
+
+    Args:
+        mono: how multi-channel audio is mixed down, ``"mean"`` averages the channels (as the
+            IndexTTS prompt loaders always did), ``"first"`` keeps the first channel.
+
+    Returns:
+        audio: [1, N] float32 tensor in [-1, 1].
+        sr: native sample rate.
+    """
+    if mono not in ("mean", "first"):
+        raise ValueError(f"mono must be 'mean' or 'first', got {mono!r}")
+    try:
+        import soundfile as sf
+
+        data, sr = sf.read(audio_path, dtype="float32", always_2d=True)
+        data = data.mean(axis=1) if mono == "mean" else data[:, 0]
+        audio = torch.from_numpy(np.ascontiguousarray(data)).unsqueeze(0)
+    except Exception:
+        audio, sr = torchaudio.load(audio_path)
+        audio = audio.float().mean(dim=0, keepdim=True) if mono == "mean" else audio[:1].float()
+    return audio, sr
+
+
+@functools.lru_cache(maxsize=32)
+def get_resampler(orig_sr: int, target_sr: int, device: str = "cpu") -> torchaudio.transforms.Resample:
+    """
+    Memoized resampler, the sinc kernel for a (orig_sr, target_sr) pair is only computed once per device.
+    """
+    return torchaudio.transforms.Resample(orig_sr, target_sr).to(device)
+
+
+def resample(audio: torch.Tensor, orig_sr: int, target_sr: int) -> torch.Tensor:
+    if orig_sr == target_sr:
+        return audio
+    # one module per device: moving a shared module would race with callers on other devices
+    return get_resampler(orig_sr, target_sr, str(audio.device))(audio)
+
+
+def load_audio_multi_rate(
+    audio_path: str,
+    sample_rates: Iterable[int],
+    max_audio_length_seconds: Optional[float] = None,
+    verbose=False,
+) -> Dict[int, torch.Tensor]:
+    """
+    Decode ``audio_path`` once and resample it to every rate in ``sample_rates``.
+
+    The audio is truncated to ``max_audio_length_seconds`` at its native rate, so that only
+    the kept part is resampled.
+
+    Returns:
+        dict mapping each sample rate to a [1, N] float32 tensor.
+    """
+    audio, sr = decode_audio(audio_path)
+    if max_audio_length_seconds is not None:
+        max_audio_samples = int(max_audio_length_seconds * sr)
+        if audio.shape[1] > max_audio_samples:
+            if verbose:
+                print(f"Audio too long ({audio.shape[1]} samples), truncating to {max_audio_samples} samples")
+            audio = audio[:, :max_audio_samples]
+    return {target_sr: resample(audio, sr, target_sr) for target_sr in sample_rates}
+
+
+def load_audio(audio_path: str, sampling_rate: int, max_audio_length_seconds: Optional[float] = None, verbose=False) -> torch.Tensor:
+    """
+    Single-rate shortcut of :func:`load_audio_multi_rate`.
+    """
+    return load_audio_multi_rate(audio_path, (sampling_rate,), max_audio_length_seconds, verbose)[sampling_rate]
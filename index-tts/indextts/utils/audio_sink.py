@@ -0,0 +1,290 @@
+import contextlib
+import functools
+import inspect
+import os
+import struct
+import sys
+from typing import BinaryIO, List, Optional, Union
+
+import torch
+import torchaudio
+
+_MAX_CHUNK_BYTES = 0xFFFFFFFF
+
+
+def to_int16(wav: torch.Tensor) -> torch.Tensor:
+    """
+    Int16 PCM of a waveform already scaled to the int16 range (as returned by the vocoder),
+    clamped in place, on CPU.
+    """
+    if wav.dtype != torch.int16:
+        wav = wav.detach().cpu().clamp_(-32767.0, 32767.0).to(torch.int16)
+    return wav.cpu()
+
+
+class AudioSink:
+    """
+    Destination of the synthesized audio, written segment by segment as it is produced:
+    nothing but the current segment is kept in memory (see ``open_sink``).
+
+    The base class only counts the samples (e.g. for ``stream_return``, the caller gets the audio).
+    Waveforms are [channels, samples] tensors in the int16 range.
+    """
+    path: Optional[str] = None
+
+    def __init__(self, sampling_rate: int, channels: int = 1):
+        self.sampling_rate = sampling_rate
+        self.channels = channels
+        self.num_samples = 0
+        self.closed = False
+
+    @property
+    def duration(self) -> float:
+        return self.num_samples / self.sampling_rate
+
+    def write(self, wav: torch.Tensor):
+        pcm = to_int16(wav)
+        if pcm.dim() == 1:
+            pcm = pcm.unsqueeze(0)
+        assert pcm.shape[0] == self.channels, f"expected {self.channels} channels, got {pcm.shape[0]}"
+        if pcm.shape[-1] == 0:
+            return
+        self._write(pcm)
+        self.num_samples += pcm.shape[-1]
+
+    def write_silence(self, num_samples: int):
+        if num_samples > 0:
+            self.write(torch.zeros(self.channels, num_samples, dtype=torch.int16))
+
+    def _write(self, pcm: torch.Tensor):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _interleaved_bytes(pcm: torch.Tensor) -> bytes:
+    # [C, N] -> little-endian s16, interleaved by sample
+    data = pcm.t().contiguous().numpy() if pcm.shape[0] > 1 else pcm[0].numpy()
+    if sys.byteorder != "little":
+        data = data.byteswap()
+    return data.tobytes()
+
+
+def _open_output(path: str) -> BinaryIO:
+    if os.path.dirname(path) != "":
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open(path, "wb")
+
+
+class WavSink(AudioSink):
+    """
+    16-bit PCM WAV file, the RIFF and data sizes of the header are rewritten after every segment,
+    so the file on disk is always a valid WAV of the audio written so far (also after a crash).
+    """
+
+    def __init__(self, path: str, sampling_rate: int, channels: int = 1):
+        super().__init__(sampling_rate, channels)
+        self.path = path
+        self.file = _open_output(path)
+        self.data_bytes = 0
+        self.file.write(self._header())
+        self.file.flush()
+
+    def _header(self) -> bytes:
+        block_align = self.channels * 2
+        data_bytes = min(self.data_bytes, _MAX_CHUNK_BYTES - 36)
+        return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + data_bytes, b"WAVE",
+                           b"fmt ", 16, 1, self.channels, self.sampling_rate,
+                           self.sampling_rate * block_align, block_align, 16,
+                           b"data", data_bytes)
+
+    def _write(self, pcm: torch.Tensor):
+        data = _interleaved_bytes(pcm)
+        self.file.write(data)
+        self.data_bytes += len(data)
+        self.file.seek(0)
+        self.file.write(self._header())
+        self.file.seek(0, os.SEEK_END)
+        self.file.flush()
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+        super().close()
+
+
+class FlacSink(AudioSink):
+    """
+    16-bit FLAC file (needs ``soundfile``), encoded frame by frame; the total length in the
+    stream header is only written at ``close``, a partial file is still decodable.
+    """
+
+    def __init__(self, path: str, sampling_rate: int, channels: int = 1):
+        import soundfile as sf
+
+        super().__init__(sampling_rate, channels)
+        self.path = path
+        if os.path.dirname(path) != "":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = sf.SoundFile(path, "w", samplerate=sampling_rate, channels=channels,
+                                 format="FLAC", subtype="PCM_16")
+
+    def _write(self, pcm: torch.Tensor):
+        self.file.write(pcm.t().contiguous().numpy())
+        self.file.flush()
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+        super().close()
+
+
+class PcmSink(AudioSink):
+    """
+    Raw s16le PCM (interleaved) to a file, a named pipe or a binary stream such as stdout,
+    e.g. ``... | ffplay -f s16le -ar 22050 -ch_layout mono -``.
+    """
+
+    def __init__(self, target: Union[str, BinaryIO], sampling_rate: int, channels: int = 1):
+        super().__init__(sampling_rate, channels)
+        if isinstance(target, str):
+            self.path = target
+            self.file = _open_output(target)
+            self.owns_file = True
+        else:
+            self.file = target
+            self.owns_file = False
+
+    def _write(self, pcm: torch.Tensor):
+        self.file.write(_interleaved_bytes(pcm))
+        self.file.flush()
+
+    def close(self):
+        if not self.closed and self.owns_file:
+            self.file.close()
+        super().close()
+
+
+class TensorSink(AudioSink):
+    """
+    Keeps the int16 audio in memory, e.g. to return it to Gradio; with a ``path``, saved by
+    ``torchaudio.save`` at ``close`` (formats without an incremental writer, e.g. mp3).
+    """
+
+    def __init__(self, sampling_rate: int, channels: int = 1, path: Optional[str] = None):
+        super().__init__(sampling_rate, channels)
+        self.path = path
+        self.chunks: List[torch.Tensor] = []
+
+    def _write(self, pcm: torch.Tensor):
+        self.chunks.append(pcm)
+
+    def tensor(self) -> torch.Tensor:
+        if not self.chunks:
+            return torch.zeros(self.channels, 0, dtype=torch.int16)
+        if len(self.chunks) > 1:
+            self.chunks = [torch.cat(self.chunks, dim=1)]
+        return self.chunks[0]
+
+    def close(self):
+        if not self.closed and self.path:
+            if os.path.dirname(self.path) != "":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            torchaudio.save(self.path, self.tensor(), self.sampling_rate)
+        super().close()
+
+
+def open_sink(output: Union[None, str, BinaryIO], sampling_rate: int, channels: int = 1) -> AudioSink:
+    """
+    Sink for the ``output_path`` of inference:
+
+    - ``None``: in memory (``TensorSink``)
+    - ``"-"`` or a binary stream: raw PCM (``PcmSink``)
+    - a path: by extension, ``.wav`` -> ``WavSink``, ``.flac`` -> ``FlacSink``,
+      ``.pcm``/``.raw`` -> ``PcmSink``, other formats are saved by torchaudio at the end.
+    """
+    if output is None:
+        return TensorSink(sampling_rate, channels)
+    if output == "-":
+        return PcmSink(sys.stdout.buffer, sampling_rate, channels)
+    if not isinstance(output, str):
+        return PcmSink(output, sampling_rate, channels)
+    ext = os.path.splitext(output)[1].lower()
+    if ext in ("", ".wav"):
+        return WavSink(output, sampling_rate, channels)
+    if ext == ".flac":
+        return FlacSink(output, sampling_rate, channels)
+    if ext in (".pcm", ".raw"):
+        return PcmSink(output, sampling_rate, channels)
+    return TensorSink(sampling_rate, channels, path=output)
+
+
+def targets_stdout(output: Union[None, str, BinaryIO]) -> bool:
+    """
+    Whether the audio of ``output`` (see ``open_sink``) goes to the standard output.
+    """
+    if output == "-":
+        return True
+    if output is None or isinstance(output, str):
+        return False
+    try:
+        return output.fileno() == 1
+    except (AttributeError, OSError, ValueError):
+        return False
+
+
+def stdout_audio(fn):
+    """
+    Decorator of the inference methods: when their ``output_path`` goes to stdout (``"-"`` or e.g.
+    ``sys.stdout.buffer``), everything they print goes to stderr instead, log lines would corrupt
+    the PCM stream. ``"-"`` is resolved to ``sys.stdout.buffer`` before the redirection.
+
+    For a generator function, only its own steps are redirected, not the caller's code between
+    two items.
+    """
+    signature = inspect.signature(fn)
+
+    def bind(args, kwargs):
+        bound = signature.bind(*args, **kwargs)
+        output = bound.arguments.get("output_path")
+        if output == "-":
+            bound.arguments["output_path"] = sys.stdout.buffer
+        return targets_stdout(output), bound
+
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def generator_wrapper(*args, **kwargs):
+            to_stdout, bound = bind(args, kwargs)
+            if not to_stdout:
+                return (yield from fn(*args, **kwargs))
+            generator = fn(*bound.args, **bound.kwargs)
+            try:
+                while True:
+                    with contextlib.redirect_stdout(sys.stderr):
+                        try:
+                            item = next(generator)
+                        except StopIteration as e:
+                            return e.value
+                    yield item
+            finally:
+                with contextlib.redirect_stdout(sys.stderr):
+                    generator.close()
+
+        return generator_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        to_stdout, bound = bind(args, kwargs)
+        if not to_stdout:
+            return fn(*args, **kwargs)
+        with contextlib.redirect_stdout(sys.stderr):
+            return fn(*bound.args, **bound.kwargs)
+
+    return wrapper
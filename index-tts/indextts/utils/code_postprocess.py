@@ -0,0 +1,69 @@
+from typing import Optional, Tuple
+
+import torch
+
+
+def find_stop_positions(codes: torch.Tensor, stop_token: int) -> torch.Tensor:
+    """
+    Index of the first ``stop_token`` in every row, or ``T`` if the row has none.
+
+    Args:
+        codes: [B, T] generated mel codes.
+    Returns:
+        [B] long tensor of code lengths.
+    """
+    B, T = codes.shape
+    is_stop = codes == stop_token
+    first = is_stop.to(torch.uint8).argmax(dim=1)
+    return torch.where(is_stop.any(dim=1), first, torch.full_like(first, T)).long()
+
+
+def silent_run_positions(codes: torch.Tensor, silent_token: int) -> torch.Tensor:
+    """
+    For each silent code, its 0-based position inside the run of consecutive silent codes
+    it belongs to (-1 for other codes).
+    """
+    silent = codes == silent_token
+    count = silent.long().cumsum(dim=1)
+    # the silent count is constant across a run of non-silent codes,
+    # cummax carries the count of the last non-silent code forward
+    run_start = torch.where(silent, torch.zeros_like(count), count).cummax(dim=1).values
+    return torch.where(silent, count - run_start - 1, torch.full_like(count, -1))
+
+
+def postprocess_codes(
+    codes: torch.Tensor,
+    stop_token: int,
+    silent_token: int = 52,
+    max_consecutive: Optional[int] = 30,
+    keep_silent: int = 10,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Trim the codes at the stop token and shrink long silences, for the whole batch at once.
+
+    Rows containing more than ``max_consecutive`` silent codes keep only the first ``keep_silent``
+    codes of every silent run. Set ``max_consecutive=None`` to only trim at the stop token.
+
+    Args:
+        codes: [B, T] generated mel codes.
+    Returns:
+        codes: [B, T'] compacted codes, padded with ``stop_token`` and clipped to the longest row.
+        code_lens: [B] long tensor of valid lengths.
+    """
+    B, T = codes.shape
+    lens = find_stop_positions(codes, stop_token)
+    keep = torch.arange(T, device=codes.device).unsqueeze(0) < lens.unsqueeze(1)
+    if max_consecutive is not None:
+        shrink_rows = (codes == silent_token).sum(dim=1) > max_consecutive
+        if shrink_rows.any():
+            long_silence = silent_run_positions(codes, silent_token) >= keep_silent
+            keep = keep & ~(long_silence & shrink_rows.unsqueeze(1))
+    code_lens = keep.sum(dim=1)
+    max_len = int(code_lens.max().item()) if B > 0 else 0
+
+    out = torch.full((B, max_len), stop_token, dtype=codes.dtype, device=codes.device)
+    # destination column of every kept code
+    dest = keep.long().cumsum(dim=1) - 1
+    rows = torch.arange(B, device=codes.device).unsqueeze(1).expand(B, T)
+    out[rows[keep], dest[keep]] = codes[keep]
+    return out, code_lens
@@ -3,21 +3,20 @@ import random
 import re
 
 import torch
-import torchaudio
+
+from indextts.utils.audio_io import decode_audio, resample
 
 MATPLOTLIB_FLAG = False
 
 
 def load_audio(audiopath, sampling_rate):
-    audio, sr = torchaudio.load(audiopath)
+    # multi-channel audio: keep the first channel
+    audio, sr = decode_audio(audiopath, mono="first")
     # print(f"wave shape: {audio.shape}, sample_rate: {sr}")
 
-    if audio.size(0) > 1:  # mix to mono
-        audio = audio[0].unsqueeze(0)
-
     if sr != sampling_rate:
         try:
-            audio = torchaudio.functional.resample(audio, sr, sampling_rate)
+            audio = resample(audio, sr, sampling_rate)
         except Exception as e:
             print(f"Warning: {audiopath}, wave shape: {audio.shape}, sample_rate: {sr}")
             return None
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import torch
+
+from indextts.utils.metrics import metrics
+
+
+def audio_content_hash(audio_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    SHA-1 of the audio file contents, so that editing a file in place invalidates its cache entries.
+    """
+    h = hashlib.sha1()
+    with open(audio_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _file_sample_hash(path: str, sample_size: int = 1 << 20) -> str:
+    """
+    SHA-1 of the size, the first and the last ``sample_size`` bytes of a file: cheap for multi-GB
+    checkpoints, and unlike the modification time it survives copying the file.
+    """
+    size = os.path.getsize(path)
+    h = hashlib.sha1(f"{size}\n".encode())
+    with open(path, "rb") as f:
+        h.update(f.read(sample_size))
+        if size > sample_size:
+            f.seek(max(sample_size, size - sample_size))
+            h.update(f.read(sample_size))
+    return h.hexdigest()
+
+
+def model_fingerprint(files: Dict[str, Optional[str]]) -> str:
+    """
+    Short hash of the contents of every model file that produces the cached bundles (see
+    ``_file_sample_hash``), so that swapping any of those weights invalidates the cache while a
+    copied or re-downloaded checkpoint keeps it.
+
+    Args:
+        files: model name -> weights path (None if the file could not be located).
+    """
+    h = hashlib.sha1()
+    for name, path in sorted(files.items()):
+        if path is not None and os.path.isfile(path):
+            h.update(f"{name}:{_file_sample_hash(path)}\n".encode())
+        else:
+            h.update(f"{name}:missing\n".encode())
+    return h.hexdigest()[:16]
+
+class ConditioningCache:
+    """
+    LRU cache of prompt conditioning bundles (dicts of tensors), keyed by audio content hash.
+
+    If ``cache_dir`` is set, every computed bundle is also persisted as ``<cache_dir>/<kind>/<hash>.pt``,
+    so that a restarted server (or another worker) can reuse voices without running the encoders again.
+    """
+
+    def __init__(self, max_entries: int = 8, cache_dir: Optional[str] = None, namespace: str = ""):
+        """
+        Args:
+            max_entries (int): maximum number of bundles kept in memory.
+            cache_dir (str): optional directory for the on-disk store.
+            namespace (str): model fingerprint stored with each entry, bundles computed by
+                a different model are ignored.
+        """
+        self.max_entries = max(1, max_entries)
+        self.cache_dir = cache_dir
+        self.namespace = namespace
+        self._entries: "OrderedDict[str, Dict[str, torch.Tensor]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(kind: str, audio_path: str) -> str:
+        return f"{kind}/{audio_content_hash(audio_path)}"
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pt")
+
+    def get(self, key: str, device=None) -> Optional[Dict[str, torch.Tensor]]:
+        with self._lock:
+            bundle = self._entries.get(key)
+            if bundle is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.inc("cache_hits", cache="cond", kind=key.split("/", 1)[0], tier="memory")
+                return bundle
+        if self.cache_dir and os.path.isfile(self._disk_path(key)):
+            try:
+                data = torch.load(self._disk_path(key), map_location="cpu")
+            except Exception as e:
+                print(f">> Failed to load cached conditioning {key}: {e!r}")
+                data = None
+            if data is not None and data.get("namespace") == self.namespace:
+                bundle = {k: v.to(device) if device is not None else v for k, v in data["tensors"].items()}
+                self._put_memory(key, bundle)
+                with self._lock:
+                    self.hits += 1
+                metrics.inc("cache_hits", cache="cond", kind=key.split("/", 1)[0], tier="disk")
+                return bundle
+        with self._lock:
+            self.misses += 1
+        metrics.inc("cache_misses", cache="cond", kind=key.split("/", 1)[0])
+        return None
+
+    def put(self, key: str, bundle: Dict[str, torch.Tensor]):
+        self._put_memory(key, bundle)
+        if self.cache_dir:
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = {
+                "namespace": self.namespace,
+                "tensors": {k: v.detach().cpu() for k, v in bundle.items()},
+            }
+            # unique per writer, threads of one process may store the same key at once
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".",
+                                            suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    torch.save(data, f)
+                # atomic on POSIX and Windows: concurrent workers never read a partial file
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    def _put_memory(self, key: str, bundle: Dict[str, torch.Tensor]):
+        with self._lock:
+            self._entries[key] = bundle
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: str):
+        return key in self._entries
@@ -0,0 +1,54 @@
+from typing import List, Sequence, Tuple
+
+# s2mel 默认把每个 GPT 语义码扩展为 1.72 个 mel 帧
+CODE_TO_FRAME_RATIO = 1.72
+
+
+class DurationPlanner:
+    """
+    Fit the speech of a request to ``target_seconds`` in one pass, through the ``ylens`` of the
+    s2mel length regulator: every segment gets a share of the remaining mel frames proportional
+    to its weight, and its codes are stretched or compressed to that many frames.
+
+    Segments are planned in order, after their GPT decode (the code count is known), so the
+    rounding and clamping error of a segment is absorbed by the next ones.
+
+    Args:
+        weights: relative length of each segment (e.g. its text token count).
+        frames_per_second: mel frame rate (sampling rate / hop length).
+        fixed_seconds: part of the target not covered by speech (silences between segments).
+        speed_range: (slowest, fastest) speaking rate relative to the natural rate of the model,
+            a segment is never stretched or compressed beyond it.
+    """
+
+    def __init__(self, target_seconds: float, weights: Sequence[float], frames_per_second: float,
+                 fixed_seconds: float = 0.0, speed_range: Tuple[float, float] = (0.5, 2.0)):
+        if target_seconds <= 0:
+            raise ValueError(f"target duration must be positive, got {target_seconds}")
+        self.weights = [max(float(w), 1e-6) for w in weights]
+        self.frames_per_second = frames_per_second
+        self.speed_range = speed_range
+        self.remaining_frames = (target_seconds - fixed_seconds) * frames_per_second
+        self.speeds: List[float] = []
+
+    def segment_frames(self, seg_idx: int, code_len: int) -> int:
+        """
+        Mel frame count of the segment ``seg_idx`` with ``code_len`` GPT codes.
+        """
+        code_len = max(int(code_len), 1)
+        natural = code_len * CODE_TO_FRAME_RATIO
+        share = self.weights[seg_idx] / sum(self.weights[seg_idx:])
+        wanted = max(self.remaining_frames, 0.0) * share
+        slowest, fastest = self.speed_range
+        frames = min(max(wanted, natural / fastest), natural / slowest)
+        frames = max(1, int(round(frames)))
+        self.remaining_frames -= frames
+        self.speeds.append(natural / frames)
+        return frames
+
+
+def pad_to_duration(num_samples: int, target_seconds: float, sampling_rate: int) -> int:
+    """
+    Samples of silence to append so that ``num_samples`` reaches ``target_seconds`` (0 if it is already longer).
+    """
+    return max(0, int(round(target_seconds * sampling_rate)) - num_samples)
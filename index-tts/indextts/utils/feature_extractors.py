@@ -48,3 +48,97 @@ class MelSpectrogramFeatures(FeatureExtractor):
         mel = self.mel_spec(audio)
         mel = safe_log(mel)
         return mel
+
+
+class SeamlessM4TFeatures(FeatureExtractor):
+    """
+    Torch implementation of ``transformers.SeamlessM4TFeatureExtractor`` (the w2v-bert 2.0 input):
+    kaldi 80-bin log-mel fbank (25 ms povey window, 10 ms hop, pre-emphasis 0.97, DC removal),
+    zero-mean unit-variance normalization of every mel bin per utterance, padding to an even
+    number of frames and stacking of frame pairs (160 features).
+
+    Runs batched on the device of the module, without going through NumPy. Same inputs and
+    outputs as the HF extractor: a [N] / [B, N] tensor or a list of waveforms in [-1, 1], and
+    ``{"input_features": [B, T, 160], "attention_mask": [B, T]}``.
+    """
+
+    def __init__(self, sampling_rate=16000, num_mel_bins=80, padding_value=0.0, stride=2):
+        super().__init__()
+        self.sampling_rate = sampling_rate
+        self.num_mel_bins = num_mel_bins
+        self.padding_value = padding_value
+        self.stride = stride
+        self.frame_length = int(0.025 * sampling_rate)
+        self.hop_length = int(0.010 * sampling_rate)
+        self.n_fft = 1 << (self.frame_length - 1).bit_length()
+        window = torch.hann_window(self.frame_length, periodic=False, dtype=torch.float64).pow(0.85)
+        mel_banks, _ = torchaudio.compliance.kaldi.get_mel_banks(num_mel_bins, self.n_fft, float(sampling_rate),
+                                                                 20.0, 0.0, 100.0, -500.0, 1.0)
+        # kaldi leaves out the Nyquist bin
+        mel_banks = torch.nn.functional.pad(mel_banks, (0, 1))
+        self.register_buffer("window", window.float(), persistent=False)
+        self.register_buffer("mel_banks", mel_banks.float().t().contiguous(), persistent=False)
+
+    @classmethod
+    def from_pretrained(cls, pretrained_model_name_or_path, **kwargs):
+        """
+        Settings of a pretrained ``SeamlessM4TFeatureExtractor``, e.g. ``facebook/w2v-bert-2.0``.
+        """
+        from transformers import SeamlessM4TFeatureExtractor
+
+        hf_extractor = SeamlessM4TFeatureExtractor.from_pretrained(pretrained_model_name_or_path, **kwargs)
+        return cls(sampling_rate=hf_extractor.sampling_rate, num_mel_bins=hf_extractor.num_mel_bins,
+                   padding_value=hf_extractor.padding_value, stride=hf_extractor.stride)
+
+    def num_output_frames(self, num_samples: int) -> int:
+        """
+        Length of ``input_features`` for one waveform of ``num_samples`` samples extracted alone.
+        """
+        num_frames = max(0, (num_samples - self.frame_length) // self.hop_length + 1)
+        return -(-num_frames // self.stride)
+
+    @torch.no_grad()
+    def forward(self, raw_speech, sampling_rate=None, **kwargs):
+        if sampling_rate is not None and sampling_rate != self.sampling_rate:
+            raise ValueError(f"expected {self.sampling_rate} Hz audio, got {sampling_rate} Hz")
+        device = self.window.device
+        if isinstance(raw_speech, (list, tuple)):
+            waveforms = [torch.as_tensor(x, dtype=torch.float32).reshape(-1).to(device) for x in raw_speech]
+            lengths = torch.tensor([len(x) for x in waveforms], device=device)
+            waveform = torch.nn.utils.rnn.pad_sequence(waveforms, batch_first=True)
+        else:
+            waveform = torch.as_tensor(raw_speech, dtype=torch.float32).to(device)
+            if waveform.dim() == 1:
+                waveform = waveform.unsqueeze(0)
+            lengths = torch.full((waveform.shape[0],), waveform.shape[1], device=device)
+        # kaldi works on the int16 scale
+        waveform = waveform * 32768.0
+        if waveform.shape[1] < self.frame_length:
+            waveform = torch.nn.functional.pad(waveform, (0, self.frame_length - waveform.shape[1]))
+        num_frames = torch.clamp((lengths - self.frame_length) // self.hop_length + 1, min=0)
+
+        frames = waveform.unfold(1, self.frame_length, self.hop_length)  # [B, T, frame_length]
+        frames = frames - frames.mean(dim=-1, keepdim=True)
+        # pre-emphasis, the first sample of a frame is its own predecessor
+        frames = torch.cat([frames[..., :1] * (1 - 0.97), frames[..., 1:] - 0.97 * frames[..., :-1]], dim=-1)
+        spectrum = torch.fft.rfft(frames * self.window, n=self.n_fft).abs().pow(2)
+        features = torch.log(torch.clamp(spectrum @ self.mel_banks, min=1.192092955078125e-07))
+
+        # per utterance and mel bin, over the frames of the utterance only (unbiased variance)
+        mask = torch.arange(features.shape[1], device=device).unsqueeze(0) < num_frames.unsqueeze(1)
+        valid = mask.unsqueeze(-1).to(features.dtype)
+        count = num_frames.to(features.dtype).view(-1, 1, 1)
+        mean = (features * valid).sum(dim=1, keepdim=True) / count.clamp(min=1)
+        var = ((features - mean) * valid).pow(2).sum(dim=1, keepdim=True) / (count - 1).clamp(min=1)
+        features = (features - mean) / torch.sqrt(var + 1e-7)
+        features = features.masked_fill(~mask.unsqueeze(-1), self.padding_value)
+
+        # pad to a multiple of the stride, then stack `stride` consecutive frames
+        pad = -features.shape[1] % self.stride
+        if pad:
+            features = torch.nn.functional.pad(features, (0, 0, 0, pad), value=self.padding_value)
+            mask = torch.nn.functional.pad(mask, (0, pad), value=False)
+        batch_size, total_frames, _ = features.shape
+        input_features = features.reshape(batch_size, total_frames // self.stride, self.num_mel_bins * self.stride)
+        attention_mask = mask[:, 1::self.stride].to(torch.int32)
+        return {"input_features": input_features, "attention_mask": attention_mask}
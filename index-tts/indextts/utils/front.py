@@ -1,15 +1,58 @@
 # -*- coding: utf-8 -*-
 import os
+import threading
 import traceback
 import re
+from collections import OrderedDict
 from typing import List, Union, overload
 import warnings
 from indextts.utils.common import tokenize_by_CJK_char, de_tokenized_by_CJK_char
+from indextts.utils.metrics import metrics
 from sentencepiece import SentencePieceProcessor
 
 
+class _LRUMemo:
+    """
+    Thread-safe LRU memo of text processing results.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
 class TextNormalizer:
-    def __init__(self):
+    def __init__(self, memo_size=4096):
+        """
+        Args:
+            memo_size (int): number of normalized texts kept in the LRU memo, 0 disables it.
+        """
         self.zh_normalizer = None
         self.en_normalizer = None
         self.char_rep_map = {
@@ -53,11 +96,13 @@ class TextNormalizer:
             "$": ".",
             **self.char_rep_map,
         }
+        self.char_rep_pattern = re.compile("|".join(re.escape(p) for p in self.char_rep_map.keys()))
+        self.zh_char_rep_pattern = re.compile("|".join(re.escape(p) for p in self.zh_char_rep_map.keys()))
+        self._memo = _LRUMemo(memo_size)
 
     def match_email(self, email):
         # 正则表达式匹配邮箱格式：数字英文@数字英文.英文
-        pattern = r"^[a-zA-Z0-9]+@[a-zA-Z0-9]+\.[a-zA-Z]+$"
-        return re.match(pattern, email) is not None
+        return TextNormalizer._EMAIL_RE.match(email) is not None
 
     PINYIN_TONE_PATTERN = r"(?<![a-z])((?:[bpmfdtnlgkhjqxzcsryw]|[zcs]h)?(?:[aeiouüv]|[ae]i|u[aio]|ao|ou|i[aue]|[uüv]e|[uvü]ang?|uai|[aeiuv]n|[aeio]ng|ia[no]|i[ao]ng)|ng|er)([1-5])"
     """
@@ -74,15 +119,23 @@ class TextNormalizer:
     # 匹配常见英语缩写 's，仅用于替换为 is，不匹配所有 's
     ENGLISH_CONTRACTION_PATTERN = r"(what|where|who|which|how|t?here|it|s?he|that|this)'s"
 
+    # 预编译的正则
+    _EMAIL_RE = re.compile(r"^[a-zA-Z0-9]+@[a-zA-Z0-9]+\.[a-zA-Z]+$")
+    _CHINESE_RE = re.compile(r"[\u4e00-\u9fff]")
+    _ALPHA_RE = re.compile(r"[a-zA-Z]")
+    _PINYIN_TONE_RE = re.compile(PINYIN_TONE_PATTERN, re.IGNORECASE)
+    _NAME_RE = re.compile(NAME_PATTERN, re.IGNORECASE)
+    _ENGLISH_CONTRACTION_RE = re.compile(ENGLISH_CONTRACTION_PATTERN, re.IGNORECASE)
+    _JQX_PINYIN_RE = re.compile(r"([jqx])[uü](n|e|an)*(\d)", re.IGNORECASE)
 
     def use_chinese(self, s):
-        has_chinese = bool(re.search(r"[\u4e00-\u9fff]", s))
-        has_alpha = bool(re.search(r"[a-zA-Z]", s))
+        has_chinese = TextNormalizer._CHINESE_RE.search(s) is not None
+        has_alpha = TextNormalizer._ALPHA_RE.search(s) is not None
         is_email = self.match_email(s)
         if has_chinese or not has_alpha or is_email:
             return True
 
-        has_pinyin = bool(re.search(TextNormalizer.PINYIN_TONE_PATTERN, s, re.IGNORECASE))
+        has_pinyin = TextNormalizer._PINYIN_TONE_RE.search(s) is not None
         return has_pinyin
 
     def load(self):
@@ -114,8 +167,25 @@ class TextNormalizer:
         if not self.zh_normalizer or not self.en_normalizer:
             print("Error, text normalizer is not initialized !!!")
             return ""
+        result = self._memo.get(text)
+        if result is None:
+            result = self._normalize(text)
+            self._memo.put(text, result)
+        return result
+
+    def batch_normalize(self, texts: List[str]) -> List[str]:
+        """
+        Normalize many texts (e.g. all subtitle lines of a video), each distinct text is normalized once.
+        """
+        results = {}
+        for text in texts:
+            if text not in results:
+                results[text] = self.normalize(text)
+        return [results[text] for text in texts]
+
+    def _normalize(self, text: str) -> str:
         if self.use_chinese(text):
-            text = re.sub(TextNormalizer.ENGLISH_CONTRACTION_PATTERN, r"\1 is", text, flags=re.IGNORECASE)
+            text = TextNormalizer._ENGLISH_CONTRACTION_RE.sub(r"\1 is", text)
             replaced_text, pinyin_list = self.save_pinyin_tones(text.rstrip())
             
             replaced_text, original_name_list = self.save_names(replaced_text)
@@ -128,17 +198,15 @@ class TextNormalizer:
             result = self.restore_names(result, original_name_list)
             # 恢复拼音声调
             result = self.restore_pinyin_tones(result, pinyin_list)
-            pattern = re.compile("|".join(re.escape(p) for p in self.zh_char_rep_map.keys()))
-            result = pattern.sub(lambda x: self.zh_char_rep_map[x.group()], result)
+            result = self.zh_char_rep_pattern.sub(lambda x: self.zh_char_rep_map[x.group()], result)
         else:
             try:
-                text = re.sub(TextNormalizer.ENGLISH_CONTRACTION_PATTERN, r"\1 is", text, flags=re.IGNORECASE)
+                text = TextNormalizer._ENGLISH_CONTRACTION_RE.sub(r"\1 is", text)
                 result = self.en_normalizer.normalize(text)
             except Exception:
                 result = text
                 print(traceback.format_exc())
-            pattern = re.compile("|".join(re.escape(p) for p in self.char_rep_map.keys()))
-            result = pattern.sub(lambda x: self.char_rep_map[x.group()], result)
+            result = self.char_rep_pattern.sub(lambda x: self.char_rep_map[x.group()], result)
         return result
 
     def correct_pinyin(self, pinyin: str):
@@ -149,9 +217,8 @@ class TextNormalizer:
         if pinyin[0] not in "jqxJQX":
             return pinyin
         # 匹配 jqx 的韵母为 u/ü 的拼音
-        pattern = r"([jqx])[uü](n|e|an)*(\d)"
         repl = r"\g<1>v\g<2>\g<3>"
-        pinyin = re.sub(pattern, repl, pinyin, flags=re.IGNORECASE)
+        pinyin = TextNormalizer._JQX_PINYIN_RE.sub(repl, pinyin)
         return pinyin.upper()
 
     def save_names(self, original_text):
@@ -160,8 +227,7 @@ class TextNormalizer:
         例如：克里斯托弗·诺兰 -> <n_a>
         """
         # 人名
-        name_pattern = re.compile(TextNormalizer.NAME_PATTERN, re.IGNORECASE)
-        original_name_list = re.findall(name_pattern, original_text)
+        original_name_list = TextNormalizer._NAME_RE.findall(original_text)
         if len(original_name_list) == 0:
             return (original_text, None)
         original_name_list = list(set("".join(n) for n in original_name_list))
@@ -194,8 +260,7 @@ class TextNormalizer:
         例如：xuan4 -> <pinyin_a>
         """
         # 声母韵母+声调数字
-        origin_pinyin_pattern = re.compile(TextNormalizer.PINYIN_TONE_PATTERN, re.IGNORECASE)
-        original_pinyin_list = re.findall(origin_pinyin_pattern, original_text)
+        original_pinyin_list = TextNormalizer._PINYIN_TONE_RE.findall(original_text)
         if len(original_pinyin_list) == 0:
             return (original_text, None)
         original_pinyin_list = list(set("".join(p) for p in original_pinyin_list))
@@ -229,7 +294,13 @@ class TextNormalizer:
 
 
 class TextTokenizer:
-    def __init__(self, vocab_file: str, normalizer: TextNormalizer = None):
+    def __init__(self, vocab_file: str, normalizer: TextNormalizer = None, memo_size=4096):
+        """
+        Args:
+            vocab_file (str): sentencepiece model file.
+            normalizer (TextNormalizer): text normalizer applied before encoding.
+            memo_size (int): number of encoded texts kept in the LRU memo, 0 disables it.
+        """
         self.vocab_file = vocab_file
         self.normalizer = normalizer
 
@@ -246,6 +317,8 @@ class TextTokenizer:
             # 预处理器
             tokenize_by_CJK_char,
         ]
+        # (text, out_type) -> tokens, e.g. the web UI re-tokenizes the same text on every edit
+        self._memo = _LRUMemo(memo_size)
 
     @property
     def vocab_size(self):
@@ -313,27 +386,75 @@ class TextTokenizer:
     def tokenize(self, text: str) -> List[str]:
         return self.encode(text, out_type=str)
 
-    def encode(self, text: str, **kwargs):
-        if len(text) == 0:
-            return []
-        if len(text.strip()) == 1:
-            return self.sp_model.Encode(text, out_type=kwargs.pop("out_type", int), **kwargs)
+    def _preprocess(self, text: str) -> str:
         # 预处理
         if self.normalizer:
-            text = self.normalizer.normalize(text)
+            with metrics.span("text_normalize"):
+                text = self.normalizer.normalize(text)
         if len(self.pre_tokenizers) > 0:
             for pre_tokenizer in self.pre_tokenizers:
                 text = pre_tokenizer(text)
-        return self.sp_model.Encode(text, out_type=kwargs.pop("out_type", int), **kwargs)
+        return text
+
+    def encode(self, text: str, **kwargs):
+        if len(text) == 0:
+            return []
+        out_type = kwargs.pop("out_type", int)
+        # only the plain encode is memoized, sampling options (enable_sampling, ...) bypass the memo
+        key = (text, out_type) if not kwargs else None
+        if key is not None:
+            tokens = self._memo.get(key)
+            if tokens is not None:
+                return list(tokens)
+        if len(text.strip()) == 1:
+            tokens = self.sp_model.Encode(text, out_type=out_type, **kwargs)
+        else:
+            text = self._preprocess(text)
+            with metrics.span("tokenize"):
+                tokens = self.sp_model.Encode(text, out_type=out_type, **kwargs)
+        if key is not None:
+            self._memo.put(key, tuple(tokens))
+        return tokens
 
     def batch_encode(self, texts: List[str], **kwargs):
-        # 预处理
-        if self.normalizer:
-            texts = [self.normalizer.normalize(text) for text in texts]
-        if len(self.pre_tokenizers) > 0:
-            for pre_tokenizer in self.pre_tokenizers:
-                texts = [pre_tokenizer(text) for text in texts]
-        return self.sp_model.Encode(texts, out_type=kwargs.pop("out_type", int), **kwargs)
+        """
+        Encode many texts: memoized texts are reused, every distinct new text is normalized once
+        and all of them are encoded by a single sentencepiece call.
+        """
+        out_type = kwargs.pop("out_type", int)
+        if kwargs:
+            return [self.encode(text, out_type=out_type, **kwargs) for text in texts]
+        results = {}
+        todo = []
+        for text in texts:
+            if text in results:
+                continue
+            tokens = self._memo.get((text, out_type)) if len(text) > 0 else ()
+            results[text] = tokens
+            if tokens is None:
+                todo.append(text)
+        if todo:
+            if self.normalizer:
+                with metrics.span("text_normalize", texts=len(todo)):
+                    normalized = self.normalizer.batch_normalize(
+                        [text for text in todo if len(text.strip()) != 1])
+                normalized = iter(normalized)
+            preprocessed = []
+            for text in todo:
+                if len(text.strip()) == 1:
+                    preprocessed.append(text)
+                    continue
+                if self.normalizer:
+                    text = next(normalized)
+                for pre_tokenizer in self.pre_tokenizers:
+                    text = pre_tokenizer(text)
+                preprocessed.append(text)
+            with metrics.span("tokenize", texts=len(todo)):
+                encoded = self.sp_model.Encode(preprocessed, out_type=out_type)
+            for text, tokens in zip(todo, encoded):
+                results[text] = tuple(tokens)
+                self._memo.put((text, out_type), results[text])
+        return [list(results[text]) for text in texts]
 
     def decode(self, ids: Union[List[int], int], do_lower_case=False, **kwargs):
         if isinstance(ids, int):
@@ -0,0 +1,4 @@
+from indextts.utils.stage_metrics import Metrics, peak_rss_bytes
+
+# 全局实例
+metrics = Metrics.from_env()
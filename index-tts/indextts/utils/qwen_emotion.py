@@ -0,0 +1,268 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+from transformers import AutoTokenizer, LogitsProcessor, LogitsProcessorList
+
+from indextts.utils.metrics import metrics
+
+
+class EmotionJsonLogitsProcessor(LogitsProcessor):
+    """
+    Restrict QwenEmotion decoding to the emotion JSON format, e.g. ``{"高兴": 0.5, "愤怒": 0.0, ...}``.
+
+    Only tokens made of JSON punctuation, digits and the characters of the emotion keys can be
+    sampled, and the sequence is forced to end right after its closing ``}``.
+
+    A processor holds the prompt length of one ``generate`` call, create one per call; the
+    token masks (``token_masks``) can be shared.
+    """
+
+    def __init__(self, allowed_mask: torch.Tensor, close_mask: torch.Tensor, eos_token_id: int, prompt_length: int):
+        self.allowed_mask = allowed_mask
+        self.close_mask = close_mask
+        self.eos_token_id = eos_token_id
+        self.prompt_length = prompt_length
+
+    @staticmethod
+    def token_masks(tokenizer, keys):
+        """
+        Returns:
+            (allowed_mask, close_mask): tokens of the JSON format and tokens containing ``}``, over the tokenizer vocab.
+        """
+        allowed_chars = set('{}":,.0123456789 \n') | set("".join(keys))
+        vocab_size = len(tokenizer)
+        pieces = tokenizer.batch_decode([[i] for i in range(vocab_size)])
+        allowed_mask = torch.zeros(vocab_size, dtype=torch.bool)
+        close_mask = torch.zeros(vocab_size, dtype=torch.bool)
+        for i, piece in enumerate(pieces):
+            if piece and all(ch in allowed_chars for ch in piece):
+                allowed_mask[i] = True
+                close_mask[i] = "}" in piece
+        allowed_mask[tokenizer.eos_token_id] = True
+        return allowed_mask, close_mask
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer, keys, prompt_length):
+        allowed_mask, close_mask = cls.token_masks(tokenizer, keys)
+        return cls(allowed_mask, close_mask, tokenizer.eos_token_id, prompt_length)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        vocab_size = scores.shape[-1]
+        if self.allowed_mask.shape[0] != vocab_size or self.allowed_mask.device != scores.device:
+            # the embedding matrix is usually padded beyond the tokenizer vocab
+            allowed_mask = torch.zeros(vocab_size, dtype=torch.bool)
+            n = min(vocab_size, self.allowed_mask.shape[0])
+            allowed_mask[:n] = self.allowed_mask[:n].cpu()
+            self.allowed_mask = allowed_mask.to(scores.device)
+            self.close_mask = self.close_mask.to(scores.device)
+        allowed = self.allowed_mask
+        scores = scores.masked_fill(~allowed, float("-inf"))
+        generated = input_ids[:, self.prompt_length:]
+        if generated.shape[1] > 0:
+            closed = self.close_mask[generated.clamp(max=len(self.close_mask) - 1)].any(dim=1)
+            if closed.any():
+                eos_only = torch.full_like(scores[0], float("-inf"))
+                eos_only[self.eos_token_id] = 0.0
+                scores[closed] = eos_only
+        return scores
+
+
+class QwenEmotion:
+    def __init__(self, model_dir, max_new_tokens=96, memo_size=4096):
+        """
+        Args:
+            model_dir (str): path to the QwenEmotion model.
+            max_new_tokens (int): upper bound of generated tokens per text, the emotion JSON needs ~60.
+            memo_size (int): number of analyzed texts kept in the result memo.
+        """
+        self.model_dir = model_dir
+        self.tokenizer, self.model = self._load_model()
+        # batched generation needs left padding
+        self.tokenizer.padding_side = "left"
+        self.max_new_tokens = max_new_tokens
+        self.memo_size = memo_size
+        # shared by concurrent requests
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self._token_masks = None
+        self.prompt = "文本情感分类"
+        self.cn_key_to_en = {
+            "高兴": "happy",
+            "愤怒": "angry",
+            "悲伤": "sad",
+            "恐惧": "afraid",
+            "反感": "disgusted",
+            # TODO: the "低落" (melancholic) emotion will always be mapped to
+            # "悲伤" (sad) by QwenEmotion's text analysis. it doesn't know the
+            # difference between those emotions even if user writes exact words.
+            # SEE: `self.melancholic_words` for current workaround.
+            "低落": "melancholic",
+            "惊讶": "surprised",
+            "自然": "calm",
+        }
+        self.desired_vector_order = ["高兴", "愤怒", "悲伤", "恐惧", "反感", "低落", "惊讶", "自然"]
+        self.melancholic_words = {
+            # emotion text phrases that will force QwenEmotion's "悲伤" (sad) detection
+            # to become "低落" (melancholic) instead, to fix limitations mentioned above.
+            "低落",
+            "melancholy",
+            "melancholic",
+            "depression",
+            "depressed",
+            "gloomy",
+        }
+        self.max_score = 1.2
+        self.min_score = 0.0
+
+    def _load_model(self):
+        from modelscope import AutoModelForCausalLM
+
+        tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
+        model = AutoModelForCausalLM.from_pretrained(
+            self.model_dir,
+            # float16 is only faster on GPU, it is emulated (slow) on CPU
+            torch_dtype="float16" if torch.cuda.is_available() else "float32",
+            device_map="auto"
+        )
+        return tokenizer, model
+
+    def clamp_score(self, value):
+        return max(self.min_score, min(self.max_score, value))
+
+    def convert(self, content):
+        # generate emotion vector dictionary:
+        # - insert values in desired order (Python 3.7+ `dict` remembers insertion order)
+        # - convert Chinese keys to English
+        # - clamp all values to the allowed min/max range
+        # - use 0.0 for any values that were missing in `content`
+        emotion_dict = {
+            self.cn_key_to_en[cn_key]: self.clamp_score(content.get(cn_key, 0.0))
+            for cn_key in self.desired_vector_order
+        }
+
+        # default to a calm/neutral voice if all emotion vectors were empty
+        if all(val <= 0.0 for val in emotion_dict.values()):
+            print(">> no emotions detected; using default calm/neutral voice")
+            emotion_dict["calm"] = 1.0
+
+        return emotion_dict
+
+    @staticmethod
+    def normalize_text(text_input):
+        return " ".join(text_input.split())
+
+    def _get_json_processor(self, prompt_length):
+        with self._lock:
+            if self._token_masks is None:
+                self._token_masks = EmotionJsonLogitsProcessor.token_masks(self.tokenizer, self.desired_vector_order)
+            allowed_mask, close_mask = self._token_masks
+        return EmotionJsonLogitsProcessor(allowed_mask, close_mask, self.tokenizer.eos_token_id, prompt_length)
+
+    def parse(self, text_input, content):
+        # decode the JSON emotion detections as a dictionary
+        try:
+            content = json.loads(content)
+        except json.decoder.JSONDecodeError:
+            # invalid JSON; fallback to manual string parsing
+            # print(">> parsing QwenEmotion response", content)
+            content = {
+                m.group(1): float(m.group(2))
+                for m in re.finditer(r'([^\s":.,]+?)"?\s*:\s*([\d.]+)', content)
+            }
+            # print(">> dict result", content)
+
+        # workaround for QwenEmotion's inability to distinguish "悲伤" (sad) vs "低落" (melancholic).
+        # if we detect any of the IndexTTS "melancholic" words, we swap those vectors
+        # to encode the "sad" emotion as "melancholic" (instead of sadness).
+        text_input_lower = text_input.lower()
+        if any(word in text_input_lower for word in self.melancholic_words):
+            # print(">> before vec swap", content)
+            content["悲伤"], content["低落"] = content.get("低落", 0.0), content.get("悲伤", 0.0)
+            # print(">>  after vec swap", content)
+
+        return self.convert(content)
+
+    @torch.no_grad()
+    def _generate(self, texts):
+        prompts = [
+            self.tokenizer.apply_chat_template(
+                [
+                    {"role": "system", "content": f"{self.prompt}"},
+                    {"role": "user", "content": f"{text_input}"}
+                ],
+                tokenize=False,
+                add_generation_prompt=True,
+                enable_thinking=False,
+            )
+            for text_input in texts
+        ]
+        model_inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.model.device)
+        prompt_len = model_inputs.input_ids.shape[1]
+        json_processor = self._get_json_processor(prompt_len)
+
+        # conduct text completion
+        generated_ids = self.model.generate(
+            **model_inputs,
+            max_new_tokens=self.max_new_tokens,
+            do_sample=False,
+            logits_processor=LogitsProcessorList([json_processor]),
+            pad_token_id=self.tokenizer.eos_token_id
+        )
+        outputs = []
+        for row in generated_ids:
+            output_ids = row[prompt_len:].tolist()
+            # parsing thinking content
+            try:
+                # rindex finding 151668 (</think>)
+                index = len(output_ids) - output_ids[::-1].index(151668)
+            except ValueError:
+                index = 0
+            outputs.append(self.tokenizer.decode(output_ids[index:], skip_special_tokens=True))
+        return outputs
+
+    def batch_inference(self, text_inputs, batch_size=16):
+        """
+        Analyze the emotions of many texts (e.g. all subtitle lines of a video) with batched
+        ``generate`` calls. Results are memoized by normalized text.
+
+        Returns:
+            list of emotion dicts, in the order of ``text_inputs``.
+        """
+        start = time.perf_counter()
+        keys = [self.normalize_text(t) for t in text_inputs]
+        results = {}
+        todo = []
+        with self._lock:
+            for key in keys:
+                if key in self._memo:
+                    self._memo.move_to_end(key)
+                    results[key] = self._memo[key]
+                elif key not in results:
+                    results[key] = None
+                    todo.append(key)
+
+        for i in range(0, len(todo), batch_size):
+            batch = todo[i:i + batch_size]
+            for key, content in zip(batch, self._generate(batch)):
+                results[key] = self.parse(key, content)
+                with self._lock:
+                    self._memo[key] = results[key]
+                    self._memo.move_to_end(key)
+                    while len(self._memo) > self.memo_size:
+                        self._memo.popitem(last=False)
+        metrics.inc("cache_hits", len(keys) - len(todo), cache="qwen_emotion")
+        metrics.inc("cache_misses", len(todo), cache="qwen_emotion")
+        if todo:
+            metrics.record_span("emotion_text", start, time.perf_counter(), texts=len(todo))
+            print(f">> QwenEmotion analyzed {len(todo)} texts "
+                  f"({len(keys) - len(todo)} memoized) in {time.perf_counter() - start:.2f} seconds")
+        # return copies, callers may modify the dicts
+        return [dict(results[key]) for key in keys]
+
+    def inference(self, text_input):
+        return self.batch_inference([text_input])[0]
+
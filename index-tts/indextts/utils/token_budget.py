@@ -0,0 +1,124 @@
+import math
+from typing import List, Optional, Sequence, Tuple
+
+import torch
+from transformers import StoppingCriteria
+
+from indextts.utils.text_utils import get_text_tts_dur
+
+
+def segment_text(tokens: Sequence[str]) -> str:
+    """
+    Text of a segment from its sentencepiece tokens.
+    """
+    return "".join(tokens).replace("▁", " ")
+
+
+def segment_token_budget(text: str, tokens_per_second: float, margin: float = 1.5,
+                         extra_tokens: int = 50, max_tokens: int = 1500) -> int:
+    """
+    Upper bound of the mel codes needed to speak ``text``, from the syllable-based duration
+    estimate of ``get_text_tts_dur`` (slowest speaking rate).
+
+    Args:
+        tokens_per_second: mel code rate of the model (IndexTTS2: 50, IndexTTS: 24000 / 1024).
+        margin: safety factor on the slowest estimated duration.
+        extra_tokens: added to the budget, covers pauses and very short segments.
+        max_tokens: hard limit (``max_mel_tokens``), also returned when the estimate is unavailable.
+    """
+    try:
+        _, slowest_dur = get_text_tts_dur(text)
+    except LookupError:
+        # textstat needs the nltk `cmudict` corpus for english syllables
+        return max_tokens
+    budget = math.ceil(slowest_dur * margin * tokens_per_second) + extra_tokens
+    return max(1, min(budget, max_tokens))
+
+
+def find_repetition(tokens: Sequence[int], max_period: int = 16, min_span: int = 150) -> Optional[Tuple[int, int]]:
+    """
+    Detect a degenerate loop at the end of ``tokens``: the last ``min_span`` tokens repeat
+    a unit of at most ``max_period`` tokens (e.g. endless silence or a stuck phoneme).
+
+    Returns:
+        ``(start, period)``, where ``start`` is the index of the first copy of the repeated unit,
+        or None.
+    """
+    tokens = list(tokens)
+    n = len(tokens)
+    for period in range(1, max_period + 1):
+        if n < min_span + period:
+            break
+        if tokens[n - min_span:] != tokens[n - min_span - period:n - period]:
+            continue
+        start = n - min_span
+        while start > period and tokens[start - 1] == tokens[start - 1 - period]:
+            start -= 1
+        return start - period, period
+    return None
+
+
+class GenerationGuard(StoppingCriteria):
+    """
+    Stopping criteria for ``inference_speech``: stops a row when it reaches its token budget
+    or when its last ``min_span`` codes are a loop of period ``<= max_period``.
+
+    With beam search, ``generate`` only stops once every beam is stopped; the budgets are
+    then also enforced by ``max_generate_length``.
+
+    Args:
+        budgets: per-row token budgets of the batch (repeated for beams / return sequences), None for no budget.
+    """
+
+    def __init__(self, budgets: Optional[List[int]] = None, max_period: int = 16, min_span: int = 150):
+        self.budgets = budgets
+        self.max_period = max_period
+        self.min_span = min_span
+        self.prompt_len = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if self.prompt_len is None:
+            # called for the first time after the first generated token
+            self.prompt_len = input_ids.shape[1] - 1
+        B = input_ids.shape[0]
+        generated = input_ids[:, self.prompt_len:]
+        n = generated.shape[1]
+        is_done = torch.zeros(B, dtype=torch.bool, device=input_ids.device)
+        if self.budgets is not None:
+            budgets = torch.tensor(self.budgets, device=input_ids.device)
+            budgets = budgets.repeat_interleave(B // budgets.numel()) if B != budgets.numel() else budgets
+            is_done |= n >= budgets
+        if self.min_span > 0:
+            tail = generated[:, n - self.min_span:]
+            for period in range(1, self.max_period + 1):
+                if n < self.min_span + period:
+                    break
+                is_done |= (tail == generated[:, n - self.min_span - period:n - period]).all(dim=1)
+        return is_done
+
+
+def trim_runaway_codes(codes: torch.Tensor, stop_token: int, budgets: Optional[List[int]] = None,
+                       max_period: int = 16, min_span: int = 150) -> Tuple[torch.Tensor, List[Optional[str]]]:
+    """
+    Find the rows of ``codes`` stopped by a :class:`GenerationGuard` and cut their loops
+    (one copy of the repeated unit is kept, the rest is replaced by ``stop_token``).
+
+    Args:
+        codes: [B, T] generated mel codes.
+    Returns:
+        the codes, and for each row ``"loop"``, ``"budget"`` or None (stopped by the model).
+    """
+    reasons = []
+    codes = codes.clone()
+    for i, row in enumerate(codes.tolist()):
+        length = row.index(stop_token) if stop_token in row else len(row)
+        loop = find_repetition(row[:length], max_period, min_span) if min_span > 0 else None
+        if loop is not None:
+            start, period = loop
+            codes[i, start + period:] = stop_token
+            reasons.append("loop")
+        elif budgets is not None and length >= budgets[i]:
+            reasons.append("budget")
+        else:
+            reasons.append(None)
+    return codes, reasons
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+
+from indextts.utils.audio_io import decode_audio, resample
+
+LIBRARY_VERSION = 1
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".ogg", ".m4a")
+# tensors are aligned in the data file, so that every one of them is a valid memory-mapped view
+_ALIGN = 64
+
+_NP_DTYPES = {
+    "float32": np.float32,
+    "float16": np.float16,
+    "int64": np.int64,
+    "int32": np.int32,
+}
+
+
+def prepare_clip(audio: torch.Tensor, sampling_rate: int, max_seconds: float = 15.0,
+                 top_db: float = 40.0, peak: float = 0.9, margin_seconds: float = 0.1) -> torch.Tensor:
+    """
+    Trim the leading/trailing silence of a reference clip (20 ms frames more than ``top_db`` below
+    the loudest one, keeping ``margin_seconds``), cut it to ``max_seconds`` and peak-normalize it.
+
+    Args:
+        audio: [1, N] float tensor.
+    """
+    frame = max(1, int(0.02 * sampling_rate))
+    num_frames = audio.shape[-1] // frame
+    if num_frames > 0:
+        rms = audio[..., :num_frames * frame].reshape(-1, num_frames, frame).pow(2).mean(dim=(0, 2)).sqrt()
+        voiced = torch.nonzero(rms > rms.max() * 10 ** (-top_db / 20)).flatten()
+        if len(voiced) > 0:
+            margin = int(margin_seconds * sampling_rate)
+            start = max(0, int(voiced[0]) * frame - margin)
+            end = min(audio.shape[-1], (int(voiced[-1]) + 1) * frame + margin)
+            audio = audio[..., start:end]
+    audio = audio[..., :int(max_seconds * sampling_rate)]
+    max_abs = audio.abs().max()
+    if max_abs > 0:
+        audio = audio * (peak / max_abs)
+    return audio
+
+
+def scan_voices(voice_dir: str) -> List[dict]:
+    """
+    Reference clips of a directory: ``<voice_dir>/<language>/<name>.wav`` gives the voice id
+    ``<language>/<name>``, clips at the top level have no language (``"default"``).
+    """
+    voices = []
+    for root, _, files in os.walk(voice_dir):
+        for name in sorted(files):
+            if not name.lower().endswith(AUDIO_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, voice_dir).replace(os.sep, "/")
+            voice_id = os.path.splitext(rel)[0]
+            language = rel.split("/")[0] if "/" in rel else "default"
+            voices.append({"id": voice_id, "language": language, "source": path})
+    return sorted(voices, key=lambda v: v["id"])
+
+
+def _file_sha1(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def build_voice_library(tts, voice_dir: str, output_path: str, max_seconds: float = 15.0, batch_size: int = 8) -> dict:
+    """
+    Precompute the prompt conditioning of every clip of ``voice_dir`` (see ``scan_voices``) with
+    ``tts`` (``IndexTTS2``) and store it as a voice library: the JSON index ``output_path`` and
+    the data file next to it (same name, ``.bin``).
+
+    Clips are trimmed and normalized (``prepare_clip``) first, then encoded ``batch_size`` at a
+    time (``IndexTTS2.encode_prompts``). Both files are written under temporary names and renamed
+    at the end.
+
+    Returns:
+        the index.
+    """
+    voices = scan_voices(voice_dir)
+    if not voices:
+        raise ValueError(f"no reference clips ({', '.join(AUDIO_EXTENSIONS)}) found in {voice_dir}")
+    data_path = os.path.splitext(output_path)[0] + ".bin"
+    if os.path.dirname(output_path) != "":
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    index = {"version": LIBRARY_VERSION, "namespace": tts.cond_cache.namespace,
+             "data_file": os.path.basename(data_path), "voices": {}}
+    tmp_data_path = f"{data_path}.{os.getpid()}.tmp"
+    offset = 0
+    with open(tmp_data_path, "wb") as f:
+        for start in range(0, len(voices), batch_size):
+            batch = voices[start:start + batch_size]
+            clips = []
+            durations = []
+            for voice in batch:
+                audio, sr = decode_audio(voice["source"])
+                audio = prepare_clip(audio, sr, max_seconds=max_seconds)
+                clips.append((resample(audio, sr, 22050), resample(audio, sr, 16000)))
+                durations.append(round(audio.shape[-1] / sr, 3))
+            bundles = tts.encode_prompts(clips, batch_size=batch_size)
+            for voice, duration, bundle in zip(batch, durations, bundles):
+                entry = {"language": voice["language"], "source": os.path.abspath(voice["source"]),
+                         "digest": _file_sha1(voice["source"]), "duration": duration, "tensors": {}}
+                for name, tensor in bundle.items():
+                    array = tensor.detach().cpu().contiguous().numpy()
+                    pad = -offset % _ALIGN
+                    f.write(b"\0" * pad)
+                    offset += pad
+                    f.write(array.tobytes())
+                    entry["tensors"][name] = {"offset": offset, "dtype": str(array.dtype), "shape": list(array.shape)}
+                    offset += array.nbytes
+                index["voices"][voice["id"]] = entry
+                print(f">> voice {voice['id']} ({voice['language']}, {entry['duration']:.1f}s)")
+    tmp_index_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_index_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_data_path, data_path)
+    os.replace(tmp_index_path, output_path)
+    print(f">> voice library: {len(voices)} voices, {offset / 1024 ** 2:.1f} MB saved to {output_path}")
+    return index
+
+
+class VoiceLibrary:
+    """
+    Precomputed prompt conditionings (``build_voice_library``), looked up by voice id.
+
+    The data file is memory-mapped (copy-on-write), so opening a library reads only its index and
+    the tensors of a voice are views of the mapping until they are moved to another device.
+
+    Args:
+        path: the JSON index of the library.
+        namespace: model fingerprint (``ConditioningCache.namespace``), a library built by
+            another model is rejected.
+    """
+
+    def __init__(self, path: str, namespace: Optional[str] = None):
+        with open(path, "r", encoding="utf-8") as f:
+            self.index = json.load(f)
+        if self.index.get("version") != LIBRARY_VERSION:
+            raise ValueError(f"unsupported voice library version {self.index.get('version')} in {path}")
+        if namespace is not None and self.index["namespace"] != namespace:
+            raise ValueError(f"voice library {path} was built with another model, rebuild it")
+        self.path = path
+        data_path = os.path.join(os.path.dirname(os.path.abspath(path)), self.index["data_file"])
+        self._data = np.memmap(data_path, dtype=np.uint8, mode="c")
+        self._bundles: Dict[tuple, Dict[str, torch.Tensor]] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, voice_id) -> bool:
+        return isinstance(voice_id, str) and voice_id in self.index["voices"]
+
+    def __len__(self):
+        return len(self.index["voices"])
+
+    def voices(self, language: Optional[str] = None) -> List[str]:
+        return [voice_id for voice_id, entry in self.index["voices"].items()
+                if language is None or entry["language"] == language]
+
+    def get(self, voice_id: str, device=None) -> Dict[str, torch.Tensor]:
+        """
+        Conditioning bundle of a voice (``spk_cond_emb``, ``style``, ``prompt_condition``, ``ref_mel``, ...).
+        """
+        key = (voice_id, str(device))
+        with self._lock:
+            bundle = self._bundles.get(key)
+            if bundle is None:
+                bundle = {}
+                for name, info in self.index["voices"][voice_id]["tensors"].items():
+                    dtype = np.dtype(_NP_DTYPES[info["dtype"]])
+                    nbytes = int(np.prod(info["shape"])) * dtype.itemsize
+                    array = self._data[info["offset"]:info["offset"] + nbytes].view(dtype).reshape(info["shape"])
+                    tensor = torch.from_numpy(array)
+                    bundle[name] = tensor.to(device) if device is not None else tensor
+                self._bundles[key] = bundle
+        return bundle
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="IndexTTS2 reference voice library")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="precompute the prompt conditioning of a directory of reference clips")
+    build.add_argument("voice_dir", type=str, help="Directory of clips, <voice_dir>/<language>/<name>.wav")
+    build.add_argument("-o", "--output_path", type=str, default="voices.json", help="Index of the library (the data is saved next to it as .bin)")
+    build.add_argument("-c", "--config", type=str, default="checkpoints/config.yaml", help="Path to the config file")
+    build.add_argument("--model_dir", type=str, default="checkpoints", help="Path to the model directory")
+    build.add_argument("-d", "--device", type=str, default=None, help="Device to run the model on (cpu, cuda, mps, xpu)")
+    build.add_argument("--max_seconds", type=float, default=15.0, help="Max length of a clip after trimming")
+    build.add_argument("--batch_size", type=int, default=8, help="Clips encoded together")
+    show = commands.add_parser("list", help="list the voices of a library")
+    show.add_argument("path", type=str, help="Index of the library")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        with open(args.path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        for voice_id, entry in index["voices"].items():
+            print(f"{voice_id}\t{entry['language']}\t{entry['duration']:.1f}s\t{entry['source']}")
+        return
+    if not os.path.isdir(args.voice_dir):
+        print(f"ERROR: {args.voice_dir} is not a directory.")
+        sys.exit(1)
+    from indextts.infer_v2 import IndexTTS2
+    tts = IndexTTS2(cfg_path=args.config, model_dir=args.model_dir, device=args.device)
+    build_voice_library(tts, args.voice_dir, args.output_path, max_seconds=args.max_seconds,
+                        batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
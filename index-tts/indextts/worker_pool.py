@@ -0,0 +1,267 @@
+import gc
+import itertools
+import multiprocessing as mp
+import multiprocessing.connection
+import os
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import Future
+
+import torch
+
+
+def iter_model_modules(tts):
+    """
+    Yield every ``torch.nn.Module`` (and loose weight tensor) owned by a loaded TTS instance.
+    """
+    seen = set()
+    for name, value in vars(tts).items():
+        if name == "qwen_emo" and getattr(value, "model", None) is not None:
+            value = value.model
+        values = value if isinstance(value, (tuple, list)) else (value,)
+        for v in values:
+            if isinstance(v, (torch.nn.Module, torch.Tensor)) and id(v) not in seen:
+                seen.add(id(v))
+                yield name, v
+
+
+def freeze_model_weights(tts, share_memory=False):
+    """
+    Mark all weights of ``tts`` as read-only inference weights.
+
+    Args:
+        tts: a loaded ``IndexTTS2`` (or ``IndexTTS``) instance.
+        share_memory (bool): also move every weight into ``torch`` shared memory, so that
+            the pages stay shared even if a worker touches them.
+    """
+    for _, obj in iter_model_modules(tts):
+        if isinstance(obj, torch.nn.Module):
+            obj.eval()
+            obj.requires_grad_(False)
+            if share_memory:
+                obj.share_memory()
+        else:
+            obj.requires_grad_(False)
+            if share_memory and obj.device.type == "cpu":
+                obj.share_memory_()
+    # Objects that survive until now are moved into the permanent generation, so that
+    # the garbage collector of the forked workers never writes to (and copies) their pages.
+    gc.collect()
+    gc.freeze()
+
+
+def _worker_main(tts, worker_idx, num_threads, task_queue, result_queue):
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # the inter-op pool may have been initialized by the parent already
+        pass
+    pid = os.getpid()
+    result_queue.put((worker_idx, pid, None, True, None))
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, method, kwargs = task
+        try:
+            with torch.inference_mode():
+                result = getattr(tts, method)(**kwargs)
+            result_queue.put((worker_idx, pid, task_id, True, result))
+        except Exception as e:
+            result_queue.put((worker_idx, pid, task_id, False, f"{e!r}\n{traceback.format_exc()}"))
+
+
+class IndexTTS2WorkerPool:
+    """
+    Pre-fork process pool sharing a single copy of the ``IndexTTS2`` weights.
+
+    The models are loaded once in the parent process, marked read-only and then the
+    workers are forked, so every worker maps the same weight pages copy-on-write
+    (or through ``torch`` shared memory with ``share_memory=True``).
+    Requests are routed to the first idle worker; when all workers are busy they wait
+    in a FIFO queue. A worker that dies (OOM kill, crash) fails the request it was running
+    and is replaced by a new fork of the parent.
+
+    Example:
+        >>> pool = IndexTTS2WorkerPool(num_workers=4, model_dir="checkpoints", cfg_path="checkpoints/config.yaml")
+        >>> future = pool.submit(spk_audio_prompt="examples/voice_01.wav", text="Hello", output_path="gen.wav")
+        >>> future.result()
+    """
+
+    def __init__(self, num_workers=None, threads_per_worker=None, share_memory=False, tts=None, **tts_kwargs):
+        """
+        Args:
+            num_workers (int): number of worker processes. Defaults to ``cpu_count // threads_per_worker``.
+            threads_per_worker (int): intra-op thread count pinned in each worker. Defaults to
+                ``cpu_count // num_workers``.
+            share_memory (bool): move the weights into ``torch`` shared memory before forking.
+            tts: an already loaded ``IndexTTS2`` instance. If None, one is created with ``tts_kwargs``.
+        """
+        if "fork" not in mp.get_all_start_methods():
+            raise RuntimeError("IndexTTS2WorkerPool requires the 'fork' start method, which is not available on this platform.")
+        cpu_count = os.cpu_count() or 1
+        if num_workers is None:
+            num_workers = max(1, cpu_count // (threads_per_worker or 4))
+        if threads_per_worker is None:
+            threads_per_worker = max(1, cpu_count // num_workers)
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+
+        if tts is None:
+            from indextts.infer_v2 import IndexTTS2
+
+            tts_kwargs.setdefault("device", "cpu")
+            tts = IndexTTS2(**tts_kwargs)
+        if str(getattr(tts, "device", "cpu")) != "cpu":
+            print(">> Warning: IndexTTS2WorkerPool is designed for CPU inference, "
+                  f"workers will share the {tts.device} device.")
+        freeze_model_weights(tts, share_memory=share_memory)
+        self.tts = tts
+
+        self._ctx = mp.get_context("fork")
+        self._result_queue = self._ctx.Queue()
+        self._task_queues = [None] * num_workers
+        self._workers = [None] * num_workers
+        for i in range(num_workers):
+            self._start_worker(i)
+
+        self._lock = threading.Lock()
+        self._idle = deque()
+        self._pending = deque()
+        self._futures = {}
+        # worker index -> id of the task it is running
+        self._assigned = {}
+        self._task_ids = itertools.count()
+        self._closed = False
+        self._collector = threading.Thread(target=self._collect_results, name="indextts-pool-collector", daemon=True)
+        self._collector.start()
+        self._monitor = threading.Thread(target=self._monitor_workers, name="indextts-pool-monitor", daemon=True)
+        self._monitor.start()
+        print(f">> IndexTTS2WorkerPool started: {num_workers} workers x {threads_per_worker} threads")
+
+    def _start_worker(self, worker_idx):
+        # a fresh task queue: the one of a dead worker may hold a half-read task
+        task_queue = self._ctx.SimpleQueue()
+        p = self._ctx.Process(target=_worker_main, name=f"indextts-worker-{worker_idx}",
+                              args=(self.tts, worker_idx, self.threads_per_worker, task_queue, self._result_queue),
+                              daemon=True)
+        p.start()
+        self._task_queues[worker_idx] = task_queue
+        self._workers[worker_idx] = p
+
+    def submit(self, method="infer", **kwargs) -> Future:
+        """
+        Queue a request and return a ``concurrent.futures.Future`` for its result.
+        ``kwargs`` are forwarded to ``IndexTTS2.<method>`` in the worker.
+        """
+        if kwargs.get("stream_return"):
+            raise ValueError("stream_return is not supported by IndexTTS2WorkerPool")
+        # progress callbacks cannot cross process boundaries
+        kwargs.pop("progress", None)
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("IndexTTS2WorkerPool is closed")
+            task_id = next(self._task_ids)
+            self._futures[task_id] = future
+            self._pending.append((task_id, method, kwargs))
+            self._dispatch()
+        return future
+
+    def infer(self, **kwargs):
+        """
+        Blocking equivalent of ``IndexTTS2.infer`` executed by an idle worker.
+        """
+        return self.submit("infer", **kwargs).result()
+
+    @property
+    def idle_workers(self):
+        with self._lock:
+            return len(self._idle)
+
+    def _dispatch(self):
+        # must be called with self._lock held
+        while self._idle and self._pending:
+            task = self._pending.popleft()
+            if not self._futures[task[0]].set_running_or_notify_cancel():
+                # cancelled by the caller while waiting
+                del self._futures[task[0]]
+                continue
+            worker_idx = self._idle.popleft()
+            self._assigned[worker_idx] = task[0]
+            self._task_queues[worker_idx].put(task)
+
+    def _collect_results(self):
+        while True:
+            message = self._result_queue.get()
+            if message is None:
+                break
+            worker_idx, pid, task_id, ok, payload = message
+            with self._lock:
+                future = self._futures.pop(task_id, None) if task_id is not None else None
+                # a message of a worker that has been replaced since must not mark the new one idle
+                if self._workers[worker_idx].pid == pid and not self._closed:
+                    self._assigned.pop(worker_idx, None)
+                    self._idle.append(worker_idx)
+                    self._dispatch()
+            if future is None:
+                continue
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(f"IndexTTS2 worker {worker_idx} failed: {payload}"))
+
+    def _monitor_workers(self):
+        while not self._closed:
+            sentinels = {p.sentinel: i for i, p in enumerate(self._workers)}
+            # the timeout picks up the sentinels of restarted workers
+            for sentinel in mp.connection.wait(list(sentinels), timeout=0.5):
+                self._restart_worker(sentinels[sentinel])
+
+    def _restart_worker(self, worker_idx):
+        with self._lock:
+            if self._closed:
+                return
+            dead = self._workers[worker_idx]
+            dead.join()
+            task_id = self._assigned.pop(worker_idx, None)
+            future = self._futures.pop(task_id, None) if task_id is not None else None
+            if worker_idx in self._idle:
+                self._idle.remove(worker_idx)
+            print(f">> IndexTTS2 worker {worker_idx} (pid {dead.pid}) died with exit code {dead.exitcode}, restarting it")
+            self._start_worker(worker_idx)
+        if future is not None:
+            future.set_exception(RuntimeError(f"IndexTTS2 worker {worker_idx} died with exit code {dead.exitcode}"))
+
+    def close(self, timeout=None):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for task_id, _, _ in self._pending:
+                self._futures.pop(task_id).cancel()
+            self._pending.clear()
+        self._monitor.join()
+        for task_queue in self._task_queues:
+            task_queue.put(None)
+        for p in self._workers:
+            p.join(timeout)
+            if p.is_alive():
+                p.terminate()
+                p.join()
+        self._result_queue.put(None)
+        self._collector.join(timeout)
+        # requests of terminated workers never get a result
+        with self._lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+        for future in futures:
+            future.set_exception(RuntimeError("IndexTTS2WorkerPool was closed before the request finished"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,155 @@
+import os
+import tempfile
+import time
+
+import torch
+
+from indextts.BigVGAN.activations import Snake, SnakeBeta
+from indextts.BigVGAN.alias_free_activation.cpu import load
+from indextts.BigVGAN.alias_free_activation.cpu.activation1d import (PolyphaseActivation1d, polyphase_upsample_weights,
+                                                                     prepare_activations)
+from indextts.BigVGAN.alias_free_torch import Activation1d
+from indextts.BigVGAN.alias_free_torch.resample import UpSample1d
+from indextts.s2mel.modules.bigvgan.activations import SnakeBeta as SnakeBetaV2
+from indextts.s2mel.modules.bigvgan.alias_free_activation.torch.act import Activation1d as Activation1dV2
+
+
+def random_activation(cls, act_cls, channels, logscale):
+    act = act_cls(channels, alpha_logscale=logscale)
+    with torch.no_grad():
+        for p in act.parameters():
+            p.copy_(torch.randn_like(p) * 0.3 + (0 if logscale else 1))
+    return cls(activation=act).eval()
+
+
+def test_polyphase_upsample():
+    torch.manual_seed(0)
+    for ratio, kernel_size in [(2, 12), (2, 8), (3, 12)]:
+        up = UpSample1d(ratio, kernel_size)
+        x = torch.randn(2, 3, 37)
+        weight, pad_left, pad_right = polyphase_upsample_weights(up.filter, ratio)
+        y = torch.nn.functional.conv1d(torch.nn.functional.pad(x, (pad_left, pad_right), mode="replicate"),
+                                       weight.repeat(3, 1).unsqueeze(1), groups=3)
+        y = y.view(2, 3, ratio, 37).transpose(2, 3).reshape(2, 3, 37 * ratio)
+        assert torch.allclose(y, up(x), atol=1e-5), (ratio, kernel_size, (y - up(x)).abs().max())
+
+
+def test_fast_path_matches_torch():
+    torch.manual_seed(0)
+    cases = [(Activation1d, Snake, True), (Activation1d, Snake, False), (Activation1d, SnakeBeta, True),
+             (Activation1d, SnakeBeta, False), (Activation1dV2, SnakeBetaV2, True)]
+    for cls, act_cls, logscale in cases:
+        module = random_activation(cls, act_cls, 16, logscale)
+        for T in (1, 7, 100):
+            x = torch.randn(2, 16, T) * 2
+            with torch.no_grad():
+                expected = module(x)
+                module.prepare_inference()
+                out = module(x)
+                module.fast = None
+            assert out.shape == expected.shape
+            assert torch.allclose(out, expected, atol=1e-5), (act_cls.__name__, logscale, T, (out - expected).abs().max())
+
+
+def load_kernel():
+    try:
+        from indextts.BigVGAN.alias_free_activation.cpu import load
+        return load.load()
+    except Exception as e:
+        print(f">> CPU kernel not available ({e}), skipped")
+        return None
+
+
+def test_kernel_matches_torch():
+    kernel = load_kernel()
+    if kernel is None:
+        return
+    torch.manual_seed(0)
+    for act_cls, logscale in [(Snake, True), (SnakeBeta, True), (SnakeBeta, False)]:
+        module = random_activation(Activation1d, act_cls, 16, logscale)
+        fast = PolyphaseActivation1d.from_activation(module)
+        fast.kernel = kernel
+        for T in (1, 7, 100):
+            x = torch.randn(2, 16, T) * 2
+            with torch.no_grad():
+                expected = module(x)
+                out = fast(x)
+            assert out.shape == expected.shape
+            assert torch.allclose(out, expected, atol=1e-5), (act_cls.__name__, logscale, T, (out - expected).abs().max())
+
+
+def test_kernel_opt_out_and_failed_build():
+    saved = (load._module, load._error, load.buildpath, load.failed_marker, load.cpp_extension.load)
+    builds = []
+
+    def failing_build(**kwargs):
+        builds.append(kwargs["name"])
+        raise RuntimeError("Ninja is required to load C++ extensions")
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            load._module, load._error = None, None
+            load.buildpath = load.pathlib.Path(tmp)
+            load.failed_marker = load.buildpath / "FAILED"
+            load.cpp_extension.load = failing_build
+
+            model = torch.nn.Sequential(random_activation(Activation1d, Snake, 4, True))
+            # opted out: the torch fast path, nothing is compiled
+            prepare_activations(model, use_cpu_kernel=False)
+            assert builds == [] and model[0].fast is not None and model[0].fast.kernel is None
+
+            # a failed build falls back to torch and is tried once per process
+            prepare_activations(model)
+            prepare_activations(model)
+            assert builds == ["anti_alias_activation_cpu"] and model[0].fast.kernel is None
+            assert load.failed_marker.read_text(encoding="utf-8").startswith(load.build_key() + "\n")
+
+            # a new process skips the build that failed for the same source and torch version
+            load._error = None
+            try:
+                load.load()
+                assert False, "expected the remembered build failure"
+            except RuntimeError as e:
+                assert "FAILED" in str(e), e
+            assert builds == ["anti_alias_activation_cpu"]
+
+            # deleting the marker retries
+            load._error = None
+            os.remove(load.failed_marker)
+            prepare_activations(model)
+            assert len(builds) == 2
+    finally:
+        load._module, load._error, load.buildpath, load.failed_marker, load.cpp_extension.load = saved
+
+
+def test_speed():
+    torch.manual_seed(0)
+    module = random_activation(Activation1dV2, SnakeBetaV2, 64, True)
+    x = torch.randn(1, 64, 24000)
+    fast = PolyphaseActivation1d.from_activation(module)
+    fused = PolyphaseActivation1d.from_activation(module)
+    fused.kernel = load_kernel()
+    with torch.no_grad():
+        for name, fn in [("torch", module), ("polyphase", fast), ("fused kernel", fused)]:
+            if name == "fused kernel" and fused.kernel is None:
+                continue
+            fn(x)
+            start = time.perf_counter()
+            for _ in range(5):
+                fn(x)
+            print(f">> Activation1d {name}: {(time.perf_counter() - start) / 5 * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    """
+    CPU fast path of the anti-aliased activation of BigVGAN against the torch implementation.
+    ```
+    python tests/activation_test.py
+    ```
+    """
+    test_polyphase_upsample()
+    test_fast_path_matches_torch()
+    test_kernel_matches_torch()
+    test_kernel_opt_out_and_failed_build()
+    test_speed()
+    print(">> all activation tests passed")
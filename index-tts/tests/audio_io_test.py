@@ -0,0 +1,80 @@
+import os
+import tempfile
+import threading
+
+import soundfile as sf
+import torch
+import torchaudio
+
+from indextts.utils.audio_io import decode_audio, get_resampler, load_audio_multi_rate, resample
+from indextts.utils.common import load_audio
+
+
+def write_stereo(path, sr=16000):
+    t = torch.arange(sr) / sr
+    left = 0.5 * torch.sin(2 * torch.pi * 220 * t)
+    right = 0.25 * torch.sin(2 * torch.pi * 330 * t)
+    sf.write(path, torch.stack([left, right], dim=1).numpy(), sr, subtype="PCM_16")
+    return left, right
+
+
+def test_stereo_downmix():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stereo.wav")
+        left, right = write_stereo(path)
+        audio, sr = decode_audio(path)
+        assert sr == 16000 and audio.shape == (1, 16000)
+        # the prompt loaders of IndexTTS / IndexTTS2 average the channels
+        assert torch.allclose(audio[0], (left + right) / 2, atol=1e-4)
+        first, _ = decode_audio(path, mono="first")
+        assert torch.allclose(first[0], left, atol=1e-4)
+        # utils.common.load_audio keeps its first-channel behaviour
+        assert torch.allclose(load_audio(path, 16000)[0], left, atol=1e-4)
+        assert torch.allclose(load_audio_multi_rate(path, (16000,))[16000], audio)
+        try:
+            decode_audio(path, mono="left")
+            assert False, "expected an invalid mono mode"
+        except ValueError:
+            pass
+
+
+def test_resampler_per_device():
+    audio = torch.randn(1, 16000)
+    expected = torchaudio.functional.resample(audio, 16000, 22050)
+    assert torch.allclose(resample(audio, 16000, 22050), expected, atol=1e-4)
+    cpu_resampler = get_resampler(16000, 22050, "cpu")
+    # another device gets its own module, the cached CPU one is never moved
+    out = resample(torch.zeros(1, 16000, device="meta"), 16000, 22050)
+    assert out.device.type == "meta" and out.shape == expected.shape
+    assert get_resampler(16000, 22050, "meta") is not cpu_resampler
+    assert cpu_resampler.kernel.device.type == "cpu"
+    assert get_resampler(16000, 22050, "cpu") is cpu_resampler
+
+    errors = []
+
+    def run(device):
+        try:
+            for _ in range(50):
+                x = torch.zeros(1, 1600, device=device)
+                assert resample(x, 16000, 22050).device.type == device
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(device,)) for device in ("cpu", "meta") * 4]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors
+
+
+if __name__ == "__main__":
+    """
+    Audio ingest: channel downmix and the per-device resampler cache.
+    ```
+    python tests/audio_io_test.py
+    ```
+    """
+    test_stereo_downmix()
+    test_resampler_per_device()
+    print(">> all audio io tests passed")
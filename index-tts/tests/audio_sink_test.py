@@ -0,0 +1,158 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import wave
+
+import numpy as np
+import torch
+
+from indextts.utils.audio_sink import (AudioSink, FlacSink, PcmSink, TensorSink, WavSink, open_sink,
+                                       targets_stdout, to_int16)
+
+SR = 22050
+
+
+def segment(n, seed):
+    g = torch.Generator().manual_seed(seed)
+    return torch.clamp(32767 * 0.3 * torch.randn(1, n, generator=g), -32767.0, 32767.0)
+
+
+def read_wav(path):
+    with wave.open(path, "rb") as f:
+        assert f.getframerate() == SR and f.getsampwidth() == 2
+        return np.frombuffer(f.readframes(f.getnframes()), dtype="<i2")
+
+
+def test_to_int16():
+    wav = torch.tensor([[40000.0, -1.6, 0.4, -40000.0]])
+    pcm = to_int16(wav)
+    assert pcm.dtype == torch.int16 and pcm.tolist() == [[32767, -1, 0, -32767]], pcm
+    # clamped in place
+    assert wav.max() == 32767.0
+
+
+def test_wav_is_valid_after_every_segment():
+    a, b = segment(1000, 0), segment(500, 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "out", "gen.wav")
+        sink = WavSink(path, SR)
+        assert len(read_wav(path)) == 0
+        sink.write(a)
+        # readable before close, as after a crash
+        assert np.array_equal(read_wav(path), to_int16(a.clone())[0].numpy())
+        sink.write_silence(200)
+        sink.write(b)
+        assert sink.num_samples == 1700 and abs(sink.duration - 1700 / SR) < 1e-9
+        sink.close()
+        expected = torch.cat([to_int16(a.clone()), torch.zeros(1, 200, dtype=torch.int16), to_int16(b.clone())], 1)
+        assert np.array_equal(read_wav(path), expected[0].numpy())
+        assert os.path.getsize(path) == 44 + 2 * 1700
+
+
+def test_flac_and_pcm():
+    import soundfile as sf
+
+    a, b = segment(800, 2), segment(300, 3)
+    expected = torch.cat([to_int16(a.clone()), to_int16(b.clone())], 1)[0].numpy()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "gen.flac")
+        with open_sink(path, SR) as sink:
+            assert isinstance(sink, FlacSink)
+            sink.write(a)
+            sink.write(b)
+        data, sr = sf.read(path, dtype="int16")
+        assert sr == SR and np.array_equal(data, expected)
+
+    stream = io.BytesIO()
+    sink = open_sink(stream, SR)
+    assert isinstance(sink, PcmSink)
+    sink.write(a)
+    sink.write(b)
+    sink.close()
+    assert not stream.closed
+    assert np.array_equal(np.frombuffer(stream.getvalue(), dtype="<i2"), expected)
+
+
+def test_tensor_sink():
+    a, b = segment(100, 4), segment(50, 5)
+    sink = open_sink(None, SR)
+    assert isinstance(sink, TensorSink)
+    sink.write(a)
+    sink.write_silence(10)
+    sink.write(b)
+    out = sink.tensor()
+    assert out.dtype == torch.int16 and out.shape == (1, 160)
+    assert torch.equal(out[:, 100:110], torch.zeros(1, 10, dtype=torch.int16))
+    # counting only
+    counter = AudioSink(SR)
+    counter.write(a)
+    assert counter.num_samples == 100
+
+
+STDOUT_SCRIPT = textwrap.dedent("""
+    import sys
+    import torch
+    from indextts.utils.audio_sink import open_sink, stdout_audio
+
+    class FakeTTS:
+        @stdout_audio
+        def infer_generator(self, text, output_path, stream_return=False):
+            print(">> starting inference...")
+            sink = open_sink(output_path, 22050)
+            for i in range(3):
+                print(f">> segment {i}")
+                sink.write(torch.full((1, 4), 1000.0 * (i + 1)))
+                if stream_return:
+                    yield i
+            sink.close()
+            print(">> RTF: 0.5")
+            yield sink.path
+
+        @stdout_audio
+        def infer(self, text, output_path):
+            print(">> starting inference...")
+            with open_sink(output_path, 22050) as sink:
+                sink.write(torch.full((1, 4), 4000.0))
+            return sink.path
+
+    tts = FakeTTS()
+    assert list(tts.infer_generator("hi", "-")) == [None]
+    for i in tts.infer_generator("hi", sys.stdout.buffer, stream_return=True):
+        # the caller's code between two items is not redirected
+        assert sys.stdout is sys.__stdout__
+    assert tts.infer("hi", output_path="-") is None
+    sys.stdout.flush()
+""")
+
+
+def test_logs_off_stdout():
+    assert targets_stdout("-") and targets_stdout(sys.__stdout__.buffer)
+    assert not targets_stdout(None) and not targets_stdout("gen.wav") and not targets_stdout(io.BytesIO())
+
+    result = subprocess.run([sys.executable, "-c", STDOUT_SCRIPT], capture_output=True,
+                            env={**os.environ, "PYTHONPATH": os.getcwd()})
+    assert result.returncode == 0, result.stderr.decode()
+    # stdout only carries the PCM, the log lines went to stderr
+    samples = [1000, 2000, 3000] * 2 + [4000]
+    expected = np.repeat(np.array(samples, dtype="<i2"), 4).tobytes()
+    assert result.stdout == expected, result.stdout[:200]
+    logs = result.stderr.decode()
+    assert logs.count(">> starting inference...") == 3 and logs.count(">> RTF: 0.5") == 2, logs
+
+
+if __name__ == "__main__":
+    """
+    Incremental audio outputs of inference (wav, flac, raw PCM).
+    ```
+    python tests/audio_sink_test.py
+    ```
+    """
+    test_to_int16()
+    test_wav_is_valid_after_every_segment()
+    test_flac_and_pcm()
+    test_tensor_sink()
+    test_logs_off_stdout()
+    print(">> all audio sink tests passed")
@@ -0,0 +1,53 @@
+import torch
+from omegaconf import OmegaConf
+
+from indextts.BigVGAN.models import BigVGAN
+from indextts.infer import IndexTTS
+
+
+def tiny_bigvgan():
+    h = OmegaConf.create(dict(
+        resblock="1", resblock_kernel_sizes=[3], resblock_dilation_sizes=[[1, 3, 5]],
+        upsample_rates=[4, 4], upsample_kernel_sizes=[8, 8], upsample_initial_channel=32,
+        gpt_dim=16, feat_upsample=False, cond_d_vector_in_each_upsampling_layer=True,
+        activation="snakebeta", snake_logscale=True, num_mels=20, speaker_embedding_dim=24,
+    ))
+    torch.manual_seed(0)
+    model = BigVGAN(h)
+    model.remove_weight_norm()
+    return model.eval()
+
+
+def test_decode_with_cached_embedding():
+    model = tiny_bigvgan()
+    mel_ref = torch.randn(1, 120, 20)
+    latents = [torch.randn(1, n, 16) for n in (9, 14)]
+    with torch.no_grad():
+        spk_emb = model.compute_speaker_embedding(mel_ref)
+        for latent in latents:
+            expected, _ = model(latent, mel_ref)
+            wav = model.decode(latent, spk_emb)
+            assert wav.shape == (1, 1, latent.shape[1] * 16), wav.shape
+            assert torch.allclose(wav, expected, atol=1e-6), (wav - expected).abs().max()
+
+
+def test_chunk_latents():
+    model = tiny_bigvgan()
+    # widest stage: 16 frames x 8 channels, 8 tensors of 4 bytes
+    assert model.activation_bytes_per_frame() == 16 * 8 * 8 * 4
+    latents = [torch.zeros(1, n, 16) for n in (30, 40, 50, 200, 10)]
+    chunks = IndexTTS.chunk_latents(latents, 100)
+    assert [[l.shape[1] for l in c] for c in chunks] == [[30, 40], [50], [200], [10]]
+    assert len(IndexTTS.chunk_latents(latents, 10 ** 6)) == 1
+
+
+if __name__ == "__main__":
+    """
+    BigVGAN (IndexTTS v1) decoding with a cached speaker embedding.
+    ```
+    python tests/bigvgan_v1_test.py
+    ```
+    """
+    test_decode_with_cached_embedding()
+    test_chunk_latents()
+    print(">> all bigvgan v1 tests passed")
@@ -0,0 +1,110 @@
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+from indextts.utils.code_postprocess import postprocess_codes
+
+STOP_MEL_TOKEN = 8193
+SILENT_TOKEN = 52
+
+
+def reference_remove_long_silence(codes: torch.Tensor, stop_mel_token=STOP_MEL_TOKEN, silent_token=SILENT_TOKEN, max_consecutive=30):
+    # the original per-element implementation of `IndexTTS.remove_long_silence`
+    code_lens = []
+    codes_list = []
+    isfix = False
+    for i in range(0, codes.shape[0]):
+        code = codes[i]
+        if not torch.any(code == stop_mel_token).item():
+            len_ = code.size(0)
+        else:
+            stop_mel_idx = (code == stop_mel_token).nonzero(as_tuple=False)
+            len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
+
+        count = torch.sum(code == silent_token).item()
+        if count > max_consecutive:
+            ncode_idx = []
+            n = 0
+            for k in range(len_):
+                if code[k] != silent_token:
+                    ncode_idx.append(k)
+                    n = 0
+                elif code[k] == silent_token and n < 10:
+                    ncode_idx.append(k)
+                    n += 1
+            len_ = len(ncode_idx)
+            codes_list.append(code[ncode_idx])
+            isfix = True
+        else:
+            codes_list.append(code[:len_])
+        code_lens.append(len_)
+    if isfix:
+        if len(codes_list) > 1:
+            codes = pad_sequence(codes_list, batch_first=True, padding_value=stop_mel_token)
+        else:
+            codes = codes_list[0].unsqueeze(0)
+    max_len = max(code_lens)
+    if max_len < codes.shape[1]:
+        codes = codes[:, :max_len]
+    code_lens = torch.tensor(code_lens, dtype=torch.long, device=codes.device)
+    return codes, code_lens
+
+
+def random_codes(batch_size, length, generator):
+    codes = torch.randint(0, 100, (batch_size, length), generator=generator)
+    # insert long silent runs
+    for b in range(batch_size):
+        for _ in range(torch.randint(0, 4, (1,), generator=generator).item()):
+            start = torch.randint(0, length, (1,), generator=generator).item()
+            run = torch.randint(1, 40, (1,), generator=generator).item()
+            codes[b, start:start + run] = SILENT_TOKEN
+        if torch.rand(1, generator=generator).item() < 0.7:
+            stop = torch.randint(0, length, (1,), generator=generator).item()
+            codes[b, stop:] = STOP_MEL_TOKEN
+    return codes
+
+
+def assert_same(codes):
+    expected_codes, expected_lens = reference_remove_long_silence(codes)
+    actual_codes, actual_lens = postprocess_codes(codes, STOP_MEL_TOKEN, silent_token=SILENT_TOKEN, max_consecutive=30)
+    assert torch.equal(actual_lens, expected_lens), (actual_lens, expected_lens)
+    assert actual_codes.shape == expected_codes.shape, (actual_codes.shape, expected_codes.shape)
+    for b, n in enumerate(expected_lens.tolist()):
+        assert torch.equal(actual_codes[b, :n], expected_codes[b, :n])
+        assert (actual_codes[b, n:] == STOP_MEL_TOKEN).all()
+
+
+def test_random_batches():
+    generator = torch.Generator().manual_seed(0)
+    for _ in range(200):
+        batch_size = torch.randint(1, 5, (1,), generator=generator).item()
+        length = torch.randint(1, 200, (1,), generator=generator).item()
+        assert_same(random_codes(batch_size, length, generator))
+
+
+def test_edge_cases():
+    # all silent, no stop token
+    assert_same(torch.full((2, 50), SILENT_TOKEN))
+    # stop token at the first position
+    assert_same(torch.tensor([[STOP_MEL_TOKEN, 1, 2], [1, 2, 3]]))
+    # silent run right before the stop token
+    assert_same(torch.tensor([[1] + [SILENT_TOKEN] * 35 + [STOP_MEL_TOKEN] * 4]))
+
+
+def test_trim_only():
+    codes = torch.tensor([[5, SILENT_TOKEN, 7, STOP_MEL_TOKEN, 9], [1, 2, 3, 4, 5]])
+    out, lens = postprocess_codes(codes, STOP_MEL_TOKEN, max_consecutive=None)
+    assert lens.tolist() == [3, 5]
+    assert out.tolist() == [[5, SILENT_TOKEN, 7, STOP_MEL_TOKEN, STOP_MEL_TOKEN], [1, 2, 3, 4, 5]]
+
+
+if __name__ == "__main__":
+    """
+    Compare the vectorized code post-processing with the original Python loop.
+    ```
+    python tests/code_postprocess_test.py
+    ```
+    """
+    test_random_batches()
+    test_edge_cases()
+    test_trim_only()
+    print(">> all code post-processing tests passed")
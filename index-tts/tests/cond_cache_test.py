@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import threading
+
+import torch
+
+from indextts.utils.cond_cache import ConditioningCache, model_fingerprint
+
+
+def bundle(value):
+    return {"spk_cond_emb": torch.full((1, 3, 4), float(value)), "style": torch.full((1, 6), float(value))}
+
+
+def test_lru_eviction():
+    cache = ConditioningCache(max_entries=2)
+    cache.put("spk/a", bundle(1))
+    cache.put("spk/b", bundle(2))
+    # touching a makes b the least recently used entry
+    assert cache.get("spk/a") is not None
+    cache.put("spk/c", bundle(3))
+    assert "spk/a" in cache and "spk/c" in cache and "spk/b" not in cache
+    assert len(cache) == 2
+    assert cache.get("spk/b") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_disk_round_trip():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ConditioningCache(max_entries=1, cache_dir=tmp, namespace="v2|abc")
+        cache.put("spk/a", bundle(1))
+        cache.put("emo/b", bundle(2))
+        assert os.path.isfile(os.path.join(tmp, "spk", "a.pt"))
+        assert not [f for _, _, files in os.walk(tmp) for f in files if f.endswith(".tmp")]
+        # evicted from memory, restored from disk
+        assert "spk/a" not in cache
+        restored = cache.get("spk/a")
+        assert restored is not None and "spk/a" in cache
+        assert all(torch.equal(restored[k], v) for k, v in bundle(1).items())
+
+        # a restarted process with the same models reuses the stored bundles
+        other = ConditioningCache(cache_dir=tmp, namespace="v2|abc")
+        assert torch.equal(other.get("emo/b")["style"], bundle(2)["style"])
+
+
+def test_concurrent_put():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ConditioningCache(cache_dir=tmp, namespace="v2|abc")
+        errors = []
+
+        def store(value):
+            try:
+                for _ in range(20):
+                    cache.put("spk/a", bundle(value))
+            except Exception as e:
+                errors.append(e)
+
+        # threads of one process storing the same voice must not share a temporary file
+        threads = [threading.Thread(target=store, args=(v,)) for v in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors, errors
+        assert os.listdir(os.path.join(tmp, "spk")) == ["a.pt"]
+        restored = ConditioningCache(cache_dir=tmp, namespace="v2|abc").get("spk/a")
+        assert restored is not None and restored["style"].unique().numel() == 1
+
+
+def test_namespace_invalidation():
+    with tempfile.TemporaryDirectory() as tmp:
+        ConditioningCache(cache_dir=tmp, namespace="v2|abc").put("spk/a", bundle(1))
+        assert ConditioningCache(cache_dir=tmp, namespace="v2|def").get("spk/a") is None
+
+
+def test_model_fingerprint():
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {}
+        for name in ("gpt", "s2mel", "w2v_bert", "campplus", "bigvgan"):
+            paths[name] = os.path.join(tmp, f"{name}.pt")
+            with open(paths[name], "wb") as f:
+                f.write(b"\0" * 16)
+        fingerprint = model_fingerprint(paths)
+        assert fingerprint == model_fingerprint(dict(reversed(list(paths.items()))))
+        # swapping any of the conditioning models changes the fingerprint
+        for name in ("w2v_bert", "campplus", "bigvgan"):
+            changed = model_fingerprint({**paths, name: None})
+            assert changed != fingerprint, name
+        with open(paths["campplus"], "wb") as f:
+            f.write(b"\0" * 32)
+        assert model_fingerprint(paths) != fingerprint
+        fingerprint = model_fingerprint(paths)
+        # same size, other weights at the end of a file larger than the sampled parts
+        with open(paths["bigvgan"], "wb") as f:
+            f.write(b"\0" * (3 << 20))
+        fingerprint = model_fingerprint(paths)
+        with open(paths["bigvgan"], "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"\1")
+        assert model_fingerprint(paths) != fingerprint
+        fingerprint = model_fingerprint(paths)
+
+        # a copied checkpoint (new path and modification time, same contents) keeps the cache
+        copy = os.path.join(tmp, "copy", "bigvgan.pt")
+        os.makedirs(os.path.dirname(copy))
+        shutil.copyfile(paths["bigvgan"], copy)
+        stat = os.stat(copy)
+        os.utime(copy, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert model_fingerprint({**paths, "bigvgan": copy}) == fingerprint
+
+
+if __name__ == "__main__":
+    """
+    Prompt conditioning cache: LRU eviction, on-disk store and model fingerprint.
+    ```
+    python tests/cond_cache_test.py
+    ```
+    """
+    test_lru_eviction()
+    test_disk_round_trip()
+    test_concurrent_put()
+    test_namespace_invalidation()
+    test_model_fingerprint()
+    print(">> all conditioning cache tests passed")
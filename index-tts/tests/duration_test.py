@@ -0,0 +1,54 @@
+from indextts.utils.duration_control import CODE_TO_FRAME_RATIO, DurationPlanner, pad_to_duration
+
+FPS = 22050 / 256
+
+
+def test_fits_target():
+    # 3 segments, 0.2 s of silence between them, 6 s in total
+    planner = DurationPlanner(6.0, [10, 20, 10], FPS, fixed_seconds=0.4)
+    frames = [planner.segment_frames(i, n) for i, n in enumerate([60, 110, 55])]
+    assert abs(sum(frames) - 5.6 * FPS) <= 1, frames
+    # proportional to the weights
+    assert frames[0] < frames[1] and abs(frames[0] - frames[2]) <= 1, frames
+    assert all(0.5 <= speed <= 2.0 for speed in planner.speeds), planner.speeds
+
+
+def test_natural_rate():
+    # a target matching the natural length keeps 1.72 frames per code
+    codes = 100
+    planner = DurationPlanner(codes * CODE_TO_FRAME_RATIO / FPS, [1], FPS)
+    assert planner.segment_frames(0, codes) == round(codes * CODE_TO_FRAME_RATIO)
+    assert abs(planner.speeds[0] - 1.0) < 0.01
+
+
+def test_clamped_error_is_absorbed():
+    # the first segment can't be compressed below 0.5x of its natural length,
+    # the second one takes the rest of the target
+    planner = DurationPlanner(3.0, [1, 1], FPS, speed_range=(0.5, 2.0))
+    first = planner.segment_frames(0, 150)
+    assert first == round(150 * CODE_TO_FRAME_RATIO / 2.0), first
+    second = planner.segment_frames(1, 50)
+    assert abs(first + second - 3.0 * FPS) <= 1, (first, second)
+    # nothing left: the last segment runs at the fastest rate
+    planner = DurationPlanner(1.0, [1], FPS)
+    assert planner.segment_frames(0, 200) == round(200 * CODE_TO_FRAME_RATIO / 2.0)
+    assert abs(planner.speeds[0] - 2.0) < 0.01
+
+
+def test_pad_to_duration():
+    assert pad_to_duration(22050, 1.5, 22050) == 11025
+    assert pad_to_duration(22050 * 2, 1.5, 22050) == 0
+
+
+if __name__ == "__main__":
+    """
+    Duration control (``target_duration``) of IndexTTS2.
+    ```
+    python tests/duration_test.py
+    ```
+    """
+    test_fits_target()
+    test_natural_rate()
+    test_clamped_error_is_absorbed()
+    test_pad_to_duration()
+    print(">> all duration tests passed")
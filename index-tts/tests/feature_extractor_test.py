@@ -0,0 +1,62 @@
+import numpy as np
+import torch
+from transformers import SeamlessM4TFeatureExtractor
+
+from indextts.utils.feature_extractors import SeamlessM4TFeatures
+
+SR = 16000
+
+
+def speech(n, seed):
+    g = torch.Generator().manual_seed(seed)
+    t = torch.arange(n) / SR
+    return (0.3 * torch.sin(2 * torch.pi * 180 * t) * torch.sin(2 * torch.pi * 3 * t)
+            + 0.05 * torch.randn(n, generator=g)).unsqueeze(0)
+
+
+def check(ours, theirs, atol=2e-3):
+    assert ours["input_features"].shape == theirs["input_features"].shape, \
+        (ours["input_features"].shape, theirs["input_features"].shape)
+    assert torch.equal(ours["attention_mask"], theirs["attention_mask"].to(torch.int32))
+    diff = (ours["input_features"] - theirs["input_features"]).abs().max().item()
+    assert diff < atol, diff
+
+
+def test_matches_hf_single():
+    hf = SeamlessM4TFeatureExtractor()
+    ours = SeamlessM4TFeatures()
+    # even and odd numbers of frames
+    for n, seed in [(SR * 2, 0), (SR * 3 + 123, 1), (SR // 2 + 160, 2)]:
+        audio = speech(n, seed)
+        check(ours(audio, sampling_rate=SR), hf(audio, sampling_rate=SR, return_tensors="pt"))
+        assert ours(audio)["input_features"].shape[1] == ours.num_output_frames(n)
+
+
+def test_matches_hf_batch():
+    for padding_value in (0.0, 1.0):
+        hf = SeamlessM4TFeatureExtractor(padding_value=padding_value)
+        ours = SeamlessM4TFeatures(padding_value=padding_value)
+        audios = [speech(SR * 2 + 480, 3)[0], speech(SR, 4)[0], speech(SR * 3 + 1000, 5)[0]]
+        check(ours(audios, sampling_rate=SR),
+              hf([a.numpy() for a in audios], sampling_rate=SR, return_tensors="pt", padding=True))
+
+
+def test_wrong_rate():
+    try:
+        SeamlessM4TFeatures()(speech(SR, 6), sampling_rate=22050)
+        assert False, "expected a sampling rate error"
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    """
+    Torch SeamlessM4T (w2v-bert 2.0) fbank features against the HF extractor.
+    ```
+    python tests/feature_extractor_test.py
+    ```
+    """
+    test_matches_hf_single()
+    test_matches_hf_batch()
+    test_wrong_rate()
+    print(">> all feature extractor tests passed")
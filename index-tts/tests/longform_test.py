@@ -0,0 +1,180 @@
+import os
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+import torch
+
+from indextts.longform import LongformJob, run_longform
+from indextts.utils.audio_sink import WavSink
+
+SR = 22050
+
+
+class FakeTokenizer:
+    def tokenize(self, text):
+        return text.split()
+
+    def split_segments(self, tokens, max_text_tokens_per_segment, **kwargs):
+        return [tokens[i:i + max_text_tokens_per_segment] for i in range(0, len(tokens), max_text_tokens_per_segment)]
+
+
+class FakeTTS:
+    """
+    Writes ``len(text)`` samples of value ``len(tokens)`` per segment, fails on request.
+    """
+
+    def __init__(self, fail_at=None):
+        self.tokenizer = FakeTokenizer()
+        self.calls = []
+        self.fail_at = fail_at
+
+    def infer(self, spk_audio_prompt, text, output_path, text_segments=None, **kwargs):
+        if len(self.calls) == self.fail_at:
+            raise RuntimeError("out of memory")
+        self.calls.append(text_segments[0])
+        with WavSink(output_path, SR) as sink:
+            sink.write(torch.full((1, 10 * len(text_segments[0])), float(len(self.calls))))
+        return output_path
+
+
+def read_wav(path):
+    with wave.open(path, "rb") as f:
+        return np.frombuffer(f.readframes(f.getnframes()), dtype="<i2")
+
+
+TEXT = " ".join(f"w{i}" for i in range(10))
+
+
+def test_resume_after_crash():
+    with tempfile.TemporaryDirectory() as tmp:
+        job_dir = os.path.join(tmp, "job")
+        voice = os.path.join(tmp, "voice.wav")
+        tts = FakeTTS(fail_at=2)
+        job = LongformJob.create(job_dir, tts, TEXT, voice, max_text_tokens_per_segment=3, interval_silence=10)
+        assert job.num_segments == 4 and job.missing() == [0, 1, 2, 3]
+        try:
+            job.run(tts)
+            assert False, "expected a failure"
+        except RuntimeError:
+            pass
+        # the committed segments survive, no claim or temporary file is left behind
+        assert job.missing() == [2, 3]
+        assert sorted(os.listdir(job.segments_dir)) == ["000000.wav", "000001.wav"]
+
+        # restart: same document, only the missing segments are synthesized
+        tts = FakeTTS()
+        out = os.path.join(tmp, "out.wav")
+        assert run_longform(tts, job_dir, TEXT, voice, out, max_text_tokens_per_segment=3, interval_silence=10) == out
+        assert tts.calls == [["w6", "w7", "w8"], ["w9"]]
+        silence = int(SR * 10 / 1000)
+        assert len(read_wav(out)) == 10 * 10 + 3 * silence
+        # another document in the same job directory
+        try:
+            LongformJob.create(job_dir, tts, TEXT + " more", voice, max_text_tokens_per_segment=3, interval_silence=10)
+            assert False, "expected a plan mismatch"
+        except ValueError:
+            pass
+
+
+def test_claims():
+    with tempfile.TemporaryDirectory() as tmp:
+        job = LongformJob.create(tmp, FakeTTS(), TEXT, "voice.wav", max_text_tokens_per_segment=5)
+        assert job.claim(0, "a")
+        assert not job.claim(0, "b")
+        # segment 0 is running elsewhere: this worker takes segment 1 only
+        tts = FakeTTS()
+        assert job.run(tts, worker_id="b") == 1 and job.missing() == [0]
+        try:
+            job.stitch(os.path.join(tmp, "out.wav"))
+            assert False, "expected missing segments"
+        except RuntimeError:
+            pass
+        # the claim of a crashed worker is taken over once stale
+        old = time.time() - 1000
+        os.utime(job._claim_path("000000"), (old, old))
+        assert job.run(tts, worker_id="b", stale_seconds=600) == 1 and job.missing() == []
+        assert not [f for f in os.listdir(job.segments_dir) if ".claim" in f]
+
+
+class SlowTTS(FakeTTS):
+    def __init__(self, seconds):
+        super().__init__()
+        self.seconds = seconds
+
+    def infer(self, *args, **kwargs):
+        time.sleep(self.seconds)
+        return super().infer(*args, **kwargs)
+
+
+def test_heartbeat():
+    with tempfile.TemporaryDirectory() as tmp:
+        job = LongformJob.create(tmp, FakeTTS(), TEXT, "voice.wav", max_text_tokens_per_segment=10)
+        other = LongformJob(tmp)
+        taken = []
+
+        def run():
+            # 1.2 seconds of synthesis against claims stale after 0.4 seconds
+            job.run(SlowTTS(1.2), worker_id="a", stale_seconds=0.4)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        while not os.path.exists(job._claim_path(0)):
+            time.sleep(0.01)
+        deadline = time.time() + 1.0
+        while time.time() < deadline:
+            taken.append(other.claim(0, "b", stale_seconds=0.4))
+            time.sleep(0.05)
+        thread.join()
+        # the running segment was never taken over, and its claim is released
+        assert not any(taken) and job.missing() == []
+        assert not os.path.exists(job._claim_path(0))
+
+
+def test_takeover_race():
+    with tempfile.TemporaryDirectory() as tmp:
+        LongformJob.create(tmp, FakeTTS(), TEXT, "voice.wav", max_text_tokens_per_segment=5)
+        crashed = LongformJob(tmp)
+        workers = [LongformJob(tmp) for _ in range(8)]
+        for attempt in range(20):
+            assert crashed.claim(attempt, "crashed")
+            old = time.time() - 1000
+            os.utime(crashed._claim_path(attempt), (old, old))
+            barrier = threading.Barrier(len(workers))
+            results = [None] * len(workers)
+
+            def take(i):
+                barrier.wait()
+                results[i] = workers[i].claim(attempt, f"w{i}", stale_seconds=600)
+
+            threads = [threading.Thread(target=take, args=(i,)) for i in range(len(workers))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            # exactly one worker takes the stale claim over, and it holds the claim on disk
+            assert results.count(True) == 1, results
+            winner = workers[results.index(True)]
+            assert winner.holds(attempt) and not crashed.holds(attempt)
+            # the crashed worker coming back does not remove the claim of the new owner
+            crashed.release(attempt)
+            assert os.path.exists(crashed._claim_path(attempt))
+            winner.release(attempt)
+            assert not os.path.exists(crashed._claim_path(attempt))
+        assert not [f for f in os.listdir(crashed.segments_dir) if ".stale" in f]
+
+
+if __name__ == "__main__":
+    """
+    Checkpointed long-form synthesis: plan, chunk store, resume and segment claims.
+    ```
+    python tests/longform_test.py
+    ```
+    """
+    test_resume_after_crash()
+    test_claims()
+    test_heartbeat()
+    test_takeover_race()
+    print(">> all long-form tests passed")
@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+import threading
+
+from indextts.utils.metrics import Metrics
+
+
+def test_spans_counters_and_outputs():
+    with tempfile.TemporaryDirectory() as tmp:
+        jsonl_path = os.path.join(tmp, "metrics.jsonl")
+        trace_path = os.path.join(tmp, "trace.json")
+        m = Metrics("test", jsonl_path=jsonl_path, trace_path=trace_path)
+
+        def work():
+            for i in range(5):
+                with m.span("gpt_decode", segment=i) as span:
+                    span["tokens"] = 10
+                m.inc("cache_hits", cache="cond")
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        m.observe("gpt_decode_tokens_per_second", 100.0)
+
+        snapshot = m.snapshot()
+        assert snapshot["spans"]["gpt_decode"]["count"] == 20, snapshot
+        assert snapshot["counters"]['cache_hits{cache="cond"}'] == 20, snapshot
+
+        text = m.prometheus_text()
+        assert 'test_stage_seconds_count{stage="gpt_decode"} 20' in text, text
+        assert 'test_cache_hits_total{cache="cond"} 20' in text, text
+        assert "test_gpt_decode_tokens_per_second_count 1" in text, text
+        assert "test_peak_rss_bytes" in text, text
+
+        with open(jsonl_path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        assert len(records) == 20 and all(r["tokens"] == 10 for r in records), records
+
+        m.write_trace()
+        with open(trace_path, encoding="utf-8") as f:
+            events = json.load(f)["traceEvents"]
+        assert sum(e["ph"] == "X" for e in events) == 20, events
+
+
+if __name__ == "__main__":
+    """
+    Span aggregation, counters, JSON lines, Prometheus text and Chrome trace output of `indextts.utils.metrics`.
+    ```
+    python tests/metrics_test.py
+    ```
+    """
+    test_spans_counters_and_outputs()
+    print(">> all metrics tests passed")
@@ -0,0 +1,89 @@
+import threading
+import time
+
+import torch
+
+from indextts.pipeline import PipelineStage, StagePipeline
+
+
+def slow(tag, delay):
+    def fn(item):
+        time.sleep(delay)
+        return item + [(tag, threading.current_thread().name)]
+    return fn
+
+
+def test_order_and_overlap():
+    stages = [PipelineStage("a", slow("a", 0.05)), PipelineStage("b", slow("b", 0.05)), PipelineStage("c", slow("c", 0.05))]
+    pipeline = StagePipeline(stages)
+    start = time.perf_counter()
+    results = list(pipeline.run([[i] for i in range(10)]))
+    elapsed = time.perf_counter() - start
+    assert [r[0] for r in results] == list(range(10)), results
+    assert all([tag for tag, _ in r[1:]] == ["a", "b", "c"] for r in results)
+    # sequential would take 10 * 3 * 0.05 = 1.5s
+    assert elapsed < 1.2, elapsed
+    assert all(pipeline.stats[name]["items"] == 10 for name in "abc")
+
+
+def test_error_propagation():
+    def fail(item):
+        if item == 3:
+            raise ValueError("boom")
+        return item
+
+    pipeline = StagePipeline([PipelineStage("a", lambda x: x), PipelineStage("fail", fail)])
+    seen = []
+    try:
+        for item in pipeline.run(range(10)):
+            seen.append(item)
+    except ValueError as e:
+        assert str(e) == "boom"
+    else:
+        raise AssertionError("the stage error was not raised")
+    assert seen == [0, 1, 2], seen
+
+
+def test_early_close():
+    pipeline = StagePipeline([PipelineStage("a", slow("a", 0.01))], queue_size=1)
+    gen = pipeline.run([[i] for i in range(100)])
+    assert next(gen) == [0, ("a", "indextts-stage-a")]
+    gen.close()
+    assert pipeline.stats["a"]["items"] < 100
+
+
+def test_stage_threads():
+    def probe(tag):
+        def fn(item):
+            # a parallel op, the thread count must stay the budget of the stage after it
+            torch.ones(1 << 16).sum()
+            time.sleep(0.01)
+            return item + [(tag, torch.get_num_threads())]
+        return fn
+
+    caller_threads = torch.get_num_threads()
+    try:
+        torch.set_num_threads(3)
+        budgets = {"a": 1, "b": 4, "c": 2}
+        pipeline = StagePipeline([PipelineStage(tag, probe(tag), n) for tag, n in budgets.items()])
+        results = list(pipeline.run([[i] for i in range(4)]))
+        # the thread count is per stage thread: every stage sees its own budget
+        assert all(threads == budgets[tag] for r in results for tag, threads in r[1:]), results
+        assert torch.get_num_threads() == 3
+    finally:
+        torch.set_num_threads(caller_threads)
+
+
+if __name__ == "__main__":
+    """
+    The stage pipeline must keep the input order, overlap the stages, re-raise stage errors
+    and shut its threads down when the consumer stops early.
+    ```
+    python tests/pipeline_test.py
+    ```
+    """
+    test_order_and_overlap()
+    test_error_propagation()
+    test_early_close()
+    test_stage_threads()
+    print(">> all pipeline tests passed")
@@ -0,0 +1,163 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from transformers import BatchEncoding
+
+from indextts.utils.qwen_emotion import EmotionJsonLogitsProcessor, QwenEmotion
+
+PIECES = ["<eos>", "{", "}", '"', ":", ",", " ", "0", ".", "5", "高兴", "愤怒", "hello", "}\n", "<think>", "x"]
+EOS = 0
+# the embedding matrix is padded beyond the tokenizer vocab
+MODEL_VOCAB = len(PIECES) + 4
+ANSWER = ["{", '"', "高兴", '"', ":", "0", ".", "5", "}"]
+
+
+def ids(*pieces):
+    return [PIECES.index(p) for p in pieces]
+
+
+class FakeTokenizer:
+    eos_token_id = EOS
+    padding_side = "right"
+
+    def __len__(self):
+        return len(PIECES)
+
+    def batch_decode(self, sequences):
+        return [self.decode(seq) for seq in sequences]
+
+    def decode(self, token_ids, skip_special_tokens=False):
+        return "".join(PIECES[i] for i in token_ids if not (skip_special_tokens and i == EOS))
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True, enable_thinking=False):
+        return messages[-1]["content"]
+
+    def __call__(self, prompts, return_tensors="pt", padding=True):
+        length = max(len(p) for p in prompts)
+        input_ids = torch.full((len(prompts), length), EOS, dtype=torch.long)
+        attention_mask = torch.zeros(len(prompts), length, dtype=torch.long)
+        for row, prompt in enumerate(prompts):
+            # left padding, every character is an "x" token
+            input_ids[row, length - len(prompt):] = PIECES.index("x")
+            attention_mask[row, length - len(prompt):] = 1
+        return BatchEncoding({"input_ids": input_ids, "attention_mask": attention_mask})
+
+
+class FakeModel:
+    """
+    Greedy decoder that always prefers tokens outside the emotion JSON format: "hello" at every
+    step, and "," after the answer, so only the logits processor can produce the answer.
+    """
+    device = torch.device("cpu")
+
+    def __init__(self, delay=0.0):
+        self.calls = []
+        # per-step sleep, lets concurrent calls interleave their decoding steps
+        self.delay = delay
+
+    def generate(self, input_ids, attention_mask, max_new_tokens, do_sample, logits_processor, pad_token_id):
+        self.calls.append(input_ids.shape[0])
+        sequences = input_ids
+        for step in range(max_new_tokens):
+            scores = torch.zeros(input_ids.shape[0], MODEL_VOCAB)
+            scores[:, PIECES.index("hello")] = 10.0
+            scores[:, len(PIECES)] = 9.0
+            target = ANSWER[step] if step < len(ANSWER) else ","
+            scores[:, PIECES.index(target)] = 5.0
+            time.sleep(self.delay)
+            scores = logits_processor(sequences, scores)
+            next_tokens = scores.argmax(dim=-1, keepdim=True)
+            sequences = torch.cat([sequences, next_tokens], dim=1)
+            if (next_tokens == EOS).all():
+                break
+        return sequences
+
+
+class FakeQwenEmotion(QwenEmotion):
+    def _load_model(self):
+        return FakeTokenizer(), FakeModel()
+
+
+def test_allowed_masks():
+    processor = EmotionJsonLogitsProcessor.from_tokenizer(FakeTokenizer(), ["高兴", "愤怒"], prompt_length=3)
+    allowed = set(ids("<eos>", "{", "}", '"', ":", ",", " ", "0", ".", "5", "高兴", "愤怒", "}\n"))
+    assert set(torch.nonzero(processor.allowed_mask).flatten().tolist()) == allowed
+    assert set(torch.nonzero(processor.close_mask).flatten().tolist()) == set(ids("}", "}\n"))
+
+    prompt = torch.full((2, 3), PIECES.index("x"))
+    scores = processor(prompt, torch.zeros(2, MODEL_VOCAB))
+    # first step: only the format tokens, never the padded embedding rows
+    assert scores.shape == (2, MODEL_VOCAB)
+    for row in scores:
+        assert set(torch.nonzero(row == 0).flatten().tolist()) == allowed
+
+    # the first row has closed the JSON object, only it is forced to end
+    steps = torch.tensor([ids("{", '"', "高兴", '"', ":", "5", "}\n"), ids("{", '"', "高兴", '"', ":", "0", ".")])
+    scores = processor(torch.cat([prompt, steps], dim=1), torch.zeros(2, MODEL_VOCAB))
+    assert torch.nonzero(scores[0] == 0).flatten().tolist() == [EOS]
+    assert set(torch.nonzero(scores[1] == 0).flatten().tolist()) == allowed
+
+
+def test_constrained_generate():
+    qwen = FakeQwenEmotion("fake")
+    outputs = qwen._generate(["I am happy", "ok"])
+    assert outputs == ['{"高兴":0.5}'] * 2, outputs
+    # a second call with another prompt length is decoded from its own prompt
+    assert qwen._generate(["much longer text than before"]) == ['{"高兴":0.5}']
+
+
+def test_memo():
+    qwen = FakeQwenEmotion("fake")
+    results = qwen.batch_inference(["I am  happy", "I am happy", "so\nsad"], batch_size=1)
+    # normalized duplicates are analyzed once
+    assert qwen.model.calls == [1, 1]
+    assert results[0] == results[1] == results[2]
+    assert results[0]["happy"] == 0.5 and results[0]["calm"] == 0.0
+    # memo hits skip generation, and the returned dicts are copies
+    results[0]["happy"] = 1.0
+    assert qwen.inference("so sad")["happy"] == 0.5
+    assert qwen.model.calls == [1, 1]
+
+    # least recently used texts are evicted
+    qwen = FakeQwenEmotion("fake", memo_size=2)
+    qwen.batch_inference(["a", "b"])
+    qwen.inference("a")
+    qwen.inference("c")
+    assert list(qwen._memo) == ["a", "c"]
+    qwen.inference("b")
+    assert qwen.model.calls == [2, 1, 1]
+
+
+def test_concurrent_requests():
+    qwen = FakeQwenEmotion("fake", memo_size=8)
+    qwen.model.delay = 0.002
+    texts = [f"text {'x' * (i * 7)}" for i in range(16)]
+    barrier = threading.Barrier(8)
+
+    def analyze(i):
+        barrier.wait()
+        # each call decodes from its own prompt length, the memo is shared
+        return qwen._generate([texts[i]]), qwen.batch_inference(texts[i::2])
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(analyze, range(8)))
+    for outputs, emotions in results:
+        assert outputs == ['{"高兴":0.5}'], outputs
+        assert all(e["happy"] == 0.5 for e in emotions)
+    assert len(qwen._memo) == 8
+
+
+if __name__ == "__main__":
+    """
+    QwenEmotion: constrained JSON decoding and the result memo, with a fake tokenizer and model.
+    ```
+    python tests/qwen_emotion_test.py
+    ```
+    """
+    test_allowed_masks()
+    test_constrained_generate()
+    test_memo()
+    test_concurrent_requests()
+    print(">> all QwenEmotion tests passed")
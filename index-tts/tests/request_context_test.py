@@ -0,0 +1,77 @@
+import threading
+
+import torch
+from transformers import GPT2Config, GPT2Model
+
+from indextts.gpt.model_v2 import GPT2InferenceModel, LearnedPositionEmbeddings
+
+
+def tiny_inference_model():
+    torch.manual_seed(0)
+    config = GPT2Config(vocab_size=64, n_positions=256, n_embd=32, n_layer=2, n_head=2, initializer_range=1.0)
+    gpt = GPT2Model(config)
+    gpt.wte = None
+    model = GPT2InferenceModel(config, gpt, LearnedPositionEmbeddings(256, 32), torch.nn.Embedding(64, 32),
+                               torch.nn.LayerNorm(32), torch.nn.Linear(32, 64), kv_cache=True)
+    return model.eval()
+
+
+def generate(model, mel_emb, num_beams=1):
+    # [conditioning + text prefix] [start token], as `UnifiedVoice.inference_speech`
+    input_ids = torch.zeros(1, mel_emb.shape[1] + 1, dtype=torch.long)
+    input_ids[:, -1] = 3
+    with torch.no_grad():
+        output = model.generate(input_ids, bos_token_id=3, pad_token_id=4, eos_token_id=4,
+                                attention_mask=torch.ones_like(input_ids), max_length=input_ids.shape[1] + 16,
+                                do_sample=False, num_beams=num_beams, cached_mel_emb=mel_emb)
+    return output[0, input_ids.shape[1]:].tolist()
+
+
+def test_prefix_is_per_call():
+    model = tiny_inference_model()
+    a, b = torch.randn(1, 5, 32) * 5, torch.randn(1, 9, 32) * 5
+    expected = {"a": generate(model, a), "b": generate(model, b)}
+    assert expected["a"] != expected["b"]
+    # nothing is left on the shared module
+    assert model.cached_mel_emb is None
+    # beam search expands the prefix with the inputs
+    assert len(generate(model, a, num_beams=3)) > 0
+
+    results = {"a": [], "b": []}
+
+    def worker(name, mel_emb):
+        for _ in range(4):
+            results[name].append(generate(model, mel_emb))
+
+    threads = [threading.Thread(target=worker, args=(name, emb)) for name, emb in (("a", a), ("b", b))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # concurrent requests on one model get their own output
+    assert results["a"] == [expected["a"]] * 4 and results["b"] == [expected["b"]] * 4
+
+
+def test_legacy_store_mel_emb():
+    model = tiny_inference_model()
+    a = torch.randn(1, 5, 32) * 5
+    expected = generate(model, a)
+    model.store_mel_emb(a)
+    input_ids = torch.zeros(1, 6, dtype=torch.long)
+    input_ids[:, -1] = 3
+    with torch.no_grad():
+        output = model.generate(input_ids, bos_token_id=3, pad_token_id=4, eos_token_id=4,
+                                attention_mask=torch.ones_like(input_ids), max_length=22, do_sample=False)
+    assert output[0, 6:].tolist() == expected
+
+
+if __name__ == "__main__":
+    """
+    Concurrent requests on one GPT inference model: the prefix embeddings are passed per call.
+    ```
+    python tests/request_context_test.py
+    ```
+    """
+    test_prefix_is_per_call()
+    test_legacy_store_mel_emb()
+    print(">> all request context tests passed")
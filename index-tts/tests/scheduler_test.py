@@ -0,0 +1,211 @@
+import threading
+
+import torch
+
+from indextts.gpt.model_v2 import UnifiedVoice
+from indextts.scheduler import ContinuousBatchingScheduler, PagedKVCache
+
+START_MEL_TOKEN = 48
+STOP_MEL_TOKEN = 49
+MAX_MEL_TOKENS = 40
+
+
+def build_tiny_gpt():
+    torch.manual_seed(0)
+    module = dict(output_size=64, linear_units=128, attention_heads=4, num_blocks=1,
+                  input_layer="conv2d2", perceiver_mult=1)
+    gpt = UnifiedVoice(layers=2, model_dim=64, heads=4, max_text_tokens=60, max_mel_tokens=80,
+                       number_text_tokens=100, number_mel_codes=50,
+                       start_mel_token=START_MEL_TOKEN, stop_mel_token=STOP_MEL_TOKEN,
+                       condition_type="conformer_perceiver", condition_num_latent=8,
+                       condition_module=dict(module), emo_condition_module=dict(module))
+    gpt.eval()
+    gpt.post_init_gpt2_config(kv_cache=True)
+    return gpt
+
+
+class DigitTokenizer:
+    def tokenize(self, text):
+        return text.split()
+
+    def split_segments(self, tokens, max_text_tokens_per_segment):
+        return [tokens[i:i + 5] for i in range(0, len(tokens), 5)]
+
+    def convert_tokens_to_ids(self, tokens):
+        return [int(t) for t in tokens]
+
+
+class TinyTTS:
+    """
+    Just enough of `IndexTTS2` for the GPT decode loop of the scheduler.
+    """
+    device = "cpu"
+    use_fp16 = False
+    dtype = None
+    codes_per_second = 50
+
+    def __init__(self):
+        self.gpt = build_tiny_gpt()
+        self.tokenizer = DigitTokenizer()
+
+    def prepare_conditioning(self, spk_audio_prompt, *args, **kwargs):
+        generator = torch.Generator().manual_seed(sum(map(ord, spk_audio_prompt)))
+        return {"conds_latent": torch.randn(1, 10, 64, generator=generator), "prompt_condition": torch.zeros(1)}
+
+
+def collect_codes(scheduler):
+    # replace the s2mel/BigVGAN stage: record the generated codes per segment
+    codes = {}
+
+    def synthesize(seqs):
+        for seq in seqs:
+            codes[(seq.request.request_id, seq.seg_idx)] = list(seq.tokens)
+            seq.request.remaining -= 1
+            if seq.request.remaining == 0 and not seq.request.future.done():
+                seq.request.future.set_result(None)
+
+    scheduler._synthesize = synthesize
+    return codes
+
+
+def reference_codes(tts, voice, segment):
+    gpt = tts.gpt
+    cond = tts.prepare_conditioning(voice)
+    text_tokens = torch.tensor([tts.tokenizer.convert_tokens_to_ids(segment)])
+    input_ids, inputs_embeds, attention_mask = gpt.prepare_gpt_inputs(cond["conds_latent"], text_tokens)
+    gpt.inference_model.store_mel_emb(inputs_embeds)
+    output = gpt.inference_model.generate(input_ids, bos_token_id=START_MEL_TOKEN, pad_token_id=STOP_MEL_TOKEN,
+                                          eos_token_id=STOP_MEL_TOKEN, attention_mask=attention_mask,
+                                          max_length=input_ids.shape[1] + MAX_MEL_TOKENS,
+                                          do_sample=False, num_beams=1, repetition_penalty=2.0)
+    codes = output[0, input_ids.shape[1]:].tolist()
+    return codes[:codes.index(STOP_MEL_TOKEN) + 1] if STOP_MEL_TOKEN in codes else codes
+
+
+def check_against_generate(kv_cache_tokens):
+    tts = TinyTTS()
+    scheduler = ContinuousBatchingScheduler(tts, max_batch_size=3, kv_cache_tokens=kv_cache_tokens, block_size=4)
+    codes = collect_codes(scheduler)
+    texts = {
+        "voice_a.wav": "1 2 3 4 5 6 7 8 9 10 11",
+        "voice_b.wav": "5 6 7",
+        "voice_c.wav": "9 9 9 9 9 9 9 9",
+        "voice_d.wav": "3 1 4 1 5 9 2 6",
+    }
+    futures = {voice: scheduler.submit(voice, text, do_sample=False, repetition_penalty=2.0,
+                                       max_mel_tokens=MAX_MEL_TOKENS)
+               for voice, text in texts.items()}
+    for future in futures.values():
+        future.result(timeout=120)
+    stats = dict(scheduler.stats)
+    scheduler.close()
+
+    for request_id, (voice, text) in enumerate(texts.items()):
+        for seg_idx, segment in enumerate(tts.tokenizer.split_segments(text.split(), 5)):
+            expected = reference_codes(tts, voice, segment)
+            assert codes[(request_id, seg_idx)] == expected, (voice, seg_idx, codes[(request_id, seg_idx)], expected)
+    return stats
+
+
+def test_matches_generate():
+    stats = check_against_generate(kv_cache_tokens=4096)
+    assert stats["max_batch"] > 1, stats
+
+
+def test_matches_generate_with_preemption():
+    stats = check_against_generate(kv_cache_tokens=120)
+    assert stats["preemptions"] > 0, stats
+
+
+def test_paged_gather():
+    cache = PagedKVCache(num_layers=3, num_heads=2, head_dim=4, num_blocks=8, block_size=4)
+    lengths = [6, 3]
+    tables = [[], []]
+    written = []
+    for table, n in zip(tables, lengths):
+        assert cache.reserve(table, n)
+        keys, values = torch.randn(3, 2, n, 4), torch.randn(3, 2, n, 4)
+        cache.write(table, keys, values)
+        written.append((keys, values))
+    table, mask = cache.block_index(tables, lengths)
+    assert mask.tolist() == [[True] * 6 + [False] * 2, [True] * 3 + [False] * 5]
+    # one layer at a time, the padding of the shorter sequence is masked out
+    for layer in range(3):
+        keys, values = cache.gather_layer(layer, table)
+        assert keys.shape == (2, 2, 8, 4)
+        for i, (k, v) in enumerate(written):
+            assert torch.equal(keys[i, :, :lengths[i]], k[layer]) and torch.equal(values[i, :, :lengths[i]], v[layer])
+
+
+def expect_failure(future, message):
+    try:
+        future.result(timeout=60)
+    except RuntimeError as e:
+        assert message in str(e), e
+    else:
+        raise AssertionError(f"expected the request to fail with {message!r}")
+
+
+def test_too_large_for_cache():
+    tts = TinyTTS()
+    # prompt of a one-token segment: cond latents, text start/stop, text, start mel token and padding
+    small_prompt = tts.gpt.cond_num + 2 + 1 + 3
+    kwargs = dict(do_sample=False, token_budget_margin=0, loop_detection_seconds=0)
+
+    # the prompt alone exceeds the cache: failed at admission instead of blocking the queue
+    with ContinuousBatchingScheduler(tts, max_batch_size=2, kv_cache_tokens=small_prompt + 3, block_size=1) as scheduler:
+        collect_codes(scheduler)
+        too_long = scheduler.submit("voice_a.wav", "1 2 3 4 5", max_mel_tokens=3, **kwargs)
+        short = scheduler.submit("voice_b.wav", "5", max_mel_tokens=3, **kwargs)
+        expect_failure(too_long, "increase kv_cache_tokens")
+        short.result(timeout=60)
+
+    # the codes outgrow the cache: failed instead of being preempted and re-admitted forever
+    with ContinuousBatchingScheduler(tts, max_batch_size=2, kv_cache_tokens=small_prompt + 10, block_size=1) as scheduler:
+        codes = collect_codes(scheduler)
+        too_long = scheduler.submit("voice_a.wav", "1", max_mel_tokens=MAX_MEL_TOKENS, **kwargs)
+        expect_failure(too_long, "increase kv_cache_tokens")
+        scheduler.submit("voice_b.wav", "5", max_mel_tokens=3, **kwargs).result(timeout=60)
+        assert len(codes) == 1 and scheduler.kv_cache.num_free_blocks == scheduler.kv_cache.num_blocks - 1
+
+
+def test_close_fails_unfinished():
+    tts = TinyTTS()
+    scheduler = ContinuousBatchingScheduler(tts, max_batch_size=2, kv_cache_tokens=4096, block_size=4)
+    collect_codes(scheduler)
+    synthesize = scheduler._synthesize
+    release = threading.Event()
+
+    def blocked(seqs):
+        release.wait()
+        synthesize(seqs)
+
+    scheduler._synthesize = blocked
+    futures = [scheduler.submit(voice, "1 2 3 4 5 6 7", do_sample=False, max_mel_tokens=MAX_MEL_TOKENS)
+               for voice in ("voice_a.wav", "voice_b.wav", "voice_c.wav")]
+    scheduler.close(timeout=1.0)
+    release.set()
+    for future in futures:
+        expect_failure(future, "closed")
+    try:
+        scheduler.submit("voice_a.wav", "1")
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("submit after close must fail")
+
+
+if __name__ == "__main__":
+    """
+    Greedy decoding through the continuous batching scheduler must produce the same codes as
+    `GPT2InferenceModel.generate` for every segment, with and without KV cache preemption.
+    ```
+    python tests/scheduler_test.py
+    ```
+    """
+    test_paged_gather()
+    test_matches_generate()
+    test_matches_generate_with_preemption()
+    test_too_large_for_cache()
+    test_close_fails_unfinished()
+    print(">> all scheduler tests passed")
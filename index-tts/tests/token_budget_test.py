@@ -0,0 +1,81 @@
+import torch
+from transformers import StoppingCriteriaList
+
+from indextts.utils.token_budget import (GenerationGuard, find_repetition, segment_text, segment_token_budget,
+                                         trim_runaway_codes)
+
+STOP = 99
+
+
+def test_segment_token_budget():
+    short = segment_token_budget(segment_text(["▁你", "好"]), 50)
+    long = segment_token_budget(segment_text(["▁今天", "天气", "不错", "，", "我们", "去", "公园", "散步", "吧", "。"]), 50)
+    assert 50 < short < long < 1500, (short, long)
+    assert segment_token_budget("今天天气不错" * 100, 50, max_tokens=600) == 600
+
+
+def test_find_repetition():
+    speech = list(range(40))
+    assert find_repetition(speech, min_span=20) is None
+    # stuck on a 3-code unit after the speech
+    looped = speech + [7, 8, 9] * 10
+    assert find_repetition(looped, min_span=20) == (40, 3)
+    # endless silence
+    assert find_repetition(speech + [52] * 25, min_span=20) == (40, 1)
+    # too short to be called a loop
+    assert find_repetition(speech + [52] * 10, min_span=20) is None
+
+
+def test_guard_and_trim():
+    prompt = torch.ones(3, 5, dtype=torch.long)
+    generated = torch.stack([
+        torch.arange(30),                                  # speech, within budget
+        torch.cat([torch.arange(10), torch.full((20,), 52)]),  # silence loop
+        torch.arange(30) + 100,                            # budget exceeded
+    ])
+    guard = GenerationGuard([100, 100, 25], min_span=15)
+    # the first call sees the prompt and one generated code
+    assert not guard(torch.cat([prompt, generated[:, :1]], dim=1), None).any()
+    assert guard(torch.cat([prompt, generated], dim=1), None).tolist() == [False, True, True]
+
+    codes = generated.clone()
+    codes[0, 20:] = STOP
+    codes, reasons = trim_runaway_codes(codes, STOP, [100, 100, 25], min_span=15)
+    assert reasons == [None, "loop", "budget"], reasons
+    assert codes[1].tolist() == list(range(10)) + [52] + [STOP] * 19
+
+
+def test_generate_stops_at_budget():
+    from indextts.gpt.model_v2 import UnifiedVoice
+
+    torch.manual_seed(0)
+    module = dict(output_size=64, linear_units=128, attention_heads=4, num_blocks=1,
+                  input_layer="conv2d2", perceiver_mult=1)
+    gpt = UnifiedVoice(layers=2, model_dim=64, heads=4, max_text_tokens=60, max_mel_tokens=200,
+                       number_text_tokens=100, number_mel_codes=50, start_mel_token=48, stop_mel_token=49,
+                       condition_type="conformer_perceiver", condition_num_latent=8,
+                       condition_module=dict(module), emo_condition_module=dict(module))
+    gpt.eval()
+    gpt.post_init_gpt2_config(kv_cache=True)
+    cond = torch.randn(1, 20, 1024)
+    text = torch.randint(2, 100, (1, 6), dtype=torch.int32)
+    with torch.inference_mode():
+        codes, _ = gpt.inference_speech(cond, text, cond_lengths=torch.tensor([20]), emo_vec=torch.zeros(1, 64),
+                                        do_sample=True, top_k=30, num_beams=1, max_generate_length=150,
+                                        min_new_tokens=150,
+                                        stopping_criteria=StoppingCriteriaList([GenerationGuard([37], min_span=0)]))
+    assert codes.shape[-1] == 37, codes.shape
+
+
+if __name__ == "__main__":
+    """
+    Per-segment token budgets and the repetition guard of the GPT decode.
+    ```
+    python tests/token_budget_test.py
+    ```
+    """
+    test_segment_token_budget()
+    test_find_repetition()
+    test_guard_and_trim()
+    test_generate_stops_at_budget()
+    print(">> all token budget tests passed")
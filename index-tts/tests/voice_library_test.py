@@ -0,0 +1,113 @@
+import os
+import tempfile
+
+import torch
+
+from indextts.utils.audio_sink import WavSink
+from indextts.voice_library import VoiceLibrary, build_voice_library, prepare_clip, scan_voices
+
+SR = 22050
+
+
+class FakeCache:
+    namespace = "IndexTTS2|gpt.pth:1|s2mel.pth:2"
+
+
+class FakeTTS:
+    """
+    Bundles of the shapes and dtypes of ``IndexTTS2.encode_prompts``, derived from the audio.
+    """
+
+    def __init__(self):
+        self.cond_cache = FakeCache()
+        self.calls = 0
+        self.batches = []
+
+    def encode_prompts(self, clips, batch_size=8):
+        self.batches.append(len(clips))
+        return [self.bundle(audio_22k, audio_16k) for audio_22k, audio_16k in clips]
+
+    def bundle(self, audio_22k, audio_16k):
+        self.calls += 1
+        frames = audio_16k.shape[-1] // 320
+        return {
+            "spk_cond_emb": torch.full((1, frames, 8), float(audio_22k.abs().max())),
+            "style": torch.arange(6, dtype=torch.float32).unsqueeze(0) * self.calls,
+            "prompt_condition": torch.randn(1, audio_22k.shape[-1] // 256, 4),
+            "ref_mel": torch.randn(1, 5, audio_22k.shape[-1] // 256),
+            "semantic_codes": torch.arange(frames, dtype=torch.int64).unsqueeze(0),
+        }
+
+
+def tone(seconds, lead=0.0, tail=0.0, amplitude=0.3):
+    t = torch.arange(int(seconds * SR)) / SR
+    voiced = amplitude * torch.sin(2 * torch.pi * 220 * t)
+    return torch.cat([torch.zeros(int(lead * SR)), voiced, torch.zeros(int(tail * SR))]).unsqueeze(0)
+
+
+def write_clip(path, audio):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with WavSink(path, SR) as sink:
+        sink.write(audio * 32767)
+
+
+def test_prepare_clip():
+    audio = tone(1.0, lead=2.0, tail=1.5)
+    out = prepare_clip(audio, SR)
+    # silence trimmed down to the 0.1 s margins, peak-normalized
+    assert abs(out.shape[-1] / SR - 1.2) < 0.03, out.shape
+    assert abs(out.abs().max() - 0.9) < 1e-5
+    # truncated
+    assert prepare_clip(tone(20.0), SR, max_seconds=15).shape[-1] == 15 * SR
+    # pure silence is left as is
+    assert torch.equal(prepare_clip(torch.zeros(1, SR), SR), torch.zeros(1, SR))
+
+
+def test_build_and_load():
+    with tempfile.TemporaryDirectory() as tmp:
+        voice_dir = os.path.join(tmp, "voices")
+        write_clip(os.path.join(voice_dir, "en", "narrator.wav"), tone(1.0, lead=0.5, amplitude=0.2))
+        write_clip(os.path.join(voice_dir, "zh", "female.wav"), tone(0.7))
+        write_clip(os.path.join(voice_dir, "fallback.wav"), tone(0.5))
+        with open(os.path.join(voice_dir, "README.txt"), "w") as f:
+            f.write("not a clip")
+        assert [v["id"] for v in scan_voices(voice_dir)] == ["en/narrator", "fallback", "zh/female"]
+
+        tts = FakeTTS()
+        index_path = os.path.join(tmp, "lib", "voices.json")
+        index = build_voice_library(tts, voice_dir, index_path, batch_size=2)
+        assert tts.batches == [2, 1]
+        assert os.path.isfile(os.path.join(tmp, "lib", "voices.bin"))
+        assert sorted(os.listdir(os.path.join(tmp, "lib"))) == ["voices.bin", "voices.json"]
+
+        library = VoiceLibrary(index_path, namespace=FakeCache.namespace)
+        assert len(library) == 3 and "zh/female" in library and "zh/male" not in library and None not in library
+        assert library.voices("en") == ["en/narrator"] and library.voices("default") == ["fallback"]
+        bundle = library.get("en/narrator")
+        # the clip was normalized before encoding
+        assert torch.allclose(bundle["spk_cond_emb"], torch.full_like(bundle["spk_cond_emb"], 0.9))
+        assert bundle["semantic_codes"].dtype == torch.int64
+        assert bundle["semantic_codes"].shape == (1, bundle["spk_cond_emb"].shape[1])
+        for entry in index["voices"].values():
+            assert all(t["offset"] % 64 == 0 for t in entry["tensors"].values())
+        # cached per device, views of the mapped file
+        assert library.get("en/narrator") is bundle
+        assert torch.equal(library.get("zh/female", device="cpu")["style"], torch.arange(6.0).unsqueeze(0) * 3)
+
+        try:
+            VoiceLibrary(index_path, namespace="IndexTTS2|other")
+            assert False, "expected a namespace mismatch"
+        except ValueError:
+            pass
+
+
+if __name__ == "__main__":
+    """
+    Precomputed reference voice library: clip preparation, on-disk layout and lookup.
+    ```
+    python tests/voice_library_test.py
+    ```
+    """
+    test_prepare_clip()
+    test_build_and_load()
+    print(">> all voice library tests passed")
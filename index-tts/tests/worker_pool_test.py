@@ -0,0 +1,91 @@
+import os
+import signal
+import time
+from concurrent.futures import TimeoutError
+
+import torch
+
+from indextts.worker_pool import IndexTTS2WorkerPool
+
+
+class FakeTTS:
+    """
+    Stands in for a loaded ``IndexTTS2``: one weight tensor and a few methods to run in the workers.
+    """
+
+    def __init__(self):
+        self.weight = torch.arange(4, dtype=torch.float32)
+
+    def infer(self, text):
+        return f"{text}:{float(self.weight.sum())}:{os.getpid()}"
+
+    def crash(self):
+        os.kill(os.getpid(), signal.SIGKILL)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+        return seconds
+
+
+def wait_idle(pool, count, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while pool.idle_workers < count:
+        assert time.monotonic() < deadline, f"only {pool.idle_workers} idle workers"
+        time.sleep(0.05)
+
+
+def test_serve():
+    with IndexTTS2WorkerPool(num_workers=2, threads_per_worker=1, tts=FakeTTS()) as pool:
+        futures = [pool.submit(text=f"t{i}") for i in range(6)]
+        results = [f.result(timeout=10) for f in futures]
+        assert [r.split(":")[0] for r in results] == [f"t{i}" for i in range(6)]
+        assert all(r.split(":")[1] == "6.0" for r in results)
+        assert all(int(r.split(":")[2]) != os.getpid() for r in results)
+
+
+def test_dead_worker():
+    with IndexTTS2WorkerPool(num_workers=2, threads_per_worker=1, tts=FakeTTS()) as pool:
+        wait_idle(pool, 2)
+        pids = {w.pid for w in pool._workers}
+        future = pool.submit("crash")
+        try:
+            future.result(timeout=10)
+            assert False, "expected the request of the killed worker to fail"
+        except RuntimeError as e:
+            assert "died" in str(e), e
+        # the worker is replaced and the pool keeps serving with both workers
+        wait_idle(pool, 2)
+        new_pids = {w.pid for w in pool._workers}
+        assert len(new_pids - pids) == 1, (pids, new_pids)
+        results = [f.result(timeout=10) for f in [pool.submit(text=f"t{i}") for i in range(4)]]
+        assert all(r.startswith(f"t{i}:") for i, r in enumerate(results))
+        assert {int(r.split(":")[2]) for r in results} <= new_pids
+
+
+def test_close_fails_running():
+    pool = IndexTTS2WorkerPool(num_workers=1, threads_per_worker=1, tts=FakeTTS())
+    running = pool.submit("sleep", seconds=30)
+    waiting = pool.submit("sleep", seconds=30)
+    time.sleep(0.5)
+    pool.close(timeout=0.5)
+    assert waiting.cancelled()
+    try:
+        running.result(timeout=5)
+        assert False, "expected the request of the terminated worker to fail"
+    except TimeoutError:
+        raise AssertionError("the request of the terminated worker never resolved")
+    except RuntimeError as e:
+        assert "closed" in str(e), e
+
+
+if __name__ == "__main__":
+    """
+    Pre-fork worker pool: routing, replacement of killed workers and shutdown.
+    ```
+    python tests/worker_pool_test.py
+    ```
+    """
+    test_serve()
+    test_dead_worker()
+    test_close_fails_running()
+    print(">> all worker pool tests passed")
@@ -28,7 +28,18 @@ parser.add_argument("--model_dir", type=str, default="./checkpoints", help="Mode
 parser.add_argument("--fp16", action="store_true", default=False, help="Use FP16 for inference if available")
 parser.add_argument("--deepspeed", action="store_true", default=False, help="Use DeepSpeed to accelerate if available")
 parser.add_argument("--cuda_kernel", action="store_true", default=False, help="Use CUDA kernel for inference if available")
+parser.add_argument("--no_cpu_kernel", action="store_true", default=False, help="Don't build the fused C++ kernel of BigVGAN on CPU")
 parser.add_argument("--gui_seg_tokens", type=int, default=120, help="GUI: Max tokens per generation segment")
+parser.add_argument("--cond_cache_dir", type=str, default=None, help="Directory to persist computed voice prompt conditionings")
+parser.add_argument("--pipeline", action="store_true", default=False, help="Overlap the GPT, s2mel and vocoder stages of consecutive segments (multi-core CPU)")
+parser.add_argument("--metrics_port", type=int, default=None, help="Serve Prometheus metrics on this port (GET /metrics)")
+parser.add_argument("--metrics_jsonl", type=str, default=None, help="Append per-stage timings as JSON lines to this file")
+parser.add_argument("--trace", type=str, default=None, help="Write a Chrome trace of all stages to this file at exit")
+parser.add_argument("--continuous_batching", action="store_true", default=False, help="Serve concurrent users with one shared in-flight decode batch")
+parser.add_argument("--max_batch_size", type=int, default=8, help="Continuous batching: max segments decoded together")
+parser.add_argument("--kv_cache_tokens", type=int, default=32768, help="Continuous batching: paged KV cache capacity in tokens")
+parser.add_argument("--concurrency", type=int, default=1, help="Requests synthesized at the same time by threads sharing one copy of the model")
+parser.add_argument("--warmup", type=str, default="none", choices=["none", "minimal", "default", "full"], help="Warm up all stages with this profile before serving")
 cmd_args = parser.parse_args()
 
 if not os.path.exists(cmd_args.model_dir):
@@ -49,8 +60,13 @@ for file in [
 
 import gradio as gr
 from indextts.infer_v2 import IndexTTS2
+from indextts.utils.metrics import metrics
 from tools.i18n.i18n import I18nAuto
 
+metrics.configure(jsonl_path=cmd_args.metrics_jsonl, trace_path=cmd_args.trace)
+if cmd_args.metrics_port:
+    metrics.serve_prometheus(cmd_args.metrics_port, host=cmd_args.host)
+
 i18n = I18nAuto(language="Auto")
 MODE = 'local'
 tts = IndexTTS2(model_dir=cmd_args.model_dir,
@@ -58,7 +74,16 @@ tts = IndexTTS2(model_dir=cmd_args.model_dir,
                 use_fp16=cmd_args.fp16,
                 use_deepspeed=cmd_args.deepspeed,
                 use_cuda_kernel=cmd_args.cuda_kernel,
+                use_cpu_kernel=not cmd_args.no_cpu_kernel,
+                cond_cache_dir=cmd_args.cond_cache_dir,
                 )
+if cmd_args.warmup != "none":
+    tts.warmup(cmd_args.warmup)
+scheduler = None
+if cmd_args.continuous_batching:
+    from indextts.scheduler import ContinuousBatchingScheduler
+    scheduler = ContinuousBatchingScheduler(tts, max_batch_size=cmd_args.max_batch_size,
+                                            kv_cache_tokens=cmd_args.kv_cache_tokens)
 # 支持的语言列表
 LANGUAGES = {
     "中文": "zh_CN",
@@ -117,9 +142,7 @@ def gen_single(emo_control_method,prompt, text,
                 *args, progress=gr.Progress()):
     output_path = None
     if not output_path:
-        output_path = os.path.join("outputs", f"spk_{int(time.time())}.wav")
-    # set gradio progress
-    tts.gr_progress = progress
+        output_path = os.path.join("outputs", f"spk_{time.time_ns()}.wav")
     do_sample, top_p, top_k, temperature, \
         length_penalty, num_beams, repetition_penalty, max_mel_tokens = args
     kwargs = {
@@ -152,6 +175,18 @@ def gen_single(emo_control_method,prompt, text,
         emo_text = None
 
     print(f"Emo control mode:{emo_control_method},weight:{emo_weight},vec:{vec}")
+    if scheduler is not None:
+        # shared decode batch, progress is reported per request
+        output = scheduler.infer(spk_audio_prompt=prompt, text=text,
+                                 output_path=output_path,
+                                 emo_audio_prompt=emo_ref_path, emo_alpha=emo_weight,
+                                 emo_vector=vec,
+                                 use_emo_text=(emo_control_method==3), emo_text=emo_text,use_random=emo_random,
+                                 verbose=cmd_args.verbose,
+                                 max_text_tokens_per_segment=int(max_text_tokens_per_segment),
+                                 progress=progress,
+                                 **kwargs)
+        return gr.update(value=output,visible=True)
     output = tts.infer(spk_audio_prompt=prompt, text=text,
                        output_path=output_path,
                        emo_audio_prompt=emo_ref_path, emo_alpha=emo_weight,
@@ -159,6 +194,8 @@ def gen_single(emo_control_method,prompt, text,
                        use_emo_text=(emo_control_method==3), emo_text=emo_text,use_random=emo_random,
                        verbose=cmd_args.verbose,
                        max_text_tokens_per_segment=int(max_text_tokens_per_segment),
+                       use_pipeline=cmd_args.pipeline,
+                       progress=progress,
                        **kwargs)
     return gr.update(value=output,visible=True)
 
@@ -438,5 +475,10 @@ with gr.Blocks(title="IndexTTS Demo") as demo:
 
 
 if __name__ == "__main__":
-    demo.queue(20)
+    if scheduler is not None:
+        # let gradio run the requests concurrently, the scheduler batches them
+        demo.queue(20, default_concurrency_limit=cmd_args.max_batch_size)
+    else:
+        # IndexTTS2 keeps per-request state in a RequestContext, requests can share the model across threads
+        demo.queue(20, default_concurrency_limit=cmd_args.concurrency)
     demo.launch(server_name=cmd_args.host, server_port=cmd_args.port)